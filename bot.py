@@ -26,6 +26,10 @@ from aiogram import Bot, Dispatcher
 # Импортируем новые сервисы
 from src.services.file_service import FileService
 from src.services.embeddings.model_manager import model_manager
+from src.core.loop_monitor import loop_lag_monitor
+from src.services.rag.llm_client_pool import llm_client_pool
+from src.services.rag.tracing import rag_tracer
+from src.services.rag.job_queue import rag_job_queue
 
 """
 bot.py:
@@ -246,6 +250,12 @@ async def main():
     
     # Регистрируем функцию startup_wrapper для выполнения при запуске бота
     dp.startup.register(startup_wrapper)
+    # Общие HTTP-клиенты LLM закрываются при остановке бота
+    # Ожидающие вопросы к AI отменяются, обработчики очереди останавливаются
+    dp.shutdown.register(rag_job_queue.close)
+    dp.shutdown.register(llm_client_pool.close)
+    # Трассы RAG из очереди дописываются на диск
+    dp.shutdown.register(rag_tracer.close)
 
     # middleware - промежуточный код, который выполняется до того, как запрос будет обработан handler'ом
     # в контексте aiogram - компоненты, которые могут изменять, добавлять, проверять данные к каждому апдейту
@@ -293,6 +303,9 @@ async def main():
         await message.answer(admin_text, reply_markup=get_admin_main_menu_keyboard(), parse_mode='HTML')
     
 
+    # Фоновое измерение задержки цикла событий (видно в логах и в отчетах о загрузке файлов)
+    loop_lag_monitor.start()
+
     await dp.start_polling(bot, skip_updates = True) # не отвечаем на ожидающие ответа сообщения
         
 
@@ -0,0 +1,94 @@
+"""
+Бенчмарк полной очистки каталога в векторной БД.
+
+Создает во временной директории синтетическую коллекцию ChromaDB
+(случайные векторы, компактные метаданные) и сравнивает:
+  * legacy  - как раньше: collection.get(where=product_id) + delete(ids) для каждого продукта;
+  * bulk    - UnifiedEmbeddingService.delete_embeddings(product_ids=[...]) одним фильтром $in.
+
+Запуск из корня репозитория:
+    python scripts/bench_catalog_wipe.py [--products 300] [--chunks 40] [--dim 1024]
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import logging
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.embeddings.unified_embedding_service import UnifiedEmbeddingService
+
+
+async def _build_catalog(path: str, products: int, chunks: int, dim: int) -> UnifiedEmbeddingService:
+    """Наполняет временную коллекцию синтетическими чанками."""
+    service = UnifiedEmbeddingService(chroma_path=path)
+    await service.initialize(load_model=False)
+
+    rng = np.random.default_rng(42)
+    for product_id in range(1, products + 1):
+        file_path = f"/tmp/catalog/product_{product_id}.pdf"
+        source_key = service.source_key(file_path)
+        ids, metadatas, documents = [], [], []
+        for i in range(chunks):
+            text = f"Продукт {product_id}, фрагмент {i}"
+            ids.append(f"{product_id}_{source_key}_chunk_{i}")
+            metadatas.append(service._chunk_metadata(product_id, file_path, text, chunk_index=i))
+            documents.append(text)
+        embeddings = rng.random((chunks, dim), dtype=np.float32).tolist()
+        service._upsert(ids, embeddings, metadatas, documents)
+    return service
+
+
+def _legacy_wipe(service: UnifiedEmbeddingService, product_ids) -> int:
+    """Старый способ: выгрузка id каждого продукта и удаление по списку."""
+    deleted = 0
+    for product_id in product_ids:
+        results = service.collection.get(where={"product_id": product_id})
+        if results["ids"]:
+            service._delete_ids(results["ids"])
+            deleted += len(results["ids"])
+    return deleted
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк очистки каталога эмбеддингов")
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--chunks", type=int, default=40, help="чанков на продукт")
+    parser.add_argument("--dim", type=int, default=1024, help="размерность векторов")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    product_ids = list(range(1, args.products + 1))
+    total = args.products * args.chunks
+
+    rows = []
+    for mode in ("legacy", "bulk"):
+        path = tempfile.mkdtemp(prefix=f"bench_wipe_{mode}_")
+        try:
+            service = await _build_catalog(path, args.products, args.chunks, args.dim)
+            started = time.perf_counter()
+            if mode == "legacy":
+                deleted = _legacy_wipe(service, product_ids)
+            else:
+                deleted = await service.delete_embeddings(product_ids=product_ids)
+            elapsed = time.perf_counter() - started
+            rows.append((mode, deleted, elapsed, service.collection.count(), service.manifest.counters()["total"]))
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print(f"Каталог: {args.products} продуктов x {args.chunks} чанков = {total} записей, dim={args.dim}")
+    print(f"{'режим':<8} {'удалено':>8} {'время, с':>10} {'осталось':>9} {'манифест':>9}")
+    for mode, deleted, elapsed, left, manifest_total in rows:
+        print(f"{mode:<8} {deleted:>8} {elapsed:>10.3f} {left:>9} {manifest_total:>9}")
+    if len(rows) == 2 and rows[1][2] > 0:
+        print(f"Ускорение: x{rows[0][2] / rows[1][2]:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+"""
+Проверка маршрутизации LLM-провайдеров (ProviderRouter + MultiLLMGenerator) на локальных заглушках.
+
+Поднимаются две OpenAI-совместимые заглушки (scripts/llm_stub_server.py):
+  * primary - обычно быстрая, но с медленным хвостом (--tail-rate, --tail-latency);
+  * secondary - стабильная задержка.
+Сценарии:
+  * single  - только primary, без дублирования;
+  * hedged  - primary + secondary, дублирование по p90;
+  * failing - primary всегда отвечает ошибкой: проверка автомата отключения;
+  * limited - единственный провайдер отвечает 429 с Retry-After на часть запросов:
+    проверка очереди пула (llm_client_pool), повторов и паузы после 429.
+Для каждого сценария печатаются p50/p90/p99 задержки, число дублирований и кто ответил,
+а также очередь и время ожидания в пуле клиентов.
+
+Запуск из корня репозитория:
+    python scripts/bench_llm_hedging.py [--requests 60] [--concurrency 4] [--tail-rate 0.15]
+"""
+import os
+import sys
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from llm_stub_server import start_stub_server
+from src.services.rag.provider_router import ProviderConfig, ProviderRouter
+from src.services.rag.multi_llm_generator import MultiLLMGenerator
+from src.services.rag.llm_client_pool import llm_client_pool
+
+SEARCH_RESULTS = [{
+    "product_id": 1,
+    "product_name": "БРИТ Т-75",
+    "similarity": 0.8,
+    "text": "Температура размягчения мастики не ниже 75 °C (по ГОСТ 11506). Поставляется в ведрах по 20 кг."
+}]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_scenario(name, providers, args):
+    router = ProviderRouter(
+        providers,
+        hedge_min_delay=args.hedge_min_delay,
+        hedge_default_delay=args.hedge_default_delay,
+        breaker_cooldown=args.breaker_cooldown
+    )
+    generator = MultiLLMGenerator(api_key="stub", router=router)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, winners, errors = [], {}, 0
+
+    async def one(index):
+        nonlocal errors
+        async with semaphore:
+            loop = asyncio.get_event_loop()
+            started = loop.time()
+            answer = await generator.generate_answer(f"Вопрос {index}: температура размягчения Т-75?", SEARCH_RESULTS)
+            latencies.append(loop.time() - started)
+            if answer.provider is None:
+                errors += 1
+            else:
+                winners[answer.provider_key] = winners.get(answer.provider_key, 0) + 1
+
+    async def sample_queue():
+        # Максимальная глубина очереди пула во время сценария
+        while True:
+            for key, pool_stats in llm_client_pool.get_stats().items():
+                queue_peaks[key] = max(queue_peaks.get(key, 0), pool_stats["queue_depth"])
+            await asyncio.sleep(0.05)
+
+    queue_peaks = {}
+    sampler = asyncio.ensure_future(sample_queue())
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    sampler.cancel()
+
+    stats = router.get_stats()
+    print(f"\n=== {name} ===")
+    print(f"p50 {percentile(latencies, 0.5):.2f} с, p90 {percentile(latencies, 0.9):.2f} с, "
+          f"p99 {percentile(latencies, 0.99):.2f} с, среднее {statistics.mean(latencies):.2f} с")
+    print(f"Дублирований: {stats['hedges']}, ошибок: {errors}, ответили: {winners}")
+    for key, provider in stats["providers"].items():
+        p90 = f"{provider['p90']:.2f}" if provider["p90"] is not None else "-"
+        print(f"  {key}: запросов {provider['requests']}, ошибок {provider['errors']}, p90 {p90}, "
+              f"побед {provider['wins']} (дубль {provider['hedged_wins']}), отменено {provider['cancelled']}, "
+              f"автомат {provider['breaker']} (срабатываний {provider['breaker_trips']})")
+    for key, pool_stats in llm_client_pool.get_stats().items():
+        if key in stats["providers"]:
+            print(f"  пул {key}: макс. очередь {queue_peaks.get(key, 0)}, ожидание p50 {pool_stats['wait_p50']:.2f} с, "
+                  f"p90 {pool_stats['wait_p90']:.2f} с, макс. {pool_stats['wait_max']:.2f} с, "
+                  f"429: {pool_stats['rate_limited']}, повторов {pool_stats['retries']}, ошибок {pool_stats['errors']}")
+    await llm_client_pool.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Дублирование запросов и автоматы отключения LLM-провайдеров на заглушках")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--primary-latency", type=float, default=0.6)
+    parser.add_argument("--secondary-latency", type=float, default=1.0)
+    parser.add_argument("--tail-rate", type=float, default=0.15)
+    parser.add_argument("--tail-latency", type=float, default=6.0)
+    parser.add_argument("--hedge-min-delay", type=float, default=0.5)
+    parser.add_argument("--hedge-default-delay", type=float, default=2.0)
+    parser.add_argument("--breaker-cooldown", type=float, default=5.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.2, help="доля ответов 429 в сценарии limited")
+    parser.add_argument("--port", type=int, default=8911)
+    args = parser.parse_args()
+
+    primary = start_stub_server(args.port, name="primary", latency=args.primary_latency, jitter=0.1,
+                                tail_rate=args.tail_rate, tail_latency=args.tail_latency)
+    secondary = start_stub_server(args.port + 1, name="secondary", latency=args.secondary_latency, jitter=0.1)
+    failing = start_stub_server(args.port + 2, name="failing", latency=0.05, jitter=0.0, error_rate=1.0)
+    limited = start_stub_server(args.port + 3, name="limited", latency=0.3, jitter=0.05,
+                                error_rate=args.rate_limit_rate, error_status=429)
+
+    def provider(name, server):
+        host, port = server.server_address[:2]
+        return ProviderConfig(name=name, model="stub-model", api_key="stub", base_url=f"http://{host}:{port}/v1")
+
+    try:
+        await run_scenario("single", [provider("primary", primary)], args)
+        await run_scenario("hedged", [provider("primary", primary), provider("secondary", secondary)], args)
+        await run_scenario("failing", [provider("failing", failing), provider("secondary", secondary)], args)
+        await run_scenario("limited", [provider("limited", limited)], args)
+    finally:
+        for server in (primary, secondary, failing, limited):
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+"""
+Сравнение индексации окнами слов и двухуровневой (parent-child) на наборе запросов.
+
+Корпус документов индексируется во две временные коллекции ChromaDB:
+  * window - окна по 400 слов с перекрытием 100 (прежняя схема);
+  * parent_child - фрагменты до RAG_CHILD_CHUNK_WORDS слов для поиска,
+    родительские разделы ChunkingService для контекста.
+Затем каждый запрос из replay-набора проходит поиск так же, как в RagService,
+и для собранного промпта считаются токены (token_counter).
+
+Replay-набор - JSONL, по одному запросу в строке:
+    {"query": "Какая тара у БРИТ Т-75?", "expected": ["ведро", "20 кг"]}
+expected (необязательно) - подстроки, по которым результат считается релевантным
+для precision@k.
+
+Запуск из корня репозитория:
+    python scripts/bench_parent_retrieval.py --replay replay.jsonl [--corpus src/files] [--top-k 8]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.services.extraction import SUPPORTED_EXTENSIONS, iter_document_blocks
+from src.services.embeddings.unified_embedding_service import UnifiedEmbeddingService
+from src.services.rag.llm_generator import LLMResponseGenerator, SYSTEM_PROMT
+from src.services.rag.rag_service import CHILD_FANOUT
+from src.services.rag.token_counter import count_tokens
+
+DEFAULT_QUERIES = [
+    {"query": "Какая температура размягчения у мастики?"},
+    {"query": "В какой таре поставляется праймер?"},
+    {"query": "Чем отличается Т-65 от Т-75?"},
+    {"query": "Какой расход мастики на квадратный метр?"},
+    {"query": "Можно ли наносить при отрицательной температуре?"},
+]
+
+
+def load_replay(path):
+    if not path:
+        return DEFAULT_QUERIES
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_documents(corpus, max_files):
+    files = []
+    for directory, _, names in os.walk(corpus):
+        for name in sorted(names):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                files.append(os.path.join(directory, name))
+    return files[:max_files] if max_files else files
+
+
+def is_relevant(text, expected):
+    lowered = text.lower()
+    return any(item.lower() in lowered for item in expected)
+
+
+async def run_mode(mode, files, queries, top_k, threshold, max_pages):
+    chroma_path = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    try:
+        service = UnifiedEmbeddingService(
+            chroma_path=chroma_path,
+            collection_name="bench_chunks",
+            parent_child=(mode == "parent_child")
+        )
+        await service.initialize()
+
+        started = time.perf_counter()
+        chunks = 0
+        for product_id, file_path in enumerate(files, 1):
+            try:
+                chunks += await service.index_text_stream(
+                    product_id=product_id,
+                    product_name=os.path.basename(file_path),
+                    blocks=iter_document_blocks(file_path, max_pages),
+                    file_path=file_path
+                )
+            except Exception as e:
+                print(f"  пропущен {file_path}: {e}")
+        index_time = time.perf_counter() - started
+
+        generator = LLMResponseGenerator(api_key="bench")
+        system_tokens = count_tokens(SYSTEM_PROMT)
+        prompt_tokens, search_times, precisions = [], [], []
+        for item in queries:
+            candidate_k = top_k * CHILD_FANOUT if service.parent_child else top_k
+            started = time.perf_counter()
+            results = await service.search_similar(item["query"], candidate_k, threshold)
+            results = service.expand_parents(results, top_k)
+            search_times.append(time.perf_counter() - started)
+
+            context = generator._build_context(results)
+            prompt = generator._build_user_prompt(item["query"], context)
+            prompt_tokens.append(system_tokens + count_tokens(prompt))
+
+            if item.get("expected") and results:
+                relevant = sum(1 for r in results if is_relevant(r.get("text", ""), item["expected"]))
+                precisions.append(relevant / len(results))
+
+        return {
+            "mode": mode,
+            "chunks": chunks,
+            "index_time": index_time,
+            "tokens_mean": statistics.mean(prompt_tokens) if prompt_tokens else 0,
+            "tokens_p95": sorted(prompt_tokens)[int(len(prompt_tokens) * 0.95) - 1] if prompt_tokens else 0,
+            "search_ms": statistics.mean(search_times) * 1000 if search_times else 0,
+            "precision": statistics.mean(precisions) if precisions else None
+        }
+    finally:
+        shutil.rmtree(chroma_path, ignore_errors=True)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Окна слов против parent-child индексации")
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "src", "files"))
+    parser.add_argument("--replay", default=None, help="JSONL с запросами (query, expected)")
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--max-files", type=int, default=0, help="0 - все файлы")
+    parser.add_argument("--max-pages", type=int, default=30)
+    args = parser.parse_args()
+
+    files = find_documents(args.corpus, args.max_files)
+    if not files:
+        print(f"В {args.corpus} нет документов")
+        return
+    queries = load_replay(args.replay)
+    print(f"Документов: {len(files)}, запросов: {len(queries)}, top_k={args.top_k}")
+
+    rows = []
+    for mode in ("window", "parent_child"):
+        print(f"Режим {mode}...")
+        rows.append(await run_mode(mode, files, queries, args.top_k, args.threshold, args.max_pages))
+
+    print(f"\n{'режим':<13} {'чанков':>7} {'индекс, с':>10} {'токенов':>8} {'p95':>7} {'поиск, мс':>10} {'precision@k':>12}")
+    for row in rows:
+        precision = f"{row['precision']:.3f}" if row["precision"] is not None else "-"
+        print(f"{row['mode']:<13} {row['chunks']:>7} {row['index_time']:>10.1f} {row['tokens_mean']:>8.0f} "
+              f"{row['tokens_p95']:>7} {row['search_ms']:>10.1f} {precision:>12}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+"""
+Бенчмарк PDF-бэкендов: скорость (страниц/с) и близость текста к эталону.
+
+Проходит по корпусу PDF (по умолчанию src/files), извлекает каждый документ
+всеми установленными бэкендами и сравнивает постраничный текст с эталонным
+бэкендом (pdfplumber) через difflib.SequenceMatcher по словам.
+Результаты группируются по классу документа (СТО, ГОСТ, ТУ, паспорт, прочее),
+чтобы выбрать бэкенд для класса через PDF_EXTRACTOR_BACKEND_RULES.
+
+Запуск из корня репозитория:
+    python scripts/bench_pdf_backends.py [--corpus src/files] [--max-pages 50] [--reference pdfplumber]
+"""
+import os
+import re
+import sys
+import time
+import difflib
+import argparse
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.services.extraction.pdf_backends import PDF_BACKENDS
+
+DOCUMENT_CLASSES = [
+    ("СТО", re.compile(r"\bсто\b", re.IGNORECASE)),
+    ("ГОСТ", re.compile(r"\bгост", re.IGNORECASE)),
+    ("ТУ", re.compile(r"\bту\b", re.IGNORECASE)),
+    ("паспорт", re.compile(r"паспорт", re.IGNORECASE)),
+]
+
+
+def document_class(file_name: str) -> str:
+    for label, pattern in DOCUMENT_CLASSES:
+        if pattern.search(file_name):
+            return label
+    return "прочее"
+
+
+def find_pdfs(corpus: str):
+    for directory, _, files in os.walk(corpus):
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(directory, name)
+
+
+def extract_pages(backend, file_path: str, max_pages: int):
+    started = time.perf_counter()
+    pages = list(backend.iter_pages(file_path, max_pages or None))
+    return pages, time.perf_counter() - started
+
+
+def fidelity(reference_pages, pages) -> float:
+    """Средняя по страницам близость последовательностей слов (1.0 - совпадение)."""
+    ratios = []
+    for index, reference in enumerate(reference_pages):
+        candidate = pages[index] if index < len(pages) else ""
+        reference_words = reference.split()
+        candidate_words = candidate.split()
+        if not reference_words and not candidate_words:
+            ratios.append(1.0)
+            continue
+        matcher = difflib.SequenceMatcher(None, reference_words, candidate_words, autojunk=False)
+        ratios.append(matcher.ratio())
+    return sum(ratios) / len(ratios) if ratios else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение PDF-бэкендов")
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "src", "files"))
+    parser.add_argument("--max-pages", type=int, default=50, help="0 - все страницы")
+    parser.add_argument("--reference", default="pdfplumber")
+    args = parser.parse_args()
+
+    backends = {name: cls() for name, cls in PDF_BACKENDS.items() if cls.is_available()}
+    missing = sorted(set(PDF_BACKENDS) - set(backends))
+    if missing:
+        print(f"Не установлены: {', '.join(missing)}")
+    if args.reference not in backends:
+        print(f"Эталонный бэкенд {args.reference} не установлен")
+        return
+
+    files = list(find_pdfs(args.corpus))
+    if not files:
+        print(f"В {args.corpus} нет PDF")
+        return
+
+    # (класс, бэкенд) -> [документов, страниц, секунд, сумма fidelity, ошибок]
+    totals = defaultdict(lambda: [0, 0, 0.0, 0.0, 0])
+    for file_path in files:
+        doc_class = document_class(os.path.basename(file_path))
+        try:
+            reference_pages, reference_time = extract_pages(backends[args.reference], file_path, args.max_pages)
+        except Exception as e:
+            print(f"Пропущен {file_path}: {e}")
+            continue
+
+        for name, backend in backends.items():
+            row = totals[(doc_class, name)]
+            if name == args.reference:
+                pages, elapsed, score = reference_pages, reference_time, 1.0
+            else:
+                try:
+                    pages, elapsed = extract_pages(backend, file_path, args.max_pages)
+                    score = fidelity(reference_pages, pages)
+                except Exception as e:
+                    row[4] += 1
+                    print(f"{name}: ошибка на {os.path.basename(file_path)}: {e}")
+                    continue
+            row[0] += 1
+            row[1] += len(pages)
+            row[2] += elapsed
+            row[3] += score
+
+    print(f"Документов: {len(files)}, эталон: {args.reference}")
+    print(f"{'класс':<9} {'бэкенд':<11} {'док.':>5} {'стр.':>6} {'стр/с':>8} {'сходство':>9} {'ошибок':>7}")
+    best = {}
+    for (doc_class, name), (docs, pages, seconds, score_sum, errors) in sorted(totals.items()):
+        speed = pages / seconds if seconds else 0.0
+        score = score_sum / docs if docs else 0.0
+        print(f"{doc_class:<9} {name:<11} {docs:>5} {pages:>6} {speed:>8.1f} {score:>9.3f} {errors:>7}")
+        # Кандидат для класса: самый быстрый бэкенд с сходством не ниже 0.97 и без ошибок
+        if docs and not errors and score >= 0.97 and speed > best.get(doc_class, ("", 0.0))[1]:
+            best[doc_class] = (name, speed)
+
+    rules = ",".join(f"{doc_class.lower()}:{name}" for doc_class, (name, _) in sorted(best.items())
+                     if doc_class != "прочее")
+    if rules:
+        print(f"\nPDF_EXTRACTOR_BACKEND_RULES=\"{rules}\"")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Нагрузочная проверка очереди вопросов к AI (RagJobQueue) на синтетическом всплеске.
+
+Вопрос моделируется как конвейер RAG: расчет, блокирующий цикл событий (эмбеддинг, MMR),
+запрос в БД (табличный индекс) из общего пула соединений и ожидание LLM с ограничением
+параллельности (как у llm_client_pool). Параллельно идут «навигационные» запросы каталога:
+короткий запрос в БД каждые --probe-interval секунд.
+Сценарии:
+  * direct - все вопросы выполняются сразу в обработчиках (как до очереди);
+  * queue  - вопросы идут через RagJobQueue с --workers обработчиками.
+Для каждого сценария печатаются пропускная способность, p50/p95 ответа для коротких
+и длинных вопросов, задержка навигации и цикла событий, глубина очереди.
+
+Запуск из корня репозитория:
+    python scripts/bench_rag_queue.py [--users 60] [--workers 8] [--db-pool 5]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.core.loop_monitor import LoopLagMonitor
+from src.services.rag.job_queue import RagJobQueue, RagJobRejected, query_priority, PRIORITY_SHORT
+
+SHORT_QUESTION = "Упаковка БРИТ Т-75?"
+LONG_QUESTION = "Какая температура размягчения у мастики и можно ли ее применять зимой при ремонте кровли из рулонных материалов?"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Backend:
+    """Общие ресурсы процесса: пул соединений БД и ограничение параллельности LLM."""
+
+    def __init__(self, args):
+        self.args = args
+        self.db = asyncio.Semaphore(args.db_pool)
+        self.llm = asyncio.Semaphore(args.llm_concurrency)
+
+    async def rag_pipeline(self, short: bool):
+        # Эмбеддинг запроса и отбор фрагментов выполняются в цикле событий
+        time.sleep(self.args.cpu_ms / 1000.0)
+        async with self.db:
+            await asyncio.sleep(self.args.db_time)
+        async with self.llm:
+            latency = self.args.llm_latency * (0.6 if short else 1.4)
+            await asyncio.sleep(max(0.05, random.gauss(latency, latency * 0.2)))
+        return {"llm_answer": "ok"}
+
+    async def catalog_probe(self):
+        async with self.db:
+            await asyncio.sleep(0.005)
+
+
+async def run_scenario(name, args, queue=None):
+    random.seed(args.seed)
+    backend = Backend(args)
+    monitor = LoopLagMonitor(interval=0.02)
+    latencies = {"short": [], "long": []}
+    probes = []
+    rejected = {}
+    depth_peak = 0
+
+    async def ask(user_id, question):
+        started = time.monotonic()
+        short = query_priority(question) == PRIORITY_SHORT
+        try:
+            if queue is None:
+                await backend.rag_pipeline(short)
+            else:
+                await queue.submit(user_id, question, lambda: backend.rag_pipeline(short))
+        except RagJobRejected as e:
+            rejected[e.reason] = rejected.get(e.reason, 0) + 1
+            return
+        latencies["short" if short else "long"].append(time.monotonic() - started)
+
+    async def probe_loop():
+        nonlocal depth_peak
+        while True:
+            started = time.monotonic()
+            await backend.catalog_probe()
+            probes.append(time.monotonic() - started)
+            if queue is not None:
+                depth_peak = max(depth_peak, queue.depth)
+            await asyncio.sleep(args.probe_interval)
+
+    async def burst():
+        tasks = []
+        for user_id in range(args.users):
+            question = SHORT_QUESTION if random.random() < args.short_rate else LONG_QUESTION
+            tasks.append(asyncio.ensure_future(ask(user_id, question)))
+            # Часть пользователей повторяет вопрос, не дождавшись ответа
+            if random.random() < args.repeat_rate:
+                tasks.append(asyncio.ensure_future(ask(user_id, question)))
+            await asyncio.sleep(random.expovariate(args.users / args.burst_seconds))
+        await asyncio.gather(*tasks)
+
+    prober = asyncio.ensure_future(probe_loop())
+    started = time.monotonic()
+    with monitor.measure() as lag:
+        await burst()
+    elapsed = time.monotonic() - started
+    prober.cancel()
+    await monitor.stop()
+    if queue is not None:
+        await queue.close()
+
+    answered = len(latencies["short"]) + len(latencies["long"])
+    print(f"\n=== {name} ===")
+    print(f"Ответов: {answered} за {elapsed:.1f} с ({answered / elapsed:.2f} в секунду), отклонено: {rejected or 0}")
+    for kind, values in latencies.items():
+        if values:
+            print(f"  {kind}: p50 {percentile(values, 0.5):.2f} с, p95 {percentile(values, 0.95):.2f} с, "
+                  f"среднее {statistics.mean(values):.2f} с ({len(values)})")
+    print(f"Навигация: p50 {percentile(probes, 0.5) * 1000:.0f} мс, p95 {percentile(probes, 0.95) * 1000:.0f} мс, "
+          f"макс. {max(probes) * 1000:.0f} мс; цикл событий: {lag.describe()}")
+    if queue is not None:
+        stats = queue.get_stats()
+        print(f"Очередь: максимум {max(depth_peak, stats['max_depth'])}, ожидание p50 {stats['wait_p50']:.2f} с, "
+              f"p90 {stats['wait_p90']:.2f} с, по таймауту {stats['timed_out']}, не дождались {stats['queue_timeouts']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Всплеск вопросов к AI: напрямую и через очередь с пулом обработчиков")
+    parser.add_argument("--users", type=int, default=60)
+    parser.add_argument("--burst-seconds", type=float, default=2.0, help="за сколько секунд приходят все вопросы")
+    parser.add_argument("--short-rate", type=float, default=0.4, help="доля коротких вопросов")
+    parser.add_argument("--repeat-rate", type=float, default=0.1, help="доля пользователей, повторяющих вопрос")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--db-pool", type=int, default=5, help="размер пула соединений БД")
+    parser.add_argument("--db-time", type=float, default=0.05, help="запрос к табличному индексу, с")
+    parser.add_argument("--cpu-ms", type=float, default=25.0, help="блокирующая часть конвейера, мс")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="средняя задержка LLM, с")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--probe-interval", type=float, default=0.1)
+    parser.add_argument("--queue-timeout", type=float, default=120.0)
+    parser.add_argument("--job-timeout", type=float, default=90.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    await run_scenario("direct", args)
+    await run_scenario(f"queue ({args.workers} обработчиков)", args, RagJobQueue(
+        workers=args.workers,
+        max_queue=0,
+        queue_timeout=args.queue_timeout,
+        job_timeout=args.job_timeout
+    ))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
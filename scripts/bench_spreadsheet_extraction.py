@@ -0,0 +1,150 @@
+"""
+Бенчмарк извлечения текста из больших прайс-листов (XLSX и CSV).
+
+Генерирует синтетический прайс-лист на тару и фасовку (несколько листов XLSX
+и CSV в cp1251 с разделителем ';') и сравнивает:
+  * legacy - прежний способ: pd.ExcelFile + pd.read_excel на каждый лист, iterrows,
+             для CSV - полные повторные чтения на каждую кодировку;
+  * new    - src.services.extraction.spreadsheet_extractor (один проход openpyxl read_only,
+             векторное форматирование строк, кодировка по образцу байтов).
+
+Запуск из корня репозитория:
+    python scripts/bench_spreadsheet_extraction.py [--rows 50000] [--sheets 3]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.extraction.spreadsheet_extractor import iter_spreadsheet_text_blocks
+
+COLUMNS = ["Артикул", "Наименование", "Тара", "Масса нетто, кг", "Кол-во на паллете",
+           "Цена без НДС, руб", "Цена с НДС, руб", "Примечание"]
+PRODUCTS = ["Битум БНД 70/100", "Битум БНД 100/130", "ПБВ 60", "ПБВ 90", "Мастика МБР-90",
+            "Эмульсия ЭБК-2", "Праймер битумный", "Герметик Брит"]
+PACKAGING = ["Бочка 200 л", "Еврокуб 1000 л", "Мешок 25 кг", "Клиперная тара", "Ведро 20 л", "Наливом"]
+
+
+def _price_rows(rows: int, seed: int):
+    rng = random.Random(seed)
+    for i in range(rows):
+        price = round(rng.uniform(15000, 95000), 2)
+        yield [
+            f"GZ-{seed:02d}-{i:06d}",
+            rng.choice(PRODUCTS),
+            rng.choice(PACKAGING),
+            rng.choice([20, 25, 180, 200, 1000]),
+            rng.choice([None, 4, 16, 40]),
+            price,
+            round(price * 1.2, 2),
+            "" if rng.random() < 0.7 else "под заказ"
+        ]
+
+
+def write_price_list_xlsx(path: str, rows: int, sheets: int) -> None:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for sheet in range(sheets):
+        worksheet = workbook.create_sheet(f"Прайс {sheet + 1}")
+        worksheet.append(COLUMNS)
+        for row in _price_rows(rows, sheet):
+            worksheet.append(row)
+    workbook.save(path)
+
+
+def write_price_list_csv(path: str, rows: int) -> None:
+    with open(path, "w", encoding="cp1251", newline="") as f:
+        f.write(";".join(COLUMNS) + "\n")
+        for row in _price_rows(rows, 99):
+            f.write(";".join("" if value is None else str(value) for value in row) + "\n")
+
+
+def legacy_xlsx(file_path: str) -> str:
+    """Прежняя реализация AutoChunkingService._extract_text_from_xlsx."""
+    excel_file = pd.ExcelFile(file_path)
+    all_text = []
+    for sheet_name in excel_file.sheet_names:
+        df = pd.read_excel(file_path, sheet_name=sheet_name)
+        all_text.append(f"=== Лист: {sheet_name} ===")
+        df_filled = df.fillna('')
+        if not df_filled.empty:
+            all_text.append("Столбцы: " + ' | '.join(str(col) for col in df_filled.columns))
+            for index, row in df_filled.iterrows():
+                row_text = ' | '.join(str(val) for val in row.values if str(val).strip())
+                if row_text.strip():
+                    all_text.append(row_text)
+        all_text.append("")
+    return '\n'.join(all_text)
+
+
+def legacy_csv(file_path: str) -> str:
+    """Прежняя реализация AutoChunkingService._extract_text_from_csv."""
+    df = None
+    for encoding in ['utf-8', 'windows-1251', 'cp1251', 'latin-1']:
+        try:
+            df = pd.read_csv(file_path, encoding=encoding)
+            break
+        except (UnicodeDecodeError, UnicodeError):
+            continue
+    if df is None:
+        return ""
+    all_text = [f"=== CSV файл: {os.path.basename(file_path)} ==="]
+    df_filled = df.fillna('')
+    if not df_filled.empty:
+        all_text.append("Столбцы: " + ' | '.join(str(col) for col in df_filled.columns))
+        for index, row in df_filled.iterrows():
+            row_text = ' | '.join(str(val) for val in row.values if str(val).strip())
+            if row_text.strip():
+                all_text.append(row_text)
+    return '\n'.join(all_text)
+
+
+def new_extractor(file_path: str) -> str:
+    return '\n'.join(iter_spreadsheet_text_blocks(file_path))
+
+
+def measure(func, file_path: str):
+    tracemalloc.start()
+    started = time.perf_counter()
+    text = func(file_path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024, len(text), text.count('\n') + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения текста из прайс-листов")
+    parser.add_argument("--rows", type=int, default=50000, help="строк на лист")
+    parser.add_argument("--sheets", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_sheets_")
+    try:
+        xlsx_path = os.path.join(workdir, "price_list.xlsx")
+        csv_path = os.path.join(workdir, "price_list.csv")
+        write_price_list_xlsx(xlsx_path, args.rows, args.sheets)
+        write_price_list_csv(csv_path, args.rows)
+
+        print(f"XLSX: {args.sheets} листа x {args.rows} строк, {os.path.getsize(xlsx_path) / 1024 / 1024:.1f} МБ")
+        print(f"CSV (cp1251, ';'): {args.rows} строк, {os.path.getsize(csv_path) / 1024 / 1024:.1f} МБ")
+        print(f"{'файл':<6} {'режим':<8} {'время, с':>9} {'пик памяти, МБ':>15} {'символов':>10} {'строк':>8}")
+        for label, path, legacy in (("xlsx", xlsx_path, legacy_xlsx), ("csv", csv_path, legacy_csv)):
+            for mode, func in (("legacy", legacy), ("new", new_extractor)):
+                elapsed, peak_mb, chars, lines = measure(func, path)
+                print(f"{label:<6} {mode:<8} {elapsed:>9.2f} {peak_mb:>15.1f} {chars:>10} {lines:>8}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Бенчмарк пикового потребления памяти при индексации большого PDF.
+
+Генерирует синтетический PDF (по умолчанию 500 страниц) и индексирует его
+во временную коллекцию ChromaDB двумя способами, каждый в отдельном процессе:
+  * legacy - весь текст в одну строку -> create_product_embeddings (все чанки и векторы в памяти);
+  * stream - постраничный генератор -> index_text_stream (пачки по --batch-size чанков).
+
+Для каждого режима печатается прирост пикового RSS относительно состояния после
+загрузки модели, время и число чанков.
+
+Запуск из корня репозитория:
+    python scripts/bench_streaming_pipeline.py [--pages 500] [--encoder hash|model]
+
+--encoder hash заменяет SentenceTransformer детерминированным хеш-кодировщиком,
+чтобы измерять только сам конвейер без загрузки модели.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import resource
+import subprocess
+import hashlib
+import logging
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "gazprom neft bitumen polymer modified binder viscosity penetration softening point "
+    "ductility storage stability packaging barrel eurocube shelf life temperature road "
+    "construction asphalt concrete emulsion cationic anionic adhesion aggregate mastic"
+).split()
+
+
+def write_synthetic_pdf(path: str, pages: int, lines_per_page: int = 55, words_per_line: int = 11) -> None:
+    """Пишет минимальный корректный PDF с текстовым слоем (шрифт Helvetica)."""
+    offsets = []
+    chunks = [b"%PDF-1.4\n"]
+
+    def add_object(number: int, body: bytes) -> None:
+        offsets.append((number, sum(len(c) for c in chunks)))
+        chunks.append(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    first_page_obj = 4
+    kids = " ".join(f"{first_page_obj + 2 * i} 0 R" for i in range(pages))
+    add_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    add_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    add_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    word_index = 0
+    for page in range(pages):
+        lines = []
+        for _ in range(lines_per_page):
+            line = " ".join(WORDS[(word_index + k) % len(WORDS)] for k in range(words_per_line))
+            word_index += words_per_line
+            lines.append(f"({line} p{page}) '")
+        content = ("BT /F1 9 Tf 12 TL 40 800 Td\n" + "\n".join(lines) + "\nET").encode()
+        page_obj = first_page_obj + 2 * page
+        add_object(page_obj, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_obj + 1} 0 R >>"
+        ).encode())
+        add_object(page_obj + 1, f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+
+    xref_offset = sum(len(c) for c in chunks)
+    total = len(offsets) + 1
+    xref = [f"xref\n0 {total}\n", "0000000000 65535 f \n"]
+    for _, offset in sorted(offsets):
+        xref.append(f"{offset:010d} 00000 n \n")
+    xref.append(f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+    chunks.append("".join(xref).encode())
+
+    with open(path, "wb") as f:
+        f.write(b"".join(chunks))
+
+
+class HashEncoder:
+    """Детерминированный кодировщик с интерфейсом SentenceTransformer.encode."""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+        return np.random.default_rng(seed).random(self.dim, dtype=np.float32)
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs):
+        if isinstance(sentences, str):
+            return self._vector(sentences)
+        return np.stack([self._vector(text) for text in sentences])
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в Linux - килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_child(mode: str, pdf_path: str, encoder: str, batch_size: int) -> dict:
+    from src.services.auto_chunking_service import AutoChunkingService
+
+    chroma_path = tempfile.mkdtemp(prefix=f"bench_stream_{mode}_")
+    try:
+        service = AutoChunkingService(chroma_path=chroma_path)
+        embedding_service = service.embedding_service
+        await embedding_service.initialize(load_model=(encoder == "model"))
+        if encoder == "hash":
+            embedding_service.model = HashEncoder()
+        service._is_initialized = True
+
+        baseline = _peak_rss_mb()
+        started = time.perf_counter()
+        blocks = service._iter_text_blocks(pdf_path, max_pages=None)
+        if mode == "legacy":
+            full_text = "\n\n".join(blocks)
+            chunks = len(await embedding_service.create_product_embeddings(
+                product_id=1, product_name="Синтетический продукт", full_text=full_text, file_path=pdf_path
+            ))
+        else:
+            chunks = await embedding_service.index_text_stream(
+                product_id=1, product_name="Синтетический продукт", blocks=blocks,
+                file_path=pdf_path, batch_size=batch_size
+            )
+        elapsed = time.perf_counter() - started
+        return {
+            "mode": mode,
+            "chunks": chunks,
+            "seconds": elapsed,
+            "baseline_mb": baseline,
+            "peak_mb": _peak_rss_mb()
+        }
+    finally:
+        shutil.rmtree(chroma_path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк потоковой индексации PDF")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--encoder", choices=["hash", "model"], default="hash")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--child", choices=["legacy", "stream"], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.child:
+        result = asyncio.run(run_child(args.child, args.pdf, args.encoder, args.batch_size))
+        print(json.dumps(result))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_stream_pdf_")
+    try:
+        pdf_path = os.path.join(workdir, f"synthetic_{args.pages}p.pdf")
+        write_synthetic_pdf(pdf_path, args.pages)
+        print(f"PDF: {args.pages} страниц, {os.path.getsize(pdf_path) / 1024 / 1024:.1f} МБ")
+
+        rows = []
+        for mode in ("legacy", "stream"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, "--pdf", pdf_path,
+                 "--encoder", args.encoder, "--batch-size", str(args.batch_size), "--pages", str(args.pages)],
+                cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            rows.append(json.loads(output))
+
+        print(f"{'режим':<8} {'чанков':>7} {'время, с':>9} {'прирост RSS, МБ':>16}")
+        for row in rows:
+            print(f"{row['mode']:<8} {row['chunks']:>7} {row['seconds']:>9.2f} "
+                  f"{row['peak_mb'] - row['baseline_mb']:>16.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Оценка маршрутизатора намерений (IntentRouter) на записанных вопросах user_queries.
+
+Разметка:
+  * по умолчанию - слабая: вопрос считается коммерческим, если бот ответил на него
+    стандартной ссылкой на сайт Брит (так отвечает LLM по системному промпту),
+    остальные вопросы - о продукции;
+  * --labels FILE - ручная разметка JSONL {"query": "...", "intent": "commercial|out_of_scope|product"},
+    она важнее слабой. Заготовку для разметки можно выгрузить через --export.
+
+Запуск из корня репозитория:
+    python scripts/eval_intent_router.py [--limit 2000] [--rules-only] [--labels labels.jsonl]
+    python scripts/eval_intent_router.py --export queries.jsonl
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from src.database.connection import AsyncSessionLocal
+from src.database.models import UserQuery
+from src.services.rag.intent_router import IntentRouter, COMMERCIAL, OUT_OF_SCOPE, PRODUCT
+
+REDIRECT_MARKER = "brit.gazprom-neft.ru/where-buy"
+INTENTS = (COMMERCIAL, OUT_OF_SCOPE, PRODUCT)
+
+
+async def load_queries(limit):
+    """Вопросы к AI с ответами бота: [(текст, слабая метка)]."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(UserQuery)
+            .where(UserQuery.query_type == 'ai_question')
+            .options(selectinload(UserQuery.responses))
+            .order_by(UserQuery.id.desc())
+            .limit(limit)
+        )
+        queries = []
+        seen = set()
+        for query in result.scalars().all():
+            text = " ".join(str(query.query_text).split())
+            if not text or text.lower() in seen:
+                continue
+            seen.add(text.lower())
+            commercial = any(REDIRECT_MARKER in str(r.response_text or "") for r in query.responses)
+            queries.append((text, COMMERCIAL if commercial else PRODUCT))
+        return queries
+
+
+def load_labels(path):
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return {" ".join(item["query"].split()).lower(): item["intent"] for item in items}
+
+
+def print_report(pairs):
+    """pairs - [(метка, предсказание)]; печатает precision/recall по намерениям и матрицу ошибок."""
+    print(f"\n{'намерение':<14} {'precision':>10} {'recall':>8} {'f1':>7} {'вопросов':>9}")
+    for intent in INTENTS:
+        tp = sum(1 for label, pred in pairs if label == intent and pred == intent)
+        predicted = sum(1 for _, pred in pairs if pred == intent)
+        actual = sum(1 for label, _ in pairs if label == intent)
+        precision = tp / predicted if predicted else 0.0
+        recall = tp / actual if actual else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        print(f"{intent:<14} {precision:>10.3f} {recall:>8.3f} {f1:>7.3f} {actual:>9}")
+
+    confusion = Counter(pairs)
+    print(f"\n{'метка / ответ':<14}" + "".join(f"{intent:>14}" for intent in INTENTS))
+    for label in INTENTS:
+        print(f"{label:<14}" + "".join(f"{confusion[(label, pred)]:>14}" for pred in INTENTS))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Precision/recall маршрутизатора намерений на user_queries")
+    parser.add_argument("--limit", type=int, default=2000, help="сколько последних вопросов взять")
+    parser.add_argument("--labels", default=None, help="JSONL с ручной разметкой (query, intent)")
+    parser.add_argument("--export", default=None, help="выгрузить вопросы со слабой разметкой в JSONL и выйти")
+    parser.add_argument("--rules-only", action="store_true", help="только правила, без модели эмбеддингов")
+    parser.add_argument("--show-errors", type=int, default=20, help="сколько ошибок показать")
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    args = parser.parse_args()
+
+    queries = await load_queries(args.limit)
+    if args.export:
+        with open(args.export, "w", encoding="utf-8") as f:
+            for text, label in queries:
+                f.write(json.dumps({"query": text, "intent": label}, ensure_ascii=False) + "\n")
+        print(f"Выгружено вопросов: {len(queries)} -> {args.export}")
+        return
+
+    labels = load_labels(args.labels)
+    embedding_service = None
+    if not args.rules_only:
+        from src.services.embeddings.unified_embedding_service import UnifiedEmbeddingService
+        embedding_service = UnifiedEmbeddingService(chroma_path=args.chroma_path)
+        await embedding_service.initialize()
+    router = IntentRouter(embedding_service, enabled=True, use_embeddings=not args.rules_only)
+
+    pairs, errors, sources = [], [], Counter()
+    for text, weak_label in queries:
+        label = labels.get(text.lower(), weak_label)
+        decision = router.classify(text)
+        sources[decision.source] += 1
+        pairs.append((label, decision.intent))
+        if label != decision.intent:
+            errors.append((label, decision, text))
+
+    print(f"Вопросов: {len(pairs)}, ручная разметка: {sum(1 for t, _ in queries if t.lower() in labels)}")
+    print("Решения по источнику: " + ", ".join(f"{name} {count}" for name, count in sources.most_common()))
+    print_report(pairs)
+
+    if errors and args.show_errors:
+        print(f"\nОшибки (первые {min(args.show_errors, len(errors))} из {len(errors)}):")
+        for label, decision, text in errors[:args.show_errors]:
+            print(f"  [{label} -> {decision.intent}, {decision.source} {decision.score:.2f}] {text}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+"""
+Локальный OpenAI-совместимый сервер для проверки маршрутизации LLM-провайдеров.
+Отвечает на POST /v1/chat/completions фиксированным текстом после искусственной задержки;
+часть запросов можно сделать медленными (хвост задержки) или ошибочными (HTTP 500/429).
+
+Запуск из корня репозитория:
+    python scripts/llm_stub_server.py --port 8901 --latency 0.8 --tail-rate 0.2 --tail-latency 6
+Затем, например:
+    RAG_LLM_PROVIDERS=openai,deepseek OPENAI_BASE_URL=http://127.0.0.1:8901/v1 OPENAI_API_KEY=stub ...
+
+Из кода: start_stub_server(port, ...) запускает сервер в фоновом потоке и возвращает его.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(self, name="stub", latency=0.5, jitter=0.1, tail_rate=0.0, tail_latency=5.0,
+                 error_rate=0.0, error_status=500):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент отменил запрос (проигравший дублированный запрос)
+                pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            with config.lock:
+                config.requests += 1
+                number = config.requests
+
+            if random.random() < config.tail_rate:
+                delay = config.tail_latency
+            else:
+                delay = max(0.0, random.gauss(config.latency, config.jitter))
+            time.sleep(delay)
+
+            if random.random() < config.error_rate:
+                headers = {"Retry-After": "1"} if config.error_status == 429 else None
+                self._send(config.error_status, {"error": {"message": f"{config.name}: injected error"}}, headers)
+                return
+
+            prompt = " ".join(str(m.get("content", "")) for m in request.get("messages", []))
+            text = f"Ответ {config.name} #{number} за {delay:.2f} с"
+            self._send(200, {
+                "id": f"chatcmpl-{config.name}-{number}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": len(prompt.split()),
+                    "completion_tokens": len(text.split()),
+                    "total_tokens": len(prompt.split()) + len(text.split())
+                }
+            })
+
+    return StubHandler
+
+
+def start_stub_server(port, host="127.0.0.1", **options):
+    """Запускает сервер в фоновом потоке; server.stub_config - настройки и счетчик запросов."""
+    config = StubConfig(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.stub_config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-совместимый сервер-заглушка с искусственной задержкой")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--name", default="stub")
+    parser.add_argument("--latency", type=float, default=0.5, help="средняя задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.1, help="разброс задержки, с")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="доля медленных ответов")
+    parser.add_argument("--tail-latency", type=float, default=5.0, help="задержка медленного ответа, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP-код ошибки (500, 429, ...)")
+    args = parser.parse_args()
+
+    config = StubConfig(args.name, args.latency, args.jitter, args.tail_rate, args.tail_latency,
+                        args.error_rate, args.error_status)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    server.daemon_threads = True
+    print(f"Заглушка {args.name}: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
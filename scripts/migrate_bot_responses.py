@@ -0,0 +1,100 @@
+"""
+Миграция таблицы bot_responses существующей базы под метрики ответов RAG
+(источник ответа, модель, токены, стоимость, время этапов).
+
+Запуск из корня репозитория (параметры подключения - из .env, как у бота):
+    python scripts/migrate_bot_responses.py [--dry-run]
+
+Идемпотентна: добавляет только отсутствующие колонки и индекс, поэтому ее можно
+запускать повторно и на базе, где часть колонок уже создана вручную.
+Колонка llm_provider, созданная раньше с другим типом, приводится к текущему через MODIFY.
+"""
+import os
+import sys
+import asyncio
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from src.database.connection import engine
+
+TABLE = "bot_responses"
+INDEX_NAME = "idx_bot_responses_source"
+
+# (колонка, определение) в порядке следования после message_id
+COLUMNS = [
+    ("answer_source", "varchar(50) DEFAULT NULL"),
+    ("llm_provider", "varchar(100) DEFAULT NULL"),
+    ("llm_model", "varchar(100) DEFAULT NULL"),
+    ("prompt_tokens", "int DEFAULT '0'"),
+    ("completion_tokens", "int DEFAULT '0'"),
+    ("cached_tokens", "int DEFAULT '0'"),
+    ("cost_usd", "decimal(10,6) DEFAULT NULL"),
+    ("time_expand", "decimal(8,3) DEFAULT NULL"),
+    ("time_embed", "decimal(8,3) DEFAULT NULL"),
+    ("time_retrieve", "decimal(8,3) DEFAULT NULL"),
+    ("time_rerank", "decimal(8,3) DEFAULT NULL"),
+    ("time_generate", "decimal(8,3) DEFAULT NULL"),
+]
+# Колонки, которые могли быть созданы раньше с другим типом
+MODIFY_COLUMNS = {"llm_provider"}
+
+
+async def plan_statements(conn) -> list:
+    """ALTER-запросы для приведения bot_responses к текущей схеме."""
+    existing = {
+        row[0]: row[1].lower() for row in await conn.execute(text(
+            "SELECT COLUMN_NAME, COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+        ), {"table": TABLE})
+    }
+    if not existing:
+        raise RuntimeError(f"Таблица {TABLE} не найдена - создайте базу по sql_db/database_setup.sql")
+
+    statements = []
+    previous = "message_id"
+    for column, definition in COLUMNS:
+        if column not in existing:
+            statements.append(f"ALTER TABLE {TABLE} ADD COLUMN {column} {definition} AFTER {previous}")
+        elif column in MODIFY_COLUMNS and existing[column] != definition.split()[0]:
+            statements.append(f"ALTER TABLE {TABLE} MODIFY COLUMN {column} {definition} AFTER {previous}")
+        previous = column
+
+    has_index = (await conn.execute(text(
+        "SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index"
+    ), {"table": TABLE, "index": INDEX_NAME})).scalar()
+    if not has_index:
+        statements.append(f"ALTER TABLE {TABLE} ADD KEY {INDEX_NAME} (answer_source, created_at)")
+    return statements
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Миграция bot_responses под метрики ответов RAG")
+    parser.add_argument("--dry-run", action="store_true", help="только показать запросы")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Подробный лог SQL движка бота здесь не нужен
+    engine.echo = False
+
+    try:
+        async with engine.begin() as conn:
+            statements = await plan_statements(conn)
+            if not statements:
+                print(f"Таблица {TABLE} уже в актуальной схеме")
+                return
+            for statement in statements:
+                print(statement)
+                if not args.dry_run:
+                    await conn.execute(text(statement))
+        print("Запросы не выполнялись (--dry-run)" if args.dry_run else f"Выполнено запросов: {len(statements)}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
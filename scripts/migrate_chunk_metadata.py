@@ -0,0 +1,54 @@
+"""
+Одноразовая миграция коллекции ChromaDB на компактную схему метаданных чанков.
+
+Запуск из корня репозитория:
+    python scripts/migrate_chunk_metadata.py [--chroma-path ./chroma_db] [--no-vacuum]
+
+Печатает размер индекса на диске и средний размер записи (метаданные + документ),
+которую возвращают collection.get/query, до и после миграции.
+"""
+import os
+import sys
+import asyncio
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.embeddings.unified_embedding_service import UnifiedEmbeddingService
+
+
+def _format_bytes(value: float) -> str:
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} ТБ"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Миграция схемы метаданных чанков")
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    parser.add_argument("--collection", default="product_chunks_embeddings")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--no-vacuum", action="store_true", help="не сжимать chroma.sqlite3 после миграции")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    service = UnifiedEmbeddingService(chroma_path=args.chroma_path, collection_name=args.collection)
+    # Модель эмбеддингов для миграции не нужна: векторы переносятся как есть
+    await service.initialize(load_model=False)
+
+    report = await service.migrate_metadata_schema(batch_size=args.batch_size, vacuum=not args.no_vacuum)
+    before, after = report["before"], report["after"]
+
+    print(f"Перенесено записей: {report['migrated']}")
+    print(f"{'':28}{'до':>14}{'после':>14}")
+    print(f"{'Размер индекса на диске':28}{_format_bytes(before['index_bytes']):>14}{_format_bytes(after['index_bytes']):>14}")
+    print(f"{'Метаданные на запись':28}{_format_bytes(before['avg_metadata_bytes']):>14}{_format_bytes(after['avg_metadata_bytes']):>14}")
+    print(f"{'Запись в ответе get/query':28}{_format_bytes(before['avg_record_bytes']):>14}{_format_bytes(after['avg_record_bytes']):>14}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
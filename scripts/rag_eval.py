@@ -0,0 +1,374 @@
+"""
+Офлайн-оценка поиска RAG и задержки этапов на записанных или размеченных вопросах.
+
+Вопросы проходят через RagService.search_and_answer так же, как в боте, но без сети:
+LLM заменена заглушкой (промпт собирается как обычно, считаются его токены),
+табличный индекс (MySQL), кеш ответов и запись трасс отключены, названия продуктов
+берутся только из кеша каталога. Для каждой конфигурации печатаются:
+  * recall@k и hit@k по размеченным product_ids, MRR (место первого нужного продукта);
+  * p50/p95 общего времени и каждого этапа (timings результата: intent, expand, embed, search, mmr, ...);
+  * токены промпта, размер индекса (записей, разделов, байт на диске), память процесса.
+
+Набор вопросов:
+  * --labels FILE - JSONL {"query": "Какая тара у БРИТ Т-75?", "product_ids": [12]};
+    вопросы без product_ids учитываются только в задержке;
+  * --from-db - записанные вопросы ai_question из user_queries (нужна БД); слабая разметка -
+    продукты каталога, названия которых упомянуты в вопросе (Т-75, ЗВС-65, «...»);
+    --liked-only - только вопросы, ответ на которые получил лайк.
+    --export FILE сохраняет такой набор в JSONL для ручной разметки.
+
+Конфигурации сравниваются бок о бок (--config, можно несколько): NAME:KEY=VALUE,KEY=VALUE.
+KEY в верхнем регистре - переменная окружения (RAG_QUERY_VARIANTS=1, RAG_MMR=0, RAG_RERANKER=1...),
+в нижнем - параметры оценки: chroma_path, collection, top_k, threshold.
+Каждая конфигурация выполняется в отдельном процессе, потому что настройки читаются при импорте.
+
+Запуск из корня репозитория:
+    python scripts/rag_eval.py --labels labeled.jsonl --config base: --config single:RAG_QUERY_VARIANTS=1
+    python scripts/rag_eval.py --from-db --limit 300 --export queries.jsonl
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EVAL_KEYS = ("chroma_path", "collection", "top_k", "threshold")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def parse_config(spec):
+    """NAME:KEY=VALUE,KEY=VALUE -> (имя, переменные окружения, параметры оценки)."""
+    name, _, items = spec.partition(":")
+    env, params = {}, {}
+    for item in filter(None, (part.strip() for part in items.split(","))):
+        key, _, value = item.partition("=")
+        if key in EVAL_KEYS:
+            params[key] = value
+        elif key.isupper():
+            env[key] = value
+        else:
+            raise SystemExit(f"Неизвестный параметр конфигурации '{key}' (ожидается {', '.join(EVAL_KEYS)} или ПЕРЕМЕННАЯ)")
+    return name or "base", env, params
+
+
+def load_labels(path):
+    with open(path, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [item for item in items if item.get("query")]
+
+
+def memory_mb():
+    """Текущая и пиковая память процесса (RSS), МБ; на системах без /proc - только пиковая."""
+    current = None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux - КБ, macOS - байты
+        peak = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        peak = None
+    return current, peak
+
+
+async def load_from_db(limit, liked_only):
+    """Записанные вопросы к AI со слабой разметкой по названиям продуктов в тексте вопроса."""
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+    from src.database.connection import AsyncSessionLocal
+    from src.database.models import UserQuery, BotResponse
+    from src.services.catalog_cache import product_catalog_cache
+    from src.services.rag.query_processor import QueryProcessor
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(UserQuery)
+            .where(UserQuery.query_type == 'ai_question')
+            .options(selectinload(UserQuery.responses).selectinload(BotResponse.feedbacks))
+            .order_by(UserQuery.id.desc())
+            .limit(limit)
+        )
+        queries = result.scalars().all()
+    catalog = await product_catalog_cache.get_all_names()
+
+    processor = QueryProcessor()
+    items, seen = [], set()
+    for query in queries:
+        text = " ".join(str(query.query_text).split())
+        if not text or text.lower() in seen:
+            continue
+        liked = any(f.feedback_type == 'like' for r in query.responses for f in r.feedbacks)
+        if liked_only and not liked:
+            continue
+        seen.add(text.lower())
+        names = [name.lower() for name in processor.extract_product_names(text)]
+        product_ids = sorted(
+            product_id for product_id, product_name in catalog.items()
+            if any(name in product_name.lower() for name in names)
+        )
+        items.append({"query": text, "product_ids": product_ids, "liked": liked, "label": "weak"})
+    return items
+
+
+class StubLLMGenerator:
+    """LLM без сети: промпт собирается настоящим генератором (для токенов), ответ - заглушка."""
+
+    def __init__(self, generator, latency):
+        self.generator = generator
+        self.latency = latency
+
+    async def generate_answer(self, query, search_results, table_context="", history=None):
+        from src.services.rag.multi_llm_generator import LLMAnswer
+        _, prompt_tokens = self.generator._build_messages(query, search_results, table_context, history)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return LLMAnswer("(ответ LLM не запрашивался)", provider="stub", model="stub", prompt_tokens=prompt_tokens)
+
+    def get_stats(self):
+        return {}
+
+
+async def run_worker(args):
+    """Оценка одной конфигурации (в отдельном процессе): результат пишется в --output как JSON."""
+    config = json.loads(args.worker)
+    params = config["params"]
+    top_k = int(params.get("top_k", args.top_k))
+    threshold = float(params.get("threshold", args.threshold))
+
+    from src.services.rag.rag_service import RagService
+    from src.services.rag.deadline import Deadline
+    from src.services.rag.answer_cache import semantic_answer_cache
+    from src.services.rag.tracing import rag_tracer
+    from src.services.rag.intent_router import IntentRouter
+    from src.services.embeddings.unified_embedding_service import UnifiedEmbeddingService
+    from src.services.catalog_cache import product_catalog_cache
+
+    # Офлайн: без записи трасс, кеша ответов, табличного индекса и запросов каталога в БД
+    rag_tracer.enabled = False
+    semantic_answer_cache.enabled = False
+
+    async def cached_names(product_ids):
+        names = {}
+        for product_id in product_ids:
+            name = product_catalog_cache.get_cached(product_id) if product_id is not None else None
+            if name:
+                names[int(product_id)] = name
+        return names
+
+    product_catalog_cache.get_names = cached_names
+
+    service = RagService()
+    if "chroma_path" in params or "collection" in params:
+        service.embedding_service = UnifiedEmbeddingService(
+            chroma_path=params.get("chroma_path", "./chroma_db"),
+            collection_name=params.get("collection", "product_chunks_embeddings")
+        )
+        service.intent_router = IntentRouter(service.embedding_service)
+    service.table_lookup.detect_intent = lambda query: None
+    service.llm_generator = StubLLMGenerator(service.llm_generator, args.llm_latency)
+
+    started = time.perf_counter()
+    await service.initialize()
+    init_time = time.perf_counter() - started
+    memory_after_init, _ = memory_mb()
+
+    items = load_labels(args.labels)
+    for item in items[:args.warmup]:
+        await service.search_and_answer(item["query"], top_k=top_k, threshold=threshold, deadline=Deadline(3600))
+
+    ks = sorted({int(k) for k in args.k.split(",")})
+    totals, stages, prompt_tokens = [], {}, []
+    recalls = {k: [] for k in ks}
+    hits = {k: [] for k in ks}
+    reciprocal_ranks, sources = [], {}
+    for item in items:
+        started = time.perf_counter()
+        result = await service.search_and_answer(
+            item["query"], top_k=top_k, threshold=threshold, deadline=Deadline(3600)
+        )
+        totals.append(time.perf_counter() - started)
+        for stage, seconds in result.get("timings", {}).items():
+            stages.setdefault(stage, []).append(seconds)
+        source = result.get("answer_source") or "?"
+        sources[source] = sources.get(source, 0) + 1
+        if result.get("llm_usage"):
+            prompt_tokens.append(result["llm_usage"]["prompt_tokens"])
+
+        relevant = {int(pid) for pid in item.get("product_ids") or []}
+        if not relevant:
+            continue
+        # Вопрос, отвеченный без поиска (намерение), считается промахом
+        # Общий фрагмент (dedup) засчитывается всем продуктам, к которым он относится
+        ranked = [
+            {int(pid) for pid in r.get("product_ids") or [r.get("product_id")] if pid is not None}
+            for r in result.get("search_results", [])
+        ]
+        for k in ks:
+            found = relevant & set().union(*ranked[:k])
+            recalls[k].append(len(found) / len(relevant))
+            hits[k].append(1.0 if found else 0.0)
+        rank = next((i for i, pids in enumerate(ranked, 1) if pids & relevant), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    index_stats = await service.embedding_service.get_statistics()
+    memory_current, memory_peak = memory_mb()
+    report = {
+        "name": config["name"],
+        "env": config["env"],
+        "top_k": top_k,
+        "queries": len(items),
+        "labeled": len(reciprocal_ranks),
+        "recall": {k: statistics.mean(values) if values else None for k, values in recalls.items()},
+        "hit": {k: statistics.mean(values) if values else None for k, values in hits.items()},
+        "mrr": statistics.mean(reciprocal_ranks) if reciprocal_ranks else None,
+        "total": {"p50": percentile(totals, 0.5), "p95": percentile(totals, 0.95)},
+        "stages": {stage: {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+                   for stage, values in stages.items()},
+        "prompt_tokens": statistics.mean(prompt_tokens) if prompt_tokens else None,
+        "answer_sources": sources,
+        "init_time": init_time,
+        "index": {
+            "embeddings": index_stats.get("total_embeddings"),
+            "parent_sections": index_stats.get("parent_sections"),
+            "bytes": service.embedding_service._index_size_bytes()
+        },
+        "memory_mb": {"after_init": memory_after_init, "current": memory_current, "peak": memory_peak}
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False)
+
+
+def run_config(args, spec, labels_path):
+    """Запускает оценку конфигурации в отдельном процессе с ее переменными окружения."""
+    name, env, params = parse_config(spec)
+    with tempfile.NamedTemporaryFile("r", suffix=".json", delete=False) as output:
+        output_path = output.name
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--worker", json.dumps({"name": name, "env": env, "params": params}),
+        "--labels", labels_path, "--output", output_path,
+        "--top-k", str(args.top_k), "--threshold", str(args.threshold), "--k", args.k,
+        "--warmup", str(args.warmup), "--llm-latency", str(args.llm_latency)
+    ]
+    print(f"Конфигурация {name}: {', '.join(f'{k}={v}' for k, v in {**env, **params}.items()) or 'текущие настройки'}")
+    try:
+        completed = subprocess.run(command, env={**os.environ, **env}, cwd=ROOT,
+                                   stdout=None if args.verbose else subprocess.DEVNULL)
+        if completed.returncode != 0:
+            print(f"  ошибка оценки (код {completed.returncode})")
+            return None
+        with open(output_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.unlink(output_path)
+
+
+def print_reports(reports, ks):
+    """Таблица: строки - метрики, столбцы - конфигурации."""
+    def fmt(value, pattern):
+        return pattern.format(value) if value is not None else "-"
+
+    rows = [("вопросов / размечено", [f"{r['queries']} / {r['labeled']}" for r in reports])]
+    for k in ks:
+        rows.append((f"recall@{k}", [fmt(r["recall"].get(str(k)), "{:.3f}") for r in reports]))
+        rows.append((f"hit@{k}", [fmt(r["hit"].get(str(k)), "{:.3f}") for r in reports]))
+    rows.append(("MRR", [fmt(r["mrr"], "{:.3f}") for r in reports]))
+    rows.append(("всего p50 / p95, мс", [f"{r['total']['p50'] * 1000:.0f} / {r['total']['p95'] * 1000:.0f}" for r in reports]))
+    stages = list(dict.fromkeys(stage for r in reports for stage in r["stages"]))
+    for stage in stages:
+        rows.append((f"  {stage} p50 / p95, мс", [
+            f"{r['stages'][stage]['p50'] * 1000:.1f} / {r['stages'][stage]['p95'] * 1000:.1f}"
+            if stage in r["stages"] else "-" for r in reports
+        ]))
+    rows.append(("токенов промпта", [fmt(r["prompt_tokens"], "{:.0f}") for r in reports]))
+    rows.append(("записей / разделов", [f"{r['index']['embeddings']} / {r['index']['parent_sections']}" for r in reports]))
+    rows.append(("индекс на диске, МБ", [f"{r['index']['bytes'] / 1024 / 1024:.1f}" for r in reports]))
+    rows.append(("память после init, МБ", [fmt(r["memory_mb"]["after_init"], "{:.0f}") for r in reports]))
+    rows.append(("память пик, МБ", [fmt(r["memory_mb"]["peak"], "{:.0f}") for r in reports]))
+    rows.append(("загрузка, с", [f"{r['init_time']:.1f}" for r in reports]))
+
+    width = max(len(label) for label, _ in rows) + 2
+    column = max(14, max(len(r["name"]) for r in reports) + 2)
+    print("\n" + " " * width + "".join(f"{r['name']:>{column}}" for r in reports))
+    for label, values in rows:
+        print(f"{label:<{width}}" + "".join(f"{value:>{column}}" for value in values))
+    for r in reports:
+        sources = ", ".join(f"{source} {count}" for source, count in r["answer_sources"].items())
+        print(f"\n{r['name']}: источники ответов - {sources}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Офлайн-оценка поиска RAG и задержки этапов")
+    parser.add_argument("--labels", default=None, help="JSONL с вопросами (query, product_ids)")
+    parser.add_argument("--from-db", action="store_true", help="записанные вопросы ai_question из БД")
+    parser.add_argument("--liked-only", action="store_true", help="только вопросы с лайком ответа")
+    parser.add_argument("--limit", type=int, default=500, help="сколько последних вопросов брать из БД")
+    parser.add_argument("--export", default=None, help="сохранить набор из БД в JSONL и выйти")
+    parser.add_argument("--config", action="append", default=[], help="NAME:KEY=VALUE,... (можно несколько)")
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--k", default="1,3,8", help="k для recall@k через запятую")
+    parser.add_argument("--warmup", type=int, default=1, help="вопросов на прогрев (не учитываются)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="задержка заглушки LLM, с")
+    parser.add_argument("--json", action="store_true", help="вывести отчеты в JSON")
+    parser.add_argument("--verbose", action="store_true", help="показывать журнал конвейера")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        await run_worker(args)
+        return
+
+    if args.from_db:
+        items = await load_from_db(args.limit, args.liked_only)
+        labeled = sum(1 for item in items if item["product_ids"])
+        print(f"Из БД: {len(items)} вопросов, со слабой разметкой {labeled}")
+        if args.export:
+            with open(args.export, "w", encoding="utf-8") as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            print(f"Набор сохранен в {args.export}")
+            return
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            labels_path = f.name
+    elif args.labels:
+        labels_path = args.labels
+    else:
+        parser.error("нужен --labels FILE или --from-db")
+
+    try:
+        reports = [report for report in (run_config(args, spec, labels_path) for spec in args.config or ["base:"])
+                   if report is not None]
+    finally:
+        if args.from_db:
+            os.unlink(labels_path)
+    if not reports:
+        return
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    else:
+        print_reports(reports, sorted({int(k) for k in args.k.split(",")}))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
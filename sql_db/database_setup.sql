@@ -97,6 +97,38 @@ CREATE TABLE `product_files` (
   CONSTRAINT `fk_pf_product` FOREIGN KEY (`product_id`) REFERENCES `products` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ========================================
+-- Таблицы из документов продуктов (упаковка, технические характеристики)
+-- ========================================
+DROP TABLE IF EXISTS `product_table_rows`;
+DROP TABLE IF EXISTS `product_tables`;
+CREATE TABLE `product_tables` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `product_id` int unsigned NOT NULL,
+  `source_path` varchar(512) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `location` varchar(255) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+  `columns_json` text COLLATE utf8mb4_unicode_ci NOT NULL,
+  `row_count` int NOT NULL DEFAULT '0',
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_pt_product` (`product_id`),
+  KEY `idx_pt_source` (`source_path`(255)),
+  CONSTRAINT `fk_pt_product` FOREIGN KEY (`product_id`) REFERENCES `products` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `product_table_rows` (
+  `id` int unsigned NOT NULL AUTO_INCREMENT,
+  `table_id` int unsigned NOT NULL,
+  `product_id` int unsigned NOT NULL,
+  `row_index` int NOT NULL,
+  `cells_json` text COLLATE utf8mb4_unicode_ci NOT NULL,
+  `row_text` text COLLATE utf8mb4_unicode_ci NOT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_ptr_table` (`table_id`),
+  KEY `idx_ptr_product` (`product_id`),
+  CONSTRAINT `fk_ptr_table` FOREIGN KEY (`table_id`) REFERENCES `product_tables` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- ========================================
 -- Группы продуктов (если используется)
 -- ========================================
@@ -177,14 +209,30 @@ CREATE TABLE bot_responses (
   execution_time decimal(8,3) DEFAULT NULL,
   sources_count int DEFAULT '0',
   message_id int DEFAULT NULL,
+  answer_source varchar(50) DEFAULT NULL,
+  llm_provider varchar(100) DEFAULT NULL,
+  llm_model varchar(100) DEFAULT NULL,
+  prompt_tokens int DEFAULT '0',
+  completion_tokens int DEFAULT '0',
+  cached_tokens int DEFAULT '0',
+  cost_usd decimal(10,6) DEFAULT NULL,
+  time_expand decimal(8,3) DEFAULT NULL,
+  time_embed decimal(8,3) DEFAULT NULL,
+  time_retrieve decimal(8,3) DEFAULT NULL,
+  time_rerank decimal(8,3) DEFAULT NULL,
+  time_generate decimal(8,3) DEFAULT NULL,
   created_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (id),
   KEY idx_bot_responses_query_id (query_id),
   KEY idx_bot_responses_created_at (created_at),
   KEY idx_bot_responses_type (response_type),
+  KEY idx_bot_responses_source (answer_source, created_at),
   FOREIGN KEY (query_id) REFERENCES user_queries(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Для уже существующей базы (идемпотентно, недостающие колонки и индекс):
+--   python scripts/migrate_bot_responses.py
+
 -- ========================================
 -- Информация о созданной структуре
 -- ========================================
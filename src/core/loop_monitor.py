@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Deque, Optional, Set
+
+"""
+loop_monitor.py
+Измерение задержки цикла событий (event loop lag):
+фоновая задача засыпает на interval и смотрит, насколько позже она проснулась.
+Окна измерения (measure) позволяют узнать задержку во время конкретной операции,
+например загрузки и индексации файла.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class LagWindow:
+	"""Статистика задержки за время окна измерения"""
+	samples: int = 0
+	max_lag: float = 0.0
+	total_lag: float = 0.0
+
+	@property
+	def mean_lag(self) -> float:
+		return self.total_lag / self.samples if self.samples else 0.0
+
+	def add(self, lag: float) -> None:
+		self.samples += 1
+		self.total_lag += lag
+		self.max_lag = max(self.max_lag, lag)
+
+	def describe(self) -> str:
+		return f"макс. {self.max_lag * 1000:.0f} мс, средн. {self.mean_lag * 1000:.0f} мс"
+
+
+class LoopLagMonitor:
+	"""
+	Монитор задержки цикла событий
+	"""
+	def __init__(self, interval: float = 0.1, history: int = 600, warn_threshold: float = 0.5):
+		self.interval = interval
+		self.warn_threshold = warn_threshold
+		self.recent: Deque[float] = deque(maxlen=history)
+		self._windows: Set[LagWindow] = set()
+		self._task: Optional[asyncio.Task] = None
+
+	@property
+	def running(self) -> bool:
+		return self._task is not None and not self._task.done()
+
+	def start(self) -> None:
+		"""Запускает фоновое измерение в текущем цикле событий"""
+		if not self.running:
+			self._task = asyncio.get_running_loop().create_task(self._run())
+
+	async def stop(self) -> None:
+		if self._task:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+			self._task = None
+
+	async def _run(self) -> None:
+		loop = asyncio.get_running_loop()
+		while True:
+			started = loop.time()
+			await asyncio.sleep(self.interval)
+			lag = max(0.0, loop.time() - started - self.interval)
+			self.recent.append(lag)
+			for window in self._windows:
+				window.add(lag)
+			if lag > self.warn_threshold:
+				logger.warning(f"[LoopMonitor] Цикл событий был заблокирован на {lag * 1000:.0f} мс")
+
+	@contextmanager
+	def measure(self):
+		"""
+		Окно измерения:
+			with loop_lag_monitor.measure() as lag:
+				...
+			lag.max_lag
+		"""
+		self.start()
+		window = LagWindow()
+		self._windows.add(window)
+		try:
+			yield window
+		finally:
+			self._windows.discard(window)
+
+	def snapshot(self) -> LagWindow:
+		"""Статистика за последние history измерений"""
+		window = LagWindow()
+		for lag in self.recent:
+			window.add(lag)
+		return window
+
+
+# Глобальный монитор, запускается при старте бота
+loop_lag_monitor = LoopLagMonitor()
@@ -2,7 +2,7 @@ from typing import List, Optional, Dict, Any, Sequence
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_, desc, update
 from sqlalchemy.orm import selectinload
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from src.database.models import UserQuery, BotResponse, UserFeedback
 
@@ -70,7 +70,8 @@ class BotResponseRepository:
         response_type: str = 'ai_generated',
         execution_time: Optional[float] = None,
         sources_count: int = 0,
-        message_id: Optional[int] = None
+        message_id: Optional[int] = None,
+        metrics: Optional[Dict[str, Any]] = None
     ) -> BotResponse:
         """Создать новый ответ бота."""
         response = BotResponse(
@@ -79,7 +80,8 @@ class BotResponseRepository:
             response_type=response_type,
             execution_time=execution_time,
             sources_count=sources_count,
-            message_id=message_id
+            message_id=message_id,
+            **(metrics or {})
         )
         self.session.add(response)
         await self.session.commit()
@@ -100,6 +102,95 @@ class BotResponseRepository:
         
         result = await self.session.execute(query)
         return list(result.scalars().all())
+    
+    async def get_usage_stats(self, days: int = 7, top_limit: int = 5) -> Dict[str, Any]:
+        """
+        Сводка токенов, стоимости и времени этапов за последние days дней:
+        по источнику ответа, по провайдеру/модели, среднее время этапов RAG
+        и вопросы с самыми большими промптами.
+        """
+        since = datetime.now() - timedelta(days=days)
+        recent = and_(BotResponse.created_at >= since, BotResponse.answer_source.is_not(None))
+        
+        by_source_query = select(
+            BotResponse.answer_source,
+            func.count(),
+            func.coalesce(func.sum(BotResponse.prompt_tokens), 0),
+            func.coalesce(func.sum(BotResponse.completion_tokens), 0),
+            func.coalesce(func.sum(BotResponse.cost_usd), 0),
+            func.avg(BotResponse.execution_time)
+        ).where(recent).group_by(BotResponse.answer_source)
+        
+        by_model_query = select(
+            BotResponse.llm_provider,
+            BotResponse.llm_model,
+            func.count(),
+            func.coalesce(func.sum(BotResponse.prompt_tokens), 0),
+            func.coalesce(func.sum(BotResponse.completion_tokens), 0),
+            func.coalesce(func.sum(BotResponse.cached_tokens), 0),
+            func.coalesce(func.sum(BotResponse.cost_usd), 0),
+            func.avg(BotResponse.time_generate)
+        ).where(and_(recent, BotResponse.llm_model.is_not(None))).group_by(BotResponse.llm_provider, BotResponse.llm_model)
+        
+        stages_query = select(
+            func.avg(BotResponse.time_expand),
+            func.avg(BotResponse.time_embed),
+            func.avg(BotResponse.time_retrieve),
+            func.avg(BotResponse.time_rerank),
+            func.avg(BotResponse.time_generate)
+        ).where(and_(recent, BotResponse.answer_source == 'rag'))
+        
+        top_prompts_query = select(
+            BotResponse.prompt_tokens,
+            BotResponse.cost_usd,
+            UserQuery.query_text
+        ).join(UserQuery, BotResponse.query_id == UserQuery.id).where(
+            and_(recent, BotResponse.prompt_tokens > 0)
+        ).order_by(desc(BotResponse.prompt_tokens)).limit(top_limit)
+        
+        by_source = [
+            {
+                'answer_source': source,
+                'responses': count,
+                'prompt_tokens': int(prompt_tokens),
+                'completion_tokens': int(completion_tokens),
+                'cost_usd': float(cost),
+                'avg_execution_time': float(avg_time or 0)
+            }
+            for source, count, prompt_tokens, completion_tokens, cost, avg_time
+            in (await self.session.execute(by_source_query)).all()
+        ]
+        by_model = [
+            {
+                'llm_provider': provider,
+                'llm_model': model,
+                'responses': count,
+                'prompt_tokens': int(prompt_tokens),
+                'completion_tokens': int(completion_tokens),
+                'cached_tokens': int(cached_tokens),
+                'cost_usd': float(cost),
+                'avg_generate_time': float(avg_time or 0)
+            }
+            for provider, model, count, prompt_tokens, completion_tokens, cached_tokens, cost, avg_time
+            in (await self.session.execute(by_model_query)).all()
+        ]
+        stage_row = (await self.session.execute(stages_query)).one()
+        stages = {
+            stage: float(value) if value is not None else None
+            for stage, value in zip(('expand', 'embed', 'retrieve', 'rerank', 'generate'), stage_row)
+        }
+        top_prompts = [
+            {'prompt_tokens': tokens, 'cost_usd': float(cost or 0), 'query_text': text}
+            for tokens, cost, text in (await self.session.execute(top_prompts_query)).all()
+        ]
+        
+        return {
+            'days': days,
+            'by_source': by_source,
+            'by_model': by_model,
+            'stages': stages,
+            'top_prompts': top_prompts
+        }
 
 
 class UserFeedbackRepository:
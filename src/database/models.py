@@ -111,6 +111,57 @@ class ProductFile(Base):
     product = relationship("Product", back_populates="files")
 
 
+class ProductTable(Base):
+    """
+    Таблица из документа продукта (лист XLSX/CSV или таблица страницы PDF).
+    Заголовки хранятся JSON-списком, строки - в ProductTableRow.
+    """
+    
+    __tablename__ = 'product_tables'
+    
+    id = Column(Integer, primary_key=True)
+    product_id = Column(
+        Integer,
+        ForeignKey('products.id', ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    source_path = Column(String(512), nullable=False, index=True)  # Путь к файлу, как в векторном индексе
+    location = Column(String(255))  # Лист книги или "стр. N"
+    columns_json = Column(Text, nullable=False)  # ["Марка", "Тара/фасовка", ...]
+    row_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=func.now())
+    
+    # Отношения
+    rows = relationship(
+        'ProductTableRow',
+        back_populates='table',
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
+
+
+class ProductTableRow(Base):
+    """Строка таблицы документа: ячейки по столбцам и текст для поиска."""
+    
+    __tablename__ = 'product_table_rows'
+    
+    id = Column(Integer, primary_key=True)
+    table_id = Column(
+        Integer,
+        ForeignKey('product_tables.id', ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    product_id = Column(Integer, nullable=False, index=True)  # Дублируется для выборки без JOIN
+    row_index = Column(Integer, nullable=False)  # Номер строки внутри листа/таблицы
+    cells_json = Column(Text, nullable=False)  # ["БРИТ Т-75", "ведро 20 кг", ...]
+    row_text = Column(Text, nullable=False)  # Непустые ячейки через " | "
+    
+    # Отношения
+    table = relationship('ProductTable', back_populates='rows')
+
+
 class UserQuery(Base):
     """Пользовательские запросы к боту."""
     
@@ -151,6 +202,19 @@ class BotResponse(Base):
     execution_time = Column(DECIMAL(8, 2))  # Время выполнения запроса в секундах
     sources_count = Column(Integer, default=0)  # Количество источников, использованных для ответа
     message_id = Column(Integer)  # ID сообщения в Telegram для связи с feedback
+    answer_source = Column(String(50))  # Откуда ответ: rag, rag_followup, answer_cache, coalesced, table_index, intent:..., deadline_*
+    llm_provider = Column(String(100))  # Провайдер LLM, давший ответ (openai, deepseek)
+    llm_model = Column(String(100))  # Модель LLM (gpt-4o-mini)
+    prompt_tokens = Column(Integer, default=0)  # Токены промпта
+    completion_tokens = Column(Integer, default=0)  # Токены ответа
+    cached_tokens = Column(Integer, default=0)  # Токены промпта из кеша провайдера
+    cost_usd = Column(DECIMAL(10, 6))  # Оценка стоимости запроса к LLM, $
+    # Время этапов обработки в секундах
+    time_expand = Column(DECIMAL(8, 3))  # Подготовка запроса
+    time_embed = Column(DECIMAL(8, 3))  # Вектор запроса
+    time_retrieve = Column(DECIMAL(8, 3))  # Поиск, MMR, табличный индекс
+    time_rerank = Column(DECIMAL(8, 3))  # Переранжирование
+    time_generate = Column(DECIMAL(8, 3))  # Кеш ответов и LLM
     created_at = Column(DateTime, nullable=False, default=func.now())
     
     # Отношения
@@ -0,0 +1,137 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import select, delete, insert, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import ProductTable, ProductTableRow
+
+"""
+Репозиторий табличного индекса: таблицы документов продуктов в структурированном виде.
+"""
+
+ROW_SEPARATOR = " | "
+
+
+def escape_like(term: str) -> str:
+    """Экранирует спецсимволы LIKE ('%', '_' и обратную косую черту), чтобы они искались буквально."""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class ProductTableRepository:
+    """Репозиторий для таблиц документов и их строк."""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def delete_tables(self,
+                            product_ids: Optional[Sequence[int]] = None,
+                            source_paths: Optional[Sequence[str]] = None) -> int:
+        """
+        Удаляет таблицы (вместе со строками) продуктов и/или файлов.
+        Возвращает число удаленных таблиц. Коммит - на стороне вызывающего кода.
+        """
+        conditions = []
+        if product_ids:
+            conditions.append(ProductTable.product_id.in_(list(product_ids)))
+        if source_paths:
+            conditions.append(ProductTable.source_path.in_(list(source_paths)))
+        if not conditions:
+            return 0
+
+        table_ids = (await self.session.execute(
+            select(ProductTable.id).where(or_(*conditions))
+        )).scalars().all()
+        if not table_ids:
+            return 0
+
+        await self.session.execute(delete(ProductTableRow).where(ProductTableRow.table_id.in_(table_ids)))
+        await self.session.execute(delete(ProductTable).where(ProductTable.id.in_(table_ids)))
+        return len(table_ids)
+
+    async def add_table(self,
+                        product_id: int,
+                        source_path: str,
+                        location: Optional[str],
+                        columns: List[str],
+                        rows: Iterable[List[str]],
+                        first_row: int = 0,
+                        batch_size: int = 1000) -> int:
+        """
+        Сохраняет таблицу и ее строки (пакетами по batch_size). Возвращает число строк.
+        """
+        table = ProductTable(
+            product_id=product_id,
+            source_path=source_path,
+            location=(location or "")[:255],
+            columns_json=json.dumps(columns, ensure_ascii=False),
+            row_count=0
+        )
+        self.session.add(table)
+        await self.session.flush()
+
+        batch: List[Dict[str, Any]] = []
+        row_count = 0
+        for offset, cells in enumerate(rows):
+            cells = ["" if cell is None else str(cell) for cell in cells]
+            batch.append({
+                "table_id": table.id,
+                "product_id": product_id,
+                "row_index": first_row + offset,
+                "cells_json": json.dumps(cells, ensure_ascii=False),
+                "row_text": ROW_SEPARATOR.join(cell for cell in cells if cell)
+            })
+            if len(batch) >= batch_size:
+                await self.session.execute(insert(ProductTableRow), batch)
+                row_count += len(batch)
+                batch = []
+        if batch:
+            await self.session.execute(insert(ProductTableRow), batch)
+            row_count += len(batch)
+
+        table.row_count = row_count
+        return row_count
+
+    async def get_tables(self,
+                         product_ids: Optional[Sequence[int]] = None,
+                         column_keys: Optional[Sequence[str]] = None,
+                         limit: Optional[int] = None) -> List[ProductTable]:
+        """
+        Таблицы продуктов (или все таблицы, если product_ids не задан) без строк.
+        column_keys - только таблицы, в заголовках которых есть хотя бы одна из подстрок.
+        """
+        query = select(ProductTable)
+        if product_ids:
+            query = query.where(ProductTable.product_id.in_(list(product_ids)))
+        if column_keys:
+            query = query.where(or_(*[
+                ProductTable.columns_json.ilike(f"%{escape_like(key)}%", escape="\\") for key in column_keys
+            ]))
+        query = query.order_by(ProductTable.id)
+        if limit:
+            query = query.limit(limit)
+        result = await self.session.execute(query)
+        return list(result.scalars().all())
+
+    async def find_rows(self,
+                        table_ids: Sequence[int],
+                        terms: Optional[Sequence[str]] = None,
+                        limit: int = 200) -> List[ProductTableRow]:
+        """
+        Строки указанных таблиц; при заданных terms - только строки, содержащие хотя бы один из них.
+        """
+        if not table_ids:
+            return []
+        query = select(ProductTableRow).where(ProductTableRow.table_id.in_(list(table_ids)))
+        if terms:
+            query = query.where(or_(*[
+                ProductTableRow.row_text.ilike(f"%{escape_like(term)}%", escape="\\") for term in terms
+            ]))
+        query = query.order_by(ProductTableRow.table_id, ProductTableRow.row_index).limit(limit)
+        result = await self.session.execute(query)
+        return list(result.scalars().all())
+
+    async def count(self) -> Tuple[int, int]:
+        """Число таблиц и строк в индексе."""
+        tables = (await self.session.execute(select(func.count(ProductTable.id)))).scalar() or 0
+        rows = (await self.session.execute(select(func.count(ProductTableRow.id)))).scalar() or 0
+        return int(tables), int(rows)
@@ -1,4 +1,5 @@
 from aiogram import Router, types
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -596,9 +597,9 @@ async def confirm_delete_product_callback(callback: types.CallbackQuery, state:
             auto_chunking = AutoChunkingService()
             await auto_chunking.initialize()
             
-            # Удаляем все эмбеддинги продукта
-            await auto_chunking.embedding_service.delete_product_embeddings(product_id)
-            logger.info(f"[AdminDeleteProduct] Эмбеддинги продукта {product_id} удалены")
+            # Удаляем все эмбеддинги и таблицы продукта одним фильтром
+            deleted_count = await auto_chunking.delete_indexed_content(session, product_ids=[product_id])
+            logger.info(f"[AdminDeleteProduct] Удалено {deleted_count} эмбеддингов продукта {product_id}")
                 
         except Exception as e:
             import logging
@@ -992,4 +993,312 @@ async def admin_get_products_callback(callback: types.CallbackQuery, session: As
                     ]])
                 )
         else:
-            await callback.answer("❌ Ошибка получения списка", show_alert=True)
\ No newline at end of file
+            await callback.answer("❌ Ошибка получения списка", show_alert=True)
+
+def format_index_stats(stats: dict) -> str:
+    """Форматирует статистику векторного индекса для админ-меню"""
+    if 'error' in stats:
+        return f"❌ Ошибка получения статистики индекса: {esc(str(stats['error'])[:100])}"
+    
+    lines = [
+        "<b>🗂 Векторный индекс</b>",
+        f"<b>Записей:</b> {stats.get('total_embeddings', 0)}",
+        f"<b>Продуктов:</b> {stats.get('unique_products', 0)}",
+        f"<b>Чанков:</b> {stats.get('chunk_embeddings', 0)}",
+        f"<b>Документов целиком:</b> {stats.get('full_document_embeddings', 0)}",
+        f"<b>В среднем на продукт:</b> {stats.get('avg_embeddings_per_product', 0):.1f}",
+    ]
+    if 'manifest_consistent' in stats:
+        status = "✅ совпадает" if stats['manifest_consistent'] else "⚠️ расходится, будет перестроен при перезапуске"
+        lines.append(f"<b>Манифест:</b> {status}")
+    return "\n".join(lines)
+
+
+def format_answer_cache_stats(stats: dict, with_audit: bool = False) -> str:
+    """Форматирует статистику семантического кеша ответов для админ-меню"""
+    if not stats.get('enabled'):
+        return "<b>🧠 Кеш ответов:</b> выключен"
+    
+    lines = [
+        "<b>🧠 Кеш ответов</b>",
+        f"<b>Записей:</b> {stats.get('entries', 0)}",
+        f"<b>Попаданий:</b> {stats.get('hits', 0)} из {stats.get('lookups', 0)} ({stats.get('hit_rate', 0):.1%})",
+        f"<b>Похожий вопрос, другие фрагменты:</b> {stats.get('near_misses', 0)}",
+        f"<b>Ложные попадания (дизлайк):</b> {stats.get('false_hits', 0)} ({stats.get('false_hit_rate', 0):.1%})",
+        f"<b>Удалено по отзывам / переиндексации:</b> {stats.get('evicted_feedback', 0)} / {stats.get('evicted_reindex', 0)}",
+    ]
+    if with_audit and stats.get('recent_hits'):
+        lines.append("\n<b>Последние попадания (вопрос ← сохраненный вопрос):</b>")
+        for hit in stats['recent_hits'][-10:]:
+            lines.append(
+                f"• {esc(hit['query'][:80])} ← {esc(hit['cached_query'][:80])} "
+                f"({hit['similarity']:.3f}, фрагменты {hit['overlap']:.2f})"
+            )
+    return "\n".join(lines)
+
+
+def format_single_flight_stats(stats: dict) -> str:
+    """Форматирует статистику объединения одинаковых запросов к AI"""
+    if not stats.get('enabled'):
+        return "<b>🔗 Объединение запросов:</b> выключено"
+    
+    return "\n".join([
+        "<b>🔗 Объединение одинаковых запросов</b>",
+        f"<b>Объединено:</b> {stats.get('coalesced', 0)} из {stats.get('calls', 0)} ({stats.get('coalesce_rate', 0):.1%})",
+        f"<b>Максимум ожидающих одного ответа:</b> {stats.get('max_waiters', 0)}",
+        f"<b>Отменено ожидающих / брошено задач:</b> {stats.get('cancelled_waiters', 0)} / {stats.get('abandoned', 0)}",
+        f"<b>Выполняется сейчас:</b> {stats.get('in_flight', 0)}",
+    ])
+
+
+def format_job_queue_stats(stats: dict) -> str:
+    """Форматирует статистику очереди вопросов к AI"""
+    return "\n".join([
+        "<b>📥 Очередь вопросов к AI</b>",
+        f"<b>В очереди / выполняется:</b> {stats['depth']} / {stats['running']} из {stats['workers']} (максимум очереди {stats['max_depth']})",
+        f"<b>Ожидание:</b> p50 {stats['wait_p50']:.2f} с, p90 {stats['wait_p90']:.2f} с; "
+        f"<b>выполнение:</b> p50 {stats['run_p50']:.2f} с, p90 {stats['run_p90']:.2f} с",
+        f"<b>Выполнено / ошибок / по таймауту:</b> {stats['completed']} / {stats['failed']} / {stats['timed_out']}",
+        f"<b>Отклонено:</b> повторный вопрос {stats['rejected_busy']}, очередь заполнена {stats['rejected_full']}, "
+        f"не дождались {stats['queue_timeouts']}, истек бюджет времени {stats.get('deadline_expired', 0)}",
+    ])
+
+
+def format_deadline_stats(stats: dict) -> str:
+    """Форматирует итоги бюджета времени вопросов к AI"""
+    if not stats['requests']:
+        return f"<b>⏱ Бюджет времени ответа:</b> {stats['budget']:.0f} с, вопросов еще не было"
+    
+    fallbacks = ", ".join(f"{esc(source)} {count}" for source, count in stats['fallbacks'].items()) or "нет"
+    timeouts = ", ".join(f"{esc(stage)} {count}" for stage, count in stats['stage_timeouts'].items()) or "нет"
+    return "\n".join([
+        f"<b>⏱ Бюджет времени ответа: {stats['budget']:.0f} с</b>",
+        f"<b>Уложились:</b> {stats['within_budget']} из {stats['requests']} ({stats['within_budget'] / stats['requests']:.0%})",
+        f"<b>Запасные ответы:</b> {fallbacks}",
+        f"<b>Прерванные этапы:</b> {timeouts}",
+    ])
+
+
+def format_conversation_stats(stats: dict) -> str:
+    """Форматирует счетчики памяти диалога с AI"""
+    if not stats['enabled']:
+        return "<b>🧵 Память диалога:</b> выключена (RAG_MEMORY=0)"
+    
+    return "\n".join([
+        f"<b>🧵 Память диалога (TTL {stats['ttl']:.0f} с)</b>",
+        f"<b>Пользователей с историей:</b> {stats['users']}, запомнено ответов: {stats['remembered']}",
+        f"<b>Уточняющих вопросов:</b> {stats['follow_ups']} "
+        f"(тот же продукт {stats['reused']}, другой продукт {stats['extended']}), истекло {stats['expired']}",
+    ])
+
+
+def format_llm_pool_stats(stats: dict) -> str:
+    """Форматирует состояние очередей запросов к LLM-провайдерам"""
+    if not stats:
+        return "<b>🌐 Очередь LLM:</b> запросов еще не было"
+    
+    lines = ["<b>🌐 Очередь LLM</b>"]
+    for provider, item in stats.items():
+        paused = f", пауза {item['paused_for']:.0f} с" if item.get('paused_for') else ""
+        lines.append(
+            f"• <b>{esc(provider)}</b>: в очереди {item['queue_depth']}, выполняется {item['in_flight']}/{item['max_concurrency']}, "
+            f"ожидание p50 {item['wait_p50']:.2f} с / p90 {item['wait_p90']:.2f} с, "
+            f"429: {item['rate_limited']}, повторов {item['retries']}, ошибок {item['errors']}{paused}"
+        )
+    return "\n".join(lines)
+
+
+@router.callback_query(lambda c: c.data in ('admin:stats', 'admin:stats:audit'))
+async def admin_stats_callback(callback: types.CallbackQuery, is_admin: bool = False):
+    """Статистика системы для администратора"""
+    if not is_admin:
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+    
+    full_scan = callback.data == 'admin:stats:audit'
+    
+    try:
+        from src.services.auto_chunking_service import AutoChunkingService
+        from src.services.rag.answer_cache import semantic_answer_cache
+        from src.services.rag.single_flight import rag_single_flight
+        from src.services.rag.llm_client_pool import llm_client_pool
+        from src.services.rag.job_queue import rag_job_queue
+        from src.services.rag.deadline import deadline_stats
+        from src.services.rag.conversation import conversation_memory
+        
+        auto_chunking = AutoChunkingService()
+        stats = await auto_chunking.get_statistics(full_scan=full_scan)
+        text = "<b>📊 Статистика</b>\n\n" + format_index_stats(stats)
+        text += "\n\n" + format_answer_cache_stats(semantic_answer_cache.get_stats(), with_audit=full_scan)
+        text += "\n\n" + format_job_queue_stats(rag_job_queue.get_stats())
+        text += "\n\n" + format_deadline_stats(deadline_stats.get_stats())
+        text += "\n\n" + format_conversation_stats(conversation_memory.get_stats())
+        text += "\n\n" + format_single_flight_stats(rag_single_flight.get_stats())
+        text += "\n\n" + format_llm_pool_stats(llm_client_pool.get_stats())
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики: {e}")
+        text = f"❌ Ошибка получения статистики: {esc(str(e)[:100])}"
+    
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔎 Аудит индекса (полный обход)", callback_data="admin:stats:audit")],
+        [types.InlineKeyboardButton(text="💬 Отзывы и расход токенов", callback_data="admin:feedback_stats")],
+        [types.InlineKeyboardButton(text="⬅️ Назад в админ-меню", callback_data="admin:menu")]
+    ])
+    
+    if callback.message and isinstance(callback.message, types.Message):
+        try:
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+        except Exception:
+            await callback.message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
+
+def format_feedback_stats(stats: dict) -> str:
+    """Форматирует статистику лайков и дизлайков"""
+    return "\n".join([
+        "<b>👍 Обратная связь</b>",
+        f"<b>Ответов:</b> {stats.get('total_responses', 0)}, с отзывом: {stats.get('responses_with_feedback', 0)} ({stats.get('feedback_rate', 0)}%)",
+        f"<b>Лайков / дизлайков:</b> {stats.get('likes', 0)} / {stats.get('dislikes', 0)} (удовлетворенность {stats.get('satisfaction_rate', 0)}%)",
+    ])
+
+
+def format_usage_stats(stats: dict) -> str:
+    """Форматирует сводку токенов, стоимости и времени этапов ответов"""
+    lines = [f"<b>💰 Токены и стоимость за {stats['days']} дн.</b>"]
+    if not stats['by_source']:
+        lines.append("Ответов с метриками пока нет")
+        return "\n".join(lines)
+    
+    total_cost = sum(item['cost_usd'] for item in stats['by_source'])
+    lines.append(f"<b>Всего:</b> ${total_cost:.4f}")
+    
+    lines.append("\n<b>По источнику ответа:</b>")
+    for item in sorted(stats['by_source'], key=lambda x: -x['responses']):
+        lines.append(
+            f"• {esc(item['answer_source'])}: {item['responses']} отв., "
+            f"промпт {item['prompt_tokens']} / ответ {item['completion_tokens']} ток., "
+            f"${item['cost_usd']:.4f}, в среднем {item['avg_execution_time']:.1f} с"
+        )
+    
+    # Экономия кеша ответов: попадания по средней цене ответа через LLM
+    rag = next((item for item in stats['by_source'] if item['answer_source'] == 'rag'), None)
+    cache = next((item for item in stats['by_source'] if item['answer_source'] == 'answer_cache'), None)
+    if rag and cache and rag['responses']:
+        saved = cache['responses'] * rag['cost_usd'] / rag['responses']
+        lines.append(f"<b>Кеш ответов сэкономил:</b> ~${saved:.4f} ({cache['responses']} вызовов LLM)")
+    
+    # Уточняющие вопросы (с историей и фрагментами прошлого ответа) против вопросов с нуля
+    follow_up = next((item for item in stats['by_source'] if item['answer_source'] == 'rag_followup'), None)
+    if rag and follow_up and rag['responses'] and follow_up['responses']:
+        lines.append(
+            f"<b>Уточнения / новые вопросы:</b> промпт {follow_up['prompt_tokens'] / follow_up['responses']:.0f} / "
+            f"{rag['prompt_tokens'] / rag['responses']:.0f} ток. на ответ, "
+            f"время {follow_up['avg_execution_time']:.1f} / {rag['avg_execution_time']:.1f} с"
+        )
+    
+    if stats['by_model']:
+        lines.append("\n<b>По модели:</b>")
+        for item in stats['by_model']:
+            cached_share = item['cached_tokens'] / item['prompt_tokens'] if item['prompt_tokens'] else 0
+            lines.append(
+                f"• {esc(item['llm_provider'] or '?')}/{esc(item['llm_model'])}: {item['responses']} отв., "
+                f"промпт {item['prompt_tokens']} (из кеша {cached_share:.0%}), ответ {item['completion_tokens']} ток., "
+                f"${item['cost_usd']:.4f}, генерация {item['avg_generate_time']:.1f} с"
+            )
+    
+    stages = [f"{name} {value:.2f}" for name, value in stats['stages'].items() if value is not None]
+    if stages:
+        lines.append("\n<b>Среднее время этапов RAG, с:</b> " + ", ".join(stages))
+    
+    if stats['top_prompts']:
+        lines.append("\n<b>Самые большие промпты:</b>")
+        for item in stats['top_prompts']:
+            lines.append(f"• {item['prompt_tokens']} ток. (${item['cost_usd']:.4f}): {esc(item['query_text'][:80])}")
+    return "\n".join(lines)
+
+
+@router.callback_query(lambda c: c.data in ('admin:feedback_stats', 'admin:feedback_stats:30'))
+async def admin_feedback_stats_callback(callback: types.CallbackQuery, session: AsyncSession, is_admin: bool = False):
+    """Отзывы пользователей и расход токенов LLM для администратора"""
+    if not is_admin:
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+    
+    days = 30 if callback.data == 'admin:feedback_stats:30' else 7
+    
+    try:
+        from src.services.feedback_service import FeedbackService
+        
+        feedback_service = FeedbackService(session)
+        text = format_feedback_stats(await feedback_service.get_feedback_stats())
+        text += "\n\n" + format_usage_stats(await feedback_service.get_usage_stats(days))
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики отзывов: {e}")
+        text = f"❌ Ошибка получения статистики отзывов: {esc(str(e)[:100])}"
+    
+    period_button = (
+        types.InlineKeyboardButton(text="📅 За 7 дней", callback_data="admin:feedback_stats")
+        if days == 30 else
+        types.InlineKeyboardButton(text="📅 За 30 дней", callback_data="admin:feedback_stats:30")
+    )
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [period_button],
+        [types.InlineKeyboardButton(text="⬅️ Назад к статистике", callback_data="admin:stats")]
+    ])
+    
+    if callback.message and isinstance(callback.message, types.Message):
+        try:
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+        except Exception:
+            await callback.message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
+
+def format_trace_stats(stats: dict) -> str:
+    """Форматирует p50/p95 этапов RAG по записанным трассам"""
+    lines = [f"<b>⏱ Этапы RAG за последние {stats['traces']} запросов</b>"]
+    if not stats['traces']:
+        lines.append(f"Трасс пока нет (файл {esc(stats['path'])}, доля записи {stats['sample_rate']:.0%})")
+        return "\n".join(lines)
+    
+    total = stats['total']
+    lines.append(f"<b>Весь запрос:</b> p50 {total['p50']:.2f} с, p95 {total['p95']:.2f} с")
+    sources = ", ".join(f"{esc(source)} {count}" for source, count in stats['answer_sources'].items())
+    lines.append(f"<b>Источники ответа:</b> {sources}")
+    lines.append("")
+    for path, item in stats['stages'].items():
+        depth = path.count('/')
+        name = path.rsplit('/', 1)[-1]
+        lines.append(
+            f"{'  ' * depth}• {esc(name)}: p50 {item['p50'] * 1000:.0f} мс, p95 {item['p95'] * 1000:.0f} мс, "
+            f"макс. {item['max'] * 1000:.0f} мс ({item['count']})"
+        )
+    lines.append(
+        f"\nДоля записи {stats['sample_rate']:.0%}, записано {stats['written']}, отброшено {stats['dropped']}"
+        f"{', ошибок записи ' + str(stats['write_errors']) if stats['write_errors'] else ''}"
+    )
+    return "\n".join(lines)
+
+
+@router.message(Command('trace_stats'))
+async def cmd_trace_stats(message: types.Message, command: CommandObject, is_admin: bool = False):
+    """Команда /trace_stats [N] - p50/p95 этапов RAG по последним N трассам"""
+    if not is_admin:
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    last_n = 200
+    if command.args:
+        try:
+            last_n = max(1, min(5000, int(command.args.strip())))
+        except ValueError:
+            await message.answer("Использование: /trace_stats [число запросов]")
+            return
+    
+    try:
+        from src.services.rag.tracing import rag_tracer
+        text = format_trace_stats(await rag_tracer.get_stage_stats(last_n))
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики трасс: {e}")
+        text = f"❌ Ошибка получения статистики трасс: {esc(str(e)[:100])}"
+    await message.answer(text, parse_mode="HTML")
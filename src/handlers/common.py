@@ -60,7 +60,8 @@ async def cmd_help(message: types.Message, state: FSMContext):
         '<b>💡 Команды:</b>\n'
         '/start - Главное меню\n'
         '/help - Эта справка\n'
-        '/admin - Админ-меню',
+        '/admin - Админ-меню\n'
+        '/trace_stats [N] - Время этапов ИИ-помощника (для администраторов)',
         reply_markup=get_main_menu_keyboard(),
         parse_mode='HTML'
     )
@@ -304,8 +305,11 @@ async def search_menu(callback: types.CallbackQuery, state: FSMContext):
 async def ai_question_menu(callback: types.CallbackQuery, state: FSMContext):
     """Меню для вопросов к AI"""
     from src.handlers.states import AskAI
+    from src.services.rag.conversation import conversation_memory
     # Устанавливаем состояние ожидания вопроса для AI
     await state.set_state(AskAI.waiting_question)
+    # Новый диалог с AI начинается без истории прошлых вопросов
+    conversation_memory.clear(callback.from_user.id)
     if callback.message and isinstance(callback.message, Message):
         try:
             # Проверяем, есть ли медиа в сообщении
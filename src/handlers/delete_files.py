@@ -317,8 +317,9 @@ async def delete_file_confirmed(callback: types.CallbackQuery, session: AsyncSes
                     DOWNLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "src", "files")
                     absolute_path = os.path.join(DOWNLOAD_FOLDER, local_path)
                 
-                # Удаляем эмбеддинги, связанные с этим файлом
-                deleted_count = await auto_chunking.embedding_service.delete_file_embeddings(absolute_path)
+                # Удаляем эмбеддинги и таблицы, связанные с этим файлом (по абсолютному и исходному пути)
+                file_paths = list({absolute_path, str(local_path)})
+                deleted_count = await auto_chunking.delete_indexed_content(session, file_paths=file_paths)
                 if deleted_count > 0:
                     logger.info(f"[DeleteFiles] Удалено {deleted_count} эмбеддингов для файла {absolute_path}")
                 else:
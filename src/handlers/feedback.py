@@ -4,6 +4,7 @@ from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.feedback_service import FeedbackService
+from src.services.rag.answer_cache import semantic_answer_cache
 from src.keyboards.user import get_feedback_submitted_keyboard
 from src.handlers.states import FeedbackState
 
@@ -109,6 +110,9 @@ async def handle_negative_feedback(callback: types.CallbackQuery, session: Async
             feedback_type='dislike'
         )
         
+        # Ответ с дизлайком больше не отдается похожим вопросам из кеша
+        semantic_answer_cache.evict_for_feedback(message_id)
+        
         if feedback:
             # Создаем клавиатуру с возможностью добавить комментарий
             keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
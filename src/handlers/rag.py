@@ -1,12 +1,19 @@
+import time
 import logging
 
 from aiogram import Router, F
 from aiogram.types import Message
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import default_state
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.rag import RagService
+from src.services.rag.answer_cache import semantic_answer_cache
+from src.services.rag.job_queue import rag_job_queue, RagJobRejected
+from src.services.rag.deadline import Deadline
+from src.services.rag.conversation import conversation_memory
+from src.services.rag.usage import ResponseMetrics
 from src.services.feedback_service import FeedbackService
 from src.handlers.states import AskAI
 from src.keyboards.user import get_main_menu_keyboard, get_feedback_keyboard
@@ -18,6 +25,31 @@ router = Router()
 # Создаем экземпляр RAG-сервиса
 rag_service = RagService()
 
+# Не чаще одного обновления места в очереди за столько секунд (ограничения Telegram на редактирование)
+QUEUE_POSITION_INTERVAL = 3.0
+
+# Ответы пользователю, если очередь не выполнила вопрос
+QUEUE_REJECT_MESSAGES = {
+	"busy": "⏳ Ваш предыдущий вопрос еще обрабатывается. Дождитесь ответа, пожалуйста.",
+	"full": "⏳ Сейчас очень много вопросов. Пожалуйста, повторите через пару минут.",
+	"queue_timeout": "⏳ Не удалось дождаться очереди: сейчас много вопросов. Пожалуйста, повторите позже.",
+	"deadline": "⌛ Вопрос слишком долго ждал очереди и не успел бы получить ответ вовремя. Пожалуйста, повторите позже.",
+	"timeout": "⌛ Не успел подготовить ответ. Попробуйте переформулировать вопрос или повторите позже."
+}
+
+def is_follow_up_message(message: Message) -> bool:
+	"""
+	Уточняющий вопрос вне режима вопросов: у пользователя жива память диалога с AI,
+	а сам текст похож на уточнение ("а для Т-90?"). Остальной текст идет в обычные обработчики.
+	"""
+	return bool(
+		message.text and not message.text.startswith('/')
+		and message.from_user and conversation_memory.active(message.from_user.id)
+		and conversation_memory.looks_like_follow_up(message.text)
+	)
+
+# Вне режима вопросов сюда идут только уточнения, пока не истекла память диалога
+@router.message(StateFilter(default_state), is_follow_up_message)
 @router.message(AskAI.waiting_question)
 async def handle_ai_question(message: Message, session: AsyncSession, state: FSMContext):
 	"""Обработчик вопросов к AI для всех пользователей."""
@@ -30,6 +62,13 @@ async def handle_ai_question(message: Message, session: AsyncSession, state: FSM
 		return
 	
 	query_text = message.text.strip()
+	# Бюджет времени на ответ отсчитывается с получения вопроса (ожидание в очереди входит в него)
+	deadline = Deadline()
+	
+	# У пользователя в работе один вопрос: следующий - после ответа на текущий
+	if rag_job_queue.user_busy(message.from_user.id):
+		await message.answer(QUEUE_REJECT_MESSAGES["busy"])
+		return
 	
 	# Создаем сервис для логирования
 	feedback_service = FeedbackService(session)
@@ -43,21 +82,50 @@ async def handle_ai_question(message: Message, session: AsyncSession, state: FSM
 	)
 	
 	# Отправляем сообщение о начале обработки запроса
-	processing_msg = await message.answer(
+	processing_text = (
 		f"🤖 Обрабатываю ваш вопрос: \n\"{query_text}\"\n"
 		"Ищу информацию в базе знаний и формирую ответ..."
 	)
+	processing_msg = await message.answer(processing_text)
+	
+	last_position_update = 0.0
+	
+	async def report_position(position: int):
+		"""Место в очереди в сообщении о загрузке; 0 - вопрос взят в работу"""
+		nonlocal last_position_update
+		now = time.monotonic()
+		if position and now - last_position_update < QUEUE_POSITION_INTERVAL:
+			return
+		last_position_update = now
+		if position:
+			await processing_msg.edit_text(
+				f"⏳ Ваш вопрос в очереди: {position}-й\n\"{query_text}\"\n"
+				"Ответ начнет готовиться, как только освободится помощник."
+			)
+		else:
+			await processing_msg.edit_text(processing_text)
 	
 	try:
 		# Инициализируем RAG-сервис если еще не инициализирован
 		await rag_service.initialize()
 		
-		# Выполняем поиск и генерацию ответа
-		result = await rag_service.search_and_answer(
+		# Поиск и генерация ответа выполняются пулом обработчиков очереди;
+		# сессию БД для табличного индекса конвейер открывает сам, на время работы
+		result = await rag_job_queue.submit(
+			user_id=message.from_user.id,
 			query=query_text,
-			top_k=8,  # Больше документов для лучшего контекста
-			threshold=0.25,  # Снижаем порог для включения больше документов
-			generate_answer=True
+			factory=lambda: rag_service.search_and_answer(
+				query=query_text,
+				top_k=8,  # Больше документов для лучшего контекста
+				threshold=0.25,  # Снижаем порог для включения больше документов
+				generate_answer=True,
+				deadline=deadline,
+				# Память диалога: следующий вопрос может быть уточнением этого
+				user_id=message.from_user.id
+			),
+			on_position=report_position,
+			# Вопрос, чей бюджет истек в очереди, снимается с нее, а не отвечает с опозданием
+			deadline=deadline
 		)
 		
 		# Формируем ответ
@@ -68,8 +136,9 @@ async def handle_ai_question(message: Message, session: AsyncSession, state: FSM
 			
 			if llm_answer:
 				# Редактируем сообщение о загрузке на уведомление о завершении
+				follow_up_hint = "\nМожно задать уточняющий вопрос." if conversation_memory.enabled else ""
 				await processing_msg.edit_text(
-					f"✅ Обработка завершена за {execution_time:.1f} сек."
+					f"✅ Обработка завершена за {execution_time:.1f} сек.{follow_up_hint}"
 				)
 				
 				# Отправляем ответ от AI отдельным сообщением
@@ -89,7 +158,15 @@ async def handle_ai_question(message: Message, session: AsyncSession, state: FSM
 					response_type='ai_generated',
 					execution_time=execution_time,
 					sources_count=len(search_results),
-					message_id=ai_response_msg.message_id
+					message_id=ai_response_msg.message_id,
+					metrics=ResponseMetrics.from_result(result).to_columns()
+				)
+				
+				# Дизлайк на этот ответ удалит его из семантического кеша
+				semantic_answer_cache.bind_message(
+					ai_response_msg.message_id,
+					result.get("answer_cache_entry"),
+					from_cache=result.get("answer_cache_hit", False)
 				)
 				
 				# Обновляем клавиатуру с правильным message_id
@@ -132,6 +209,24 @@ async def handle_ai_question(message: Message, session: AsyncSession, state: FSM
 				message_id=error_response.message_id
 			)
 	
+	except RagJobRejected as e:
+		logger.warning(f"[RAG] Вопрос пользователя {message.from_user.id} не выполнен очередью: {e.reason}")
+		
+		try:
+			await processing_msg.edit_text(QUEUE_REJECT_MESSAGES.get(e.reason, "❌ Обработка завершена с ошибкой"))
+		except Exception:
+			pass
+		
+		try:
+			await feedback_service.log_bot_response(
+				query_id=user_query.id,
+				response_text=f"Очередь вопросов: {e.reason}",
+				response_type='error',
+				message_id=processing_msg.message_id
+			)
+		except Exception as log_error:
+			logger.error(f"Ошибка при логировании ответа: {log_error}")
+	
 	except Exception as e:
 		logger.error(f"Ошибка при обработке AI-вопроса: {e}")
 		
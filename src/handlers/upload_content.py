@@ -11,6 +11,7 @@ from src.database.models import Product, ProductFile
 from src.services.product_service import ProductService
 from src.keyboards.admin import get_admin_main_menu_keyboard
 from src.core.utils import esc
+from src.core.loop_monitor import loop_lag_monitor
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +43,30 @@ MEDIA_TYPES = {
     'video/webm': 'video',
 }
 
+EXTRACTION_STATUS_TEXT = {
+    'ok': '✅',
+    'timeout': '⏱ превышено время обработки',
+    'memory_limit': '💾 превышен лимит памяти',
+    'failed': '❌ ошибка разбора',
+    'quarantined': '🚫 в карантине (повторные сбои)',
+}
+
+def format_indexing_report(reindex_result: dict) -> str:
+    """Краткий отчет об индексации файлов продукта для админа"""
+    lines = [f"<b>Индексация:</b> {reindex_result.get('total_chunks', 0)} фрагментов"]
+    shared = reindex_result.get('shared_chunks', 0)
+    if shared:
+        lines[0] += f" (+{shared} общих со ссылкой, дедупликация {reindex_result.get('dedup_ratio', 0):.0%})"
+    for file_info in reindex_result.get('files', []):
+        status = EXTRACTION_STATUS_TEXT.get(file_info['extraction_status'], file_info['extraction_status'])
+        if file_info['extraction_status'] == 'ok':
+            table_rows = file_info.get('table_rows', 0)
+            tables = f", {table_rows} строк таблиц" if table_rows else ""
+            lines.append(f"  {status} {esc(file_info['title'])}: {file_info['chunks']} фрагм.{tables}")
+        else:
+            lines.append(f"  {status}: {esc(file_info['title'])}")
+    return "\n".join(lines) + "\n"
+
 def get_file_kind(mime_type: str) -> str:
     """Определяет тип файла по MIME типу"""
     if mime_type in DOCUMENT_TYPES:
@@ -271,32 +296,40 @@ async def process_file_title(message: types.Message, state: FSMContext, session:
         
         # Скачиваем файл и сохраняем его локально через сервис
         is_document = file_kind in ['document', 'pdf', 'word', 'excel', 'presentation', 'archive', 'other']
-        new_file = await file_service.download_and_store_file(
-            file_id=data['file_id'],
-            product_id=data['product_id'],
-            is_document=is_document,
-            title=title,
-            file_kind=file_kind,
-            file_size=data.get('file_size'),
-            mime_type=data.get('mime_type'),
-            original_filename=data.get('original_filename')
-        )
+        indexing_report = ""
+        with loop_lag_monitor.measure() as loop_lag:
+            new_file = await file_service.download_and_store_file(
+                file_id=data['file_id'],
+                product_id=data['product_id'],
+                is_document=is_document,
+                title=title,
+                file_kind=file_kind,
+                file_size=data.get('file_size'),
+                mime_type=data.get('mime_type'),
+                original_filename=data.get('original_filename')
+            )
+            
+            # После сохранения файла обновляем индексацию продукта
+            try:
+                from src.services.auto_chunking_service import AutoChunkingService
+                auto_chunking = AutoChunkingService()
+                reindex_result = await auto_chunking.reindex_product(data['product_id'], data['product_name'], session)
+                indexing_report = format_indexing_report(reindex_result)
+                logger.info(f"Продукт {data['product_id']} переиндексирован после добавления файла")
+            except Exception as e:
+                logger.warning(f"Не удалось переиндексировать продукт {data['product_id']} после добавления файла: {e}")
+                indexing_report = "<b>Индексация:</b> ⚠️ не выполнена, подробности в логах\n"
+                # Не прерываем выполнение, так как файл уже добавлен
         
-        # После сохранения файла обновляем индексацию продукта
-        try:
-            from src.services.auto_chunking_service import AutoChunkingService
-            auto_chunking = AutoChunkingService()
-            await auto_chunking.reindex_product(data['product_id'], data['product_name'], session)
-            logger.info(f"Продукт {data['product_id']} переиндексирован после добавления файла")
-        except Exception as e:
-            logger.warning(f"Не удалось переиндексировать продукт {data['product_id']} после добавления файла: {e}")
-            # Не прерываем выполнение, так как файл уже добавлен
+        logger.info(f"Задержка цикла событий во время загрузки файла '{title}': {loop_lag.describe()}")
         
         await message.answer(
             f"<b>✅ Файл успешно добавлен!</b>\n\n"
             f"<b>Название:</b> {esc(title)}\n"
             f"<b>Продукт:</b> {esc(data['product_name'])}\n"
-            f"<b>Тип:</b> {file_kind}\n\n"
+            f"<b>Тип:</b> {file_kind}\n"
+            f"{indexing_report}"
+            f"<b>Задержка бота во время обработки:</b> {loop_lag.describe()}\n\n"
             "Хотите добавить ещё файлы к этому продукту?",
             parse_mode="HTML",
             reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[
@@ -1,16 +1,22 @@
 import asyncio
+import itertools
 import logging
 import os
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterator
 from datetime import datetime
 
 from src.services.embeddings.unified_embedding_service import UnifiedEmbeddingService
+from src.services.extraction import SUPPORTED_EXTENSIONS, iter_document_blocks, extraction_supervisor
+from src.services.extraction.pdf_backends import select_backend_name
 from src.database.models import ProductFile
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 logger = logging.getLogger(__name__)
 
+# Ограничение строк табличного индекса на один файл (крупные прайс-листы)
+TABLE_INDEX_MAX_ROWS = int(os.getenv("TABLE_INDEX_MAX_ROWS", "20000"))
+
 class AutoChunkingService:
     """
     Автоматизированный сервис для чанкинга и индексации файлов.
@@ -64,11 +70,15 @@ class AutoChunkingService:
             "product_id": product_id,
             "file_path": file_path,
             "chunks_created": 0,
+            "chunks_shared": 0,
+            "table_rows": 0,
+            "extraction_status": None,
             "error": None,
             "processing_time": 0
         }
         
         start_time = datetime.now()
+        extraction = None
         
         try:
             # Проверяем, что файл существует
@@ -76,40 +86,124 @@ class AutoChunkingService:
                 result["error"] = f"Файл не найден: {file_path}"
                 return result
             
-            # Извлекаем текст из файла
-            full_text = await self._extract_text_from_file(file_path)
+            if not file_path.lower().endswith(SUPPORTED_EXTENSIONS):
+                result["error"] = f"Неподдерживаемый формат файла: {os.path.splitext(file_path)[1]}"
+                return result
+            
+            # Извлекаем текст в отдельном процессе с лимитами времени и памяти
+            # PDF-бэкенд выбирается по классу документа (СТО, ГОСТ, паспорт...), см. pdf_backends
+            pdf_backend = select_backend_name(file_title or os.path.basename(file_path))
+            extraction = await extraction_supervisor.extract(file_path, pdf_backend=pdf_backend, with_tables=True)
+            result["extraction_status"] = extraction.status
+            if not extraction.ok:
+                result["error"] = f"Извлечение текста: {extraction.status} ({extraction.error})"
+                return result
+            
+            # Таблицы документа - в табличный индекс (упаковка, характеристики)
+            result["table_rows"] = await self._store_tables(product_id, file_path, extraction)
+            
+            # Блоки читаются из spool-файла; начало документа буферизуем только для проверки длины
+            blocks = extraction.iter_blocks()
+            head_blocks = []
+            head_length = 0
+            for block in blocks:
+                head_blocks.append(block)
+                head_length += len(block)
+                if head_length >= 100:
+                    break
             
-            if not full_text or len(full_text) < 100:
-                result["error"] = f"Недостаточно текста для индексации (длина: {len(full_text) if full_text else 0})"
+            if head_length < 100:
+                blocks.close()
+                result["error"] = f"Недостаточно текста для индексации (длина: {head_length})"
                 return result
             
             logger.info(f"[AutoChunking] Обрабатываем файл {file_path} (продукт {product_id})")
-            logger.info(f"[AutoChunking] Извлечено {len(full_text)} символов текста")
             
-            # Создаем эмбеддинги с чанкингом
-            chunks = await self.embedding_service.create_product_embeddings(
+            # Потоково режем на чанки, кодируем и сохраняем пачками;
+            # почти одинаковые с уже сохраненными фрагменты записываются ссылкой
+            index_stats: Dict[str, int] = {}
+            chunks_created = await self.embedding_service.index_text_stream(
                 product_id=product_id,
                 product_name=product_name,
-                full_text=full_text,
+                blocks=itertools.chain(head_blocks, blocks),
                 file_path=file_path,
-                description=file_title  # Используем description вместо file_title
+                stats=index_stats
             )
             
             result["success"] = True
-            result["chunks_created"] = len(chunks)
+            result["chunks_created"] = chunks_created
+            result["chunks_shared"] = index_stats.get("shared", 0)
             
-            logger.info(f"[AutoChunking] Создано {len(chunks)} эмбеддингов для продукта {product_id}")
+            logger.info(f"[AutoChunking] Создано {chunks_created} эмбеддингов для продукта {product_id}")
             
         except Exception as e:
             logger.error(f"[AutoChunking] Ошибка при обработке файла {file_path}: {e}")
             result["error"] = str(e)
         
         finally:
+            if extraction is not None:
+                extraction.discard()
             end_time = datetime.now()
             result["processing_time"] = (end_time - start_time).total_seconds()
         
         return result
     
+    async def _store_tables(self, product_id: int, file_path: str, extraction) -> int:
+        """
+        Заменяет таблицы файла в табличном индексе на только что извлеченные.
+        Ошибки БД не прерывают индексацию текста. Возвращает число сохраненных строк.
+        """
+        from src.database.connection import AsyncSessionLocal
+        from src.database.table_repositories import ProductTableRepository
+        
+        stored_rows = 0
+        try:
+            async with AsyncSessionLocal() as session:
+                repository = ProductTableRepository(session)
+                await repository.delete_tables(source_paths=[file_path])
+                for table in extraction.iter_tables():
+                    rows = table["rows"][:max(0, TABLE_INDEX_MAX_ROWS - stored_rows)]
+                    if not rows:
+                        logger.warning(f"[AutoChunking] Табличный индекс {file_path} обрезан до {TABLE_INDEX_MAX_ROWS} строк")
+                        break
+                    stored_rows += await repository.add_table(
+                        product_id=product_id,
+                        source_path=file_path,
+                        location=table.get("location"),
+                        columns=table["columns"],
+                        rows=rows,
+                        first_row=table.get("first_row", 0)
+                    )
+                await session.commit()
+            if stored_rows:
+                logger.info(f"[AutoChunking] В табличный индекс сохранено {stored_rows} строк из {file_path}")
+        except Exception as e:
+            logger.error(f"[AutoChunking] Ошибка сохранения таблиц файла {file_path}: {e}")
+            stored_rows = 0
+        return stored_rows
+    
+    async def delete_indexed_content(self,
+                                     session: AsyncSession,
+                                     product_ids: Optional[List[int]] = None,
+                                     file_paths: Optional[List[str]] = None) -> int:
+        """
+        Удаляет эмбеддинги и табличный индекс продуктов и/или файлов.
+        Таблицы удаляются в переданной сессии (коммит - на стороне вызывающего кода).
+        Возвращает число удаленных эмбеддингов.
+        """
+        from src.database.table_repositories import ProductTableRepository
+        
+        await self.initialize()
+        # Кешированные ответы по этим продуктам/файлам удаляет сам delete_embeddings
+        deleted_count = await self.embedding_service.delete_embeddings(product_ids=product_ids, file_paths=file_paths)
+        try:
+            deleted_tables = await ProductTableRepository(session).delete_tables(product_ids, file_paths)
+            if deleted_tables:
+                logger.info(f"[AutoChunking] Удалено таблиц из табличного индекса: {deleted_tables}")
+        except Exception as e:
+            logger.error(f"[AutoChunking] Ошибка удаления табличного индекса: {e}")
+        return deleted_count
+    
     async def index_product_metadata(self, 
                                    product_id: int, 
                                    product_name: str,
@@ -179,7 +273,8 @@ class AutoChunkingService:
     async def reindex_product(self, 
                             product_id: int, 
                             product_name: str,
-                            session: AsyncSession) -> Dict[str, Any]:
+                            session: AsyncSession,
+                            clear_existing: bool = True) -> Dict[str, Any]:
         """
         Переиндексирует все файлы продукта
         
@@ -187,6 +282,7 @@ class AutoChunkingService:
             product_id: ID продукта
             product_name: Название продукта
             session: Сессия базы данных
+            clear_existing: Удалять ли старые эмбеддинги продукта перед индексацией
             
         Returns:
             Результаты переиндексации
@@ -198,6 +294,9 @@ class AutoChunkingService:
             "product_id": product_id,
             "files_processed": 0,
             "total_chunks": 0,
+            "shared_chunks": 0,
+            "dedup_ratio": 0.0,
+            "files": [],
             "errors": [],
             "processing_time": 0
         }
@@ -206,8 +305,10 @@ class AutoChunkingService:
         
         try:
             # Удаляем старые эмбеддинги продукта
-            await self.embedding_service.delete_product_embeddings(product_id)
-            logger.info(f"[AutoChunking] Удалены старые эмбеддинги для продукта {product_id}")
+            if clear_existing:
+                await self.delete_indexed_content(session, product_ids=[product_id])
+                await session.commit()
+                logger.info(f"[AutoChunking] Удалены старые эмбеддинги и таблицы для продукта {product_id}")
             
             # Сначала индексируем метаданные продукта (описание, сферы применения)
             metadata_result = await self.index_product_metadata(product_id, product_name, session)
@@ -244,14 +345,31 @@ class AutoChunkingService:
                     file_title=str(file_title) if file_title else None
                 )
                 
+                if file_result.get("extraction_status") is not None:
+                    result["files"].append({
+                        "title": str(file_title) if file_title else os.path.basename(file_path),
+                        "extraction_status": file_result["extraction_status"],
+                        "chunks": file_result["chunks_created"],
+                        "shared": file_result.get("chunks_shared", 0),
+                        "table_rows": file_result.get("table_rows", 0),
+                        "error": file_result.get("error")
+                    })
+                
                 if file_result["success"]:
                     result["files_processed"] += 1
                     result["total_chunks"] += file_result["chunks_created"]
+                    result["shared_chunks"] += file_result.get("chunks_shared", 0)
                 else:
                     result["errors"].append(f"Файл {file_path}: {file_result.get('error', 'Неизвестная ошибка')}")
             
             # Операция считается успешной, если проиндексированы метаданные ИЛИ есть файлы
             result["success"] = result["total_chunks"] > 0
+            result["dedup_ratio"] = self._dedup_ratio(result["total_chunks"], result["shared_chunks"])
+            if result["shared_chunks"]:
+                logger.info(
+                    f"[AutoChunking] Продукт {product_id}: {result['shared_chunks']} общих фрагментов "
+                    f"записаны ссылками (дедупликация {result['dedup_ratio']:.1%})"
+                )
             
         except Exception as e:
             logger.error(f"[AutoChunking] Ошибка при переиндексации продукта {product_id}: {e}")
@@ -274,6 +392,8 @@ class AutoChunkingService:
             "products_processed": 0,
             "total_files": 0,
             "total_chunks": 0,
+            "shared_chunks": 0,
+            "dedup_ratio": 0.0,
             "errors": [],
             "processing_time": 0
         }
@@ -281,23 +401,22 @@ class AutoChunkingService:
         start_time = datetime.now()
         
         try:
-            # Получаем все продукты с файлами для очистки старых эмбеддингов
+            # Получаем все продукты
             from src.database.models import Product
-            query_clear = select(Product.id).distinct()
-            result_clear = await session.execute(query_clear)
-            product_ids_to_clear = [row[0] for row in result_clear.all()]
-            
-            # Удаляем старые эмбеддинги всех продуктов
-            for pid in product_ids_to_clear:
-                await self.embedding_service.delete_product_embeddings(pid)
-            
-            logger.info(f"[AutoChunking] Очищены эмбеддинги для {len(product_ids_to_clear)} продуктов")
-            
-            # Получаем все продукты с файлами
             query = select(Product.id, Product.name).distinct()
             result_products = await session.execute(query)
             products = result_products.all()
             
+            # Удаляем старые эмбеддинги всех продуктов одной пакетной операцией
+            product_ids_to_clear = [product_id for product_id, _ in products]
+            deleted_count = await self.delete_indexed_content(session, product_ids=product_ids_to_clear)
+            await session.commit()
+            
+            logger.info(
+                f"[AutoChunking] Очищены эмбеддинги для {len(product_ids_to_clear)} продуктов "
+                f"({deleted_count} записей)"
+            )
+            
             logger.info(f"[AutoChunking] Начинаем массовую переиндексацию {len(products)} продуктов")
             
             for product_id, product_name in products:
@@ -306,17 +425,24 @@ class AutoChunkingService:
                 product_result = await self.reindex_product(
                     product_id=product_id,
                     product_name=product_name,
-                    session=session
+                    session=session,
+                    clear_existing=False
                 )
                 
                 if product_result["success"]:
                     result["products_processed"] += 1
                     result["total_files"] += product_result["files_processed"]
                     result["total_chunks"] += product_result["total_chunks"]
+                    result["shared_chunks"] += product_result["shared_chunks"]
                 else:
                     result["errors"].extend(product_result.get("errors", []))
             
             result["success"] = result["products_processed"] > 0
+            result["dedup_ratio"] = self._dedup_ratio(result["total_chunks"], result["shared_chunks"])
+            logger.info(
+                f"[AutoChunking] Массовая переиндексация: {result['total_chunks']} фрагментов сохранено, "
+                f"{result['shared_chunks']} общих записаны ссылками (дедупликация {result['dedup_ratio']:.1%})"
+            )
             
         except Exception as e:
             logger.error(f"[AutoChunking] Ошибка при массовой переиндексации: {e}")
@@ -328,139 +454,24 @@ class AutoChunkingService:
         
         return result
     
+    @staticmethod
+    def _dedup_ratio(stored: int, shared: int) -> float:
+        """Доля фрагментов, не закодированных повторно благодаря дедупликации."""
+        return shared / (stored + shared) if stored + shared else 0.0
+    
     async def _extract_text_from_file(self, file_path: str, max_pages: int = 30) -> str:
         """Извлечение текста из файлов различных форматов: PDF, XLSX, CSV"""
-        file_extension = os.path.splitext(file_path)[1].lower()
-        
-        try:
-            if file_extension == '.pdf':
-                return await self._extract_text_from_pdf(file_path, max_pages)
-            elif file_extension in ['.xlsx', '.xls']:
-                return await self._extract_text_from_xlsx(file_path)
-            elif file_extension == '.csv':
-                return await self._extract_text_from_csv(file_path)
-            else:
-                logger.warning(f"Неподдерживаемый формат файла: {file_extension}")
-                return ""
-        except Exception as e:
-            logger.error(f"Ошибка при извлечении текста из {file_path}: {e}")
-            return ""
-    
-    async def _extract_text_from_pdf(self, file_path: str, max_pages: int = 30) -> str:
-        """Извлечение текста из PDF файла"""
-        try:
-            import pdfplumber
-            with pdfplumber.open(file_path) as pdf:
-                pages_text = []
-                
-                pages_to_process = pdf.pages[:max_pages] if max_pages else pdf.pages
-                
-                for page in pages_to_process:
-                    page_text = page.extract_text()
-                    if page_text:
-                        pages_text.append(page_text)
-                
-                return '\n\n'.join(pages_text)
-        except Exception as e:
-            logger.error(f"Ошибка при извлечении текста из PDF {file_path}: {e}")
-            return ""
-    
-    async def _extract_text_from_xlsx(self, file_path: str) -> str:
-        """Извлечение текста из Excel файла (.xlsx)"""
-        try:
-            import pandas as pd
-            
-            # Читаем все листы Excel файла
-            excel_file = pd.ExcelFile(file_path)
-            all_text = []
-            
-            for sheet_name in excel_file.sheet_names:
-                try:
-                    # Читаем лист
-                    df = pd.read_excel(file_path, sheet_name=sheet_name)
-                    
-                    # Добавляем название листа как заголовок
-                    all_text.append(f"=== Лист: {sheet_name} ===")
-                    
-                    # Конвертируем DataFrame в текст
-                    # Заменяем NaN на пустые строки для лучшей читаемости
-                    df_filled = df.fillna('')
-                    
-                    # Добавляем заголовки столбцов
-                    if not df_filled.empty:
-                        headers = ' | '.join(str(col) for col in df_filled.columns)
-                        all_text.append(f"Столбцы: {headers}")
-                        
-                        # Добавляем строки данных
-                        for index, row in df_filled.iterrows():
-                            row_text = ' | '.join(str(val) for val in row.values if str(val).strip())
-                            if row_text.strip():  # Добавляем только непустые строки
-                                all_text.append(row_text)
-                    
-                    all_text.append("")  # Пустая строка между листами
-                    
-                except Exception as e:
-                    logger.warning(f"Ошибка при чтении листа '{sheet_name}' из файла {file_path}: {e}")
-                    continue
-            
-            result_text = '\n'.join(all_text)
-            logger.info(f"Извлечено {len(result_text)} символов из Excel файла {file_path}")
-            return result_text
-            
-        except Exception as e:
-            logger.error(f"Ошибка при извлечении текста из Excel файла {file_path}: {e}")
-            return ""
+        return '\n\n'.join(self._iter_text_blocks(file_path, max_pages))
     
-    async def _extract_text_from_csv(self, file_path: str) -> str:
-        """Извлечение текста из CSV файла"""
+    def _iter_text_blocks(self, file_path: str, max_pages: Optional[int] = 30) -> Iterator[str]:
+        """
+        Потоковое извлечение текста в текущем процессе: страницы PDF или группы строк таблиц.
+        Для загрузок из бота используется изолированный вариант (extraction_supervisor).
+        """
         try:
-            import pandas as pd
-            
-            # Пробуем различные кодировки для CSV файлов
-            encodings_to_try = ['utf-8', 'windows-1251', 'cp1251', 'latin-1']
-            df = None
-            
-            for encoding in encodings_to_try:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding)
-                    logger.info(f"CSV файл {file_path} успешно прочитан с кодировкой {encoding}")
-                    break
-                except (UnicodeDecodeError, UnicodeError):
-                    continue
-                except Exception as e:
-                    logger.warning(f"Ошибка при чтении CSV с кодировкой {encoding}: {e}")
-                    continue
-            
-            if df is None:
-                logger.error(f"Не удалось прочитать CSV файл {file_path} ни с одной из кодировок")
-                return ""
-            
-            all_text = []
-            
-            # Добавляем информацию о файле
-            all_text.append(f"=== CSV файл: {os.path.basename(file_path)} ===")
-            
-            # Заменяем NaN на пустые строки
-            df_filled = df.fillna('')
-            
-            # Добавляем заголовки столбцов
-            if not df_filled.empty:
-                headers = ' | '.join(str(col) for col in df_filled.columns)
-                all_text.append(f"Столбцы: {headers}")
-                
-                # Добавляем строки данных
-                for index, row in df_filled.iterrows():
-                    row_text = ' | '.join(str(val) for val in row.values if str(val).strip())
-                    if row_text.strip():  # Добавляем только непустые строки
-                        all_text.append(row_text)
-            
-            result_text = '\n'.join(all_text)
-            logger.info(f"Извлечено {len(result_text)} символов из CSV файла {file_path}")
-            return result_text
-            
+            yield from iter_document_blocks(file_path, max_pages)
         except Exception as e:
-            logger.error(f"Ошибка при извлечении текста из CSV файла {file_path}: {e}")
-            return ""
+            logger.error(f"Ошибка при извлечении текста из {file_path}: {e}")
     
     def _get_absolute_file_path(self, relative_path: str) -> str:
         """Преобразует относительный путь в абсолютный"""
@@ -469,7 +480,7 @@ class AutoChunkingService:
             return relative_path
         return os.path.join(DOWNLOAD_FOLDER, relative_path)
     
-    async def get_statistics(self) -> Dict[str, Any]:
-        """Получить статистику по индексации"""
+    async def get_statistics(self, full_scan: bool = False) -> Dict[str, Any]:
+        """Получить статистику по индексации (full_scan=True - аудит постраничным обходом)"""
         await self.initialize()
-        return await self.embedding_service.get_statistics()
+        return await self.embedding_service.get_statistics(full_scan=full_scan)
@@ -0,0 +1,109 @@
+import time
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+"""
+Кеш каталога продуктов (id -> название).
+Метаданные чанков в ChromaDB хранят только product_id,
+названия подставляются из этого кеша при чтении результатов поиска.
+"""
+
+
+class ProductCatalogCache:
+    """
+    Кеш названий продуктов в памяти процесса.
+    Заполняется при индексации и догружает недостающие id из БД одним запросом.
+    """
+
+    def __init__(self, ttl_seconds: int = 600):
+        self.ttl_seconds = ttl_seconds
+        self._names: Dict[int, Tuple[str, float]] = {}
+        self._all_loaded_at: Optional[float] = None
+
+    def put(self, product_id: int, name: Optional[str]) -> None:
+        """Запоминает название продукта."""
+        if product_id is None or not name:
+            return
+        self._names[int(product_id)] = (str(name), time.monotonic())
+
+    def invalidate(self, product_id: Optional[int] = None) -> None:
+        """Сбрасывает кеш продукта (или весь кеш)."""
+        if product_id is None:
+            self._names.clear()
+            self._all_loaded_at = None
+        else:
+            self._names.pop(int(product_id), None)
+
+    def get_cached(self, product_id: int) -> Optional[str]:
+        """Название продукта из кеша без обращения к БД."""
+        entry = self._names.get(int(product_id))
+        if not entry:
+            return None
+        name, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            return None
+        return name
+
+    async def get_names(self, product_ids: Iterable[int]) -> Dict[int, str]:
+        """
+        Возвращает названия продуктов, догружая отсутствующие в кеше из БД.
+        """
+        names: Dict[int, str] = {}
+        missing = set()
+        for product_id in product_ids:
+            if product_id is None:
+                continue
+            cached = self.get_cached(product_id)
+            if cached:
+                names[int(product_id)] = cached
+            else:
+                missing.add(int(product_id))
+
+        if missing:
+            try:
+                from sqlalchemy import select
+                from src.database.connection import AsyncSessionLocal
+                from src.database.models import Product
+
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        select(Product.id, Product.name).where(Product.id.in_(missing))
+                    )
+                    for product_id, name in result.all():
+                        self.put(product_id, name)
+                        names[int(product_id)] = str(name)
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить названия продуктов из БД: {e}")
+
+        return names
+
+    async def get_all_names(self) -> Dict[int, str]:
+        """
+        Названия всех неудаленных продуктов (весь каталог загружается одним запросом раз в ttl).
+        """
+        fresh = self._all_loaded_at is not None and time.monotonic() - self._all_loaded_at <= self.ttl_seconds
+        if not fresh:
+            try:
+                from sqlalchemy import select
+                from src.database.connection import AsyncSessionLocal
+                from src.database.models import Product
+
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        select(Product.id, Product.name).where(Product.is_deleted == False)
+                    )
+                    rows = result.all()
+                self._names.clear()
+                for product_id, name in rows:
+                    self.put(product_id, name)
+                self._all_loaded_at = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить каталог продуктов из БД: {e}")
+
+        return {product_id: name for product_id, (name, _) in self._names.items()}
+
+
+# Глобальный экземпляр кеша каталога
+product_catalog_cache = ProductCatalogCache()
@@ -0,0 +1,90 @@
+import os
+import hashlib
+from typing import List, Optional
+
+import numpy as np
+
+"""
+Поиск почти одинаковых фрагментов при индексации (MinHash + LSH).
+Ссылки на ГОСТ, разделы о безопасности и шаблонный текст производителя
+повторяются в документах многих продуктов. Такой фрагмент кодируется и хранится
+в ChromaDB один раз, остальные вхождения записываются в манифест индекса как
+ссылки (chunk_aliases) на уже сохраненный фрагмент.
+
+Сигнатура - минимумы NUM_PERM хеш-функций по шинглам из SHINGLE_WORDS слов.
+Для поиска кандидатов сигнатура режется на LSH_BANDS полос, ключи полос
+лежат в манифесте; сходство кандидата оценивается по доле совпавших минимумов.
+"""
+
+DEDUP_ENABLED = os.getenv("RAG_DEDUP", "1") == "1"
+# Оценка сходства Жаккара, начиная с которой фрагмент считается дублем
+DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.9"))
+# Короткие фрагменты ("Цвет: черный") не объединяются: смысл им придает продукт
+DEDUP_MIN_WORDS = int(os.getenv("RAG_DEDUP_MIN_WORDS", "30"))
+
+NUM_PERM = 64
+LSH_BANDS = 16
+SHINGLE_WORDS = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+class MinHasher:
+    """
+    MinHash-сигнатуры текста и ключи LSH-полос.
+    Параметры перестановок фиксированы (seed), чтобы сигнатуры разных запусков совпадали.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = LSH_BANDS,
+                 shingle_words: int = SHINGLE_WORDS, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на число полос")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_words = shingle_words
+        generator = np.random.RandomState(seed)
+        # a, b < 2^32 и хеши шинглов < 2^32: произведение не переполняет uint64
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def _shingle_hashes(self, words: List[str]) -> np.ndarray:
+        size = min(self.shingle_words, len(words))
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+        return np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "big") for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Сигнатура нормализованного текста (uint32[num_perm]) или None для пустого текста."""
+        words = text.split()
+        if not words:
+            return None
+        hashes = self._shingle_hashes(words)
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> List[int]:
+        """Ключи LSH-полос (int64 для SQLite); номер полосы входит в ключ."""
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(bytes([band]) + chunk, digest_size=8).digest()
+            keys.append(int.from_bytes(digest, "big", signed=True))
+        return keys
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """Оценка сходства Жаккара по доле совпавших минимумов."""
+        return float(np.mean(first == second))
+
+    @staticmethod
+    def to_bytes(signature: np.ndarray) -> bytes:
+        return signature.astype(np.uint32).tobytes()
+
+    @staticmethod
+    def from_bytes(data: bytes) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.uint32)
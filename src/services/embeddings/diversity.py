@@ -0,0 +1,128 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""
+Диверсификация результатов поиска методом MMR (maximal marginal relevance).
+Перекрывающиеся окна и одинаковые шаблонные разделы паспортов дают в top-k
+несколько почти одинаковых фрагментов. MMR выбирает результаты по сходству
+с запросом за вычетом сходства с уже выбранными; используются векторы,
+уже посчитанные при индексации (их возвращает ChromaDB вместе с результатами).
+"""
+
+MMR_ENABLED = os.getenv("RAG_MMR", "1") == "1"
+# Вес релевантности против разнообразия: 1.0 - чистое ранжирование по сходству
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# Фрагменты ближе этого порога к уже выбранному считаются дублями и отбрасываются
+MMR_DUPLICATE_THRESHOLD = float(os.getenv("RAG_MMR_DUPLICATE_THRESHOLD", "0.95"))
+# Во сколько раз больше кандидатов брать из поиска под итоговое число результатов
+MMR_FETCH_FACTOR = int(os.getenv("RAG_MMR_FETCH_FACTOR", "2"))
+
+
+@dataclass
+class DiversityReport:
+    """
+    Итог диверсификации.
+    redundancy_* - среднее максимальное сходство результата с предыдущими
+    (0 - все разные, 1 - сплошные дубли) для top-k по сходству и после MMR.
+    tokens_saved - токены дублей из top-k по сходству, которые не попали в выдачу.
+    """
+    candidates: int = 0
+    selected: int = 0
+    duplicates: int = 0
+    redundancy_before: float = 0.0
+    redundancy_after: float = 0.0
+    tokens_saved: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "candidates": self.candidates,
+            "selected": self.selected,
+            "duplicates": self.duplicates,
+            "redundancy_before": round(self.redundancy_before, 4),
+            "redundancy_after": round(self.redundancy_after, 4),
+            "tokens_saved": self.tokens_saved
+        }
+
+
+def _redundancy(similarity: np.ndarray, indices: List[int]) -> float:
+    if len(indices) < 2:
+        return 0.0
+    values = [float(similarity[indices[i], indices[:i]].max()) for i in range(1, len(indices))]
+    return sum(values) / len(values)
+
+
+def _count_tokens(text: str) -> int:
+    # Импорт внутри функции: пакет rag при импорте тянет за собой этот модуль
+    from src.services.rag.token_counter import count_tokens
+    return count_tokens(text)
+
+
+def mmr_select(results: List[Dict[str, Any]],
+               limit: int,
+               lambda_mult: float = MMR_LAMBDA,
+               duplicate_threshold: float = MMR_DUPLICATE_THRESHOLD) -> Tuple[List[Dict[str, Any]], DiversityReport]:
+    """
+    Отбирает до limit результатов с учетом разнообразия.
+
+    Args:
+        results: Результаты поиска по убыванию сходства; вектор в result["embedding"]
+        limit: Сколько результатов вернуть
+        lambda_mult: Вес релевантности в оценке MMR
+        duplicate_threshold: Порог сходства, выше которого кандидат считается дублем
+    """
+    report = DiversityReport(candidates=len(results))
+    with_vectors = [i for i, r in enumerate(results) if r.get("embedding") is not None]
+    if len(with_vectors) < 2 or len(with_vectors) != len(results):
+        # Нет векторов (старый формат результатов) - оставляем порядок поиска
+        selected = results[:limit]
+        report.selected = len(selected)
+        return selected, report
+
+    vectors = np.asarray([r["embedding"] for r in results], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.maximum(norms, 1e-12)
+    similarity = vectors @ vectors.T
+    relevance = np.asarray([r.get("similarity", 0) or 0 for r in results], dtype=np.float32)
+
+    chosen: List[int] = []
+    duplicates: List[int] = []
+    remaining = list(range(len(results)))
+    while remaining and len(chosen) < limit:
+        if chosen:
+            max_to_chosen = similarity[np.ix_(remaining, chosen)].max(axis=1)
+        else:
+            max_to_chosen = np.zeros(len(remaining), dtype=np.float32)
+
+        # Дубли уже выбранных отбрасываются сразу
+        keep = max_to_chosen < duplicate_threshold
+        duplicates.extend(idx for idx, ok in zip(remaining, keep) if not ok)
+        remaining = [idx for idx, ok in zip(remaining, keep) if ok]
+        max_to_chosen = max_to_chosen[keep]
+        if not remaining:
+            break
+
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * max_to_chosen
+        best = remaining[int(np.argmax(scores))]
+        chosen.append(best)
+        remaining.remove(best)
+
+    baseline = list(range(min(limit, len(results))))
+    report.selected = len(chosen)
+    report.duplicates = len(duplicates)
+    report.redundancy_before = _redundancy(similarity, baseline)
+    report.redundancy_after = _redundancy(similarity, chosen)
+    duplicate_set = set(duplicates)
+    report.tokens_saved = sum(_count_tokens(results[i].get("text", "")) for i in baseline if i in duplicate_set)
+
+    logger.info(
+        f"MMR: {report.candidates} кандидатов -> {report.selected}, дублей {report.duplicates}, "
+        f"избыточность {report.redundancy_before:.3f} -> {report.redundancy_after:.3f}, "
+        f"сэкономлено ~{report.tokens_saved} токенов"
+    )
+    return [results[i] for i in chosen], report
@@ -0,0 +1,45 @@
+import os
+import logging
+from typing import Any, Callable, Dict, Hashable, List
+
+logger = logging.getLogger(__name__)
+
+"""
+Объединение результатов поиска по нескольким формулировкам запроса методом
+RRF (reciprocal rank fusion): результат получает сумму 1 / (k + место) по всем спискам.
+Учитываются только места, поэтому сходства разных формулировок не нужно приводить
+к одной шкале; фрагмент, найденный несколькими формулировками, поднимается выше.
+"""
+
+# Сглаживание RRF: чем больше, тем меньше разница между первыми местами
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Dict[str, Any]]],
+                           key: Callable[[Dict[str, Any]], Hashable],
+                           limit: int,
+                           k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Объединяет списки результатов (каждый - по убыванию релевантности).
+    Из повторов остается результат с наибольшим similarity; в него добавляются
+    rrf_score и matched_queries - сколько формулировок его нашли.
+    """
+    scores: Dict[Hashable, float] = {}
+    best: Dict[Hashable, Dict[str, Any]] = {}
+    hits: Dict[Hashable, int] = {}
+    for results in ranked_lists:
+        for rank, result in enumerate(results, start=1):
+            result_key = key(result)
+            scores[result_key] = scores.get(result_key, 0.0) + 1.0 / (k + rank)
+            hits[result_key] = hits.get(result_key, 0) + 1
+            if result_key not in best or result.get("similarity", 0) > best[result_key].get("similarity", 0):
+                best[result_key] = result
+
+    ordered = sorted(scores, key=lambda item: (-scores[item], -best[item].get("similarity", 0)))
+    fused = []
+    for result_key in ordered[:limit]:
+        result = dict(best[result_key])
+        result["rrf_score"] = scores[result_key]
+        result["matched_queries"] = hits[result_key]
+        fused.append(result)
+    return fused
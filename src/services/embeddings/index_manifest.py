@@ -0,0 +1,465 @@
+import os
+import sqlite3
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+"""
+Манифест векторного индекса.
+Небольшая SQLite-база рядом с ChromaDB, в которой хранится список чанков
+(id, продукт, файл, тип) и счетчики, поддерживаемые триггерами.
+Позволяет получать статистику индекса за константное время,
+не выгружая метаданные всей коллекции.
+Здесь же хранятся родительские разделы двухуровневой индексации
+(в ChromaDB лежат только мелкие дочерние фрагменты со ссылкой parent_id),
+MinHash-сигнатуры фрагментов и ссылки продуктов на общие фрагменты
+(почти одинаковый текст хранится в коллекции один раз, см. dedup).
+"""
+
+# (chunk_id, product_id, file_path, is_chunk)
+ManifestRecord = Tuple[str, Optional[int], Optional[str], bool]
+
+# (parent_id, product_id, file_path, section_type, start_word, end_word, text)
+ParentRecord = Tuple[str, int, Optional[str], Optional[str], int, int, str]
+
+# (chunk_id, product_id, file_path, signature, band_keys)
+SignatureRecord = Tuple[str, int, Optional[str], bytes, List[int]]
+
+# (chunk_id, product_id, file_path, parent_id, chunk_index, start_word, end_word)
+AliasRecord = Tuple[str, int, Optional[str], Optional[str], Optional[int], Optional[int], Optional[int]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_manifest (
+    chunk_id TEXT PRIMARY KEY,
+    product_id INTEGER,
+    file_path TEXT,
+    is_chunk INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_manifest_product ON chunk_manifest(product_id);
+CREATE INDEX IF NOT EXISTS idx_manifest_file ON chunk_manifest(file_path);
+
+CREATE TABLE IF NOT EXISTS parent_sections (
+    parent_id TEXT PRIMARY KEY,
+    product_id INTEGER,
+    file_path TEXT,
+    section_type TEXT,
+    start_word INTEGER NOT NULL DEFAULT 0,
+    end_word INTEGER NOT NULL DEFAULT 0,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_parent_product ON parent_sections(product_id);
+CREATE INDEX IF NOT EXISTS idx_parent_file ON parent_sections(file_path);
+
+CREATE TABLE IF NOT EXISTS chunk_signatures (
+    chunk_id TEXT PRIMARY KEY,
+    product_id INTEGER,
+    file_path TEXT,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_signature_product ON chunk_signatures(product_id);
+CREATE INDEX IF NOT EXISTS idx_signature_file ON chunk_signatures(file_path);
+
+CREATE TABLE IF NOT EXISTS minhash_bands (
+    band_key INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bands_key ON minhash_bands(band_key);
+CREATE INDEX IF NOT EXISTS idx_bands_chunk ON minhash_bands(chunk_id);
+
+CREATE TABLE IF NOT EXISTS chunk_aliases (
+    chunk_id TEXT NOT NULL,
+    product_id INTEGER,
+    file_path TEXT,
+    parent_id TEXT,
+    chunk_index INTEGER,
+    start_word INTEGER,
+    end_word INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_alias_chunk ON chunk_aliases(chunk_id);
+CREATE INDEX IF NOT EXISTS idx_alias_product ON chunk_aliases(product_id);
+CREATE INDEX IF NOT EXISTS idx_alias_file ON chunk_aliases(file_path);
+
+CREATE TABLE IF NOT EXISTS product_counters (
+    product_id INTEGER PRIMARY KEY,
+    embeddings INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS collection_counters (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    full_documents INTEGER NOT NULL DEFAULT 0,
+    products INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO collection_counters (id) VALUES (1);
+
+CREATE TRIGGER IF NOT EXISTS trg_manifest_insert AFTER INSERT ON chunk_manifest
+BEGIN
+    INSERT OR IGNORE INTO product_counters (product_id, embeddings)
+        SELECT NEW.product_id, 0 WHERE NEW.product_id IS NOT NULL;
+    UPDATE collection_counters SET products = products + 1
+        WHERE id = 1 AND NEW.product_id IS NOT NULL
+        AND (SELECT embeddings FROM product_counters WHERE product_id = NEW.product_id) = 0;
+    UPDATE product_counters SET embeddings = embeddings + 1
+        WHERE product_id = NEW.product_id;
+    UPDATE collection_counters SET
+        total = total + 1,
+        chunks = chunks + NEW.is_chunk,
+        full_documents = full_documents + 1 - NEW.is_chunk
+        WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_manifest_delete AFTER DELETE ON chunk_manifest
+BEGIN
+    UPDATE product_counters SET embeddings = embeddings - 1
+        WHERE product_id = OLD.product_id;
+    UPDATE collection_counters SET
+        total = total - 1,
+        chunks = chunks - OLD.is_chunk,
+        full_documents = full_documents - 1 + OLD.is_chunk,
+        products = products - COALESCE(
+            (SELECT embeddings = 0 FROM product_counters WHERE product_id = OLD.product_id), 0)
+        WHERE id = 1;
+    DELETE FROM product_counters
+        WHERE product_id = OLD.product_id AND embeddings <= 0;
+END;
+"""
+
+
+class IndexManifest:
+    """
+    Манифест чанков коллекции ChromaDB со счетчиками.
+    Обновляется при каждом upsert/delete в UnifiedEmbeddingService.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Открывает соединение и коммитит транзакцию по завершении."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def record_upsert(self, records: List[ManifestRecord]) -> None:
+        """
+        Регистрирует записанные в коллекцию чанки.
+        Существующие id сначала удаляются, чтобы счетчики оставались точными.
+        """
+        if not records:
+            return
+        rows = [
+            (chunk_id, product_id, file_path, 1 if is_chunk else 0)
+            for chunk_id, product_id, file_path, is_chunk in records
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM chunk_manifest WHERE chunk_id = ?",
+                [(row[0],) for row in rows]
+            )
+            conn.executemany(
+                "INSERT INTO chunk_manifest (chunk_id, product_id, file_path, is_chunk) VALUES (?, ?, ?, ?)",
+                rows
+            )
+
+    def remove_ids(self, chunk_ids: List[str]) -> None:
+        """Удаляет чанки из манифеста по id."""
+        if not chunk_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM chunk_manifest WHERE chunk_id = ?",
+                [(chunk_id,) for chunk_id in chunk_ids]
+            )
+            conn.executemany(
+                "DELETE FROM chunk_aliases WHERE chunk_id = ?",
+                [(chunk_id,) for chunk_id in chunk_ids]
+            )
+            self._remove_signatures(conn, "chunk_id", chunk_ids)
+
+    @staticmethod
+    def _remove_signatures(conn: sqlite3.Connection, column: str, values: List[Any]) -> None:
+        """Удаляет сигнатуры и LSH-полосы фрагментов по chunk_id, product_id или file_path."""
+        for i in range(0, len(values), 500):
+            batch = values[i:i + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            conn.execute(
+                "DELETE FROM minhash_bands WHERE chunk_id IN "
+                f"(SELECT chunk_id FROM chunk_signatures WHERE {column} IN ({placeholders}))",
+                batch
+            )
+            conn.execute(f"DELETE FROM chunk_signatures WHERE {column} IN ({placeholders})", batch)
+
+    def remove_matching(self,
+                        product_ids: Optional[List[int]] = None,
+                        file_paths: Optional[List[str]] = None) -> int:
+        """
+        Удаляет из манифеста все чанки указанных продуктов и/или файлов.
+        Возвращает количество удаленных записей.
+        """
+        removed = 0
+        with self._connect() as conn:
+            for column, values in (("product_id", product_ids), ("file_path", file_paths)):
+                values = list(values or [])
+                for i in range(0, len(values), 500):
+                    batch = values[i:i + 500]
+                    placeholders = ", ".join("?" for _ in batch)
+                    cursor = conn.execute(
+                        f"DELETE FROM chunk_manifest WHERE {column} IN ({placeholders})",
+                        batch
+                    )
+                    removed += max(cursor.rowcount, 0)
+                    conn.execute(f"DELETE FROM parent_sections WHERE {column} IN ({placeholders})", batch)
+                    conn.execute(f"DELETE FROM chunk_aliases WHERE {column} IN ({placeholders})", batch)
+                self._remove_signatures(conn, column, values)
+        return removed
+
+    def store_signatures(self, records: List[SignatureRecord]) -> None:
+        """Сохраняет MinHash-сигнатуры записанных в коллекцию фрагментов и ключи их LSH-полос."""
+        if not records:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM minhash_bands WHERE chunk_id = ?",
+                [(record[0],) for record in records]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunk_signatures (chunk_id, product_id, file_path, signature) "
+                "VALUES (?, ?, ?, ?)",
+                [(chunk_id, product_id, file_path, signature)
+                 for chunk_id, product_id, file_path, signature, _ in records]
+            )
+            conn.executemany(
+                "INSERT INTO minhash_bands (band_key, chunk_id) VALUES (?, ?)",
+                [(band_key, record[0]) for record in records for band_key in record[4]]
+            )
+
+    def find_candidates(self, band_keys: Iterable[int]) -> Dict[int, List[Tuple[str, bytes]]]:
+        """
+        Сохраненные фрагменты с совпавшими LSH-полосами (полосы всей пачки - одним соединением):
+        {band_key: [(chunk_id, signature)]}. Учитываются только фрагменты, которые есть в манифесте.
+        """
+        band_keys = list(dict.fromkeys(band_keys))
+        candidates: Dict[int, List[Tuple[str, bytes]]] = {}
+        if not band_keys:
+            return candidates
+        with self._connect() as conn:
+            for i in range(0, len(band_keys), 500):
+                batch = band_keys[i:i + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(
+                    "SELECT b.band_key, s.chunk_id, s.signature FROM minhash_bands b "
+                    "JOIN chunk_signatures s ON s.chunk_id = b.chunk_id "
+                    "JOIN chunk_manifest m ON m.chunk_id = s.chunk_id "
+                    f"WHERE b.band_key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for band_key, chunk_id, signature in rows:
+                    candidates.setdefault(band_key, []).append((chunk_id, signature))
+        return candidates
+
+    def add_aliases(self, records: List[AliasRecord]) -> None:
+        """Записывает ссылки продуктов на общие фрагменты."""
+        if not records:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO chunk_aliases "
+                "(chunk_id, product_id, file_path, parent_id, chunk_index, start_word, end_word) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+
+    def alias_products(self, chunk_ids: Iterable[str]) -> Dict[str, List[int]]:
+        """Продукты, ссылающиеся на фрагменты: {chunk_id: [product_id, ...]}."""
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        products: Dict[str, List[int]] = {}
+        with self._connect() as conn:
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(
+                    f"SELECT DISTINCT chunk_id, product_id FROM chunk_aliases WHERE chunk_id IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for chunk_id, product_id in rows:
+                    products.setdefault(chunk_id, []).append(product_id)
+        return products
+
+    def orphaned_aliases(self,
+                         product_ids: Optional[List[int]] = None,
+                         file_paths: Optional[List[str]] = None) -> List[AliasRecord]:
+        """
+        Для общих фрагментов удаляемых продуктов/файлов - по одной ссылке из тех, что останутся.
+        Ссылки самих удаляемых продуктов/файлов не учитываются.
+        """
+        product_ids = list(product_ids or [])
+        file_paths = list(file_paths or [])
+        if not product_ids and not file_paths:
+            return []
+        product_marks = ", ".join("?" for _ in product_ids) or "NULL"
+        file_marks = ", ".join("?" for _ in file_paths) or "NULL"
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT a.chunk_id, a.product_id, a.file_path, a.parent_id, a.chunk_index, a.start_word, a.end_word "
+                "FROM chunk_aliases a JOIN chunk_manifest m ON m.chunk_id = a.chunk_id "
+                f"WHERE (m.product_id IN ({product_marks}) OR m.file_path IN ({file_marks})) "
+                f"AND NOT (COALESCE(a.product_id IN ({product_marks}), 0) OR COALESCE(a.file_path IN ({file_marks}), 0)) "
+                "ORDER BY a.chunk_id, a.rowid",
+                product_ids + file_paths + product_ids + file_paths
+            ).fetchall()
+        promoted: Dict[str, AliasRecord] = {}
+        for row in rows:
+            promoted.setdefault(row[0], row)
+        return list(promoted.values())
+
+    def promote_aliases(self, promotions: List[Tuple[str, AliasRecord]]) -> None:
+        """
+        Передает общие фрагменты одной из оставшихся ссылок.
+        promotions - (новый chunk_id, ссылка): запись манифеста, сигнатура и остальные
+        ссылки переходят на новый id, сама ссылка удаляется.
+        """
+        if not promotions:
+            return
+        with self._connect() as conn:
+            for new_id, (old_id, product_id, file_path, _, chunk_index, _, _) in promotions:
+                row = conn.execute("SELECT is_chunk FROM chunk_manifest WHERE chunk_id = ?", (old_id,)).fetchone()
+                is_chunk = row[0] if row else 1
+                # Удаление и вставка, а не UPDATE - чтобы триггеры пересчитали счетчики продуктов
+                conn.execute("DELETE FROM chunk_manifest WHERE chunk_id IN (?, ?)", (old_id, new_id))
+                conn.execute(
+                    "INSERT INTO chunk_manifest (chunk_id, product_id, file_path, is_chunk) VALUES (?, ?, ?, ?)",
+                    (new_id, product_id, file_path, is_chunk)
+                )
+                conn.execute(
+                    "UPDATE chunk_signatures SET chunk_id = ?, product_id = ?, file_path = ? WHERE chunk_id = ?",
+                    (new_id, product_id, file_path, old_id)
+                )
+                conn.execute("UPDATE minhash_bands SET chunk_id = ? WHERE chunk_id = ?", (new_id, old_id))
+                conn.execute(
+                    "DELETE FROM chunk_aliases WHERE rowid = (SELECT rowid FROM chunk_aliases "
+                    "WHERE chunk_id = ? AND product_id IS ? AND file_path IS ? AND chunk_index IS ? LIMIT 1)",
+                    (old_id, product_id, file_path, chunk_index)
+                )
+                conn.execute("UPDATE chunk_aliases SET chunk_id = ? WHERE chunk_id = ?", (new_id, old_id))
+
+    def alias_count(self) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) FROM chunk_aliases").fetchone()
+        return row[0] if row else 0
+
+    def store_parents(self, records: List[ParentRecord]) -> None:
+        """Сохраняет (перезаписывает) родительские разделы."""
+        if not records:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO parent_sections "
+                "(parent_id, product_id, file_path, section_type, start_word, end_word, text) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+
+    def get_parents(self, parent_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Родительские разделы по id: {parent_id: {text, section_type, start_word, end_word, ...}}."""
+        parent_ids = list(dict.fromkeys(parent_ids))
+        parents: Dict[str, Dict[str, Any]] = {}
+        with self._connect() as conn:
+            for i in range(0, len(parent_ids), 500):
+                batch = parent_ids[i:i + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = conn.execute(
+                    "SELECT parent_id, product_id, file_path, section_type, start_word, end_word, text "
+                    f"FROM parent_sections WHERE parent_id IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for parent_id, product_id, file_path, section_type, start_word, end_word, text in rows:
+                    parents[parent_id] = {
+                        "product_id": product_id,
+                        "file_path": file_path,
+                        "section_type": section_type,
+                        "start_word": start_word,
+                        "end_word": end_word,
+                        "text": text
+                    }
+        return parents
+
+    def parent_count(self) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) FROM parent_sections").fetchone()
+        return row[0] if row else 0
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Возвращает поддерживаемые счетчики коллекции (константное время).
+        product_embeddings - записи с product_id (сумма счетчиков продуктов, одна строка на продукт).
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT total, chunks, full_documents, products FROM collection_counters WHERE id = 1"
+            ).fetchone()
+            product_embeddings = conn.execute("SELECT COALESCE(SUM(embeddings), 0) FROM product_counters").fetchone()[0]
+        total, chunks, full_documents, products = row if row else (0, 0, 0, 0)
+        return {
+            "total": total,
+            "chunks": chunks,
+            "full_documents": full_documents,
+            "products": products,
+            "product_embeddings": product_embeddings
+        }
+
+    def rebuild(self, records: Iterable[ManifestRecord], parent_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        Полностью перестраивает манифест по переданным записям.
+        Используется при первом запуске на существующей коллекции
+        или при обнаружении расхождения со счетчиком ChromaDB.
+        Сигнатуры, LSH-полосы и ссылки фрагментов, которых нет среди записей, удаляются.
+        parent_ids - разделы, на которые ссылаются записи (читаются после обхода records);
+        остальные разделы без ссылок тоже удаляются. None - разделы не трогаются.
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chunk_manifest")
+            conn.execute("DELETE FROM product_counters")
+            conn.execute(
+                "UPDATE collection_counters SET total = 0, chunks = 0, full_documents = 0, products = 0 WHERE id = 1"
+            )
+        total = 0
+        batch: List[ManifestRecord] = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= 1000:
+                self.record_upsert(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.record_upsert(batch)
+            total += len(batch)
+        with self._connect() as conn:
+            for table in ("chunk_aliases", "minhash_bands", "chunk_signatures"):
+                conn.execute(f"DELETE FROM {table} WHERE chunk_id NOT IN (SELECT chunk_id FROM chunk_manifest)")
+            if parent_ids is not None:
+                conn.execute("CREATE TEMP TABLE kept_parents (parent_id TEXT PRIMARY KEY)")
+                conn.executemany(
+                    "INSERT OR IGNORE INTO kept_parents (parent_id) VALUES (?)",
+                    [(parent_id,) for parent_id in parent_ids]
+                )
+                conn.execute(
+                    "DELETE FROM parent_sections WHERE parent_id NOT IN (SELECT parent_id FROM kept_parents) "
+                    "AND parent_id NOT IN (SELECT parent_id FROM chunk_aliases WHERE parent_id IS NOT NULL)"
+                )
+        logger.info(f"Манифест индекса перестроен: {total} записей")
+        return total
@@ -1,5 +1,11 @@
+import os
 import logging
-from typing import Optional
+from typing import Any, Dict, Optional
+
+# Токенизаторы HuggingFace не должны запускать свои потоки в процессах, порожденных после загрузки модели;
+# переменная задается один раз до импорта sentence_transformers
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
 from sentence_transformers import SentenceTransformer
 
 logger = logging.getLogger(__name__)
@@ -14,6 +20,7 @@ class ModelManager:
     _instance: Optional['ModelManager'] = None
     _model: Optional[SentenceTransformer] = None
     _model_name: Optional[str] = None
+    _cross_encoders: Dict[str, Any] = {}
     
     def __new__(cls):
         if cls._instance is None:
@@ -41,6 +48,19 @@ class ModelManager:
         self.get_model(model_name)
         logger.info(f"Модель {model_name} предзагружена и готова к использованию")
     
+    def get_cross_encoder(self, model_name: str) -> Any:
+        """
+        Получает модель-реранкер (CrossEncoder). Загружается один раз на имя модели.
+        """
+        if model_name not in self._cross_encoders:
+            from sentence_transformers import CrossEncoder
+            
+            logger.info(f"Загружаем модель реранкинга: {model_name}")
+            self._cross_encoders[model_name] = CrossEncoder(model_name, device="cpu")
+            logger.info(f"Модель реранкинга {model_name} успешно загружена")
+        
+        return self._cross_encoders[model_name]
+    
     def is_model_loaded(self, model_name: str = 'deepvk/USER-bge-m3') -> bool:
         """
         Проверяет, загружена ли модель с указанным именем.
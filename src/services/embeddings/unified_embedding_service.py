@@ -1,12 +1,34 @@
+import os
 import re
+import asyncio
+import json
+import sqlite3
+import hashlib
 import logging
-from typing import List, Tuple, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import List, Tuple, Dict, Any, Optional, Iterator, Iterable
 
 import chromadb
 from .model_manager import model_manager
+from .index_manifest import IndexManifest, ManifestRecord, ParentRecord, SignatureRecord, AliasRecord
+from .dedup import DEDUP_ENABLED, DEDUP_THRESHOLD, DEDUP_MIN_WORDS, MinHasher
+from .diversity import MMR_ENABLED, MMR_FETCH_FACTOR, mmr_select
+from .fusion import reciprocal_rank_fusion
+from src.services.catalog_cache import product_catalog_cache
 
 logger = logging.getLogger(__name__)
 
+# Версия схемы метаданных чанков (2 - компактная схема без текстовых полей продукта)
+METADATA_SCHEMA_VERSION = 2
+
+# Двухуровневая индексация файлов: мелкие дочерние фрагменты для поиска, разделы - для контекста
+PARENT_CHILD_INDEXING = os.getenv("RAG_PARENT_CHILD", "1") == "1"
+CHILD_CHUNK_WORDS = int(os.getenv("RAG_CHILD_CHUNK_WORDS", "60"))
+
+# Сколько векторов запросов держать в памяти (повторные вопросы, маршрутизатор намерений)
+QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "512"))
+
 
 class UnifiedEmbeddingService:
     """
@@ -21,13 +43,20 @@ class UnifiedEmbeddingService:
                  chunk_size: int = 400,  # Увеличиваем до 400 слов для лучшего контекста
                  chunk_overlap: int = 100,  # Увеличиваем перекрытие до 100 слов
                  enable_chunking: bool = True,
-                 collection_name: Optional[str] = None):
+                 collection_name: Optional[str] = None,
+                 parent_child: Optional[bool] = None,
+                 child_words: int = CHILD_CHUNK_WORDS,
+                 dedup: bool = DEDUP_ENABLED):
         
         self.model_name = model_name
         self.chroma_path = chroma_path
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.enable_chunking = enable_chunking
+        self.parent_child = PARENT_CHILD_INDEXING if parent_child is None else parent_child
+        self.child_words = child_words
+        # Почти одинаковые фрагменты разных документов хранятся один раз (MinHash/LSH)
+        self.minhasher = MinHasher() if dedup else None
         
         # Определяем имя коллекции
         if collection_name:
@@ -38,11 +67,16 @@ class UnifiedEmbeddingService:
         self.model = None
         self.client = None
         self.collection = None
+        self.manifest: Optional[IndexManifest] = None
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        # embed_queries вызывается из разных потоков (asyncio.to_thread); кодирование - вне блокировки
+        self._query_cache_lock = threading.Lock()
         self._is_initialized = False
     
-    async def initialize(self):
+    async def initialize(self, load_model: bool = True):
         """
         Инициализирует векторную БД и загружает модель.
+        load_model=False - только хранилище (миграции, статистика, удаление).
         """
         if self._is_initialized:
             logger.info("Объединенный сервис эмбеддингов уже инициализирован")
@@ -50,7 +84,8 @@ class UnifiedEmbeddingService:
         
         try:
             # Получаем модель через менеджер (загружается только один раз)
-            self.model = model_manager.get_model(self.model_name)
+            if load_model:
+                self.model = model_manager.get_model(self.model_name)
             
             # Инициализируем ChromaDB
             self.client = chromadb.PersistentClient(path=self.chroma_path)
@@ -61,6 +96,12 @@ class UnifiedEmbeddingService:
                 metadata={"hnsw:space": "cosine"}
             )
             
+            # Манифест со счетчиками лежит рядом с коллекцией
+            self.manifest = IndexManifest(
+                os.path.join(self.chroma_path, f"{self.collection_name}_index.sqlite3")
+            )
+            self._sync_manifest()
+            
             self._is_initialized = True
             logger.info(
                 f"Объединенный сервис эмбеддингов инициализирован успешно. "
@@ -78,7 +119,94 @@ class UnifiedEmbeddingService:
                 "Объединенный сервис эмбеддингов не инициализирован. "
                 "Вызовите initialize() перед использованием."
             )
-    
+
+    @staticmethod
+    def _manifest_record(chunk_id: str, metadata: Dict[str, Any]) -> ManifestRecord:
+        """Формирует запись манифеста по метаданным чанка."""
+        return (
+            chunk_id,
+            metadata.get("product_id"),
+            metadata.get("file_path"),
+            "chunk_index" in metadata
+        )
+
+    def _upsert(self,
+                ids: List[str],
+                embeddings: List[List[float]],
+                metadatas: List[Dict[str, Any]],
+                documents: List[str]) -> None:
+        """
+        Записывает чанки в коллекцию и обновляет манифест индекса.
+        """
+        self.collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            metadatas=metadatas,
+            documents=documents
+        )
+        if self.manifest:
+            self.manifest.record_upsert([
+                self._manifest_record(chunk_id, metadata)
+                for chunk_id, metadata in zip(ids, metadatas)
+            ])
+
+    def _delete_ids(self, ids: List[str]) -> None:
+        """
+        Удаляет чанки из коллекции и из манифеста индекса.
+        """
+        self.collection.delete(ids=ids)
+        if self.manifest:
+            self.manifest.remove_ids(ids)
+
+    def _iter_metadata_pages(self, page_size: int = 1000) -> Iterator[Tuple[List[str], List[Dict[str, Any]]]]:
+        """
+        Постранично обходит коллекцию, не загружая все метаданные в память разом.
+        """
+        offset = 0
+        while True:
+            page = self.collection.get(
+                include=["metadatas"],
+                limit=page_size,
+                offset=offset
+            )
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            yield ids, page.get("metadatas") or [{} for _ in ids]
+            if len(ids) < page_size:
+                break
+            offset += page_size
+
+    def _sync_manifest(self) -> None:
+        """
+        Сверяет манифест с коллекцией по общему числу записей.
+        При расхождении (первый запуск, ручные изменения) перестраивает манифест постраничным обходом.
+        """
+        if not self.manifest:
+            return
+
+        collection_count = self.collection.count()
+        manifest_total = self.manifest.counters()["total"]
+        if collection_count == manifest_total:
+            return
+
+        logger.info(
+            f"Манифест индекса расходится с коллекцией ({manifest_total} != {collection_count}), "
+            f"перестраиваем постраничным обходом"
+        )
+        # Разделы, на которые ссылаются фрагменты коллекции, набираются по ходу обхода
+        parent_ids = set()
+        
+        def records():
+            for ids, metadatas in self._iter_metadata_pages():
+                for chunk_id, metadata in zip(ids, metadatas):
+                    metadata = metadata or {}
+                    if metadata.get("parent_id"):
+                        parent_ids.add(metadata["parent_id"])
+                    yield self._manifest_record(chunk_id, metadata)
+        
+        self.manifest.rebuild(records(), parent_ids=parent_ids)
+
     def normalize_text_for_embedding(self, text: str) -> str:
         """
         Нормализует текст для создания эмбеддинга.
@@ -97,7 +225,47 @@ class UnifiedEmbeddingService:
         
         return text
     
-    def _simple_chunk_text(self, text: str, product_id: int) -> List[Dict[str, Any]]:
+    @staticmethod
+    def source_key(file_path: Optional[str]) -> str:
+        """
+        Короткий ключ источника чанков: хеш пути файла или 'meta' для метаданных продукта.
+        Входит в id чанка, чтобы чанки разных файлов одного продукта не перезаписывали друг друга.
+        """
+        if not file_path:
+            return "meta"
+        return hashlib.blake2b(file_path.encode("utf-8"), digest_size=4).hexdigest()
+
+    @staticmethod
+    def text_hash(text: str) -> int:
+        """Хеш текста чанка (помещается в int64 метаданных ChromaDB)."""
+        return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=7).digest(), "big")
+
+    def _chunk_metadata(self,
+                        product_id: int,
+                        file_path: Optional[str],
+                        text: str,
+                        chunk_index: Optional[int] = None,
+                        start_word: Optional[int] = None,
+                        end_word: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Компактные метаданные чанка: целочисленные id, смещения и хеш.
+        Название и описание продукта не храним - они берутся из кеша каталога при чтении.
+        """
+        metadata: Dict[str, Any] = {
+            "schema": METADATA_SCHEMA_VERSION,
+            "product_id": product_id,
+            "text_hash": self.text_hash(text)
+        }
+        if file_path:
+            metadata["file_path"] = file_path
+        if chunk_index is not None:
+            metadata["chunk_index"] = chunk_index
+        if start_word is not None and end_word is not None:
+            metadata["start_word"] = start_word
+            metadata["end_word"] = end_word
+        return metadata
+
+    def _simple_chunk_text(self, text: str, product_id: int, source_key: str = "meta") -> List[Dict[str, Any]]:
         """
         Простая реализация чанкинга текста.
         """
@@ -107,7 +275,7 @@ class UnifiedEmbeddingService:
         if len(words) <= self.chunk_size:
             # Если текст короткий, возвращаем как один чанк
             return [{
-                "chunk_id": f"{product_id}_chunk_0",
+                "chunk_id": f"{product_id}_{source_key}_chunk_0",
                 "text": text,
                 "chunk_index": 0,
                 "start_word": 0,
@@ -125,7 +293,7 @@ class UnifiedEmbeddingService:
             chunk_text = " ".join(chunk_words)
             
             chunks.append({
-                "chunk_id": f"{product_id}_chunk_{chunk_index}",
+                "chunk_id": f"{product_id}_{source_key}_chunk_{chunk_index}",
                 "text": chunk_text,
                 "chunk_index": chunk_index,
                 "start_word": start_word,
@@ -146,6 +314,274 @@ class UnifiedEmbeddingService:
         
         return chunks
     
+    def _iter_word_windows(self, blocks: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+        """
+        Потоковый вариант _simple_chunk_text.
+        Принимает блоки текста (страницы, группы строк таблицы) и отдает окна
+        (start_word, end_word, text) с теми же границами, что и чанкинг всего текста.
+        В памяти держится только текущее окно с перекрытием и очередной блок.
+        """
+        step = self.chunk_size - self.chunk_overlap
+        if step <= 0:
+            step = self.chunk_size
+        
+        buffer: List[str] = []
+        buffer_start = 0  # глобальный номер первого слова в буфере
+        
+        for block in blocks:
+            if not block:
+                continue
+            buffer.extend(block.split())
+            # Окно отдаем, только когда за ним точно есть еще слова:
+            # последнее (возможно, неполное) окно формируется после исчерпания потока
+            while len(buffer) > self.chunk_size:
+                yield buffer_start, buffer_start + self.chunk_size, " ".join(buffer[:self.chunk_size])
+                del buffer[:step]
+                buffer_start += step
+        
+        if buffer:
+            yield buffer_start, buffer_start + len(buffer), " ".join(buffer)
+    
+    def _iter_stream_chunks(self,
+                            product_id: int,
+                            source_key: str,
+                            file_path: Optional[str],
+                            blocks: Iterable[str],
+                            parents_out: List[ParentRecord]) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Фрагменты для потоковой индексации: (chunk_id, text, metadata).
+        В режиме parent_child фрагменты - предложения/строки раздела (до child_words слов)
+        со ссылкой parent_id, а сами разделы складываются в parents_out для сохранения в манифесте.
+        Иначе - окна слов _iter_word_windows.
+        """
+        if not self.parent_child:
+            for chunk_index, (start_word, end_word, text) in enumerate(self._iter_word_windows(blocks)):
+                yield f"{product_id}_{source_key}_chunk_{chunk_index}", text, self._chunk_metadata(
+                    product_id=product_id,
+                    file_path=file_path,
+                    text=text,
+                    chunk_index=chunk_index,
+                    start_word=start_word,
+                    end_word=end_word
+                )
+            return
+        
+        # Импорт здесь: пакет rag сам импортирует этот модуль
+        from src.services.rag.chunking_service import ChunkingService
+        
+        chunk_index = 0
+        for parent_index, parent in enumerate(ChunkingService().iter_parent_sections(blocks, self.child_words)):
+            parent_id = f"{product_id}_{source_key}_parent_{parent_index}"
+            parent_end = parent.start_word + len(parent.text.split())
+            parents_out.append((parent_id, product_id, file_path, parent.section_type,
+                                parent.start_word, parent_end, parent.text))
+            
+            start_word = parent.start_word
+            for child in parent.children:
+                end_word = start_word + len(child.split())
+                metadata = self._chunk_metadata(
+                    product_id=product_id,
+                    file_path=file_path,
+                    text=child,
+                    chunk_index=chunk_index,
+                    start_word=start_word,
+                    end_word=end_word
+                )
+                metadata["parent_id"] = parent_id
+                yield f"{product_id}_{source_key}_chunk_{chunk_index}", child, metadata
+                chunk_index += 1
+                start_word = end_word
+    
+    @staticmethod
+    def _invalidate_answers(product_ids: Optional[List[int]] = None,
+                            file_paths: Optional[List[Optional[str]]] = None) -> None:
+        """Удаляет из семантического кеша ответы, собранные по старым фрагментам продуктов/файлов."""
+        # Импорт здесь: пакет rag сам импортирует этот модуль
+        from src.services.rag.answer_cache import semantic_answer_cache
+        
+        removed = semantic_answer_cache.invalidate(
+            product_ids or [], [path for path in file_paths or [] if path]
+        )
+        if removed:
+            logger.info(f"Из кеша ответов удалено устаревших записей: {removed}")
+    
+    def _find_duplicate(self,
+                        signature: Any,
+                        band_keys: List[int],
+                        *band_maps: Dict[int, List[Tuple[str, Any]]]) -> Optional[str]:
+        """
+        id уже сохраненного фрагмента, почти совпадающего с новым (оценка Жаккара
+        не ниже RAG_DEDUP_THRESHOLD), или None. Кандидаты - по совпавшим LSH-полосам
+        в band_maps: {band_key: [(chunk_id, signature)]} из манифеста и текущего документа.
+        """
+        candidates: Dict[str, Any] = {}
+        for bands in band_maps:
+            for band_key in band_keys:
+                for chunk_id, candidate in bands.get(band_key, []):
+                    candidates[chunk_id] = candidate
+        
+        best_id, best_score = None, DEDUP_THRESHOLD
+        for chunk_id, candidate in candidates.items():
+            score = self.minhasher.similarity(signature, candidate)
+            if score >= best_score:
+                best_id, best_score = chunk_id, score
+        return best_id
+    
+    async def index_text_stream(self,
+                                product_id: int,
+                                product_name: str,
+                                blocks: Iterable[str],
+                                file_path: Optional[str] = None,
+                                batch_size: int = 32,
+                                stats: Optional[Dict[str, int]] = None) -> int:
+        """
+        Потоковая индексация документа: блоки текста -> окна слов -> эмбеддинги пачками.
+        
+        В отличие от create_product_embeddings не собирает весь текст, список слов,
+        чанки и векторы в памяти: каждые batch_size чанков кодируются и сразу пишутся в ChromaDB.
+        Старые чанки файла удаляются заранее, чтобы от более длинной версии документа не оставался хвост.
+        
+        Args:
+            product_id: ID продукта
+            product_name: Название продукта
+            blocks: Итератор блоков текста (страницы PDF, группы строк таблицы)
+            file_path: Путь к файлу-источнику
+            batch_size: Сколько чанков кодировать и сохранять за раз
+            stats: Словарь, в который добавляются счетчики chunks (сохранено)
+                и shared (почти одинаковые фрагменты, записанные ссылкой на уже сохраненный)
+            
+        Returns:
+            Количество созданных чанков
+        """
+        self._check_initialization()
+        
+        if not self.enable_chunking:
+            # Без чанкинга документ все равно становится одним эмбеддингом
+            results = await self.create_product_embeddings(
+                product_id=product_id,
+                product_name=product_name,
+                full_text="\n\n".join(block for block in blocks if block),
+                file_path=file_path
+            )
+            return len(results)
+        
+        product_catalog_cache.put(product_id, product_name)
+        if file_path:
+            await self.delete_embeddings(file_paths=[file_path])
+        
+        source_key = self.source_key(file_path)
+        created = 0
+        # (chunk_id, текст, нормализованный текст, метаданные, MinHash-сигнатура или None, LSH-полосы)
+        pending: List[Tuple[str, str, str, Dict[str, Any], Any, List[int]]] = []
+        batch_ids: List[str] = []
+        batch_texts: List[str] = []
+        batch_inputs: List[str] = []
+        batch_metadatas: List[Dict[str, Any]] = []
+        pending_parents: List[ParentRecord] = []
+        batch_signatures: List[SignatureRecord] = []
+        pending_aliases: List[AliasRecord] = []
+        # Сигнатуры фрагментов этого документа, еще не записанных в манифест: {band_key: [(chunk_id, signature)]}
+        stream_bands: Dict[int, List[Tuple[str, Any]]] = {}
+        shared = 0
+        
+        def select_unique() -> None:
+            """Отбирает из pending новые фрагменты, почти одинаковые записывает ссылками."""
+            nonlocal shared
+            # Кандидаты из манифеста - одним запросом по полосам всей пачки
+            stored_bands: Dict[int, List[Tuple[str, Any]]] = {}
+            band_keys = [key for item in pending if item[4] is not None for key in item[5]]
+            if band_keys:
+                decoded: Dict[str, Any] = {}
+                for band_key, rows in self.manifest.find_candidates(band_keys).items():
+                    for stored_id, raw in rows:
+                        if stored_id not in decoded:
+                            decoded[stored_id] = self.minhasher.from_bytes(raw)
+                        stored_bands.setdefault(band_key, []).append((stored_id, decoded[stored_id]))
+            
+            for chunk_id, text, normalized_text, metadata, signature, keys in pending:
+                if signature is not None:
+                    duplicate_of = self._find_duplicate(signature, keys, stored_bands, stream_bands)
+                    if duplicate_of:
+                        pending_aliases.append((
+                            duplicate_of, product_id, file_path, metadata.get("parent_id"),
+                            metadata.get("chunk_index"), metadata.get("start_word"), metadata.get("end_word")
+                        ))
+                        shared += 1
+                        continue
+                    batch_signatures.append((chunk_id, product_id, file_path,
+                                             self.minhasher.to_bytes(signature), keys))
+                    for band_key in keys:
+                        stream_bands.setdefault(band_key, []).append((chunk_id, signature))
+                batch_ids.append(chunk_id)
+                batch_texts.append(text)
+                batch_inputs.append(normalized_text)
+                batch_metadatas.append(metadata)
+            pending.clear()
+        
+        async def flush() -> None:
+            nonlocal created
+            select_unique()
+            # Родительские разделы сохраняются раньше ссылающихся на них фрагментов
+            if pending_parents and self.manifest:
+                self.manifest.store_parents(list(pending_parents))
+            pending_parents.clear()
+            if not batch_ids:
+                if pending_aliases and self.manifest:
+                    self.manifest.add_aliases(list(pending_aliases))
+                    pending_aliases.clear()
+                return
+            # Кодирование пачки занимает CPU надолго - в отдельном потоке, чтобы бот отвечал
+            encoded = await asyncio.to_thread(self.model.encode, list(batch_inputs), batch_size=batch_size)
+            embeddings = encoded.tolist()
+            self._upsert(
+                ids=list(batch_ids),
+                embeddings=embeddings,
+                metadatas=list(batch_metadatas),
+                documents=list(batch_texts)
+            )
+            created += len(batch_ids)
+            if self.manifest:
+                # Ссылки пишутся после фрагментов, на которые они указывают
+                self.manifest.store_signatures(list(batch_signatures))
+                self.manifest.add_aliases(list(pending_aliases))
+            batch_ids.clear()
+            batch_texts.clear()
+            batch_inputs.clear()
+            batch_metadatas.clear()
+            batch_signatures.clear()
+            pending_aliases.clear()
+        
+        try:
+            for chunk_id, text, metadata in self._iter_stream_chunks(
+                    product_id, source_key, file_path, blocks, pending_parents):
+                normalized_text = self.normalize_text_for_embedding(text)
+                if not normalized_text:
+                    continue
+                
+                signature, band_keys = None, []
+                if self.minhasher and self.manifest and len(normalized_text.split()) >= DEDUP_MIN_WORDS:
+                    signature = self.minhasher.signature(normalized_text)
+                    band_keys = self.minhasher.band_keys(signature)
+                pending.append((chunk_id, text, normalized_text, metadata, signature, band_keys))
+                
+                if len(pending) >= batch_size:
+                    await flush()
+            
+            await flush()
+            self._invalidate_answers([product_id], [file_path])
+            if stats is not None:
+                stats["chunks"] = stats.get("chunks", 0) + created
+                stats["shared"] = stats.get("shared", 0) + shared
+            logger.info(
+                f"Потоковая индексация: создано {created} чанков для продукта {product_id}"
+                + (f", {shared} общих фрагментов не дублировались" if shared else "")
+            )
+            return created
+            
+        except Exception as e:
+            logger.error(f"Ошибка потоковой индексации для продукта {product_id}: {e}")
+            raise
+    
     async def create_product_embeddings(self, 
                                        product_id: int, 
                                        product_name: str, 
@@ -155,45 +591,25 @@ class UnifiedEmbeddingService:
         """
         Создает эмбеддинги для продукта.
         В зависимости от настроек может создавать один эмбеддинг или множество чанков.
+        
+        В метаданные попадают только id, смещения и хеш чанка (см. _chunk_metadata);
+        product_name запоминается в кеше каталога, description больше не сохраняется.
         """
         self._check_initialization()
         
         try:
             logger.info(f"Создаем эмбеддинги для продукта {product_id}: '{product_name}'")
-            
-            # Подготавливаем базовые метаданные
-            base_metadata = {
-                "product_id": product_id,
-                "product_name": product_name,
-                "text_length": len(full_text)
-            }
-            
-            if file_path:
-                base_metadata["file_path"] = file_path
-            if description:
-                base_metadata["description"] = description
+            product_catalog_cache.put(product_id, product_name)
             
             results = []
             
             if self.enable_chunking:
-                # Проверяем количество слов, а не символов
-                word_count = len(full_text.split())
-                if word_count > self.chunk_size:
-                    # Разбиваем на чанки
-                    chunks = self._simple_chunk_text(full_text, product_id)
-                    logger.info(f"Разбили документ на {len(chunks)} чанков (слов в документе: {word_count})")
-                else:
-                    # Создаем один чанк для короткого документа
-                    chunks = [{
-                        "chunk_id": f"product_{product_id}_chunk_1",
-                        "chunk_index": 1,
-                        "text": full_text
-                    }]
-                    logger.info(f"Документ короткий ({word_count} слов), создаем один чанк")
+                source_key = self.source_key(file_path)
+                chunks = self._simple_chunk_text(full_text, product_id, source_key)
+                logger.info(f"Разбили документ на {len(chunks)} чанков (слов в документе: {len(full_text.split())})")
                 
-                # Создаем эмбеддинги для каждого чанка
                 chunk_ids = []
-                chunk_embeddings = []
+                chunk_inputs = []
                 chunk_metadatas = []
                 chunk_documents = []
                 
@@ -203,20 +619,17 @@ class UnifiedEmbeddingService:
                     if not normalized_text:
                         continue
                     
-                    # Создаем эмбеддинг
-                    embedding = self.model.encode(normalized_text).tolist()
-                    
-                    # Метаданные для чанка
-                    chunk_metadata = base_metadata.copy()
-                    chunk_metadata.update({
-                        "chunk_index": chunk["chunk_index"],
-                        "section_type": "content",
-                        "chunk_text_length": len(chunk["text"]),
-                        "processed_text": normalized_text[:500]
-                    })
+                    chunk_metadata = self._chunk_metadata(
+                        product_id=product_id,
+                        file_path=file_path,
+                        text=chunk["text"],
+                        chunk_index=chunk["chunk_index"],
+                        start_word=chunk["start_word"],
+                        end_word=chunk["end_word"]
+                    )
                     
                     chunk_ids.append(chunk["chunk_id"])
-                    chunk_embeddings.append(embedding)
+                    chunk_inputs.append(normalized_text)
                     chunk_metadatas.append(chunk_metadata)
                     chunk_documents.append(chunk["text"])
                     
@@ -226,9 +639,11 @@ class UnifiedEmbeddingService:
                         "text": chunk["text"]
                     })
                 
-                # Сохраняем все чанки одним запросом
+                # Эмбеддинги всех чанков - одним батчем в отдельном потоке (не блокируем цикл событий),
+                # сохраняем одним запросом
                 if chunk_ids:
-                    self.collection.upsert(
+                    chunk_embeddings = (await asyncio.to_thread(self.model.encode, chunk_inputs)).tolist()
+                    self._upsert(
                         ids=chunk_ids,
                         embeddings=chunk_embeddings,
                         metadatas=chunk_metadatas,
@@ -236,54 +651,23 @@ class UnifiedEmbeddingService:
                     )
                     
                     logger.info(f"Создано {len(chunk_ids)} эмбеддингов-чанков для продукта {product_id}")
-                
-                else:
-                    # Создаем один эмбеддинг для всего документа (если чанкинг включен, но документ слишком короткий)
-                    normalized_text = self.normalize_text_for_embedding(full_text)
-                    
-                    if normalized_text:
-                        embedding = self.model.encode(normalized_text).tolist()
-                        
-                        metadata = base_metadata.copy()
-                        metadata.update({
-                            "section_type": "full_document",
-                            "processed_text": normalized_text[:500],
-                            "chunk_index": 0
-                        })
-                        
-                        doc_id = f"{product_id}_chunk_0"
-                        
-                        self.collection.upsert(
-                            ids=[doc_id],
-                            embeddings=[embedding],
-                            metadatas=[metadata],
-                            documents=[full_text]
-                        )
-                        
-                        logger.info(f"Создан 1 эмбеддинг для продукта {product_id} (документ слишком короткий для чанкинга)")
-                        
-                        results.append({
-                            "chunk_id": doc_id,
-                            "metadata": metadata,
-                            "text": full_text
-                        })
             
             else:
                 # Чанкинг отключен - создаем один эмбеддинг для всего документа
                 normalized_text = self.normalize_text_for_embedding(full_text)
                 
                 if normalized_text:
-                    embedding = self.model.encode(normalized_text).tolist()
+                    embedding = (await asyncio.to_thread(self.model.encode, normalized_text)).tolist()
                     
-                    metadata = base_metadata.copy()
-                    metadata.update({
-                        "section_type": "full_document",
-                        "processed_text": normalized_text[:500]
-                    })
+                    metadata = self._chunk_metadata(
+                        product_id=product_id,
+                        file_path=file_path,
+                        text=full_text
+                    )
                     
                     doc_id = str(product_id)
                     
-                    self.collection.upsert(
+                    self._upsert(
                         ids=[doc_id],
                         embeddings=[embedding],
                         metadatas=[metadata],
@@ -298,34 +682,116 @@ class UnifiedEmbeddingService:
                         "text": full_text
                     })
             
+            if results:
+                self._invalidate_answers([product_id], [file_path])
             return results
             
         except Exception as e:
             logger.error(f"Ошибка при создании эмбеддингов для продукта {product_id}: {e}")
             raise
     
-    async def delete_product_embeddings(self, product_id: int) -> None:
+    async def delete_embeddings(self,
+                                product_ids: Optional[List[int]] = None,
+                                file_paths: Optional[List[str]] = None,
+                                batch_size: int = 500) -> int:
         """
-        Удаляет все эмбеддинги продукта из векторной БД.
+        Массовое удаление эмбеддингов продуктов и/или файлов.
+        
+        Удаляет по фильтру $in прямо в ChromaDB, не выгружая id чанков в Python.
+        Количество удаленных записей берется из манифеста индекса.
+        
+        Args:
+            product_ids: ID продуктов, все чанки которых нужно удалить
+            file_paths: Пути файлов, чанки которых нужно удалить
+            batch_size: Максимальный размер списка в одном фильтре $in
+            
+        Returns:
+            Количество удаленных эмбеддингов
         """
         self._check_initialization()
         
+        product_ids = [int(pid) for pid in (product_ids or [])]
+        file_paths = [str(path) for path in (file_paths or [])]
+        if not product_ids and not file_paths:
+            return 0
+        
         try:
-            # Получаем все эмбеддинги продукта
-            results = self.collection.get(
-                where={"product_id": product_id}
+            self._promote_shared_chunks(product_ids, file_paths)
+            for field, values in (("product_id", product_ids), ("file_path", file_paths)):
+                for i in range(0, len(values), batch_size):
+                    self.collection.delete(where={field: {"$in": values[i:i + batch_size]}})
+            
+            deleted_count = self.manifest.remove_matching(product_ids, file_paths) if self.manifest else 0
+            self._invalidate_answers(product_ids, file_paths)
+            logger.info(
+                f"Удалено {deleted_count} эмбеддингов "
+                f"(продуктов: {len(product_ids)}, файлов: {len(file_paths)})"
             )
+            return deleted_count
             
-            if results['ids']:
-                self.collection.delete(ids=results['ids'])
-                logger.info(f"Удалено {len(results['ids'])} эмбеддингов для продукта {product_id}")
-            else:
-                logger.info(f"Эмбеддинги для продукта {product_id} не найдены")
-                
         except Exception as e:
-            logger.error(f"Ошибка при удалении эмбеддингов для продукта {product_id}: {e}")
+            logger.error(f"Ошибка при массовом удалении эмбеддингов: {e}")
             raise
     
+    def _promote_shared_chunks(self, product_ids: List[int], file_paths: List[str]) -> None:
+        """
+        Общие фрагменты удаляемых продуктов/файлов, на которые ссылаются другие продукты,
+        не удаляются, а переходят к одной из ссылок. Фрагмент переписывается под id
+        нового владельца с сохраненным вектором - повторно кодировать текст не нужно.
+        """
+        if not self.manifest:
+            return
+        aliases = self.manifest.orphaned_aliases(product_ids, file_paths)
+        if not aliases:
+            return
+        
+        current = self.collection.get(
+            ids=[alias[0] for alias in aliases],
+            include=["embeddings", "metadatas", "documents"]
+        )
+        stored = {
+            chunk_id: (embedding, metadata or {}, document)
+            for chunk_id, embedding, metadata, document in zip(
+                current.get("ids") or [], current.get("embeddings"),
+                current.get("metadatas") or [], current.get("documents") or []
+            )
+        }
+        
+        old_ids, new_ids, embeddings, metadatas, documents, promoted = [], [], [], [], [], []
+        for alias in aliases:
+            chunk_id, product_id, file_path, parent_id, chunk_index, start_word, end_word = alias
+            if chunk_id not in stored:
+                continue
+            embedding, old_metadata, document = stored[chunk_id]
+            metadata = {
+                key: value for key, value in old_metadata.items()
+                if key not in ("file_path", "parent_id", "chunk_index", "start_word", "end_word")
+            }
+            metadata["product_id"] = product_id
+            for key, value in (("file_path", file_path), ("parent_id", parent_id), ("chunk_index", chunk_index),
+                               ("start_word", start_word), ("end_word", end_word)):
+                if value is not None:
+                    metadata[key] = value
+            old_ids.append(chunk_id)
+            new_ids.append(f"{product_id}_{self.source_key(file_path)}_chunk_{chunk_index}")
+            embeddings.append(list(embedding))
+            metadatas.append(metadata)
+            documents.append(document)
+            promoted.append(alias)
+        
+        if not promoted:
+            return
+        self.collection.upsert(ids=new_ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+        self.collection.delete(ids=old_ids)
+        self.manifest.promote_aliases(list(zip(new_ids, promoted)))
+        logger.info(f"Общие фрагменты переданы другим продуктам: {len(promoted)}")
+    
+    async def delete_product_embeddings(self, product_id: int) -> int:
+        """
+        Удаляет все эмбеддинги продукта из векторной БД.
+        """
+        return await self.delete_embeddings(product_ids=[product_id])
+    
     async def delete_file_embeddings(self, file_path: str) -> int:
         """
         Удаляет эмбеддинги конкретного файла из векторной БД.
@@ -336,34 +802,19 @@ class UnifiedEmbeddingService:
         Returns:
             Количество удаленных эмбеддингов
         """
-        self._check_initialization()
-        
-        try:
-            # Получаем все эмбеддинги файла
-            results = self.collection.get(
-                where={"file_path": file_path}
-            )
-            
-            deleted_count = 0
-            if results['ids']:
-                self.collection.delete(ids=results['ids'])
-                deleted_count = len(results['ids'])
-                logger.info(f"Удалено {deleted_count} эмбеддингов для файла {file_path}")
-            else:
-                logger.info(f"Эмбеддинги для файла {file_path} не найдены")
-                
-            return deleted_count
-                
-        except Exception as e:
-            logger.error(f"Ошибка при удалении эмбеддингов для файла {file_path}: {e}")
-            raise
+        return await self.delete_embeddings(file_paths=[file_path])
     
     async def search_similar(self, 
                             query: str, 
                             result_limit: int = 5, 
-                            min_similarity_threshold: float = 0.3) -> List[Dict[str, Any]]:
+                            min_similarity_threshold: float = 0.3,
+                            include_embeddings: bool = False,
+                            query_variants: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
         Поиск похожих документов или чанков по текстовому запросу.
+        include_embeddings - вернуть векторы найденных фрагментов (result["embedding"]) для MMR.
+        query_variants - другие формулировки запроса (синонимы): их векторы считаются одним батчем
+        вместе с запросом, ищутся одним запросом к ChromaDB, а списки объединяются по RRF.
         """
         self._check_initialization()
         
@@ -375,47 +826,50 @@ class UnifiedEmbeddingService:
                 logger.warning("Пустой поисковый запрос после нормализации")
                 return []
             
-            # Создаем эмбеддинг для запроса
-            query_embedding = self.model.encode(normalized_query).tolist()
+            queries = [query] + [variant for variant in (query_variants or []) if variant != query]
+            # Эмбеддинги запросов (из кеша или одним батчем)
+            query_embeddings = self.embed_queries(queries)
             
-            # Выполняем поиск
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
+            # Выполняем поиск в потоке: запрос к ChromaDB не блокирует цикл событий
+            # и может быть прерван по бюджету времени вопроса
+            results = await asyncio.to_thread(
+                self.collection.query,
+                query_embeddings=query_embeddings,
                 n_results=result_limit,
-                include=["metadatas", "documents", "distances"]
+                include=["metadatas", "documents", "distances"] + (["embeddings"] if include_embeddings else [])
             )
             
-            # Обрабатываем результаты
-            enhanced_results = []
+            # Обрабатываем результаты: по списку на каждую формулировку
+            ranked_lists = [
+                self._query_results(results, row, min_similarity_threshold, include_embeddings)
+                for row in range(len(results['ids'] or []))
+            ]
+            if len(ranked_lists) > 1:
+                enhanced_results = reciprocal_rank_fusion(ranked_lists, key=lambda r: r["id"], limit=result_limit)
+            else:
+                enhanced_results = ranked_lists[0] if ranked_lists else []
             
-            if results['ids'] and results['distances']:
-                for i, (doc_id, distance) in enumerate(zip(results['ids'][0], results['distances'][0])):
-                    # Преобразуем distance в similarity
-                    similarity = 1 - distance
-                    
-                    if similarity >= min_similarity_threshold:
-                        metadata = results['metadatas'][0][i] if results['metadatas'] else {}
-                        document = results['documents'][0][i] if results['documents'] else ""
-                        
-                        result_data = {
-                            "id": doc_id,
-                            "product_id": metadata.get("product_id"),
-                            "product_name": metadata.get("product_name"),
-                            "similarity": similarity,
-                            "text": document,
-                            "metadata": metadata
-                        }
-                        
-                        # Добавляем информацию о чанке, если это чанк
-                        if "chunk_index" in metadata:
-                            result_data["chunk_index"] = metadata["chunk_index"]
-                            result_data["is_chunk"] = True
-                        else:
-                            result_data["is_chunk"] = False
-                        
-                        enhanced_results.append(result_data)
+            await self._resolve_product_names(enhanced_results)
             
-            logger.info(f"Поиск для '{query}': найдено {len(enhanced_results)} результатов")
+            # Общий фрагмент найден один раз, но относится ко всем продуктам со ссылками на него
+            if self.manifest and enhanced_results:
+                shared = self.manifest.alias_products(r["id"] for r in enhanced_results)
+                for result in enhanced_results:
+                    shared_ids = [pid for pid in shared.get(result["id"], []) if pid != result.get("product_id")]
+                    if shared_ids:
+                        result["shared_product_ids"] = list(dict.fromkeys(shared_ids))
+                shared_names = await product_catalog_cache.get_names(
+                    {pid for r in enhanced_results for pid in r.get("shared_product_ids", [])}
+                )
+                for result in enhanced_results:
+                    if result.get("shared_product_ids"):
+                        result["shared_product_names"] = [
+                            shared_names.get(pid, f"Продукт {pid}") for pid in result["shared_product_ids"]
+                        ]
+            
+            logger.info(
+                f"Поиск для '{query}' ({len(queries)} формулировок): найдено {len(enhanced_results)} результатов"
+            )
             
             return enhanced_results
             
@@ -423,47 +877,209 @@ class UnifiedEmbeddingService:
             logger.error(f"Ошибка при поиске: {e}")
             return []
     
-    async def get_statistics(self) -> Dict[str, Any]:
+    @staticmethod
+    def _query_results(results: Dict[str, Any],
+                       row: int,
+                       min_similarity_threshold: float,
+                       include_embeddings: bool) -> List[Dict[str, Any]]:
+        """Результаты ChromaDB для одного вектора запроса (строка row) выше порога сходства."""
+        enhanced_results = []
+        if not results['ids'] or not results['distances']:
+            return enhanced_results
+        
+        for i, (doc_id, distance) in enumerate(zip(results['ids'][row], results['distances'][row])):
+            # Преобразуем distance в similarity
+            similarity = 1 - distance
+            
+            if similarity >= min_similarity_threshold:
+                metadata = results['metadatas'][row][i] if results['metadatas'] else {}
+                document = results['documents'][row][i] if results['documents'] else ""
+                
+                result_data = {
+                    "id": doc_id,
+                    "product_id": metadata.get("product_id"),
+                    "product_name": metadata.get("product_name"),
+                    "similarity": similarity,
+                    "text": document,
+                    "metadata": metadata
+                }
+                if include_embeddings and results.get('embeddings') is not None:
+                    result_data["embedding"] = results['embeddings'][row][i]
+                
+                # Добавляем информацию о чанке, если это чанк
+                if "chunk_index" in metadata:
+                    result_data["chunk_index"] = metadata["chunk_index"]
+                    result_data["is_chunk"] = True
+                else:
+                    result_data["is_chunk"] = False
+                
+                enhanced_results.append(result_data)
+        return enhanced_results
+    
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Вектор запроса с LRU-кешем по нормализованному тексту.
+        Один и тот же вектор используют маршрутизатор намерений и поиск.
+        """
+        return self.embed_queries([query])[0]
+    
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Векторы нескольких запросов: найденные в LRU-кеше берутся из него,
+        остальные кодируются моделью одним батчем.
+        """
+        self._check_initialization()
+        normalized = [self.normalize_text_for_embedding(query) for query in queries]
+        found: Dict[str, List[float]] = {}
+        with self._query_cache_lock:
+            for text in normalized:
+                embedding = self._query_cache.get(text)
+                if embedding is not None:
+                    self._query_cache.move_to_end(text)
+                    found[text] = embedding
+        
+        missing = [text for text in dict.fromkeys(normalized) if text not in found]
+        if missing:
+            encoded = self.model.encode(missing).tolist()
+            found.update(zip(missing, encoded))
+            with self._query_cache_lock:
+                for text, embedding in zip(missing, encoded):
+                    self._query_cache[text] = embedding
+                    self._query_cache.move_to_end(text)
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+        
+        return [found[text] for text in normalized]
+    
+    def expand_parents(self, results: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """
+        Заменяет найденные дочерние фрагменты их родительскими разделами.
+        Фрагменты одного раздела схлопываются в один результат с наибольшим сходством,
+        совпавшие фрагменты сохраняются в matched_text. Результаты без parent_id
+        (окна слов, метаданные продукта) остаются как есть.
+        Общие фрагменты (shared_product_ids) тоже не расширяются: раздел владельца
+        может содержать данные только его продукта, а общий текст верен для всех.
+        
+        Args:
+            results: Результаты search_similar (по убыванию сходства)
+            limit: Сколько результатов вернуть после схлопывания
+        """
+        parent_ids = [
+            None if r.get("shared_product_ids") else r.get("metadata", {}).get("parent_id")
+            for r in results
+        ]
+        parents = self.manifest.get_parents(pid for pid in parent_ids if pid) if self.manifest else {}
+        
+        expanded: List[Dict[str, Any]] = []
+        by_key: Dict[str, Dict[str, Any]] = {}
+        for result, parent_id in zip(results, parent_ids):
+            key = parent_id or result.get("id")
+            if key in by_key:
+                by_key[key]["matched_text"].append(result.get("text", ""))
+                continue
+            if len(expanded) >= limit:
+                continue
+            
+            item = dict(result)
+            item["matched_text"] = [result.get("text", "")]
+            parent = parents.get(parent_id) if parent_id else None
+            if parent:
+                item["parent_id"] = parent_id
+                item["text"] = parent["text"]
+                item["metadata"] = {
+                    **result.get("metadata", {}),
+                    "start_word": parent["start_word"],
+                    "end_word": parent["end_word"],
+                    "section_type": parent["section_type"]
+                }
+            by_key[key] = item
+            expanded.append(item)
+        
+        return expanded
+    
+    async def _resolve_product_names(self, results: List[Dict[str, Any]]) -> None:
+        """
+        Подставляет названия продуктов из кеша каталога.
+        Для записей в старой схеме используется product_name из метаданных.
+        """
+        product_ids = [r["product_id"] for r in results if r.get("product_id") is not None and not r.get("product_name")]
+        if not product_ids:
+            return
+        names = await product_catalog_cache.get_names(product_ids)
+        for result in results:
+            if not result.get("product_name"):
+                product_id = result.get("product_id")
+                result["product_name"] = names.get(product_id, f"Продукт {product_id}")
+    
+    async def get_statistics(self, full_scan: bool = False, page_size: int = 1000) -> Dict[str, Any]:
         """
         Получает статистику по векторной БД.
+        
+        По умолчанию читает счетчики из манифеста индекса (константное время).
+        При full_scan=True постранично обходит коллекцию и сверяет результат
+        с манифестом (режим аудита).
         """
         self._check_initialization()
         
         try:
             count = self.collection.count()
             
-            # Получаем дополнительную статистику
-            results = self.collection.get(include=["metadatas"])
-            
-            product_counts = {}
-            chunk_counts = 0
-            full_doc_counts = 0
-            
-            if results['metadatas']:
-                for metadata in results['metadatas']:
-                    product_id = metadata.get('product_id')
-                    if product_id:
-                        product_counts[product_id] = product_counts.get(product_id, 0) + 1
-                    
-                    if "chunk_index" in metadata:
-                        chunk_counts += 1
-                    else:
-                        full_doc_counts += 1
+            if full_scan:
+                product_counts = {}
+                chunk_counts = 0
+                full_doc_counts = 0
+                
+                for _, metadatas in self._iter_metadata_pages(page_size):
+                    for metadata in metadatas:
+                        metadata = metadata or {}
+                        product_id = metadata.get('product_id')
+                        if product_id:
+                            product_counts[product_id] = product_counts.get(product_id, 0) + 1
+                        
+                        if "chunk_index" in metadata:
+                            chunk_counts += 1
+                        else:
+                            full_doc_counts += 1
+                
+                unique_products = len(product_counts)
+                product_embeddings = sum(product_counts.values())
+            else:
+                counters = self.manifest.counters() if self.manifest else {}
+                unique_products = counters.get("products", 0)
+                chunk_counts = counters.get("chunks", 0)
+                full_doc_counts = counters.get("full_documents", 0)
+                product_embeddings = counters.get("product_embeddings", 0)
             
-            return {
+            stats = {
                 "total_embeddings": count,
                 "collection_name": self.collection.name,
                 "model_name": self.model_name,
                 "chunking_enabled": self.enable_chunking,
                 "chunk_size": self.chunk_size,
                 "chunk_overlap": self.chunk_overlap,
-                "unique_products": len(product_counts),
+                "parent_child": self.parent_child,
+                "parent_sections": self.manifest.parent_count() if self.manifest else 0,
+                "dedup": self.minhasher is not None,
+                "shared_chunk_refs": self.manifest.alias_count() if self.manifest else 0,
+                "unique_products": unique_products,
                 "chunk_embeddings": chunk_counts,
                 "full_document_embeddings": full_doc_counts,
-                "avg_embeddings_per_product": sum(product_counts.values()) / len(product_counts) if product_counts else 0,
-                "is_initialized": self._is_initialized
+                "avg_embeddings_per_product": product_embeddings / unique_products if unique_products else 0,
+                "is_initialized": self._is_initialized,
+                "source": "full_scan" if full_scan else "manifest"
             }
             
+            if full_scan and self.manifest:
+                counters = self.manifest.counters()
+                stats["manifest_consistent"] = (
+                    counters["total"] == count
+                    and counters["products"] == unique_products
+                    and counters["chunks"] == chunk_counts
+                    and counters["full_documents"] == full_doc_counts
+                )
+            
+            return stats
+            
         except Exception as e:
             logger.error(f"Ошибка получения статистики: {e}")
             return {
@@ -471,6 +1087,117 @@ class UnifiedEmbeddingService:
                 "is_initialized": self._is_initialized
             }
     
+    def _index_size_bytes(self) -> int:
+        """Размер каталога ChromaDB на диске."""
+        total = 0
+        for root, _, files in os.walk(self.chroma_path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total
+
+    def _payload_stats(self, page_size: int = 500) -> Dict[str, float]:
+        """
+        Средний размер записи, которую возвращают get/query (метаданные + документ), в байтах.
+        """
+        records = 0
+        metadata_bytes = 0
+        document_bytes = 0
+        offset = 0
+        while True:
+            page = self.collection.get(include=["metadatas", "documents"], limit=page_size, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            for metadata, document in zip(page.get("metadatas") or [], page.get("documents") or []):
+                metadata_bytes += len(json.dumps(metadata or {}, ensure_ascii=False).encode("utf-8"))
+                document_bytes += len((document or "").encode("utf-8"))
+                records += 1
+            if len(ids) < page_size:
+                break
+            offset += page_size
+        return {
+            "records": records,
+            "avg_metadata_bytes": metadata_bytes / records if records else 0,
+            "avg_record_bytes": (metadata_bytes + document_bytes) / records if records else 0
+        }
+
+    async def migrate_metadata_schema(self, batch_size: int = 256, vacuum: bool = True) -> Dict[str, Any]:
+        """
+        Одноразовая миграция коллекции на компактную схему метаданных.
+
+        Записи старой схемы (product_name, description, processed_text и т.д.)
+        перезаписываются с теми же id, эмбеддингами и документами, но с метаданными
+        из _chunk_metadata. Возвращает размер индекса и полезной нагрузки до и после.
+        """
+        self._check_initialization()
+
+        before = {"index_bytes": self._index_size_bytes(), **self._payload_stats()}
+
+        legacy_ids = [
+            chunk_id
+            for ids, metadatas in self._iter_metadata_pages()
+            for chunk_id, metadata in zip(ids, metadatas)
+            if (metadata or {}).get("schema") != METADATA_SCHEMA_VERSION
+        ]
+        logger.info(f"Миграция схемы метаданных: {len(legacy_ids)} записей старой схемы")
+
+        migrated = 0
+        for i in range(0, len(legacy_ids), batch_size):
+            batch_ids = legacy_ids[i:i + batch_size]
+            page = self.collection.get(ids=batch_ids, include=["embeddings", "metadatas", "documents"])
+
+            ids = page["ids"]
+            documents = [document or "" for document in page["documents"]]
+            metadatas = []
+            for metadata, document in zip(page["metadatas"], documents):
+                metadata = metadata or {}
+                product_name = metadata.get("product_name")
+                if product_name and metadata.get("product_id") is not None:
+                    product_catalog_cache.put(metadata["product_id"], product_name)
+                metadatas.append(self._chunk_metadata(
+                    product_id=metadata.get("product_id"),
+                    file_path=metadata.get("file_path"),
+                    text=document,
+                    chunk_index=metadata.get("chunk_index"),
+                    start_word=metadata.get("start_word"),
+                    end_word=metadata.get("end_word")
+                ))
+
+            # upsert в ChromaDB сливает метаданные со старыми, поэтому удаляем и добавляем заново
+            self.collection.delete(ids=ids)
+            self.collection.add(
+                ids=ids,
+                embeddings=[list(embedding) for embedding in page["embeddings"]],
+                metadatas=metadatas,
+                documents=documents
+            )
+            migrated += len(ids)
+
+        if vacuum and migrated:
+            try:
+                conn = sqlite3.connect(os.path.join(self.chroma_path, "chroma.sqlite3"))
+                conn.execute("VACUUM")
+                conn.close()
+            except Exception as e:
+                logger.warning(f"Не удалось выполнить VACUUM хранилища ChromaDB: {e}")
+
+        after = {"index_bytes": self._index_size_bytes(), **self._payload_stats()}
+
+        logger.info(
+            f"Миграция схемы метаданных завершена: {migrated} записей, "
+            f"индекс {before['index_bytes']} -> {after['index_bytes']} байт, "
+            f"запись {before['avg_record_bytes']:.0f} -> {after['avg_record_bytes']:.0f} байт"
+        )
+
+        return {
+            "migrated": migrated,
+            "before": before,
+            "after": after
+        }
+
     # Методы для совместимости со старым API
     async def create_product_embedding(self, product_id: int, product_name: str, product_description: str = "") -> None:
         """
@@ -489,18 +1216,22 @@ class UnifiedEmbeddingService:
         """
         results = await self.search_similar(
             query=query,
-            result_limit=result_limit,
-            min_similarity_threshold=min_similarity_threshold
+            result_limit=result_limit * MMR_FETCH_FACTOR if MMR_ENABLED else result_limit,
+            min_similarity_threshold=min_similarity_threshold,
+            include_embeddings=MMR_ENABLED
         )
+        if MMR_ENABLED:
+            # Шаблонные разделы паспортов совпадают у многих продуктов - дубли не должны
+            # вытеснять из выдачи фрагменты с действительно разным содержанием
+            results, _ = mmr_select(results, result_limit)
         
         # Группируем по продуктам и берем лучший результат для каждого
         product_results = {}
         for result in results:
-            product_id = result["product_id"]
             similarity = result["similarity"]
-            
-            if product_id not in product_results or similarity > product_results[product_id]:
-                product_results[product_id] = similarity
+            for product_id in [result["product_id"]] + result.get("shared_product_ids", []):
+                if product_id not in product_results or similarity > product_results[product_id]:
+                    product_results[product_id] = similarity
         
         # Конвертируем в старый формат
         return [(product_id, similarity) for product_id, similarity in product_results.items()]
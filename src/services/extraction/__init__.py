@@ -0,0 +1,16 @@
+# Извлечение текста из документов (PDF, XLSX, XLS, CSV)
+from .documents import SUPPORTED_EXTENSIONS, iter_document_blocks
+from .pdf_backends import PdfBackend, PDF_BACKENDS, get_pdf_backend, select_backend_name
+from .supervisor import ExtractionResult, ExtractionSupervisor, extraction_supervisor
+
+__all__ = [
+    "SUPPORTED_EXTENSIONS",
+    "iter_document_blocks",
+    "PdfBackend",
+    "PDF_BACKENDS",
+    "get_pdf_backend",
+    "select_backend_name",
+    "ExtractionResult",
+    "ExtractionSupervisor",
+    "extraction_supervisor"
+]
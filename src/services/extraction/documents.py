@@ -0,0 +1,151 @@
+import os
+import re
+import logging
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+from .pdf_backends import get_pdf_backend
+
+logger = logging.getLogger(__name__)
+
+"""
+Потоковое извлечение текста из документов: страницы PDF или группы строк таблиц.
+Дополнительно - структурированные таблицы (заголовки + строки ячеек) для табличного индекса.
+Модуль намеренно не тянет за собой БД, эмбеддинги и LLM - он импортируется
+в отдельном процессе-обработчике (см. worker.py).
+"""
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.xlsx', '.xls', '.csv')
+
+# Сколько строк таблицы отдается одним блоком в потоковом извлечении
+STREAM_BLOCK_ROWS = 200
+
+
+def iter_pdf_pages(file_path: str,
+                   max_pages: Optional[int] = 30,
+                   tables_fallback: bool = False,
+                   backend: Optional[str] = None) -> Iterator[str]:
+    """
+    Постраничное извлечение текста из PDF файла (пустые страницы пропускаются).
+
+    Args:
+        file_path: Путь к PDF
+        max_pages: Сколько страниц обрабатывать (None - все)
+        tables_fallback: Добавлять таблицы страницы, если текста на ней почти нет
+        backend: Имя PDF-бэкенда (None - из PDF_EXTRACTOR_BACKEND)
+    """
+    pdf_backend = get_pdf_backend(backend)
+    for page_text in pdf_backend.iter_pages(file_path, max_pages, tables_fallback):
+        if page_text and page_text.strip():
+            yield page_text
+
+
+def iter_document_blocks(file_path: str,
+                         max_pages: Optional[int] = 30,
+                         tables_fallback: bool = False,
+                         pdf_backend: Optional[str] = None) -> Iterator[str]:
+    """
+    Блоки текста документа в зависимости от формата: PDF, XLSX, XLS, CSV.
+    Исключения парсеров пробрасываются вызывающему коду.
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    if file_extension == '.pdf':
+        yield from iter_pdf_pages(file_path, max_pages, tables_fallback, pdf_backend)
+    elif file_extension in ('.xlsx', '.xls', '.csv'):
+        from .spreadsheet_extractor import iter_spreadsheet_text_blocks
+        yield from iter_spreadsheet_text_blocks(file_path, block_rows=STREAM_BLOCK_ROWS)
+    else:
+        logger.warning(f"Неподдерживаемый формат файла: {file_extension}")
+
+
+@dataclass
+class ExtractedTable:
+    """
+    Таблица документа в структурированном виде.
+    location - лист книги или 'стр. N' для PDF, first_row - смещение фрагмента внутри листа.
+    """
+    location: str
+    columns: List[str]
+    rows: List[List[str]] = field(default_factory=list)
+    first_row: int = 0
+
+    def to_dict(self) -> dict:
+        return {"location": self.location, "columns": self.columns,
+                "rows": self.rows, "first_row": self.first_row}
+
+
+def _clean_cell(value) -> str:
+    return re.sub(r'\s+', ' ', str(value)).strip() if value is not None else ''
+
+
+def _pdf_table(page_number: int, raw_rows: Sequence[Sequence]) -> Optional[ExtractedTable]:
+    """
+    Сырые строки таблицы PDF -> ExtractedTable.
+    Заголовок - первая строка; None в заголовке (объединенные ячейки) заполняется соседом слева.
+    """
+    if len(raw_rows) < 2:
+        return None
+    width = max(len(row) for row in raw_rows)
+    columns = []
+    previous = ''
+    for index in range(width):
+        value = raw_rows[0][index] if index < len(raw_rows[0]) else None
+        name = _clean_cell(value) if value is not None else previous
+        columns.append(name or f"Столбец {index + 1}")
+        previous = name
+    rows = []
+    for raw in raw_rows[1:]:
+        cells = [_clean_cell(raw[index]) if index < len(raw) else '' for index in range(width)]
+        if any(cells):
+            rows.append(cells)
+    return ExtractedTable(f"стр. {page_number}", columns, rows) if rows else None
+
+
+def iter_pdf_tables(file_path: str,
+                    max_pages: Optional[int] = 30,
+                    backend: Optional[str] = None) -> Iterator[ExtractedTable]:
+    """
+    Таблицы PDF. Если выбранный бэкенд не умеет таблицы (pypdfium2), используется pdfplumber.
+    """
+    pdf_backend = get_pdf_backend(backend)
+    if not pdf_backend.supports_tables:
+        pdf_backend = get_pdf_backend("pdfplumber")
+    for page_number, raw_rows in pdf_backend.iter_tables(file_path, max_pages):
+        table = _pdf_table(page_number, raw_rows)
+        if table:
+            yield table
+
+
+def iter_document_parts(file_path: str,
+                        max_pages: Optional[int] = 30,
+                        tables_fallback: bool = False,
+                        pdf_backend: Optional[str] = None,
+                        with_tables: bool = False) -> Iterator[Tuple[str, Union[str, ExtractedTable]]]:
+    """
+    Текстовые блоки и (при with_tables) таблицы документа: пары ("text", str) / ("table", ExtractedTable).
+    Таблицы XLSX/XLS/CSV берутся из того же прохода по книге, что и текст - файл не разбирается дважды.
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    if not with_tables:
+        for block in iter_document_blocks(file_path, max_pages, tables_fallback, pdf_backend):
+            yield "text", block
+    elif file_extension == '.pdf':
+        for block in iter_pdf_pages(file_path, max_pages, tables_fallback, pdf_backend):
+            yield "text", block
+        for table in iter_pdf_tables(file_path, max_pages, pdf_backend):
+            yield "table", table
+    elif file_extension in ('.xlsx', '.xls', '.csv'):
+        from .spreadsheet_extractor import iter_spreadsheet_tables
+        kind = "CSV файл" if file_extension == '.csv' else "Лист"
+        for sheet_table in iter_spreadsheet_tables(file_path):
+            if sheet_table.is_first_part:
+                yield "text", sheet_table.header_text(kind)
+            yield from (("text", block) for block in sheet_table.iter_text_blocks(STREAM_BLOCK_ROWS))
+            rows = [row for row in sheet_table.frame.values.tolist() if any(row)]
+            if rows:
+                yield "table", ExtractedTable(sheet_table.sheet, list(sheet_table.columns),
+                                              rows, sheet_table.first_row)
+    else:
+        logger.warning(f"Неподдерживаемый формат файла: {file_extension}")
@@ -0,0 +1,239 @@
+import os
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+"""
+Бэкенды извлечения текста из PDF.
+Единый интерфейс PdfBackend над pdfplumber (эталон, медленный, умеет таблицы),
+PyMuPDF (быстрый, таблицы через find_tables) и pypdfium2 (быстрый, только текст).
+
+Выбор бэкенда:
+- PDF_EXTRACTOR_BACKEND - бэкенд по умолчанию (pdfplumber | pymupdf | pypdfium2);
+- PDF_EXTRACTOR_BACKEND_RULES - переопределение по классу документа,
+  подстрока названия/имени файла -> бэкенд, например: "сто:pymupdf,гост:pymupdf,паспорт:pdfplumber".
+pypdfium2 не извлекает таблицы: tables_fallback и iter_tables для него ничего не дают,
+поэтому документы, где данные в таблицах, стоит направлять правилом на pdfplumber или pymupdf.
+"""
+
+DEFAULT_BACKEND = "pdfplumber"
+
+
+def _tables_to_text(tables: List[List[List[Optional[str]]]]) -> str:
+    """Таблицы в виде строк 'ячейка | ячейка'."""
+    return "\n\n".join(
+        "\n".join(" | ".join(str(cell) if cell else "" for cell in row) for row in table)
+        for table in tables if table
+    )
+
+
+class PdfBackend(ABC):
+    """
+    Базовый класс бэкенда: постраничная выдача текста PDF.
+    tables_fallback - дописывать таблицы страницы, если текста на ней почти нет (< 100 символов).
+    """
+    name = ""
+    module = ""
+    supports_tables = False
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            __import__(cls.module)
+            return True
+        except ImportError:
+            return False
+
+    @abstractmethod
+    def page_count(self, file_path: str) -> int:
+        """Число страниц документа."""
+
+    @abstractmethod
+    def iter_pages(self,
+                   file_path: str,
+                   max_pages: Optional[int] = None,
+                   tables_fallback: bool = False) -> Iterator[str]:
+        """Текст страниц по порядку (не больше max_pages)."""
+
+    def iter_tables(self,
+                    file_path: str,
+                    max_pages: Optional[int] = None) -> Iterator[Tuple[int, List[List[Optional[str]]]]]:
+        """Таблицы документа: (номер страницы с 1, строки таблицы)."""
+        return iter(())
+
+    @staticmethod
+    def _with_tables(page_text: Optional[str], tables_text: str) -> str:
+        if not tables_text:
+            return page_text or ""
+        return f"{page_text}\n\n{tables_text}" if page_text else tables_text
+
+
+class PdfPlumberBackend(PdfBackend):
+    """pdfplumber: эталонное качество, таблицы, но самый медленный."""
+    name = "pdfplumber"
+    module = "pdfplumber"
+    supports_tables = True
+
+    def page_count(self, file_path: str) -> int:
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+
+    def iter_pages(self, file_path, max_pages=None, tables_fallback=False):
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            pages_to_process = pdf.pages[:max_pages] if max_pages else pdf.pages
+
+            for page in pages_to_process:
+                page_text = page.extract_text()
+
+                if tables_fallback and (not page_text or len(page_text) < 100):
+                    try:
+                        page_text = self._with_tables(page_text, _tables_to_text(page.extract_tables()))
+                    except Exception as e:
+                        logger.warning(f"Не удалось извлечь таблицы со страницы {page.page_number}: {e}")
+
+                # Сбрасываем разобранные объекты страницы, иначе pdfplumber держит их до закрытия файла
+                page.flush_cache()
+                yield page_text or ""
+
+    def iter_tables(self, file_path, max_pages=None):
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            pages_to_process = pdf.pages[:max_pages] if max_pages else pdf.pages
+            for page in pages_to_process:
+                try:
+                    tables = page.extract_tables()
+                except Exception as e:
+                    logger.warning(f"Не удалось извлечь таблицы со страницы {page.page_number}: {e}")
+                    tables = []
+                page.flush_cache()
+                for table in tables:
+                    if table:
+                        yield page.page_number, table
+
+
+class PyMuPdfBackend(PdfBackend):
+    """PyMuPDF (fitz): в разы быстрее pdfplumber, таблицы через page.find_tables()."""
+    name = "pymupdf"
+    module = "fitz"
+    supports_tables = True
+
+    def page_count(self, file_path: str) -> int:
+        import fitz
+        with fitz.open(file_path) as document:
+            return document.page_count
+
+    def iter_pages(self, file_path, max_pages=None, tables_fallback=False):
+        import fitz
+        with fitz.open(file_path) as document:
+            total = min(document.page_count, max_pages) if max_pages else document.page_count
+
+            for page_number in range(total):
+                page = document.load_page(page_number)
+                page_text = page.get_text("text", sort=True)
+
+                if tables_fallback and len(page_text.strip()) < 100 and hasattr(page, "find_tables"):
+                    try:
+                        tables = [table.extract() for table in page.find_tables().tables]
+                        page_text = self._with_tables(page_text.strip(), _tables_to_text(tables))
+                    except Exception as e:
+                        logger.warning(f"Не удалось извлечь таблицы со страницы {page_number + 1}: {e}")
+
+                yield page_text
+
+    def iter_tables(self, file_path, max_pages=None):
+        import fitz
+        with fitz.open(file_path) as document:
+            total = min(document.page_count, max_pages) if max_pages else document.page_count
+            for page_number in range(total):
+                page = document.load_page(page_number)
+                if not hasattr(page, "find_tables"):
+                    return
+                try:
+                    tables = [table.extract() for table in page.find_tables().tables]
+                except Exception as e:
+                    logger.warning(f"Не удалось извлечь таблицы со страницы {page_number + 1}: {e}")
+                    continue
+                for table in tables:
+                    if table:
+                        yield page_number + 1, table
+
+
+class PdfiumBackend(PdfBackend):
+    """pypdfium2: самый быстрый, только текстовый слой (без таблиц, tables_fallback не поддерживается)."""
+    name = "pypdfium2"
+    module = "pypdfium2"
+    # Предупреждение о tables_fallback - один раз на процесс обработчика
+    _tables_fallback_warned = False
+
+    def page_count(self, file_path: str) -> int:
+        import pypdfium2 as pdfium
+        document = pdfium.PdfDocument(file_path)
+        try:
+            return len(document)
+        finally:
+            document.close()
+
+    def iter_pages(self, file_path, max_pages=None, tables_fallback=False):
+        import pypdfium2 as pdfium
+        if tables_fallback and not PdfiumBackend._tables_fallback_warned:
+            PdfiumBackend._tables_fallback_warned = True
+            logger.warning("PDF-бэкенд pypdfium2 не извлекает таблицы: tables_fallback игнорируется")
+        document = pdfium.PdfDocument(file_path)
+        try:
+            total = min(len(document), max_pages) if max_pages else len(document)
+            for page_number in range(total):
+                page = document[page_number]
+                text_page = page.get_textpage()
+                try:
+                    yield text_page.get_text_range()
+                finally:
+                    text_page.close()
+                    page.close()
+        finally:
+            document.close()
+
+
+PDF_BACKENDS: Dict[str, Type[PdfBackend]] = {
+    backend.name: backend for backend in (PdfPlumberBackend, PyMuPdfBackend, PdfiumBackend)
+}
+
+
+def _parse_rules(raw: str) -> List[tuple]:
+    rules = []
+    for item in raw.split(","):
+        pattern, _, backend = item.partition(":")
+        if pattern.strip() and backend.strip():
+            rules.append((pattern.strip().lower(), backend.strip().lower()))
+    return rules
+
+
+def select_backend_name(document_name: Optional[str] = None) -> str:
+    """
+    Имя бэкенда для документа: правило по классу документа или значение по умолчанию.
+    """
+    if document_name:
+        lowered = document_name.lower()
+        for pattern, backend in _parse_rules(os.getenv("PDF_EXTRACTOR_BACKEND_RULES", "")):
+            if pattern in lowered:
+                return backend
+    return os.getenv("PDF_EXTRACTOR_BACKEND", DEFAULT_BACKEND).strip().lower()
+
+
+def get_pdf_backend(name: Optional[str] = None) -> PdfBackend:
+    """
+    Экземпляр бэкенда по имени (по умолчанию - из PDF_EXTRACTOR_BACKEND).
+    Неизвестный или неустановленный бэкенд заменяется на pdfplumber.
+    """
+    name = (name or select_backend_name()).lower()
+    backend_class = PDF_BACKENDS.get(name)
+    if backend_class is None:
+        logger.warning(f"Неизвестный PDF-бэкенд '{name}', используется {DEFAULT_BACKEND}")
+        backend_class = PDF_BACKENDS[DEFAULT_BACKEND]
+    elif not backend_class.is_available():
+        logger.warning(f"PDF-бэкенд '{name}' не установлен ({backend_class.module}), используется {DEFAULT_BACKEND}")
+        backend_class = PDF_BACKENDS[DEFAULT_BACKEND]
+    return backend_class()
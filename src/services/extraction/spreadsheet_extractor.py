@@ -0,0 +1,226 @@
+import os
+import csv
+import codecs
+import logging
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+"""
+Извлечение таблиц из XLSX/XLS/CSV.
+Каждая книга разбирается один раз (openpyxl в режиме read_only, потоково по строкам),
+строки форматируются векторными операциями pandas, кодировка CSV определяется по образцу байтов.
+Таблицы отдаются фрагментами SheetTable, чтобы их можно было использовать не только как текст.
+"""
+
+# Кодировки, которые реально встречаются в выгрузках прайс-листов
+CSV_ENCODINGS = ['utf-8-sig', 'utf-8', 'cp1251']
+CSV_SAMPLE_BYTES = 64 * 1024
+CELL_SEPARATOR = ' | '
+
+
+@dataclass
+class SheetTable:
+    """
+    Фрагмент таблицы: лист книги (или часть CSV) с заголовками.
+    Все значения frame - строки, пустые ячейки - ''.
+    """
+    source: str
+    sheet: str
+    columns: List[str]
+    frame: pd.DataFrame
+    first_row: int = 0  # номер первой строки фрагмента внутри листа
+
+    @property
+    def is_first_part(self) -> bool:
+        return self.first_row == 0
+
+    def header_text(self, kind: str = "Лист") -> str:
+        """Заголовок листа в том виде, в котором он попадает в индекс."""
+        header = f"=== {kind}: {self.sheet} ==="
+        if self.columns:
+            header += "\nСтолбцы: " + CELL_SEPARATOR.join(self.columns)
+        return header
+
+    def row_texts(self) -> pd.Series:
+        """Строки таблицы в виде 'значение | значение' без пустых ячеек и пустых строк."""
+        return format_rows(self.frame)
+
+    def iter_text_blocks(self, block_rows: int = 200) -> Iterator[str]:
+        """Текст фрагмента группами по block_rows строк."""
+        texts = self.row_texts()
+        for start in range(0, len(texts), block_rows):
+            yield '\n'.join(texts.iloc[start:start + block_rows])
+
+
+def format_rows(frame: pd.DataFrame) -> pd.Series:
+    """
+    Векторное форматирование строк: ячейки склеиваются по столбцам,
+    разделитель ставится только между непустыми значениями.
+    """
+    if frame.empty:
+        return pd.Series([], dtype=object)
+
+    text: Optional[pd.Series] = None
+    for column in frame.columns:
+        values = frame[column]
+        if text is None:
+            text = values
+            continue
+        separator = np.where((text != '') & (values != ''), CELL_SEPARATOR, '')
+        text = text + separator + values
+
+    return text[text != '']
+
+
+def _normalize_frame(rows: Sequence[Sequence], columns: List[str]) -> pd.DataFrame:
+    """Строки произвольных значений -> DataFrame строк без NaN/None."""
+    frame = pd.DataFrame(rows, columns=columns, dtype=object)
+    if frame.empty:
+        return frame
+    return frame.fillna('').astype(str).apply(lambda column: column.str.strip())
+
+
+def _column_names(header: Sequence, width: int) -> List[str]:
+    """Имена столбцов по строке заголовка (пустые - как в pandas: 'Unnamed: N')."""
+    names = []
+    for index in range(width):
+        value = header[index] if index < len(header) else None
+        name = str(value).strip() if value is not None else ''
+        names.append(name or f"Unnamed: {index}")
+    return names
+
+
+def _iter_xlsx_tables(file_path: str, chunk_rows: int) -> Iterator[SheetTable]:
+    """Потоковое чтение .xlsx через openpyxl (read_only): книга разбирается один раз."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            columns: Optional[List[str]] = None
+            buffer: List[Sequence] = []
+            first_row = 0
+
+            for row in worksheet.iter_rows(values_only=True):
+                if columns is None:
+                    # Заголовок - первая непустая строка листа
+                    if any(value is not None and str(value).strip() for value in row):
+                        columns = _column_names(row, len(row))
+                    continue
+                if len(row) > len(columns):
+                    columns = _column_names(columns, len(row))
+                buffer.append(tuple(row) + (None,) * (len(columns) - len(row)))
+
+                if len(buffer) >= chunk_rows:
+                    yield SheetTable(os.path.basename(file_path), worksheet.title, columns,
+                                     _normalize_frame(buffer, columns), first_row)
+                    first_row += len(buffer)
+                    buffer = []
+
+            if columns is None:
+                continue
+            if buffer or first_row == 0:
+                yield SheetTable(os.path.basename(file_path), worksheet.title, columns,
+                                 _normalize_frame(buffer, columns), first_row)
+    finally:
+        workbook.close()
+
+
+def _iter_xls_tables(file_path: str) -> Iterator[SheetTable]:
+    """Старый формат .xls: openpyxl его не читает, разбираем все листы за один вызов pandas."""
+    sheets = pd.read_excel(file_path, sheet_name=None, dtype=object)
+    for sheet_name, frame in sheets.items():
+        columns = _column_names(list(frame.columns), len(frame.columns))
+        yield SheetTable(os.path.basename(file_path), str(sheet_name), columns,
+                         _normalize_frame(frame.values.tolist(), columns))
+
+
+def sniff_encoding(file_path: str, sample_size: int = CSV_SAMPLE_BYTES) -> str:
+    """
+    Определяет кодировку CSV по первым sample_size байтам.
+    Обрезанный на границе образца многобайтовый символ ошибкой не считается.
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+
+    for encoding in CSV_ENCODINGS:
+        if encoding == 'utf-8-sig' and not sample.startswith(codecs.BOM_UTF8):
+            continue
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+
+    # latin-1 декодирует любые байты
+    return 'latin-1'
+
+
+def sniff_delimiter(file_path: str, encoding: str, sample_size: int = CSV_SAMPLE_BYTES) -> str:
+    """Разделитель CSV по образцу (выгрузки из русского Excel часто используют ';')."""
+    with open(file_path, 'r', encoding=encoding, errors='replace', newline='') as f:
+        sample = f.read(sample_size)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+    except csv.Error:
+        return ','
+
+
+def _iter_csv_tables(file_path: str, chunk_rows: int) -> Iterator[SheetTable]:
+    """Чтение CSV порциями в уже определенной кодировке - без повторных полных чтений."""
+    encoding = sniff_encoding(file_path)
+    delimiter = sniff_delimiter(file_path, encoding)
+    logger.info(f"CSV файл {file_path}: кодировка {encoding}, разделитель '{delimiter}'")
+
+    reader = pd.read_csv(
+        file_path,
+        encoding=encoding,
+        sep=delimiter,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunk_rows,
+        encoding_errors='replace'
+    )
+    first_row = 0
+    columns: Optional[List[str]] = None
+    for frame in reader:
+        if columns is None:
+            columns = _column_names(list(frame.columns), len(frame.columns))
+        yield SheetTable(os.path.basename(file_path), os.path.basename(file_path), columns,
+                         _normalize_frame(frame.values.tolist(), columns), first_row)
+        first_row += len(frame)
+
+
+def iter_spreadsheet_tables(file_path: str, chunk_rows: int = 5000) -> Iterator[SheetTable]:
+    """
+    Отдает таблицы файла фрагментами не более chunk_rows строк.
+
+    Args:
+        file_path: Путь к .xlsx/.xls/.csv
+        chunk_rows: Максимальное число строк в одном фрагменте
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.xlsx':
+        yield from _iter_xlsx_tables(file_path, chunk_rows)
+    elif extension == '.xls':
+        yield from _iter_xls_tables(file_path)
+    elif extension == '.csv':
+        yield from _iter_csv_tables(file_path, chunk_rows)
+    else:
+        raise ValueError(f"Неподдерживаемый формат таблицы: {extension}")
+
+
+def iter_spreadsheet_text_blocks(file_path: str, block_rows: int = 200) -> Iterator[str]:
+    """
+    Текст таблиц для индексации: заголовок листа, затем группы по block_rows строк.
+    """
+    kind = "CSV файл" if file_path.lower().endswith('.csv') else "Лист"
+    for table in iter_spreadsheet_tables(file_path):
+        if table.is_first_part:
+            yield table.header_text(kind)
+        yield from table.iter_text_blocks(block_rows)
@@ -0,0 +1,360 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+"""
+Супервизор извлечения текста.
+pdfplumber/openpyxl выполняются не в цикле событий бота, а в отдельных процессах
+(worker.py) с ограничением по времени и памяти. Неудачные попытки повторяются,
+файлы, которые стабильно роняют обработчик, попадают в карантин и больше не разбираются.
+"""
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+EXIT_MEMORY = 3
+
+
+@dataclass
+class ExtractionResult:
+    """Результат извлечения одного файла."""
+    file_path: str
+    status: str  # ok | timeout | memory_limit | failed | quarantined
+    attempts: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+    spool_path: Optional[str] = None
+    tables_spool_path: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+    def iter_blocks(self) -> Iterator[str]:
+        """Читает блоки из spool-файла по одному и удаляет файл после чтения."""
+        if not self.spool_path:
+            return
+        try:
+            with open(self.spool_path, "r", encoding="utf-8") as spool:
+                for line in spool:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            _remove_quietly(self.spool_path)
+            self.spool_path = None
+
+    def iter_tables(self) -> Iterator[Dict[str, Any]]:
+        """
+        Структурированные таблицы (location, columns, rows, first_row), если извлечение
+        запускалось с with_tables. Spool таблиц удаляется после чтения.
+        """
+        if not self.tables_spool_path:
+            return
+        try:
+            with open(self.tables_spool_path, "r", encoding="utf-8") as spool:
+                for line in spool:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            _remove_quietly(self.tables_spool_path)
+            self.tables_spool_path = None
+
+    def discard(self) -> None:
+        """Удаляет spool-файлы (если блоки не понадобились)."""
+        _remove_quietly(self.spool_path)
+        _remove_quietly(self.tables_spool_path)
+        self.spool_path = None
+        self.tables_spool_path = None
+
+
+def _remove_quietly(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ExtractionSupervisor:
+    """
+    Пул процессов извлечения текста с лимитами, повторами и карантином.
+    """
+
+    def __init__(self,
+                 max_workers: int = int(os.getenv("EXTRACTION_WORKERS", "2")),
+                 timeout_seconds: float = float(os.getenv("EXTRACTION_TIMEOUT_SECONDS", "180")),
+                 memory_limit_mb: int = int(os.getenv("EXTRACTION_MEMORY_LIMIT_MB", "1536")),
+                 retries: int = int(os.getenv("EXTRACTION_RETRIES", "1")),
+                 quarantine_after: int = int(os.getenv("EXTRACTION_QUARANTINE_AFTER", "3")),
+                 quarantine_path: str = os.getenv("EXTRACTION_QUARANTINE_PATH", "./extraction_quarantine.json"),
+                 spool_dir: Optional[str] = None):
+        self.max_workers = max_workers
+        self.timeout_seconds = timeout_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.retries = retries
+        self.quarantine_after = quarantine_after
+        self.quarantine_path = quarantine_path
+        self.spool_dir = spool_dir or os.path.join(tempfile.gettempdir(), "gzbot_extraction")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._active = 0
+        self._waiting = 0
+        self.counters: Dict[str, int] = {
+            "ok": 0, "timeout": 0, "memory_limit": 0, "failed": 0, "quarantined": 0, "retries": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Карантин
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def fingerprint(file_path: str) -> str:
+        """Отпечаток содержимого файла: размер + хеш первого мегабайта."""
+        digest = hashlib.blake2b(digest_size=12)
+        with open(file_path, "rb") as f:
+            digest.update(f.read(1024 * 1024))
+        digest.update(str(os.path.getsize(file_path)).encode())
+        return digest.hexdigest()
+
+    def _load_quarantine(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.quarantine_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_quarantine(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.quarantine_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.quarantine_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.quarantine_path)
+
+    def _record_failure(self, file_path: str, fingerprint: str, error: str) -> int:
+        """Увеличивает счетчик неудач файла и возвращает его."""
+        entries = self._load_quarantine()
+        entry = entries.get(fingerprint, {"failures": 0})
+        entry.update({
+            "file_path": file_path,
+            "failures": entry["failures"] + 1,
+            "last_error": error[:500],
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")
+        })
+        entries[fingerprint] = entry
+        self._save_quarantine(entries)
+        return entry["failures"]
+
+    def _clear_failures(self, fingerprint: str) -> None:
+        entries = self._load_quarantine()
+        if entries.pop(fingerprint, None) is not None:
+            self._save_quarantine(entries)
+
+    def is_quarantined(self, file_path: str) -> bool:
+        """Файл в карантине, если число неудачных попыток достигло порога."""
+        entry = self._load_quarantine().get(self.fingerprint(file_path))
+        return bool(entry) and entry["failures"] >= self.quarantine_after
+
+    def release(self, file_path: str) -> None:
+        """Снимает файл с карантина (например, после ручной проверки)."""
+        self._clear_failures(self.fingerprint(file_path))
+
+    # ------------------------------------------------------------------
+    # Запуск обработчиков
+    # ------------------------------------------------------------------
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._semaphore
+
+    async def _run_worker(self, file_path: str, spool_path: str,
+                          max_pages: Optional[int], tables_fallback: bool,
+                          pdf_backend: Optional[str] = None,
+                          tables_spool_path: Optional[str] = None) -> Optional[str]:
+        """
+        Один запуск обработчика. Возвращает None при успехе или строку-статус ошибки
+        в формате '<status>: <описание>'.
+        """
+        command = [
+            sys.executable, "-m", "src.services.extraction.worker",
+            file_path, spool_path,
+            "--max-pages", str(max_pages or 0),
+            "--memory-mb", str(self.memory_limit_mb)
+        ]
+        if tables_fallback:
+            command.append("--tables-fallback")
+        if pdf_backend:
+            command.extend(["--pdf-backend", pdf_backend])
+        if tables_spool_path:
+            command.extend(["--tables-spool", tables_spool_path])
+
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=PROJECT_ROOT,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout_seconds)
+        except asyncio.TimeoutError:
+            await self._kill(process)
+            return f"timeout: обработка дольше {self.timeout_seconds:.0f} с"
+        except BaseException:
+            # Отмена задачи (остановка бота, отмена индексации) не должна оставлять обработчик работать
+            await self._kill(process)
+            raise
+
+        if process.returncode == 0:
+            return None
+
+        message = stderr.decode("utf-8", errors="replace").strip().splitlines()
+        details = message[-1] if message else f"код возврата {process.returncode}"
+        if process.returncode == EXIT_MEMORY or process.returncode == -9:
+            return f"memory_limit: {details} (лимит {self.memory_limit_mb} МБ)"
+        return f"failed: {details}"
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process) -> None:
+        """Завершает процесс обработчика и дожидается его, чтобы не оставлять зомби."""
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        await process.wait()
+
+    async def extract(self,
+                      file_path: str,
+                      max_pages: Optional[int] = 30,
+                      tables_fallback: bool = False,
+                      pdf_backend: Optional[str] = None,
+                      with_tables: bool = False) -> ExtractionResult:
+        """
+        Извлекает текст файла в отдельном процессе.
+        При успехе блоки доступны через ExtractionResult.iter_blocks(),
+        а при with_tables - структурированные таблицы через ExtractionResult.iter_tables().
+        pdf_backend - имя PDF-бэкенда (None - из PDF_EXTRACTOR_BACKEND).
+        """
+        result = ExtractionResult(file_path=file_path, status="failed")
+        started = time.monotonic()
+
+        try:
+            fingerprint = self.fingerprint(file_path)
+        except OSError as e:
+            result.error = str(e)
+            return result
+
+        if self.is_quarantined(file_path):
+            result.status = "quarantined"
+            result.error = "файл в карантине после повторных сбоев обработки"
+            self.counters["quarantined"] += 1
+            logger.warning(f"[Extraction] Файл {file_path} в карантине, извлечение пропущено")
+            return result
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        semaphore = self._get_semaphore()
+
+        for attempt in range(1, self.retries + 2):
+            result.attempts = attempt
+            spool_fd, spool_path = tempfile.mkstemp(prefix="extract_", suffix=".jsonl", dir=self.spool_dir)
+            os.close(spool_fd)
+            tables_spool_path = None
+            if with_tables:
+                tables_fd, tables_spool_path = tempfile.mkstemp(prefix="tables_", suffix=".jsonl",
+                                                                dir=self.spool_dir)
+                os.close(tables_fd)
+
+            try:
+                self._waiting += 1
+                try:
+                    await semaphore.acquire()
+                finally:
+                    self._waiting -= 1
+                self._active += 1
+                try:
+                    failure = await self._run_worker(file_path, spool_path, max_pages, tables_fallback,
+                                                     pdf_backend, tables_spool_path)
+                finally:
+                    self._active -= 1
+                    semaphore.release()
+            except BaseException:
+                # При отмене временные файлы попытки никому не достанутся
+                _remove_quietly(spool_path)
+                _remove_quietly(tables_spool_path)
+                raise
+
+            if failure is None:
+                result.status = "ok"
+                result.error = None
+                result.spool_path = spool_path
+                result.tables_spool_path = tables_spool_path
+                self.counters["ok"] += 1
+                self._clear_failures(fingerprint)
+                break
+
+            os.remove(spool_path)
+            _remove_quietly(tables_spool_path)
+            result.status, _, result.error = failure.partition(": ")
+            failures = self._record_failure(file_path, fingerprint, failure)
+            logger.warning(
+                f"[Extraction] Попытка {attempt} для {file_path} неудачна ({failure}), всего сбоев: {failures}"
+            )
+            if failures >= self.quarantine_after:
+                logger.error(f"[Extraction] Файл {file_path} отправлен в карантин")
+                break
+            if attempt <= self.retries:
+                self.counters["retries"] += 1
+                await asyncio.sleep(min(2 ** attempt, 10))
+
+        if not result.ok:
+            self.counters[result.status] = self.counters.get(result.status, 0) + 1
+        result.elapsed = time.monotonic() - started
+        return result
+
+    async def extract_text(self,
+                           file_path: str,
+                           max_pages: Optional[int] = None,
+                           max_length: Optional[int] = None) -> str:
+        """
+        Текст документа одной строкой (для коротких выдержек, не для индексации).
+        """
+        extraction = await self.extract(file_path, max_pages=max_pages, tables_fallback=True)
+        if not extraction.ok:
+            logger.warning(f"[Extraction] Не удалось извлечь текст из {file_path}: {extraction.error}")
+            return ""
+
+        parts = []
+        total_length = 0
+        blocks = extraction.iter_blocks()
+        for block in blocks:
+            block = re.sub(r'\s+', ' ', block).strip()
+            parts.append(block)
+            total_length += len(block)
+            if max_length and total_length > max_length:
+                break
+        blocks.close()
+
+        full_text = ' '.join(parts)
+        return full_text[:max_length] if max_length else full_text
+
+    def stats(self) -> Dict[str, Any]:
+        """Текущая загрузка пула и счетчики результатов."""
+        return {
+            "active": self._active,
+            "waiting": self._waiting,
+            "max_workers": self.max_workers,
+            **self.counters
+        }
+
+
+# Глобальный супервизор, общий для всех сервисов процесса
+extraction_supervisor = ExtractionSupervisor()
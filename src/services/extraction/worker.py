@@ -0,0 +1,74 @@
+"""
+Процесс-обработчик извлечения текста.
+
+Запускается супервизором (supervisor.py) для одного файла:
+    python -m src.services.extraction.worker <file_path> <spool_path> [--max-pages N] [--memory-mb M] [--pdf-backend NAME]
+        [--tables-spool PATH]
+
+Блоки текста пишутся в spool-файл построчно (JSON-строки), чтобы ни обработчик,
+ни бот не держали документ целиком в памяти. С --tables-spool структурированные
+таблицы документа пишутся во второй spool-файл. Код возврата сообщает результат.
+"""
+import sys
+import json
+import argparse
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_MEMORY = 3
+
+
+def _apply_memory_limit(memory_mb: int) -> None:
+    """Ограничивает адресное пространство процесса (Linux/macOS)."""
+    if memory_mb <= 0:
+        return
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"Не удалось установить лимит памяти: {e}", file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Извлечение текста документа в spool-файл")
+    parser.add_argument("file_path")
+    parser.add_argument("spool_path")
+    parser.add_argument("--max-pages", type=int, default=30, help="0 - все страницы")
+    parser.add_argument("--memory-mb", type=int, default=0)
+    parser.add_argument("--tables-fallback", action="store_true")
+    parser.add_argument("--pdf-backend", default=None, help="pdfplumber | pymupdf | pypdfium2")
+    parser.add_argument("--tables-spool", default=None, help="файл для структурированных таблиц")
+    args = parser.parse_args(argv)
+
+    _apply_memory_limit(args.memory_mb)
+
+    try:
+        from src.services.extraction.documents import iter_document_parts
+
+        tables_spool = open(args.tables_spool, "w", encoding="utf-8") if args.tables_spool else None
+        try:
+            with open(args.spool_path, "w", encoding="utf-8") as spool:
+                for kind, part in iter_document_parts(args.file_path, args.max_pages or None,
+                                                      args.tables_fallback, args.pdf_backend,
+                                                      with_tables=tables_spool is not None):
+                    if kind == "table":
+                        tables_spool.write(json.dumps(part.to_dict(), ensure_ascii=False))
+                        tables_spool.write("\n")
+                    else:
+                        spool.write(json.dumps(part, ensure_ascii=False))
+                        spool.write("\n")
+        finally:
+            if tables_spool:
+                tables_spool.close()
+        return EXIT_OK
+    except MemoryError:
+        print("Превышен лимит памяти", file=sys.stderr)
+        return EXIT_MEMORY
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,16 +44,21 @@ class FeedbackService:
         response_type: str = 'ai_generated',
         execution_time: Optional[float] = None,
         sources_count: int = 0,
-        message_id: Optional[int] = None
+        message_id: Optional[int] = None,
+        metrics: Optional[Dict[str, Any]] = None
     ) -> BotResponse:
-        """Логирование ответа бота."""
+        """
+        Логирование ответа бота.
+        metrics - токены, модель и время этапов (ResponseMetrics.to_columns()).
+        """
         return await self.response_repo.create_response(
             query_id=query_id,
             response_text=response_text,
             response_type=response_type,
             execution_time=execution_time,
             sources_count=sources_count,
-            message_id=message_id
+            message_id=message_id,
+            metrics=metrics
         )
     
     async def add_user_feedback(
@@ -92,6 +97,10 @@ class FeedbackService:
         """Получить статистику по обратной связи."""
         return await self.feedback_repo.get_feedback_stats()
     
+    async def get_usage_stats(self, days: int = 7) -> Dict[str, Any]:
+        """Получить сводку токенов, стоимости и времени этапов ответов."""
+        return await self.response_repo.get_usage_stats(days)
+    
     async def get_user_feedback_for_message(
         self, 
         message_id: int, 
@@ -184,6 +184,10 @@ class ProductService:
                 
                 # Синхронизируем название в ProductSphere записях
                 await self.product_repo.sync_product_name_to_spheres(product_id, value)
+                
+                # Обновляем название в кеше каталога (используется при чтении результатов поиска)
+                from src.services.catalog_cache import product_catalog_cache
+                product_catalog_cache.put(product_id, value)
             elif field in ["description", "advantages", "notes"]:
                 # Обновляем поля в ProductSphere через репозиторий
                 success = await self.product_repo.update_product_sphere_field(product_id, field, value)
@@ -2,8 +2,9 @@
 from .rag_service import RagService
 from .query_processor import QueryProcessor
 from .llm_generator import LLMResponseGenerator
+from .multi_llm_generator import MultiLLMGenerator, LLMAnswer
 
 # Импортируем объединенный сервис эмбеддингов
 from ..embeddings.unified_embedding_service import UnifiedEmbeddingService
 
-__all__ = ["RagService", "QueryProcessor", "LLMResponseGenerator", "UnifiedEmbeddingService"]
+__all__ = ["RagService", "QueryProcessor", "LLMResponseGenerator", "MultiLLMGenerator", "LLMAnswer", "UnifiedEmbeddingService"]
@@ -0,0 +1,269 @@
+import os
+import time
+import hashlib
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""
+Семантический кеш ответов LLM.
+Одни и те же вопросы задают по-разному ("какая температура размягчения Т-75",
+"Т-75 температура размягчения?"), поэтому ключ кеша - вектор запроса, а не текст.
+Ответ отдается из кеша, только если новый запрос очень близок к сохраненному
+И поиск нашел для него практически тот же набор фрагментов: тогда LLM получила бы
+тот же контекст. Дизлайк на ответ удаляет запись, переиндексация продукта -
+все записи с его фрагментами.
+"""
+
+ANSWER_CACHE_ENABLED = os.getenv("RAG_ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = int(os.getenv("RAG_ANSWER_CACHE_TTL", "86400"))
+# Косинусное сходство запросов, начиная с которого ответ можно переиспользовать
+ANSWER_CACHE_THRESHOLD = float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+# Минимальное совпадение (Жаккар) наборов найденных фрагментов
+ANSWER_CACHE_MIN_OVERLAP = float(os.getenv("RAG_ANSWER_CACHE_MIN_OVERLAP", "0.8"))
+
+# Ответы-ошибки LLMResponseGenerator не кешируются
+_ERROR_PREFIXES = ("Ошибка", "Произошла ошибка", "Превышено время", "Я не могу ответить")
+
+
+@dataclass(eq=False)
+class CachedAnswer:
+    entry_id: int
+    query: str
+    vector: np.ndarray
+    chunk_keys: FrozenSet[str]
+    product_ids: Set[int]
+    file_paths: Set[str]
+    answer: str
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+@dataclass
+class CacheLookup:
+    """Результат поиска в кеше; entry - найденная запись или None."""
+    entry: Optional[CachedAnswer] = None
+    similarity: float = 0.0
+    overlap: float = 0.0
+
+
+def result_chunk_keys(search_results: List[Dict[str, Any]], table_context: str = "") -> FrozenSet[str]:
+    """Набор фрагментов контекста: раздел (parent_id) или чанк, плюс хеш табличных данных."""
+    keys = set()
+    for result in search_results:
+        key = result.get("parent_id") or result.get("chunk_id")
+        if not key:
+            key = f"{result.get('product_id')}:{result.get('file_path')}:{result.get('start_word')}"
+        keys.add(str(key))
+    if table_context:
+        keys.add("table:" + hashlib.blake2b(table_context.encode("utf-8"), digest_size=8).hexdigest())
+    return frozenset(keys)
+
+
+class SemanticAnswerCache:
+    """
+    Кеш ответов в памяти процесса с вытеснением по LRU и TTL.
+    """
+
+    def __init__(self,
+                 enabled: bool = ANSWER_CACHE_ENABLED,
+                 max_entries: int = ANSWER_CACHE_SIZE,
+                 ttl_seconds: int = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD,
+                 min_overlap: float = ANSWER_CACHE_MIN_OVERLAP):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 1
+        # Матрица векторов записей для поиска одним умножением; пересобирается после изменений
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+        # message_id ответа в Telegram -> (entry_id, ответ отдан из кеша)
+        self._messages: "OrderedDict[int, Tuple[int, bool]]" = OrderedDict()
+        self._recent_hits: Deque[Dict[str, Any]] = deque(maxlen=20)
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "near_misses": 0,
+            "stored": 0,
+            "evicted_feedback": 0,
+            "evicted_reindex": 0,
+            "false_hits": 0
+        }
+
+    @staticmethod
+    def _normalize(vector: Iterable[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        return array / max(float(np.linalg.norm(array)), 1e-12)
+
+    def _remove(self, entry_id: int) -> Optional[CachedAnswer]:
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._matrix = None
+        return entry
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [entry_id for entry_id, entry in self._entries.items()
+                   if now - entry.created_at > self.ttl_seconds]
+        for entry_id in expired:
+            self._remove(entry_id)
+
+    def _get_matrix(self) -> Tuple[Optional[np.ndarray], List[int]]:
+        if self._matrix is None and self._entries:
+            self._matrix_ids = list(self._entries)
+            self._matrix = np.stack([self._entries[entry_id].vector for entry_id in self._matrix_ids])
+        return self._matrix, self._matrix_ids
+
+    def lookup(self, query: str, query_vector: Iterable[float], chunk_keys: FrozenSet[str],
+               min_overlap: Optional[float] = None) -> CacheLookup:
+        """
+        Ищет ответ для запроса: сходство векторов не ниже threshold
+        и совпадение наборов фрагментов не ниже min_overlap
+        (меньшее значение передается, когда LLM не успевает ответить).
+        """
+        min_overlap = self.min_overlap if min_overlap is None else min_overlap
+        if not self.enabled or not chunk_keys:
+            return CacheLookup()
+        self._stats["lookups"] += 1
+        self._expire()
+        matrix, ids = self._get_matrix()
+        if matrix is None:
+            return CacheLookup()
+
+        scores = matrix @ self._normalize(query_vector)
+        best = CacheLookup()
+        for index in np.argsort(-scores):
+            similarity = float(scores[index])
+            if similarity < self.threshold:
+                break
+            entry = self._entries[ids[index]]
+            overlap = len(entry.chunk_keys & chunk_keys) / len(entry.chunk_keys | chunk_keys)
+            if overlap >= min_overlap:
+                best = CacheLookup(entry, similarity, overlap)
+                break
+            if best.similarity == 0.0:
+                # Похожий запрос, но поиск нашел другие фрагменты - ответ не переиспользуем
+                best = CacheLookup(None, similarity, overlap)
+
+        if best.entry is None:
+            if best.similarity:
+                self._stats["near_misses"] += 1
+            return best
+
+        best.entry.hits += 1
+        self._entries.move_to_end(best.entry.entry_id)
+        self._stats["hits"] += 1
+        self._recent_hits.append({
+            "entry_id": best.entry.entry_id,
+            "query": query,
+            "cached_query": best.entry.query,
+            "similarity": round(best.similarity, 4),
+            "overlap": round(best.overlap, 3)
+        })
+        logger.info(
+            f"[AnswerCache] Ответ из кеша для '{query}' (запрос '{best.entry.query}', "
+            f"сходство {best.similarity:.3f}, фрагменты {best.overlap:.2f})"
+        )
+        return best
+
+    def store(self,
+              query: str,
+              query_vector: Iterable[float],
+              chunk_keys: FrozenSet[str],
+              product_ids: Iterable[int],
+              answer: str,
+              file_paths: Iterable[Optional[str]] = ()) -> Optional[int]:
+        """Сохраняет ответ; возвращает id записи или None, если ответ не кешируется."""
+        if not self.enabled or not chunk_keys or not answer or answer.startswith(_ERROR_PREFIXES):
+            return None
+        entry = CachedAnswer(
+            entry_id=self._next_id,
+            query=query,
+            vector=self._normalize(query_vector),
+            chunk_keys=chunk_keys,
+            product_ids={int(pid) for pid in product_ids if pid is not None},
+            file_paths={str(path) for path in file_paths if path},
+            answer=answer
+        )
+        self._next_id += 1
+        self._entries[entry.entry_id] = entry
+        self._matrix = None
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._stats["stored"] += 1
+        return entry.entry_id
+
+    def bind_message(self, message_id: int, entry_id: Optional[int], from_cache: bool = False) -> None:
+        """Связывает отправленное сообщение с записью кеша, чтобы дизлайк мог ее удалить."""
+        if entry_id is None or message_id is None:
+            return
+        self._messages[int(message_id)] = (entry_id, from_cache)
+        while len(self._messages) > self.max_entries * 4:
+            self._messages.popitem(last=False)
+
+    def evict_for_feedback(self, message_id: int) -> bool:
+        """
+        Удаляет запись, ответ из которой получил дизлайк.
+        Дизлайк на ответ, отданный из кеша, считается ложным попаданием.
+        """
+        binding = self._messages.pop(int(message_id), None)
+        if binding is None:
+            return False
+        entry_id, from_cache = binding
+        if from_cache:
+            self._stats["false_hits"] += 1
+        if self._remove(entry_id) is None:
+            return False
+        self._stats["evicted_feedback"] += 1
+        logger.info(f"[AnswerCache] Запись {entry_id} удалена по отрицательному отзыву")
+        return True
+
+    def invalidate(self,
+                   product_ids: Optional[Iterable[int]] = None,
+                   file_paths: Optional[Iterable[str]] = None) -> int:
+        """
+        Удаляет записи, в контексте которых были фрагменты указанных продуктов или файлов.
+        Без аргументов очищает весь кеш.
+        """
+        if product_ids is None and file_paths is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._matrix = None
+        else:
+            product_ids = {int(pid) for pid in product_ids or []}
+            file_paths = {str(path) for path in file_paths or []}
+            stale = [
+                entry_id for entry_id, entry in self._entries.items()
+                if entry.product_ids & product_ids or entry.file_paths & file_paths
+            ]
+            for entry_id in stale:
+                self._remove(entry_id)
+            removed = len(stale)
+        self._stats["evicted_reindex"] += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self._stats["lookups"]
+        hits = self._stats["hits"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "false_hit_rate": self._stats["false_hits"] / hits if hits else 0.0,
+            "recent_hits": list(self._recent_hits)
+        }
+
+
+# Глобальный экземпляр кеша ответов
+semantic_answer_cache = SemanticAnswerCache()
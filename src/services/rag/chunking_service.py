@@ -1,7 +1,7 @@
 import re
 import logging
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+from dataclasses import dataclass, field
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +17,17 @@ class DocumentChunk:
     chunk_index: int = 0
     metadata: Optional[Dict[str, Any]] = None
 
+@dataclass
+class ParentSection:
+    """
+    Родительский раздел для двухуровневой индексации:
+    текст раздела уходит в контекст LLM, дочерние фрагменты - в векторный поиск.
+    """
+    text: str
+    section_type: str
+    start_word: int  # глобальный номер первого слова раздела в документе
+    children: List[str] = field(default_factory=list)
+
 class ChunkingService:
     """
     Сервис для разбивки PDF документов на смысловые чанки.
@@ -103,45 +114,137 @@ class ChunkingService:
         """
         Разбивка текста по семантическим разделам.
         """
-        sections = []
-        
-        # Разбиваем текст на абзацы
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-        
+        return list(self.iter_sections([text]))
+    
+    def iter_sections(self,
+                      blocks: Iterable[str],
+                      max_section_chars: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковая разбивка по семантическим разделам: блоки текста (страницы, группы строк)
+        режутся на абзацы, раздел начинается с заголовка или нумерованного пункта.
+        max_section_chars - принудительно закрывать раздел, выросший больше лимита
+        (документы без заголовков не должны собираться в один раздел целиком).
+        """
         current_section = {
             'text': '',
             'type': 'content',
             'start_paragraph': 0
         }
         
-        for i, paragraph in enumerate(paragraphs):
-            # Определяем тип параграфа
-            section_type = self._classify_paragraph(paragraph)
-            
-            # Если нашли новый раздел и текущий раздел не пустой
-            if (section_type in ['title', 'numbered_section'] and 
-                current_section['text'] and 
-                len(current_section['text']) > self.min_chunk_size):
+        i = 0
+        for block in blocks:
+            for paragraph in block.split('\n\n'):
+                paragraph = paragraph.strip()
+                if not paragraph:
+                    continue
                 
-                sections.append(current_section)
-                current_section = {
-                    'text': paragraph,
-                    'type': section_type,
-                    'start_paragraph': i
-                }
-            else:
-                # Добавляем к текущему разделу
-                if current_section['text']:
-                    current_section['text'] += '\n\n' + paragraph
+                # Определяем тип параграфа
+                section_type = self._classify_paragraph(paragraph)
+                
+                # Если нашли новый раздел и текущий раздел не пустой
+                if (section_type in ['title', 'numbered_section'] and 
+                    current_section['text'] and 
+                    len(current_section['text']) > self.min_chunk_size):
+                    
+                    yield current_section
+                    current_section = {
+                        'text': paragraph,
+                        'type': section_type,
+                        'start_paragraph': i
+                    }
+                elif max_section_chars and len(current_section['text']) > max_section_chars:
+                    yield current_section
+                    current_section = {
+                        'text': paragraph,
+                        'type': current_section['type'],
+                        'start_paragraph': i
+                    }
                 else:
-                    current_section['text'] = paragraph
-                    current_section['type'] = section_type
+                    # Добавляем к текущему разделу
+                    if current_section['text']:
+                        current_section['text'] += '\n\n' + paragraph
+                    else:
+                        current_section['text'] = paragraph
+                        current_section['type'] = section_type
+                i += 1
         
         # Добавляем последний раздел
         if current_section['text']:
-            sections.append(current_section)
-        
-        return sections
+            yield current_section
+    
+    def iter_parent_sections(self,
+                             blocks: Iterable[str],
+                             child_words: int = 60) -> Iterator[ParentSection]:
+        """
+        Двухуровневая разбивка: разделы _semantic_chunking (не длиннее max_chunk_size символов)
+        и их дочерние фрагменты из целых предложений/строк (не длиннее child_words слов).
+        Слова не теряются и не дублируются: дочерние фрагменты покрывают раздел без перекрытий.
+        """
+        next_word = 0
+        for section in self.iter_sections(blocks, max_section_chars=self.max_chunk_size * 4):
+            for parent_text in self._split_parent_text(section['text']):
+                units = self._split_units(parent_text, child_words)
+                parent = ParentSection(
+                    text=parent_text,
+                    section_type=section['type'],
+                    start_word=next_word,
+                    children=self._group_units(units, child_words)
+                )
+                next_word += len(parent_text.split())
+                yield parent
+    
+    def _split_units(self, text: str, max_words: int) -> List[str]:
+        """
+        Минимальные единицы текста: строки, внутри строк - предложения (с сохранением знаков),
+        слишком длинные предложения режутся по словам.
+        """
+        units = []
+        for line in text.split('\n'):
+            for sentence in re.split(r'(?<=[.!?])\s+', line.strip()):
+                words = sentence.split()
+                for start in range(0, len(words), max_words):
+                    units.append(' '.join(words[start:start + max_words]))
+        return [unit for unit in units if unit]
+    
+    @staticmethod
+    def _group_units(units: List[str], max_words: int) -> List[str]:
+        """Склеивает соседние единицы в фрагменты не длиннее max_words слов."""
+        groups = []
+        current: List[str] = []
+        current_words = 0
+        for unit in units:
+            unit_words = len(unit.split())
+            if current and current_words + unit_words > max_words:
+                groups.append(' '.join(current))
+                current, current_words = [], 0
+            current.append(unit)
+            current_words += unit_words
+        if current:
+            groups.append(' '.join(current))
+        return groups
+    
+    def _split_parent_text(self, text: str) -> List[str]:
+        """
+        Делит раздел на родительские фрагменты не длиннее max_chunk_size символов
+        по границам строк (таблицы) и предложений.
+        """
+        if len(text) <= self.max_chunk_size:
+            return [text]
+        
+        parts = []
+        current = ""
+        for line in text.split('\n'):
+            pieces = [line] if len(line) <= self.max_chunk_size else self._split_units(line, self.max_chunk_size // 8)
+            separator = '\n'
+            for piece in pieces:
+                if current and len(current) + len(piece) + 1 > self.max_chunk_size:
+                    parts.append(current.strip())
+                    current = ""
+                current = f"{current}{separator}{piece}" if current else piece
+                separator = ' '
+        if current.strip():
+            parts.append(current.strip())
+        return parts
     
     def _classify_paragraph(self, paragraph: str) -> str:
         """Классифицирует тип параграфа."""
@@ -0,0 +1,204 @@
+import os
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.services.rag.token_counter import count_tokens
+
+logger = logging.getLogger(__name__)
+
+"""
+Сборка контекста LLM в пределах бюджета токенов.
+Результаты поиска идут по убыванию релевантности; перекрывающиеся фрагменты одного
+источника (по смещениям start_word/end_word) и повторы текста отбрасываются,
+контекст заполняется жадно, пока хватает бюджета.
+"""
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Меньше этого остатка бюджета документ не обрезается, а пропускается
+MIN_TRUNCATED_TOKENS = 150
+# Непокрытый хвост перекрывающегося фрагмента короче этого числа слов не добавляется
+MIN_UNCOVERED_WORDS = 15
+
+
+@dataclass
+class BuiltContext:
+    """Собранный контекст и статистика отбора."""
+    text: str = ""
+    tokens: int = 0
+    budget: int = 0
+    documents: int = 0
+    candidates: int = 0
+    duplicates: int = 0
+    truncated: int = 0
+    over_budget: int = 0
+    sources: List[Dict[str, Any]] = field(default_factory=list)
+
+    def describe(self) -> str:
+        return (
+            f"{self.tokens}/{self.budget} токенов, документов {self.documents} из {self.candidates} "
+            f"(повторов {self.duplicates}, не влезло {self.over_budget}, обрезано {self.truncated})"
+        )
+
+
+class ContextBuilder:
+    """
+    Жадная сборка контекста по бюджету токенов с удалением перекрытий.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    @staticmethod
+    def _header(index: int, result: Dict[str, Any]) -> str:
+        # Общий для нескольких продуктов фрагмент подписывается всеми их названиями
+        product_name = ", ".join(result.get("product_names") or []) or result.get("product_name", f"Документ {index}")
+        return f"=== ДОКУМЕНТ {index}: {product_name} ===\n"
+
+    @staticmethod
+    def _relevance(result: Dict[str, Any]) -> float:
+        """Оценка реранкера, если он включен, иначе косинусное сходство."""
+        score = result.get("rerank_score")
+        return score if score is not None else (result.get("similarity", 0) or 0)
+
+    @staticmethod
+    def _source_key(result: Dict[str, Any]) -> Tuple[Any, Any]:
+        return result.get("product_id"), result.get("file_path") or "meta"
+
+    @staticmethod
+    def _offsets(result: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        metadata = result.get("metadata") or {}
+        start = result.get("start_word", metadata.get("start_word"))
+        end = result.get("end_word", metadata.get("end_word"))
+        if start is None or end is None or end <= start:
+            return None
+        return int(start), int(end)
+
+    @staticmethod
+    def _uncovered(start: int, end: int, covered: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Части диапазона [start, end), не покрытые уже выбранными диапазонами."""
+        segments = [(start, end)]
+        for covered_start, covered_end in covered:
+            next_segments = []
+            for segment_start, segment_end in segments:
+                if covered_end <= segment_start or covered_start >= segment_end:
+                    next_segments.append((segment_start, segment_end))
+                    continue
+                if segment_start < covered_start:
+                    next_segments.append((segment_start, covered_start))
+                if covered_end < segment_end:
+                    next_segments.append((covered_end, segment_end))
+            segments = next_segments
+        return segments
+
+    def _deduplicated_text(self,
+                           result: Dict[str, Any],
+                           text: str,
+                           covered: Dict[Tuple[Any, Any], List[Tuple[int, int]]]) -> Optional[str]:
+        """
+        Текст результата без частей, уже вошедших в контекст из того же источника.
+        None - результат целиком повторяет выбранные фрагменты.
+        """
+        offsets = self._offsets(result)
+        if offsets is None:
+            return text
+
+        start, end = offsets
+        key = self._source_key(result)
+        segments = self._uncovered(start, end, covered.get(key, []))
+        if not segments:
+            return None
+        if segments == [(start, end)]:
+            covered.setdefault(key, []).append((start, end))
+            return text
+
+        words = text.split()
+        if len(words) != end - start:
+            # Смещения не соответствуют тексту (старая схема) - берем фрагмент целиком
+            covered.setdefault(key, []).append((start, end))
+            return text
+
+        parts = [
+            " ".join(words[segment_start - start:segment_end - start])
+            for segment_start, segment_end in segments
+            if segment_end - segment_start >= MIN_UNCOVERED_WORDS
+        ]
+        if not parts:
+            return None
+        covered.setdefault(key, []).extend(segments)
+        return " ... ".join(parts)
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        """Обрезает текст по словам так, чтобы он уложился в max_tokens."""
+        words = text.split()
+        tokens = count_tokens(text)
+        if tokens <= max_tokens or not words:
+            return text
+        keep = max(1, int(len(words) * max_tokens / tokens))
+        while keep > 1 and count_tokens(" ".join(words[:keep])) > max_tokens:
+            keep = int(keep * 0.9)
+        return " ".join(words[:keep]) + " ..."
+
+    def build(self, search_results: List[Dict[str, Any]], reserved_tokens: int = 0) -> BuiltContext:
+        """
+        Собирает контекст из результатов поиска.
+
+        Args:
+            search_results: Результаты поиска (text, similarity, product_name, смещения)
+            reserved_tokens: Токены, уже занятые другими частями контекста (табличные данные)
+        """
+        budget = max(0, self.token_budget - reserved_tokens)
+        built = BuiltContext(budget=budget, candidates=len(search_results))
+        ordered = sorted(search_results, key=self._relevance, reverse=True)
+
+        covered: Dict[Tuple[Any, Any], List[Tuple[int, int]]] = {}
+        seen_hashes = set()
+        parts: List[str] = []
+
+        for result in ordered:
+            text = (result.get("text", "") or result.get("text_preview", "")).strip()
+            if not text:
+                continue
+
+            digest = hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=8).digest()
+            if digest in seen_hashes:
+                built.duplicates += 1
+                continue
+
+            covered_snapshot = {key: list(value) for key, value in covered.items()}
+            text = self._deduplicated_text(result, text, covered)
+            if text is None:
+                built.duplicates += 1
+                continue
+
+            header = self._header(built.documents + 1, result)
+            piece_tokens = count_tokens(header) + count_tokens(text)
+            remaining = budget - built.tokens
+            if piece_tokens > remaining:
+                if remaining - count_tokens(header) < MIN_TRUNCATED_TOKENS:
+                    covered = covered_snapshot
+                    built.over_budget += 1
+                    continue
+                text = self._truncate(text, remaining - count_tokens(header))
+                piece_tokens = count_tokens(header) + count_tokens(text)
+                built.truncated += 1
+
+            seen_hashes.add(digest)
+            parts.append(f"{header}{text}\n")
+            built.tokens += piece_tokens
+            built.documents += 1
+            built.sources.append({
+                "product_id": result.get("product_id"),
+                "file_path": result.get("file_path"),
+                "similarity": result.get("similarity", 0)
+            })
+            logger.info(
+                f"Документ #{built.documents}: '{result.get('product_name')}' "
+                f"(ID: {result.get('product_id')}, сходство: {result.get('similarity', 0):.4f}, {piece_tokens} ток.)"
+            )
+
+        built.text = "\n".join(parts)
+        return built
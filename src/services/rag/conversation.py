@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from src.services.rag.query_processor import QueryProcessor
+from src.services.rag.token_counter import count_tokens
+
+logger = logging.getLogger(__name__)
+
+"""
+Короткая память диалога с ИИ-помощником: для каждого пользователя последние вопросы,
+сжатые ответы и найденные фрагменты (RAG_MEMORY_TTL секунд).
+Уточняющий вопрос ("а для Т-90?", "какая у него упаковка?") переписывается в
+самостоятельный запрос для поиска, переиспользует фрагменты предыдущего ответа
+(или дополняет их небольшим поиском), а LLM получает сжатую историю диалога.
+"""
+
+MEMORY_ENABLED = os.getenv("RAG_MEMORY", "1") == "1"
+MEMORY_TTL = float(os.getenv("RAG_MEMORY_TTL", "600"))
+MEMORY_TURNS = int(os.getenv("RAG_MEMORY_TURNS", "2"))
+MEMORY_USERS = int(os.getenv("RAG_MEMORY_USERS", "1000"))
+# Вопрос длиннее этого числа слов считается самостоятельным
+FOLLOW_UP_MAX_WORDS = int(os.getenv("RAG_MEMORY_FOLLOWUP_WORDS", "8"))
+# Токенов на один сжатый ответ в истории для LLM
+HISTORY_ANSWER_TOKENS = int(os.getenv("RAG_MEMORY_ANSWER_TOKENS", "150"))
+# Сколько новых фрагментов дозапрашивать к фрагментам прошлого ответа (вопрос про тот же продукт)
+EXTEND_K = int(os.getenv("RAG_MEMORY_EXTEND_K", "3"))
+# Сколько фрагментов прошлого ответа оставлять, если вопрос про другой продукт
+KEEP_CHUNKS = int(os.getenv("RAG_MEMORY_KEEP_CHUNKS", "2"))
+
+# Начало уточняющего вопроса: "а для...", "и какая...", "подробнее"
+_FOLLOW_UP_START = re.compile(
+    r"^\s*(а|и|но|тогда|еще|ещё|также|подробнее|поподробнее|расскажи подробнее|а если)\b",
+    re.IGNORECASE
+)
+# Личные местоимения, отсылающие к продукту прошлого вопроса ("какая у него упаковка?").
+# Указательные ("это", "эти", "такой") и "их" слишком частые в самостоятельных вопросах
+_ANAPHORA = re.compile(
+    r"\b(он|она|оно|они|его|ее|её|него|нее|неё|них|нему|ней|ним)\b",
+    re.IGNORECASE
+)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+@dataclass
+class ConversationTurn:
+    """Один вопрос-ответ: вопрос в самостоятельной форме, ответ и найденные фрагменты."""
+    query: str
+    answer: str
+    product_names: List[str]
+    search_results: List[Dict[str, Any]]
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def chunk_ids(self) -> List[Any]:
+        return [r.get("chunk_id") for r in self.search_results]
+
+
+@dataclass
+class FollowUp:
+    """Уточняющий вопрос: запрос для поиска и что делать с фрагментами прошлого ответа."""
+    query: str
+    retrieval_query: str
+    previous: ConversationTurn
+    history: List[ConversationTurn]
+    # True - вопрос про те же продукты: фрагменты прошлого ответа идут первыми и дополняются
+    reuse_results: bool
+    new_products: List[str]
+
+    def history_messages(self, max_answer_tokens: int = HISTORY_ANSWER_TOKENS) -> List[Dict[str, str]]:
+        """История диалога для LLM: вопросы и сжатые ответы, от старых к новым."""
+        messages = []
+        for turn in self.history:
+            messages.append({"role": "user", "content": turn.query})
+            messages.append({"role": "assistant", "content": compress_answer(turn.answer, max_answer_tokens)})
+        return messages
+
+
+def compress_answer(answer: str, max_tokens: int = HISTORY_ANSWER_TOKENS) -> str:
+    """Первые предложения ответа в пределах max_tokens (главное в ответе идет в начале)."""
+    text = " ".join(answer.split())
+    if count_tokens(text) <= max_tokens:
+        return text
+    compressed = ""
+    for sentence in _SENTENCE_END.split(text):
+        candidate = f"{compressed} {sentence}".strip()
+        if compressed and count_tokens(candidate) > max_tokens:
+            break
+        compressed = candidate
+    if count_tokens(compressed) > max_tokens:
+        # Одно длинное предложение - обрезаем по словам
+        words = compressed.split()
+        while words and count_tokens(" ".join(words)) > max_tokens:
+            words = words[:int(len(words) * 0.8)]
+        compressed = " ".join(words)
+    return compressed + " …"
+
+
+def merge_results(first: List[Dict[str, Any]], second: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """Объединяет фрагменты без повторов (по разделу или чанку), сохраняя порядок."""
+    merged, seen = [], set()
+    for result in list(first) + list(second):
+        key = result.get("parent_id") or result.get("chunk_id") or id(result)
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(result)
+        if len(merged) >= limit:
+            break
+    return merged
+
+
+class ConversationMemory:
+    """
+    Память диалогов по user_id с TTL. Хранится в процессе: после перезапуска бота
+    вопросы снова начинаются без контекста.
+    """
+
+    def __init__(self,
+                 enabled: bool = MEMORY_ENABLED,
+                 ttl: float = MEMORY_TTL,
+                 max_turns: int = MEMORY_TURNS,
+                 max_users: int = MEMORY_USERS):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_turns = max(1, max_turns)
+        self.max_users = max_users
+        self.query_processor = QueryProcessor()
+        self._turns: "OrderedDict[int, Deque[ConversationTurn]]" = OrderedDict()
+        self._stats = {"remembered": 0, "follow_ups": 0, "reused": 0, "extended": 0, "expired": 0}
+
+    def _get_turns(self, user_id: int) -> List[ConversationTurn]:
+        turns = self._turns.get(user_id)
+        if not turns:
+            return []
+        now = time.monotonic()
+        while turns and now - turns[0].created_at > self.ttl:
+            turns.popleft()
+        if not turns:
+            self._turns.pop(user_id, None)
+            self._stats["expired"] += 1
+            return []
+        return list(turns)
+
+    def looks_like_follow_up(self, query: str) -> bool:
+        """
+        Короткий вопрос, начинающийся с "а/и/подробнее...", или с местоимением ("его", "у нее")
+        без названия продукта - такой вопрос без прошлого не понять.
+        """
+        if len(query.split()) > FOLLOW_UP_MAX_WORDS:
+            return False
+        if _FOLLOW_UP_START.search(query):
+            return True
+        return bool(_ANAPHORA.search(query)) and not self.query_processor.extract_product_names(query)
+
+    def follow_up(self, user_id: Optional[int], query: str) -> Optional[FollowUp]:
+        """Контекст для уточняющего вопроса или None (вопрос самостоятельный или памяти нет)."""
+        if not self.enabled or user_id is None:
+            return None
+        turns = self._get_turns(user_id)
+        if not turns or not self.looks_like_follow_up(query):
+            return None
+
+        previous = turns[-1]
+        new_products = [
+            name for name in self.query_processor.extract_product_names(query)
+            if name not in previous.product_names
+        ]
+        if new_products:
+            # "а для Т-90?" - прошлый вопрос с заменой продукта плюс сам уточняющий вопрос
+            base = previous.query
+            if previous.product_names:
+                for name in previous.product_names:
+                    base = base.replace(name, ", ".join(new_products))
+            retrieval_query = f"{base} {query}"
+        else:
+            # "какая у него упаковка?" - добавляем продукты прошлого вопроса
+            retrieval_query = f"{query} {' '.join(previous.product_names)}".strip()
+            if not previous.product_names:
+                retrieval_query = f"{previous.query} {query}"
+
+        self._stats["follow_ups"] += 1
+        self._stats["extended" if new_products else "reused"] += 1
+        logger.info(f"[Memory] Уточняющий вопрос '{query}' -> '{retrieval_query}'")
+        return FollowUp(
+            query=query,
+            retrieval_query=retrieval_query,
+            previous=previous,
+            history=turns,
+            reuse_results=not new_products,
+            new_products=new_products
+        )
+
+    def remember(self, user_id: Optional[int], query: str, answer: str,
+                 search_results: List[Dict[str, Any]]) -> None:
+        """Запоминает вопрос (в самостоятельной форме), ответ и фрагменты."""
+        if not self.enabled or user_id is None or not answer or not search_results:
+            return
+        product_names = self.query_processor.extract_product_names(query)
+        if not product_names:
+            # Продукт не назван в вопросе - берем продукты лучшего фрагмента (общий - всех)
+            top = search_results[0]
+            product_names = [name for name in top.get("product_names") or [top.get("product_name")] if name]
+        turns = self._turns.get(user_id)
+        if turns is None:
+            turns = deque(maxlen=self.max_turns)
+            self._turns[user_id] = turns
+        turns.append(ConversationTurn(
+            query=query,
+            answer=answer,
+            product_names=product_names,
+            # Векторы фрагментов (для MMR) в памяти не нужны
+            search_results=[{k: v for k, v in r.items() if k != "embedding"} for r in search_results]
+        ))
+        self._turns.move_to_end(user_id)
+        while len(self._turns) > self.max_users:
+            self._turns.popitem(last=False)
+        self._stats["remembered"] += 1
+
+    def active(self, user_id: int) -> bool:
+        """Есть ли у пользователя неистекшая история (следующий текст может быть уточнением)."""
+        return self.enabled and bool(self._get_turns(user_id))
+
+    def clear(self, user_id: int) -> None:
+        self._turns.pop(user_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "enabled": self.enabled, "users": len(self._turns), "ttl": self.ttl}
+
+
+# Глобальная память диалогов
+conversation_memory = ConversationMemory()
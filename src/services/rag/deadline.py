@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+"""
+Сквозной бюджет времени на вопрос к ИИ-помощнику.
+Deadline создается при получении вопроса (ожидание в очереди тоже входит в бюджет)
+и передается через весь конвейер RAG: каждый этап выполняется через run() с тайм-аутом
+по остатку бюджета. Необязательные этапы (табличный индекс, реранкинг) при нехватке
+времени пропускаются, оставляя LLM не меньше RAG_LLM_MIN_BUDGET секунд. Если LLM не успевает,
+RagService отдает ответ из кеша для очень похожего вопроса или лучшие найденные фрагменты
+с названиями продуктов вместо ошибки.
+"""
+
+RAG_LATENCY_BUDGET = float(os.getenv("RAG_LATENCY_BUDGET", "30"))
+# Меньше этого остатка LLM не вызывается: ответ все равно не успеет
+RAG_LLM_MIN_BUDGET = float(os.getenv("RAG_LLM_MIN_BUDGET", "4"))
+# Сколько фрагментов показывать в запасном ответе
+RAG_FALLBACK_PASSAGES = int(os.getenv("RAG_FALLBACK_PASSAGES", "3"))
+
+T = TypeVar("T")
+
+# Итоги этапа: ok - уложился, timeout - прерван по бюджету, skipped - не запускался
+STAGE_OK = "ok"
+STAGE_TIMEOUT = "timeout"
+STAGE_SKIPPED = "skipped"
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Этап не уложился в остаток бюджета (или не был запущен)."""
+
+    def __init__(self, stage: str, outcome: str):
+        super().__init__(f"{stage}: {outcome}")
+        self.stage = stage
+        self.outcome = outcome
+
+
+class Deadline:
+    """Бюджет времени одного вопроса и итоги этапов."""
+
+    def __init__(self, budget: float = RAG_LATENCY_BUDGET):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+        self.stages: Dict[str, str] = {}
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, reserve: float = 0.0, cap: Optional[float] = None) -> float:
+        """Тайм-аут этапа: остаток бюджета минус reserve (время для следующих этапов), не больше cap."""
+        available = self.remaining() - reserve
+        return max(0.0, min(available, cap) if cap is not None else available)
+
+    def record(self, stage: str, outcome: str) -> None:
+        # Повторный этап (второй поиск в таблицах) не затирает прерывание
+        if self.stages.get(stage) in (STAGE_TIMEOUT, STAGE_SKIPPED) and outcome == STAGE_OK:
+            return
+        self.stages[stage] = outcome
+
+    async def run(self, stage: str, awaitable: Awaitable[T], reserve: float = 0.0,
+                  cap: Optional[float] = None) -> T:
+        """Выполняет этап с тайм-аутом по бюджету; при нехватке времени - DeadlineExceeded."""
+        timeout = self.timeout(reserve, cap)
+        if timeout <= 0:
+            # Корутину нужно закрыть, иначе будет предупреждение "never awaited"
+            close = getattr(awaitable, "close", None)
+            if close:
+                close()
+            self.record(stage, STAGE_SKIPPED)
+            raise DeadlineExceeded(stage, STAGE_SKIPPED)
+        try:
+            result = await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.record(stage, STAGE_TIMEOUT)
+            raise DeadlineExceeded(stage, STAGE_TIMEOUT)
+        self.record(stage, STAGE_OK)
+        return result
+
+    @property
+    def exceeded_stages(self) -> List[str]:
+        return [stage for stage, outcome in self.stages.items() if outcome != STAGE_OK]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "budget": self.budget,
+            "elapsed": round(self.elapsed(), 3),
+            "remaining": round(self.remaining(), 3),
+            "stages": dict(self.stages),
+            "exceeded": self.exceeded_stages
+        }
+
+
+def fallback_passages_answer(search_results: List[Dict[str, Any]], table_context: str = "",
+                             limit: int = RAG_FALLBACK_PASSAGES) -> str:
+    """Запасной ответ без LLM: лучшие найденные фрагменты с названиями продуктов."""
+    lines = ["Не успел подготовить полный ответ. Вот самое подходящее из документации:"]
+    for index, result in enumerate(search_results[:limit], start=1):
+        name = ", ".join(result.get("product_names") or []) or result.get("product_name") \
+            or f"Продукт {result.get('product_id')}"
+        text = " ".join((result.get("text_preview") or result.get("text") or "").split())
+        lines.append(f"\n{index}. {name}\n{text}")
+    if table_context and not search_results:
+        lines.append("\n" + table_context)
+    lines.append("\nПопробуйте задать вопрос еще раз чуть позже, чтобы получить развернутый ответ.")
+    return "\n".join(lines)
+
+
+class DeadlineStats:
+    """Счетчики итогов бюджета по всем вопросам (для статистики администратора)."""
+
+    def __init__(self):
+        self.requests = 0
+        self.within_budget = 0
+        self.fallbacks: Dict[str, int] = {}
+        self.stage_timeouts: Dict[str, int] = {}
+
+    def add(self, deadline: Deadline, answer_source: Optional[str]) -> None:
+        self.requests += 1
+        if not deadline.exceeded_stages:
+            self.within_budget += 1
+        for stage in deadline.exceeded_stages:
+            self.stage_timeouts[stage] = self.stage_timeouts.get(stage, 0) + 1
+        if answer_source and answer_source.startswith("deadline"):
+            self.fallbacks[answer_source] = self.fallbacks.get(answer_source, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "budget": RAG_LATENCY_BUDGET,
+            "requests": self.requests,
+            "within_budget": self.within_budget,
+            "fallbacks": dict(self.fallbacks),
+            "stage_timeouts": dict(self.stage_timeouts)
+        }
+
+
+# Глобальные счетчики бюджета времени
+deadline_stats = DeadlineStats()
@@ -0,0 +1,212 @@
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""
+Маршрутизация вопросов до поиска.
+Коммерческие вопросы (цена, наличие, доставка) и вопросы не по теме не требуют
+поиска по документам и вызова LLM: на них сразу отдается стандартный ответ.
+Сначала срабатывают правила по ключевым словам, затем - сравнение вектора
+запроса (из кеша UnifiedEmbeddingService) с центроидами примеров каждого намерения.
+"""
+
+INTENT_ROUTER_ENABLED = os.getenv("RAG_INTENT_ROUTER", "1") == "1"
+INTENT_EMBEDDINGS_ENABLED = os.getenv("RAG_INTENT_EMBEDDINGS", "1") == "1"
+# Минимальное сходство с центроидом и отрыв от центроида вопросов о продукции
+INTENT_MIN_SCORE = float(os.getenv("RAG_INTENT_MIN_SCORE", "0.55"))
+INTENT_MARGIN = float(os.getenv("RAG_INTENT_MARGIN", "0.05"))
+
+PRODUCT = "product"
+COMMERCIAL = "commercial"
+OUT_OF_SCOPE = "out_of_scope"
+
+COMMERCIAL_ANSWER = (
+    "Для получения актуальной информации о ценах, остатках продукции и условиях доставки, "
+    "пожалуйста, посетите сайт Брит: https://brit.gazprom-neft.ru/where-buy/#panel2"
+)
+OUT_OF_SCOPE_ANSWER = (
+    "Я отвечаю на вопросы о битумной продукции компании «Газпромнефть - Битумные материалы»: "
+    "характеристики, применение, упаковка, сравнение продуктов. Задайте, пожалуйста, вопрос о продукции."
+)
+CANNED_ANSWERS = {
+    COMMERCIAL: COMMERCIAL_ANSWER,
+    OUT_OF_SCOPE: OUT_OF_SCOPE_ANSWER
+}
+
+# Коммерческий вопрос - только фраза о цене, наличии, покупке или доставке целиком
+# ("сколько стоит", "где купить", "цена на"): отдельные слова "наличие", "купить", "доставка"
+# встречаются и в вопросах о продукции ("при наличии трещин", "какой праймер купить под...")
+COMMERCIAL_PATTERN = re.compile(
+    r"\b(сколько\s+(будет\s+)?сто(ит|ят|ить)|(как(ая|ие|ова|овы)|узнать|уточнить)\s+(цен\w*|стоимост\w*)|"
+    r"цен[аыуе]?\s+(на|за)\b|по\s+как(ой|им)\s+цен\w*|прайс\w*|скидк\w*|"
+    r"(есть\s+ли|что\s+есть|что)\s+в\s+наличии|в\s+наличии\s+ли|(есть|наличи\w*)\s+на\s+склад\w*|"
+    r"остатк(и|ах|ов)\s+(на\s+склад\w*|продукц\w*)|"
+    r"(где|как)\s+(можно\s+)?(купить|приобрести|заказать)|(оформить|сделать)\s+заказ|"
+    r"(срок\w*|услови\w*|стоимост\w*)\s+(доставк\w*|оплат\w*)|(есть\s+ли|как\s+оформить)\s+доставк\w*|"
+    r"достав(ите|ляете)(\s+ли)?(\s+вы)?\s+(в|до)\b|способ\w*\s+оплат\w*|дилер\w*)",
+    re.IGNORECASE
+)
+# Вопрос с техническими терминами или названием вида продукции идет в RAG (или к центроидам),
+# даже если в нем есть коммерческая фраза
+TECHNICAL_PATTERN = re.compile(
+    r"(температур|характеристик|расход|упаковк|тар[аеуы]\b|фасовк|применени|примен[яи]|нанесени|нанос|"
+    r"хранени|хран[ия]|использ|гост|сто\b|паспорт|состав|свойств|отлич|сравн|гибкост|прочност|плотност|"
+    r"вязкост|трещин|мороз|гидроизол|наплавл|монтаж|укладк|"
+    r"мастик|праймер|кровл|герметик|эмульси|битум|лент[аыу]\b|\b[a-zа-яё]{1,4}-?\d{2,3}\b)",
+    re.IGNORECASE
+)
+SMALL_TALK_PATTERN = re.compile(
+    r"^\W*(привет\w*|здравствуй\w*|добрый\s+(день|вечер)|доброе\s+утро|спасибо\w*|благодарю|"
+    r"пока|до\s+свидания|ок|хорошо|понятно|кто\s+ты|как\s+дела)\W*$",
+    re.IGNORECASE
+)
+
+# Примеры для центроидов намерений
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    COMMERCIAL: [
+        "Сколько стоит мастика?",
+        "Какая цена на праймер за ведро?",
+        "Есть ли в наличии герметик?",
+        "Как купить вашу продукцию?",
+        "Где можно приобрести битумную мастику?",
+        "Сколько дней доставка до Москвы?",
+        "Какие условия оплаты и скидки для оптовых покупателей?",
+        "Какие остатки продукции на складе?",
+        "Можно оформить заказ с доставкой?",
+    ],
+    OUT_OF_SCOPE: [
+        "Какая сегодня погода?",
+        "Расскажи анекдот",
+        "Кто выиграл чемпионат мира по футболу?",
+        "Напиши программу на Python",
+        "Как приготовить борщ?",
+        "Переведи текст на английский",
+        "Привет, как дела?",
+    ],
+    PRODUCT: [
+        "Какая температура размягчения у мастики?",
+        "В какой таре поставляется праймер?",
+        "Чем отличается Т-65 от Т-75?",
+        "Какой расход мастики на квадратный метр?",
+        "Можно ли наносить при отрицательной температуре?",
+        "Для чего применяется герметик?",
+        "Какие характеристики у битумной эмульсии?",
+        "Какой срок хранения у праймера?",
+        "Подходит ли мастика для гидроизоляции фундамента?",
+    ],
+}
+
+
+@dataclass
+class IntentDecision:
+    """Результат маршрутизации: намерение, чем оно определено и оценка."""
+    intent: str = PRODUCT
+    source: str = "default"
+    score: float = 0.0
+
+    @property
+    def short_circuit(self) -> bool:
+        return self.intent in CANNED_ANSWERS
+
+    @property
+    def answer(self) -> Optional[str]:
+        return CANNED_ANSWERS.get(self.intent)
+
+
+class IntentRouter:
+    """
+    Быстрый классификатор намерений перед RagService.search_and_answer.
+    """
+
+    def __init__(self,
+                 embedding_service=None,
+                 enabled: bool = INTENT_ROUTER_ENABLED,
+                 use_embeddings: bool = INTENT_EMBEDDINGS_ENABLED,
+                 min_score: float = INTENT_MIN_SCORE,
+                 margin: float = INTENT_MARGIN):
+        self.embedding_service = embedding_service
+        self.enabled = enabled
+        self.use_embeddings = use_embeddings and embedding_service is not None
+        self.min_score = min_score
+        self.margin = margin
+        self._centroids: Optional[Dict[str, np.ndarray]] = None
+
+    def classify_rules(self, query: str) -> Optional[IntentDecision]:
+        """Правила по ключевым словам; None - правила не сработали."""
+        text = " ".join(query.split())
+        if SMALL_TALK_PATTERN.match(text):
+            return IntentDecision(OUT_OF_SCOPE, "rule", 1.0)
+        if COMMERCIAL_PATTERN.search(text) and not TECHNICAL_PATTERN.search(text):
+            return IntentDecision(COMMERCIAL, "rule", 1.0)
+        return None
+
+    def prepare(self) -> None:
+        """
+        Считает центроиды заранее (блокирующий вызов - из потока при старте),
+        чтобы первый вопрос не ждал кодирования примеров.
+        """
+        if self.enabled and self.use_embeddings:
+            self._get_centroids()
+
+    def _get_centroids(self) -> Dict[str, np.ndarray]:
+        if self._centroids is None:
+            centroids = {}
+            for intent, examples in INTENT_EXAMPLES.items():
+                vectors = np.asarray(self.embedding_service.embed_queries(examples), dtype=np.float32)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                centroid = vectors.mean(axis=0)
+                centroids[intent] = centroid / max(np.linalg.norm(centroid), 1e-12)
+            self._centroids = centroids
+        return self._centroids
+
+    def classify_vector(self, query_vector) -> IntentDecision:
+        """Ближайший центроид намерения по уже посчитанному вектору запроса."""
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / max(np.linalg.norm(vector), 1e-12)
+        scores = {intent: float(centroid @ vector) for intent, centroid in self._get_centroids().items()}
+        best = max(scores, key=scores.get)
+        if (best != PRODUCT
+                and scores[best] >= self.min_score
+                and scores[best] - scores.get(PRODUCT, 0.0) >= self.margin):
+            return IntentDecision(best, "centroid", scores[best])
+        return IntentDecision(PRODUCT, "centroid", scores.get(PRODUCT, 0.0))
+
+    def classify_embedding(self, query: str) -> IntentDecision:
+        """Ближайший центроид намерения по вектору запроса."""
+        return self.classify_vector(self.embedding_service.embed_query(query))
+
+    def classify_fast(self, query: str) -> Optional[IntentDecision]:
+        """
+        Часть classify без вектора запроса: правила (и отключенный маршрутизатор).
+        None - решение за центроидами, нужен вектор запроса.
+        """
+        if not self.enabled or not query or not query.strip():
+            return IntentDecision()
+        decision = self.classify_rules(query)
+        if decision:
+            return decision
+        if not self.use_embeddings:
+            return IntentDecision()
+        return None
+
+    def classify(self, query: str, query_vector=None) -> IntentDecision:
+        """
+        Определяет намерение вопроса; при ошибке - вопрос о продукции (обычный RAG).
+        query_vector - вектор запроса, если он уже посчитан (этап embed RagService).
+        """
+        decision = self.classify_fast(query)
+        if decision is not None:
+            return decision
+        try:
+            if query_vector is not None:
+                return self.classify_vector(query_vector)
+            return self.classify_embedding(query)
+        except Exception as e:
+            logger.error(f"Ошибка классификации намерения по вектору: {e}")
+            return IntentDecision()
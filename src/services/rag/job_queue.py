@@ -0,0 +1,320 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from src.services.rag.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+"""
+Очередь вопросов к ИИ-помощнику с ограниченным пулом обработчиков.
+Обработчик Telegram ставит вопрос в очередь и ждет результата, а конвейер RAG
+выполняют RAG_WORKERS фоновых задач, поэтому всплеск тяжелых вопросов не занимает
+цикл событий и соединения БД сверх этого числа.
+- у пользователя одновременно не больше RAG_USER_MAX_JOBS вопросов;
+- короткие вопросы (до RAG_SHORT_QUERY_WORDS слов) берутся первыми, но длинный вопрос,
+  прождавший RAG_QUEUE_AGING секунд, догоняет их по приоритету;
+- вопрос, не начатый за RAG_QUEUE_TIMEOUT секунд или до конца своего бюджета времени
+  (Deadline), снимается с очереди, выполнение ограничено RAG_JOB_TIMEOUT секундами;
+- on_position сообщает ожидающему его место в очереди.
+"""
+
+# По умолчанию столько же, сколько параллельных запросов к LLM: больше обработчиков только ждут пул клиентов
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", os.getenv("RAG_LLM_MAX_CONCURRENCY", "8")))
+RAG_QUEUE_MAX = int(os.getenv("RAG_QUEUE_MAX", "100"))
+RAG_USER_MAX_JOBS = int(os.getenv("RAG_USER_MAX_JOBS", "1"))
+RAG_SHORT_QUERY_WORDS = int(os.getenv("RAG_SHORT_QUERY_WORDS", "8"))
+RAG_QUEUE_AGING = float(os.getenv("RAG_QUEUE_AGING", "10"))
+RAG_QUEUE_TIMEOUT = float(os.getenv("RAG_QUEUE_TIMEOUT", "120"))
+RAG_JOB_TIMEOUT = float(os.getenv("RAG_JOB_TIMEOUT", "90"))
+
+PRIORITY_SHORT = 0
+PRIORITY_LONG = 1
+
+
+class RagJobRejected(Exception):
+    """
+    Вопрос не выполнен очередью. reason:
+    busy - у пользователя уже есть вопрос в работе, full - очередь заполнена,
+    queue_timeout - вопрос не дождался обработчика, deadline - бюджет времени вопроса
+    истек в очереди, timeout - превышено время выполнения.
+    """
+
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+def query_priority(query: str) -> int:
+    """Короткие вопросы обычно проще (название продукта, одна характеристика) - их берем раньше."""
+    return PRIORITY_SHORT if len(query.split()) <= RAG_SHORT_QUERY_WORDS else PRIORITY_LONG
+
+
+@dataclass(eq=False)
+class RagJob:
+    """Вопрос в очереди."""
+    seq: int
+    user_id: int
+    priority: int
+    factory: Callable[[], Awaitable[Any]]
+    future: "asyncio.Future[Any]"
+    on_position: Optional[Callable[[int], Awaitable[None]]] = None
+    deadline: Optional[Deadline] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    last_position: Optional[int] = None
+
+    def effective_priority(self, now: float) -> int:
+        # Долго ждущий длинный вопрос не должен бесконечно уступать коротким
+        if RAG_QUEUE_AGING > 0 and now - self.enqueued_at >= RAG_QUEUE_AGING:
+            return PRIORITY_SHORT
+        return self.priority
+
+    def sort_key(self, now: float):
+        return (self.effective_priority(now), self.seq)
+
+
+class RagJobQueue:
+    """
+    Очередь вопросов с пулом из workers обработчиков.
+    Обработчики запускаются при первом вопросе в текущем цикле событий.
+    """
+
+    def __init__(self,
+                 workers: int = RAG_WORKERS,
+                 max_queue: int = RAG_QUEUE_MAX,
+                 user_max_jobs: int = RAG_USER_MAX_JOBS,
+                 queue_timeout: float = RAG_QUEUE_TIMEOUT,
+                 job_timeout: float = RAG_JOB_TIMEOUT):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.user_max_jobs = user_max_jobs
+        self.queue_timeout = queue_timeout
+        self.job_timeout = job_timeout
+        self._pending: List[RagJob] = []
+        self._running: Dict[int, RagJob] = {}
+        self._user_jobs: Dict[int, int] = {}
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._waits: Deque[float] = deque(maxlen=500)
+        self._runs: Deque[float] = deque(maxlen=500)
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "timed_out": 0,
+            "queue_timeouts": 0, "deadline_expired": 0, "rejected_busy": 0, "rejected_full": 0, "max_depth": 0
+        }
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def user_busy(self, user_id: int) -> bool:
+        """У пользователя уже максимум вопросов в очереди или в работе."""
+        return self.user_max_jobs > 0 and self._user_jobs.get(user_id, 0) >= self.user_max_jobs
+
+    def _ensure_workers(self) -> None:
+        loop = asyncio.get_running_loop()
+        alive = [task for task in self._tasks if not task.done()]
+        if self._wakeup is None or not alive or alive[0].get_loop() is not loop:
+            self._wakeup = asyncio.Condition()
+            alive = []
+        self._tasks = alive
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker(len(self._tasks) + 1)))
+
+    async def submit(self,
+                     user_id: int,
+                     query: str,
+                     factory: Callable[[], Awaitable[Any]],
+                     on_position: Optional[Callable[[int], Awaitable[None]]] = None,
+                     deadline: Optional[Deadline] = None) -> Any:
+        """
+        Ставит вопрос в очередь и ждет результат factory().
+        on_position(n) вызывается, если вопрос ждет свободного обработчика, и при каждом изменении
+        места в очереди (1 - следующий); on_position(0) - вопрос взят в работу.
+        Отмена ожидающего снимает вопрос с очереди или отменяет его выполнение.
+        deadline - бюджет времени вопроса: ожидание в очереди не дольше его остатка,
+        вопрос с истекшим бюджетом не ставится в очередь и не берется в работу.
+        """
+        if self.user_busy(user_id):
+            self._stats["rejected_busy"] += 1
+            raise RagJobRejected("busy")
+        if self.max_queue and len(self._pending) >= self.max_queue:
+            self._stats["rejected_full"] += 1
+            raise RagJobRejected("full")
+        if deadline is not None and deadline.expired:
+            self._stats["deadline_expired"] += 1
+            raise RagJobRejected("deadline")
+
+        self._ensure_workers()
+        loop = asyncio.get_running_loop()
+        self._seq += 1
+        job = RagJob(
+            seq=self._seq,
+            user_id=user_id,
+            priority=query_priority(query),
+            factory=factory,
+            future=loop.create_future(),
+            on_position=on_position,
+            deadline=deadline
+        )
+        self._pending.append(job)
+        self._user_jobs[user_id] = self._user_jobs.get(user_id, 0) + 1
+        self._stats["submitted"] += 1
+        self._stats["max_depth"] = max(self._stats["max_depth"], len(self._pending))
+        self._notify_positions()
+
+        # Ожидание в очереди ограничено queue_timeout и остатком бюджета вопроса,
+        # выполнение - job_timeout (в обработчике)
+        wait_limit = self.queue_timeout or None
+        if deadline is not None:
+            wait_limit = min(wait_limit, deadline.remaining()) if wait_limit else deadline.remaining()
+        timer = loop.call_later(wait_limit, self._queue_timeout, job) if wait_limit is not None else None
+        try:
+            async with self._wakeup:
+                self._wakeup.notify()
+            return await job.future
+        except asyncio.CancelledError:
+            self._cancel(job)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._release_user(job)
+
+    def _release_user(self, job: RagJob) -> None:
+        count = self._user_jobs.get(job.user_id, 0) - 1
+        if count > 0:
+            self._user_jobs[job.user_id] = count
+        else:
+            self._user_jobs.pop(job.user_id, None)
+
+    def _queue_timeout(self, job: RagJob) -> None:
+        """Вопрос не дождался свободного обработчика (за queue_timeout или до конца бюджета)."""
+        if job not in self._pending:
+            return
+        self._pending.remove(job)
+        reason = "deadline" if job.deadline is not None and job.deadline.expired else "queue_timeout"
+        self._stats["deadline_expired" if reason == "deadline" else "queue_timeouts"] += 1
+        self._notify_positions()
+        if not job.future.done():
+            job.future.set_exception(RagJobRejected(reason))
+
+    def _cancel(self, job: RagJob) -> None:
+        """Снимает вопрос с очереди; уже выполняющийся отменяется."""
+        if job in self._pending:
+            self._pending.remove(job)
+            self._notify_positions()
+        if not job.future.done():
+            job.future.cancel()
+
+    def _take(self) -> RagJob:
+        now = time.monotonic()
+        job = min(self._pending, key=lambda item: item.sort_key(now))
+        self._pending.remove(job)
+        return job
+
+    def _notify_positions(self) -> None:
+        """
+        Сообщает ожидающим новое место в очереди (только если оно изменилось).
+        Вопросы, которые сразу заберут свободные обработчики, не уведомляются.
+        """
+        now = time.monotonic()
+        free = max(0, self.workers - len(self._running))
+        ordered = sorted(self._pending, key=lambda item: item.sort_key(now))
+        for position, job in enumerate(ordered, start=1):
+            if position <= free or job.on_position is None or job.last_position == position:
+                continue
+            job.last_position = position
+            asyncio.ensure_future(self._report_position(job, position))
+
+    async def _report_position(self, job: RagJob, position: int) -> None:
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            logger.debug(f"[RAG-QUEUE] Не удалось сообщить место в очереди: {e}")
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: bool(self._pending))
+                job = self._take()
+
+            if job.future.done():
+                self._notify_positions()
+                continue
+            # Бюджет мог истечь, пока вопрос ждал (таймер еще не сработал): не тратим на него обработчик
+            if job.deadline is not None and job.deadline.expired:
+                self._stats["deadline_expired"] += 1
+                job.future.set_exception(RagJobRejected("deadline"))
+                self._notify_positions()
+                continue
+            now = time.monotonic()
+            job.started_at = now
+            self._waits.append(now - job.enqueued_at)
+            self._running[job.seq] = job
+            self._notify_positions()
+            # Ожидавшему в очереди сообщаем, что вопрос взят в работу (место 0)
+            if job.on_position is not None and job.last_position is not None:
+                asyncio.ensure_future(self._report_position(job, 0))
+            task = asyncio.ensure_future(job.factory())
+            # Отмена ожидающего (job.future) отменяет и выполнение
+            job.future.add_done_callback(lambda future, task=task: task.cancel() if future.cancelled() else None)
+            try:
+                result = await asyncio.wait_for(task, self.job_timeout or None)
+            except asyncio.TimeoutError:
+                self._stats["timed_out"] += 1
+                logger.warning(f"[RAG-QUEUE] Вопрос #{job.seq} не выполнен за {self.job_timeout:.1f} с")
+                if not job.future.done():
+                    job.future.set_exception(RagJobRejected("timeout"))
+            except asyncio.CancelledError:
+                # Ожидающий ушел - выполнение отменено, обработчик берет следующий вопрос
+                if not job.future.cancelled():
+                    # Остановка самого обработчика
+                    job.future.cancel()
+                    raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self._stats["completed"] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self._running.pop(job.seq, None)
+                self._runs.append(time.monotonic() - now)
+
+    def get_stats(self) -> Dict[str, Any]:
+        def percentile(values: Deque[float], q: float) -> float:
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+        return {
+            **self._stats,
+            "workers": self.workers,
+            "depth": len(self._pending),
+            "running": len(self._running),
+            "wait_p50": percentile(self._waits, 0.5),
+            "wait_p90": percentile(self._waits, 0.9),
+            "run_p50": percentile(self._runs, 0.5),
+            "run_p90": percentile(self._runs, 0.9)
+        }
+
+    async def close(self) -> None:
+        """Останавливает обработчики; ожидающие вопросы отменяются (при остановке бота)."""
+        for job in list(self._pending):
+            self._cancel(job)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+
+# Глобальная очередь вопросов к ИИ-помощнику
+rag_job_queue = RagJobQueue()
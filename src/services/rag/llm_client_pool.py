@@ -0,0 +1,253 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from openai import (
+    AsyncOpenAI,
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError
+)
+
+from src.services.rag.provider_router import ProviderConfig, LLM_REQUEST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+"""
+Общие HTTP-клиенты LLM на весь процесс: один AsyncOpenAI на провайдера, поэтому
+keep-alive соединения его HTTP-пула переиспользуются всеми запросами. Перед запросом клиент ждет свободный слот (семафор
+RAG_LLM_MAX_CONCURRENCY) и токен из ведра (RAG_LLM_RPM запросов в минуту с запасом
+RAG_LLM_BURST). Ответ 429 приостанавливает очередь провайдера на Retry-After,
+ошибки 429/5xx/соединения повторяются с задержкой и случайным разбросом.
+Настройки можно переопределить для провайдера: <NAME>_MAX_CONCURRENCY, <NAME>_RPM, <NAME>_BURST.
+"""
+
+LLM_MAX_CONCURRENCY = int(os.getenv("RAG_LLM_MAX_CONCURRENCY", "8"))
+# 0 - без ограничения частоты
+LLM_RPM = float(os.getenv("RAG_LLM_RPM", "300"))
+LLM_BURST = int(os.getenv("RAG_LLM_BURST", "10"))
+LLM_MAX_RETRIES = int(os.getenv("RAG_LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("RAG_LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("RAG_LLM_RETRY_MAX_DELAY", "20"))
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Задержка из заголовков retry-after-ms / retry-after (секунды или HTTP-дата)."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов: rate_per_minute в среднем, до burst подряд.
+    pause() останавливает выдачу токенов всем ожидающим (после ответа 429).
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        if self.rate <= 0 and self.paused_until <= time.monotonic():
+            return
+        # Под блокировкой: токены выдаются по очереди, в порядке ожидания
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+class PooledLLMClient:
+    """
+    Клиент одного провайдера: keep-alive соединения, очередь с ограничением
+    параллельности и частоты, повторы с учетом Retry-After.
+    """
+
+    def __init__(self,
+                 provider: ProviderConfig,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 rate_per_minute: float = LLM_RPM,
+                 burst: int = LLM_BURST,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.client = AsyncOpenAI(
+            api_key=provider.api_key,
+            base_url=provider.base_url,
+            timeout=LLM_REQUEST_TIMEOUT,
+            # Повторы делает chat(): общая очередь должна знать о 429
+            max_retries=0
+        )
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self._waits: Deque[float] = deque(maxlen=200)
+        self._stats = {"requests": 0, "retries": 0, "rate_limited": 0, "errors": 0}
+
+    async def _acquire(self) -> float:
+        """Ждет слот и токен; возвращает время ожидания в очереди."""
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+            try:
+                await self.bucket.acquire()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+        wait = time.monotonic() - started
+        self._waits.append(wait)
+        return wait
+
+    def _backoff(self, attempt: int) -> float:
+        # Экспоненциальная задержка с полным случайным разбросом
+        return random.uniform(0.0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+    async def chat(self, max_retries: Optional[int] = None, timing: Optional[Dict[str, float]] = None, **kwargs: Any):
+        """
+        chat.completions.create через очередь провайдера.
+        max_retries=0 - без повторов (например, когда есть другой провайдер);
+        timing заполняется временем ожидания в очереди (queue_wait) и числом повторов (retries).
+        """
+        retries = self.max_retries if max_retries is None else max_retries
+        timing = timing if timing is not None else {}
+        timing.setdefault("queue_wait", 0.0)
+        timing.setdefault("retries", 0)
+
+        attempt = 0
+        while True:
+            timing["queue_wait"] += await self._acquire()
+            self.in_flight += 1
+            self._stats["requests"] += 1
+            try:
+                return await self.client.chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                error = e
+            except Exception:
+                self._stats["errors"] += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+
+            retry_after = retry_after_seconds(error)
+            if isinstance(error, RateLimitError):
+                self._stats["rate_limited"] += 1
+                # Остальные запросы к провайдеру тоже подождут
+                self.bucket.pause(retry_after if retry_after is not None else self._backoff(attempt + 1))
+            if attempt >= retries or (retry_after is not None and retry_after > LLM_REQUEST_TIMEOUT):
+                self._stats["errors"] += 1
+                raise error
+
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0.0, 0.1 + retry_after * 0.1)
+            else:
+                delay = self._backoff(attempt)
+            attempt += 1
+            timing["retries"] = attempt
+            self._stats["retries"] += 1
+            logger.warning(
+                f"[LLM] {self.provider.key}: {type(error).__name__}, повтор {attempt}/{retries} через {delay:.2f} с"
+            )
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def percentile(q: float) -> float:
+            return waits[min(len(waits) - 1, int(q * len(waits)))] if waits else 0.0
+
+        return {
+            **self._stats,
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "wait_p50": percentile(0.5),
+            "wait_p90": percentile(0.9),
+            "wait_max": waits[-1] if waits else 0.0,
+            "paused_for": max(0.0, self.bucket.paused_until - time.monotonic())
+        }
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class LLMClientPool:
+    """
+    Реестр клиентов по провайдеру (имя, адрес, ключ); все генераторы ответов используют его.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, Optional[str], Optional[str]], PooledLLMClient] = {}
+
+    def get(self, provider: ProviderConfig) -> PooledLLMClient:
+        key = (provider.name, provider.base_url, provider.api_key)
+        client = self._clients.get(key)
+        if client is None:
+            prefix = provider.name.upper()
+            client = PooledLLMClient(
+                provider,
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", LLM_MAX_CONCURRENCY)),
+                rate_per_minute=float(os.getenv(f"{prefix}_RPM", LLM_RPM)),
+                burst=int(os.getenv(f"{prefix}_BURST", LLM_BURST))
+            )
+            self._clients[key] = client
+        return client
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {client.provider.key: client.get_stats() for client in self._clients.values()}
+
+    async def close(self) -> None:
+        """Закрывает соединения всех клиентов (при остановке бота)."""
+        for client in self._clients.values():
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии клиента {client.provider.key}: {e}")
+        self._clients.clear()
+
+
+# Глобальный пул клиентов LLM
+llm_client_pool = LLMClientPool()
@@ -1,8 +1,11 @@
 import os
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
-from openai import AsyncOpenAI
+from typing import List, Dict, Any, Optional, Tuple
+from src.services.rag.context_builder import ContextBuilder
+from src.services.rag.llm_client_pool import llm_client_pool
+from src.services.rag.provider_router import ProviderConfig
+from src.services.rag.token_counter import count_tokens
 
 
 logger = logging.getLogger(__name__)
@@ -43,8 +46,8 @@ SYSTEM_PROMT = """
 Работа с таблицами: Если в документах содержатся таблицы с техническими характеристиками, внимательно анализируй их содержимое. При сравнении продуктов всегда ищи и используй точные числовые данные из таблиц.
 
 Упаковка/тара/фасовка:
-- Если вопрос касается упаковки, тары, фасовки, массы нетто/брутто, количества в упаковке — ищи эти сведения в таблицах и особенно в электронных таблицах (Excel/CSV).
-- Обращай внимание на столбцы с названиями: «Наименование», «Тара/фасовка», «ВЕС НЕТТО, кг», «ВЕС БРУТТО, кг», «КОЛ-ВО на поддоне, шт», «ГАБАРИТЫ полного поддона (ДхШхВ)», «КОЛ-ВО поддонов, шт», «ВЕС НЕТТО, кг (итого)», «ВЕС БРУТТО, кг (итого)».
+- Если в контексте есть блок «ТАБЛИЧНЫЕ ДАННЫЕ», бери значения упаковки и характеристик оттуда: каждая строка таблицы уже приведена в виде «столбец: значение».
+- Иначе ищи эти сведения в таблицах документов, особенно в электронных таблицах (Excel/CSV).
 - Приводи точные значения и единицы измерения из таблиц. Если указано несколько вариантов упаковки, перечисли их кратко отдельными маркерами.
 - Если в соответствующей ячейке значение отсутствует — сообщи: «значение не указано в документе».
 
@@ -77,7 +80,7 @@ USER_PROMPT = """
 - Укажи источники данных (СТО, ГОСТ, Паспорт)
 - Если информации недостаточно - честно сообщи об этом
 - Форматируй ответ простым текстом. Разрешены только списки/маркеры ("-", нумерация). НЕЛЬЗЯ HTML и Markdown (не используй **, __, *, _, ```, `, # и т.п.)
-- Если вопрос касается упаковки/тары/фасовки — используй данные из таблиц/Excel, обращая внимание на столбцы: «Наименование», «Тара/фасовка», «ВЕС НЕТТО, кг», «ВЕС БРУТТО, кг», «КОЛ-ВО на поддоне, шт», «ГАБАРИТЫ полного поддона (ДхШхВ)», «КОЛ-ВО поддонов, шт», «ВЕС НЕТТО, кг (итого)», «ВЕС БРУТТО, кг (итого)»
+- Если вопрос касается упаковки/тары/фасовки или числовых характеристик — в первую очередь используй блок «ТАБЛИЧНЫЕ ДАННЫЕ» (строки в виде «столбец: значение»)
 - Не выполняй расчеты/агрегации по табличным данным (приводи числа как в источнике; без сумм, пересчетов, среднего и т.п.)
 - Не используй фразы вида «Эти данные подтверждаются технической документацией» — отвечай по существу без таких заявлений
 - НЕ упоминай названия документов и их номера
@@ -96,52 +99,49 @@ class LLMResponseGenerator:
 	
 	def __init__(self, api_key: Optional[str] = None):
 		self.api_key = api_key or os.environ.get('OPENAI_API_KEY')
-		self.client = None
+		# HTTP-клиент общий на процесс: очередь, ограничение частоты и повторы (llm_client_pool)
+		self.provider = ProviderConfig(name="openai", model="gpt-4o-mini", api_key=self.api_key)
 		
 		# Системный промпт для LLM
 		self.system_prompt = SYSTEM_PROMT
+		# Сборка контекста в пределах бюджета токенов (RAG_CONTEXT_TOKEN_BUDGET)
+		self.context_builder = ContextBuilder()
+		self._system_prompt_tokens = count_tokens(self.system_prompt)
 	
-	async def generate_response(self, query: str, search_results: List[Dict[str, Any]]) -> str:
+	async def generate_response(self, query: str, search_results: List[Dict[str, Any]], table_context: str = "") -> str:
 		"""
 		Генерирует ответ LLM на основе запроса и результатов поиска.
+		table_context - строки из табличного индекса, подставляются перед документами.
 		"""
 		logger.info(f"Генерация ответа LLM для запроса: {query}")
 		
-		if not search_results:
+		if not search_results and not table_context:
 			return "Я не могу ответить на этот вопрос, так как не нашел релевантной информации в документах."
 		
 		if not self.api_key:
 			logger.error("API ключ OpenAI не найден")
 			return "Ошибка: API ключ OpenAI не найден. Настройте переменную окружения OPENAI_API_KEY."
 		
-		# Формируем контекст из найденных документов
-		context = self._build_context(search_results)
-		logger.info(f"Контекст для LLM: {len(context)} символов")
-		
-		# Формируем пользовательский промпт
-		user_prompt = self._build_user_prompt(query, context)
+		messages, prompt_tokens = self._build_messages(query, search_results, table_context)
 		
 		try:
-			# Инициализируем клиента, если еще не инициализирован
-			if not self.client:
-				self.client = AsyncOpenAI(api_key=self.api_key, timeout=60.0)
-			
-			# Устанавливаем переменную окружения для отключения параллелизма токенизаторов
-			os.environ["TOKENIZERS_PARALLELISM"] = "false"
-			
 			logger.info("Отправляем запрос к OpenAI API...")
+			started = asyncio.get_event_loop().time()
 			
-			response = await self.client.chat.completions.create(
-				model="gpt-4o-mini",
-				messages=[
-					{"role": "system", "content": self.system_prompt},
-					{"role": "user", "content": user_prompt}
-				],
+			response = await llm_client_pool.get(self.provider).chat(
+				model=self.provider.model,
+				messages=messages,
 				temperature=0.1,
 				max_tokens=1500,
 				timeout=45
 			)
 			
+			elapsed = asyncio.get_event_loop().time() - started
+			usage = getattr(response, "usage", None)
+			if usage is not None and getattr(usage, "prompt_tokens", None):
+				prompt_tokens = usage.prompt_tokens
+			logger.info(f"[LLM] Промпт {prompt_tokens} токенов, ответ за {elapsed:.2f} с")
+			
 			answer = response.choices[0].message.content or "Ответ не получен"
 			logger.info(f"Получен ответ от OpenAI API длиной {len(answer)} символов")
 			
@@ -154,28 +154,35 @@ class LLMResponseGenerator:
 			logger.error(f"Ошибка при генерации ответа LLM: {e}")
 			return f"Произошла ошибка при генерации ответа: {str(e)}"
 	
-	def _build_context(self, search_results: List[Dict[str, Any]]) -> str:
+	def _build_messages(self, query: str, search_results: List[Dict[str, Any]], table_context: str = "",
+						history: Optional[List[Dict[str, str]]] = None) -> Tuple[List[Dict[str, str]], int]:
 		"""
-		Формирует контекст из результатов поиска для передачи в LLM.
+		Собирает сообщения для chat.completions и оценку токенов промпта.
+		Табличные данные входят в тот же бюджет контекста, что и документы.
+		history - предыдущие вопросы и сжатые ответы диалога (для уточняющих вопросов),
+		идут между системным промптом и текущим вопросом.
 		"""
-		context_parts = []
-		
-		for i, result in enumerate(search_results, 1):
-			product_id = result.get("product_id")
-			product_name = result.get("product_name", f"Документ {i}")
-			similarity = result.get("similarity", 0)
-			text = result.get("text", "") or result.get("text_preview", "")
-			
-			# Логируем информацию о документе
-			logger.info(f"Документ #{i}: '{product_name}' (ID: {product_id}, сходство: {similarity:.4f})")
-			
-			# Добавляем информацию о документе в контекст
-			document_header = f"=== ДОКУМЕНТ {i}: {product_name} ===\n"
-			document_content = f"{text}\n"
-			
-			context_parts.append(document_header + document_content)
-		
-		return "\n".join(context_parts)
+		table_block = f"=== ТАБЛИЧНЫЕ ДАННЫЕ ===\n{table_context}\n\n" if table_context else ""
+		context = table_block + self._build_context(search_results, reserved_tokens=count_tokens(table_block))
+		user_prompt = self._build_user_prompt(query, context)
+		history = history or []
+		messages = [
+			{"role": "system", "content": self.system_prompt},
+			*history,
+			{"role": "user", "content": user_prompt}
+		]
+		history_tokens = sum(count_tokens(message["content"]) for message in history)
+		return messages, self._system_prompt_tokens + history_tokens + count_tokens(user_prompt)
+	
+	def _build_context(self, search_results: List[Dict[str, Any]], reserved_tokens: int = 0) -> str:
+		"""
+		Формирует контекст из результатов поиска для передачи в LLM:
+		по убыванию сходства, без перекрывающихся фрагментов, в пределах бюджета токенов.
+		reserved_tokens - токены, уже занятые табличными данными.
+		"""
+		built = self.context_builder.build(search_results, reserved_tokens=reserved_tokens)
+		logger.info(f"Контекст для LLM: {built.describe()}")
+		return built.text
 	
 	def _build_user_prompt(self, query: str, context: str) -> str:
 		"""
@@ -184,6 +191,4 @@ class LLMResponseGenerator:
 		return USER_PROMPT.format(context=context, query=query)
 	
 	async def close(self):
-		"""Закрывает соединение с OpenAI API."""
-		if self.client:
-			await self.client.close()
+		"""Клиенты общие (llm_client_pool) и закрываются при остановке бота."""
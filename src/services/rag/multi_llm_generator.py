@@ -1,126 +1,192 @@
-import os
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Literal
-from openai import AsyncOpenAI
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
+
+from .llm_generator import LLMResponseGenerator
+from .llm_client_pool import llm_client_pool
+from .provider_router import ProviderConfig, ProviderRouter, LLM_REQUEST_TIMEOUT
+from .tracing import current_span
 
 logger = logging.getLogger(__name__)
 
-# Импортируем константы из оригинального файла
-from .llm_generator import SYSTEM_PROMT, USER_PROMPT
 
-class MultiLLMGenerator:
+@dataclass
+class LLMAnswer:
+    """Ответ LLM и сведения о том, кто и как его дал."""
+    text: str
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    latency: float = 0.0
+    hedged: bool = False
+    attempts: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Токены промпта, взятые из кеша провайдера (дешевле обычных)
+    cached_tokens: int = 0
+
+    @property
+    def provider_key(self) -> Optional[str]:
+        return f"{self.provider}/{self.model}" if self.provider else None
+
+
+class MultiLLMGenerator(LLMResponseGenerator):
     """
-    Класс для генерации ответов с помощью разных LLM провайдеров (OpenAI, DeepSeek).
+    Класс для генерации ответов с помощью разных LLM провайдеров (OpenAI, DeepSeek и
+    любых OpenAI-совместимых API). Провайдер выбирается на каждый запрос через ProviderRouter:
+    если первый не ответил за p90 своей задержки, тот же запрос уходит следующему,
+    используется первый успешный ответ. Ошибка провайдера сразу передает запрос дальше.
     """
-    
-    def __init__(self, provider: Literal["openai", "deepseek"] = "openai"):
-        self.provider = provider
-        self.client = None
-        self.system_prompt = SYSTEM_PROMT
-        
-        # Настройка API ключей и базовых URL в зависимости от провайдера
-        if provider == "openai":
-            self.api_key = os.environ.get('OPENAI_API_KEY')
-            self.base_url = None
-            self.model = "gpt-4o-mini"
-        elif provider == "deepseek":
-            self.api_key = os.environ.get('DEEPSEEK_API_KEY')
-            self.base_url = "https://api.deepseek.com"
-            self.model = "deepseek-chat"
-        else:
-            raise ValueError(f"Неподдерживаемый провайдер: {provider}")
-    
-    async def generate_response(self, query: str, search_results: List[Dict[str, Any]]) -> str:
+
+    def __init__(self, api_key: Optional[str] = None, providers: Optional[List[str]] = None,
+                 router: Optional[ProviderRouter] = None):
+        super().__init__(api_key)
+        self.router = router or ProviderRouter.from_env(providers, openai_api_key=api_key)
+
+    async def generate_response(self, query: str, search_results: List[Dict[str, Any]], table_context: str = "") -> str:
+        """Текст ответа (совместимо с LLMResponseGenerator)."""
+        answer = await self.generate_answer(query, search_results, table_context)
+        return answer.text
+
+    async def generate_answer(self, query: str, search_results: List[Dict[str, Any]], table_context: str = "",
+                              history: Optional[List[Dict[str, str]]] = None) -> LLMAnswer:
         """
-        Генерирует ответ LLM на основе запроса и результатов поиска.
+        Генерирует ответ LLM на основе запроса и результатов поиска
+        с выбором провайдера, дублированием медленных запросов и переключением при ошибках.
+        history - сжатая история диалога для уточняющего вопроса.
         """
-        logger.info(f"Генерация ответа {self.provider.upper()} для запроса: {query}")
-        
-        if not search_results:
-            return "Я не могу ответить на этот вопрос, так как не нашел релевантной информации в документах."
-        
-        if not self.api_key:
-            logger.error(f"API ключ {self.provider.upper()} не найден")
-            return f"Ошибка: API ключ {self.provider.upper()} не найден."
-        
-        # Формируем контекст из найденных документов
-        context = self._build_context(search_results)
-        logger.info(f"Контекст для {self.provider.upper()}: {len(context)} символов")
-        
-        # Формируем пользовательский промпт
-        user_prompt = self._build_user_prompt(query, context)
-        
+        logger.info(f"Генерация ответа LLM для запроса: {query}")
+
+        if not search_results and not table_context:
+            return LLMAnswer("Я не могу ответить на этот вопрос, так как не нашел релевантной информации в документах.")
+
+        candidates = self.router.ranked()
+        if not candidates:
+            logger.error("Нет доступных LLM-провайдеров: нет ключей API или все отключены после ошибок")
+            return LLMAnswer("Ошибка: нет доступных LLM-провайдеров. Проверьте ключи API (RAG_LLM_PROVIDERS).")
+
+        messages, prompt_tokens = self._build_messages(query, search_results, table_context, history)
+
         try:
-            # Инициализируем клиента, если еще не инициализирован
-            if not self.client:
-                if self.base_url:
-                    self.client = AsyncOpenAI(
-                        api_key=self.api_key, 
-                        base_url=self.base_url,
-                        timeout=60.0
-                    )
-                else:
-                    self.client = AsyncOpenAI(api_key=self.api_key, timeout=60.0)
-            
-            # Устанавливаем переменную окружения для отключения параллелизма токенизаторов
-            os.environ["TOKENIZERS_PARALLELISM"] = "false"
-            
-            logger.info(f"Отправляем запрос к {self.provider.upper()} API...")
-            
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.1,  # Низкая температура для точных ответов с данными
-                max_tokens=1500,  # Увеличиваем лимит токенов для более полных ответов
-                timeout=45  # Таймаут для запроса
-            )
-            
-            answer = response.choices[0].message.content or "Ответ не получен"
-            logger.info(f"Получен ответ от {self.provider.upper()} API длиной {len(answer)} символов")
-            
-            return answer
-            
+            answer = await self._race(candidates, messages)
         except asyncio.TimeoutError:
-            logger.error(f"Превышено время ожидания ответа от {self.provider.upper()} API")
-            return f"Превышено время ожидания ответа от {self.provider.upper()}. Пожалуйста, попробуйте еще раз."
+            logger.error("Превышено время ожидания ответа от LLM API")
+            return LLMAnswer("Превышено время ожидания ответа от LLM. Пожалуйста, попробуйте еще раз.")
         except Exception as e:
-            logger.error(f"Ошибка при генерации ответа {self.provider.upper()}: {e}")
-            return f"Произошла ошибка при генерации ответа {self.provider.upper()}: {str(e)}"
-    
-    def _build_context(self, search_results: List[Dict[str, Any]]) -> str:
+            logger.error(f"Ошибка при генерации ответа LLM: {e}")
+            return LLMAnswer(f"Произошла ошибка при генерации ответа: {str(e)}")
+
+        answer.prompt_tokens = answer.prompt_tokens or prompt_tokens
+        logger.info(
+            f"[LLM] {answer.provider_key}: промпт {answer.prompt_tokens} токенов (из кеша {answer.cached_tokens}), "
+            f"ответ {answer.completion_tokens} токенов за {answer.latency:.2f} с"
+            f"{' (дублированный запрос)' if answer.hedged else ''}"
+        )
+        return answer
+
+    async def _call(self, provider: ProviderConfig, messages: List[Dict[str, str]],
+                    max_retries: Optional[int] = None) -> LLMAnswer:
         """
-        Формирует контекст из результатов поиска для передачи в LLM.
+        Один запрос к провайдеру через общий пул клиентов.
+        В статистику маршрутизатора идет задержка без ожидания в очереди пула.
         """
-        context_parts = []
-        
-        for i, result in enumerate(search_results, 1):
-            product_id = result.get("product_id")
-            product_name = result.get("product_name", f"Документ {i}")
-            similarity = result.get("similarity", 0)
-            text = result.get("text", "") or result.get("text_preview", "")
-            
-            # Логируем информацию о документе
-            logger.info(f"Документ #{i}: '{product_name}' (ID: {product_id}, сходство: {similarity:.4f})")
-            
-            # Добавляем информацию о документе в контекст
-            document_header = f"=== ДОКУМЕНТ {i}: {product_name} ===\n"
-            document_content = f"{text}\n"
-            
-            context_parts.append(document_header + document_content)
-        
-        return "\n".join(context_parts)
-    
-    def _build_user_prompt(self, query: str, context: str) -> str:
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        timing: Dict[str, float] = {}
+        try:
+            # Интервал трассы на каждый запрос к провайдеру (при дублировании их несколько)
+            with current_span("llm_call", provider=provider.key) as span:
+                response = await llm_client_pool.get(provider).chat(
+                    max_retries=max_retries,
+                    timing=timing,
+                    model=provider.model,
+                    messages=messages,
+                    temperature=0.1,  # Низкая температура для точных ответов с данными
+                    max_tokens=1500,
+                    timeout=LLM_REQUEST_TIMEOUT
+                )
+                if span is not None:
+                    span.set(queue_wait=round(timing.get("queue_wait", 0.0), 4), retries=timing.get("retries", 0))
+        except asyncio.CancelledError:
+            self.router.record_cancelled(provider)
+            raise
+        except Exception as e:
+            self.router.record_failure(provider, e)
+            raise
+
+        latency = loop.time() - started
+        self.router.record_success(provider, latency - timing.get("queue_wait", 0.0))
+        usage = getattr(response, "usage", None)
+        # OpenAI: prompt_tokens_details.cached_tokens, DeepSeek: prompt_cache_hit_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or getattr(usage, "prompt_cache_hit_tokens", None) or 0
+        return LLMAnswer(
+            text=response.choices[0].message.content or "Ответ не получен",
+            provider=provider.name,
+            model=provider.model,
+            latency=latency,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            cached_tokens=cached_tokens
+        )
+
+    async def _race(self, candidates: List[ProviderConfig], messages: List[Dict[str, str]]) -> LLMAnswer:
         """
-        Формирует пользовательский промпт для LLM.
+        Запускает запрос к первому провайдеру; если он не ответил за hedge_delay -
+        дублирует следующему (один раз), при ошибке - сразу переходит к следующему.
+        Пока есть запасной провайдер, пул не повторяет запрос после 429/5xx сам.
+        Возвращает первый успешный ответ, остальные запросы отменяются.
         """
-        return USER_PROMPT.format(context=context, query=query)
-    
+        queue = list(candidates)
+        pending: Dict["asyncio.Task[LLMAnswer]", ProviderConfig] = {}
+        hedged = False
+        attempts = 0
+        last_error: Optional[BaseException] = None
+
+        def launch() -> ProviderConfig:
+            nonlocal attempts
+            provider = queue.pop(0)
+            max_retries = 0 if queue else None
+            pending[asyncio.ensure_future(self._call(provider, messages, max_retries))] = provider
+            attempts += 1
+            return provider
+
+        hedge_at = self.router.hedge_delay(launch())
+        try:
+            while pending:
+                can_hedge = self.router.hedge_enabled and not hedged and queue
+                done, _ = await asyncio.wait(
+                    pending, timeout=hedge_at if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    self.router.hedges += 1
+                    provider = launch()
+                    logger.info(f"[LLM] Нет ответа за {hedge_at:.1f} с, дублируем запрос в {provider.key}")
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        answer = task.result()
+                        # Ответ дублирующего запроса считается выигрышем хеджирования
+                        answer.hedged = hedged and provider is not candidates[0]
+                        answer.attempts = attempts
+                        self.router.record_win(provider, answer.hedged)
+                        return answer
+                    last_error = task.exception()
+                    logger.warning(f"[LLM] Ошибка провайдера {provider.key}: {last_error}")
+
+                if not pending and queue:
+                    hedge_at = self.router.hedge_delay(launch())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise last_error or RuntimeError("LLM-провайдеры не вернули ответ")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.router.get_stats()
+
     async def close(self):
-        """Закрывает соединение с API."""
-        if self.client:
-            await self.client.close()
+        """Клиенты общие (llm_client_pool) и закрываются при остановке бота."""
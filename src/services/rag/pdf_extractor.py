@@ -1,12 +1,14 @@
 import os
 import re
 import logging
-import pdfplumber
 from typing import Optional
 
+from src.services.extraction.pdf_backends import get_pdf_backend
+
 logger = logging.getLogger(__name__)
 
-async def extract_text_from_pdf(pdf_path: str, max_pages: Optional[int] = None, max_length: Optional[int] = None) -> str:
+async def extract_text_from_pdf(pdf_path: str, max_pages: Optional[int] = None, max_length: Optional[int] = None,
+                                backend: Optional[str] = None) -> str:
     """
     Извлекает текст из PDF файла с расширенными возможностями и обработкой ошибок.
     
@@ -14,6 +16,7 @@ async def extract_text_from_pdf(pdf_path: str, max_pages: Optional[int] = None,
         pdf_path: Путь к PDF файлу
         max_pages: Максимальное количество страниц для извлечения (None для всех)
         max_length: Максимальная длина извлекаемого текста (None для всего текста)
+        backend: PDF-бэкенд (None - из PDF_EXTRACTOR_BACKEND), таблицы добавляются для страниц без текста
         
     Returns:
         Извлеченный текст
@@ -25,56 +28,28 @@ async def extract_text_from_pdf(pdf_path: str, max_pages: Optional[int] = None,
         return "Файл не найден"
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            documents = []
-            pages_to_process = pdf.pages[:max_pages] if max_pages else pdf.pages
-            logger.info(f"PDF содержит {len(pdf.pages)} страниц, обрабатываем {len(pages_to_process)} страниц")
-            
-            total_text_length = 0
-            for i, page in enumerate(pages_to_process):
-                try:
-                    # Пробуем сначала извлечь текст стандартным методом
-                    page_text = page.extract_text()
-                    
-                    # Если текст не удалось извлечь или он слишком короткий, 
-                    # попробуем альтернативный подход с извлечением таблиц
-                    if not page_text or len(page_text) < 100:
-                        try:
-                            # Пробуем извлечь таблицы
-                            tables = page.extract_tables()
-                            if tables:
-                                table_texts = []
-                                for table in tables:
-                                    # Преобразуем таблицу в текст
-                                    table_text = "\n".join([" | ".join([str(cell) if cell else "" for cell in row]) for row in table])
-                                    table_texts.append(table_text)
-                                
-                                # Объединяем текст таблиц
-                                tables_text = "\n\n".join(table_texts)
-                                if tables_text:
-                                    if page_text:  # Если был текст, добавляем таблицы
-                                        page_text += "\n\n" + tables_text
-                                    else:  # Если текста не было, используем только таблицы
-                                        page_text = tables_text
-                        except Exception as e:
-                            logger.warning(f"Не удалось извлечь таблицы со страницы {i+1}: {e}")
-                    
-                    if page_text:
-                        # Выполняем дополнительную очистку текста от артефактов
-                        # Удаляем множественные пробелы и переводы строк
-                        page_text = re.sub(r'\s+', ' ', page_text).strip()
-                        # Удаляем повторяющиеся знаки пунктуации
-                        page_text = re.sub(r'([.,:;!?])\1+', r'\1', page_text)
-                        
-                        documents.append(page_text)
-                        total_text_length += len(page_text)
-                        
-                        # Если превысили максимальную длину, останавливаемся (только если лимит установлен)
-                        if max_length and total_text_length > max_length:
-                            logger.info(f"Достигнут максимальный размер текста ({max_length} символов) на странице {i+1}")
-                            break
-                except Exception as e:
-                    logger.error(f"Ошибка при извлечении текста из страницы {i+1}: {e}")
+        pdf_backend = get_pdf_backend(backend)
+        documents = []
+        pages_processed = 0
+        total_text_length = 0
+        logger.info(f"PDF обрабатывается бэкендом {pdf_backend.name}")
+        
+        for i, page_text in enumerate(pdf_backend.iter_pages(pdf_path, max_pages, tables_fallback=True)):
+            pages_processed += 1
+            if page_text:
+                # Выполняем дополнительную очистку текста от артефактов
+                # Удаляем множественные пробелы и переводы строк
+                page_text = re.sub(r'\s+', ' ', page_text).strip()
+                # Удаляем повторяющиеся знаки пунктуации
+                page_text = re.sub(r'([.,:;!?])\1+', r'\1', page_text)
+                
+                documents.append(page_text)
+                total_text_length += len(page_text)
+                
+                # Если превысили максимальную длину, останавливаемся (только если лимит установлен)
+                if max_length and total_text_length > max_length:
+                    logger.info(f"Достигнут максимальный размер текста ({max_length} символов) на странице {i+1}")
+                    break
     
         full_text = ' '.join(documents)
         
@@ -86,7 +61,7 @@ async def extract_text_from_pdf(pdf_path: str, max_pages: Optional[int] = None,
         full_text = re.sub(r'\s+', ' ', full_text).strip()
         
         # Если текст слишком короткий, логируем предупреждение
-        if len(full_text) < 500 and len(pages_to_process) > 0:
+        if len(full_text) < 500 and pages_processed > 0:
             logger.warning(f"Извлеченный текст слишком короткий ({len(full_text)} символов), возможно документ содержит изображения или защищен")
             
         logger.info(f"Извлечено {len(full_text)} символов текста из PDF")
@@ -2,7 +2,8 @@ import os
 import logging
 from typing import Dict, Any, Optional
 
-from src.services.rag.pdf_extractor import extract_text_from_pdf
+from src.services.extraction import extraction_supervisor
+from src.services.catalog_cache import product_catalog_cache
 
 logger = logging.getLogger(__name__)
 
@@ -33,12 +34,13 @@ async def get_product_metadata(embedding_service, product_id: int) -> Dict[str,
                     if entries and 'metadatas' in entries and entries['metadatas']:
                         chroma_metadata = entries['metadatas'][0]
                         if chroma_metadata:
-                            if 'product_name' in chroma_metadata:
+                            cached_name = product_catalog_cache.get_cached(product_id)
+                            if cached_name:
+                                metadata["name"] = cached_name
+                            elif 'product_name' in chroma_metadata:
                                 metadata["name"] = chroma_metadata['product_name']
                             if 'file_path' in chroma_metadata:
                                 metadata["file_path"] = chroma_metadata['file_path']
-                            if 'description' in chroma_metadata:
-                                metadata["description"] = chroma_metadata['description']
             except Exception as e:
                 logger.warning(f"Не удалось получить данные из ChromaDB для продукта {product_id}: {e}")
 
@@ -62,7 +64,6 @@ async def get_product_metadata(embedding_service, product_id: int) -> Dict[str,
                     
                     if product:
                         metadata["name"] = getattr(product, 'name', f"Продукт {product_id}")
-                        metadata["description"] = getattr(product, 'description', "")
                         
                         # Получаем информацию о PDF файлах продукта
                         if not metadata["file_path"]:
@@ -83,7 +84,8 @@ async def get_product_metadata(embedding_service, product_id: int) -> Dict[str,
                                     # можем попытаться извлечь текст прямо из PDF
                                     if not metadata["text"] and os.path.exists(local_path):
                                         try:
-                                            extracted_text = await extract_text_from_pdf(
+                                            # Разбор PDF в отдельном процессе, чтобы не блокировать бота
+                                            extracted_text = await extraction_supervisor.extract_text(
                                                 local_path,
                                                 max_pages=5,
                                                 max_length=10000
@@ -0,0 +1,233 @@
+import os
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+"""
+Выбор LLM-провайдера по задержке и ошибкам.
+Для каждой пары провайдер/модель хранится скользящее окно последних запросов:
+задержки успешных ответов и исходы. По нему считаются p50/p90, доля ошибок и
+срок, после которого MultiLLMGenerator дублирует запрос следующему провайдеру (hedging).
+Провайдер, который подряд вернул несколько ошибок, выключается автоматом
+(circuit breaker) на время охлаждения, затем получает пробные запросы.
+"""
+
+# Провайдеры в порядке предпочтения; настройки каждого - <NAME>_API_KEY, <NAME>_BASE_URL, <NAME>_MODEL
+LLM_PROVIDERS = [name.strip().lower() for name in os.getenv("RAG_LLM_PROVIDERS", "openai").split(",") if name.strip()]
+LLM_HEDGE_ENABLED = os.getenv("RAG_LLM_HEDGE", "1") == "1"
+# Срок дублирования - p90 задержки провайдера в этих пределах; пока статистики нет - DEFAULT_DELAY
+LLM_HEDGE_MIN_DELAY = float(os.getenv("RAG_LLM_HEDGE_MIN_DELAY", "2"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("RAG_LLM_HEDGE_MAX_DELAY", "20"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("RAG_LLM_HEDGE_DEFAULT_DELAY", "8"))
+LLM_STATS_WINDOW = int(os.getenv("RAG_LLM_STATS_WINDOW", "50"))
+LLM_BREAKER_FAILURES = int(os.getenv("RAG_LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("RAG_LLM_BREAKER_COOLDOWN", "60"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("RAG_LLM_TIMEOUT", "45"))
+
+# Меньше успешных ответов в окне - перцентили не считаются
+MIN_LATENCY_SAMPLES = 5
+
+PROVIDER_DEFAULTS: Dict[str, Dict[str, Optional[str]]] = {
+    "openai": {"base_url": None, "model": "gpt-4o-mini"},
+    "deepseek": {"base_url": "https://api.deepseek.com", "model": "deepseek-chat"},
+}
+
+
+@dataclass
+class ProviderConfig:
+    name: str
+    model: str
+    api_key: Optional[str] = None
+    base_url: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}/{self.model}"
+
+    @classmethod
+    def from_env(cls, name: str, api_key: Optional[str] = None) -> "ProviderConfig":
+        prefix = name.upper()
+        defaults = PROVIDER_DEFAULTS.get(name, {})
+        model = os.getenv(f"{prefix}_MODEL") or defaults.get("model")
+        if not model:
+            raise ValueError(f"Не задана модель для провайдера {name}: укажите {prefix}_MODEL")
+        return cls(
+            name=name,
+            model=model,
+            api_key=api_key or os.getenv(f"{prefix}_API_KEY"),
+            base_url=os.getenv(f"{prefix}_BASE_URL") or defaults.get("base_url")
+        )
+
+
+class ProviderStats:
+    """Скользящее окно задержек и исходов запросов к одному провайдеру."""
+
+    def __init__(self, window: int = LLM_STATS_WINDOW):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0
+        self.hedged_wins = 0
+        self.cancelled = 0
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.errors += 1
+        self.outcomes.append(False)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class CircuitBreaker:
+    """
+    closed - запросы идут; open - провайдер пропускается до конца охлаждения;
+    после охлаждения (half-open) первый успех закрывает автомат, ошибка снова открывает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._open = False
+
+    @property
+    def state(self) -> str:
+        if not self._open:
+            return self.CLOSED
+        return self.HALF_OPEN if time.monotonic() - self.opened_at >= self.cooldown else self.OPEN
+
+    def available(self) -> bool:
+        return self.state != self.OPEN
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._open = False
+
+    def record_failure(self) -> bool:
+        """Учитывает ошибку; True - автомат только что открылся."""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (not self._open and self.failures >= self.failure_threshold):
+            self._open = True
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            return True
+        return False
+
+
+class ProviderRouter:
+    """
+    Порядок провайдеров для очередного запроса и учет результатов.
+    """
+
+    def __init__(self,
+                 providers: List[ProviderConfig],
+                 hedge_enabled: bool = LLM_HEDGE_ENABLED,
+                 hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+                 hedge_max_delay: float = LLM_HEDGE_MAX_DELAY,
+                 hedge_default_delay: float = LLM_HEDGE_DEFAULT_DELAY,
+                 window: int = LLM_STATS_WINDOW,
+                 breaker_failures: int = LLM_BREAKER_FAILURES,
+                 breaker_cooldown: float = LLM_BREAKER_COOLDOWN):
+        if not providers:
+            raise ValueError("Не настроено ни одного LLM-провайдера (RAG_LLM_PROVIDERS)")
+        self.providers = providers
+        self.hedge_enabled = hedge_enabled and len(providers) > 1
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.stats = {p.key: ProviderStats(window) for p in providers}
+        self.breakers = {p.key: CircuitBreaker(breaker_failures, breaker_cooldown) for p in providers}
+        self.hedges = 0
+
+    @classmethod
+    def from_env(cls, names: Optional[List[str]] = None, openai_api_key: Optional[str] = None) -> "ProviderRouter":
+        providers = [
+            ProviderConfig.from_env(name, openai_api_key if name == "openai" else None)
+            for name in (names or LLM_PROVIDERS)
+        ]
+        return cls(providers)
+
+    def _expected_latency(self, provider: ProviderConfig) -> Optional[float]:
+        stats = self.stats[provider.key]
+        p50 = stats.percentile(0.5)
+        return None if p50 is None else p50 * (1.0 + 2.0 * stats.error_rate)
+
+    def ranked(self) -> List[ProviderConfig]:
+        """
+        Провайдеры с закрытым автоматом и ключом API, быстрые - первыми.
+        Пока у кого-то из них мало статистики, порядок - как в RAG_LLM_PROVIDERS.
+        """
+        available = [p for p in self.providers if p.api_key and self.breakers[p.key].available()]
+        expected = [self._expected_latency(p) for p in available]
+        if None in expected:
+            return available
+        order = sorted(range(len(available)), key=lambda i: (expected[i], i))
+        return [available[i] for i in order]
+
+    def hedge_delay(self, provider: ProviderConfig) -> float:
+        """Через сколько секунд дублировать запрос следующему провайдеру."""
+        p90 = self.stats[provider.key].percentile(0.9)
+        if p90 is None:
+            return self.hedge_default_delay
+        return min(max(p90, self.hedge_min_delay), self.hedge_max_delay)
+
+    def record_success(self, provider: ProviderConfig, latency: float) -> None:
+        self.stats[provider.key].record_success(latency)
+        self.breakers[provider.key].record_success()
+
+    def record_failure(self, provider: ProviderConfig, error: BaseException) -> None:
+        self.stats[provider.key].record_failure()
+        if self.breakers[provider.key].record_failure():
+            logger.warning(f"[LLM] Провайдер {provider.key} отключен после ошибок: {error}")
+
+    def record_win(self, provider: ProviderConfig, hedged: bool) -> None:
+        stats = self.stats[provider.key]
+        stats.wins += 1
+        if hedged:
+            stats.hedged_wins += 1
+
+    def record_cancelled(self, provider: ProviderConfig) -> None:
+        self.stats[provider.key].cancelled += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        providers = {}
+        for provider in self.providers:
+            stats = self.stats[provider.key]
+            providers[provider.key] = {
+                "requests": stats.requests,
+                "errors": stats.errors,
+                "error_rate": stats.error_rate,
+                "p50": stats.percentile(0.5),
+                "p90": stats.percentile(0.9),
+                "wins": stats.wins,
+                "hedged_wins": stats.hedged_wins,
+                "cancelled": stats.cancelled,
+                "breaker": self.breakers[provider.key].state,
+                "breaker_trips": self.breakers[provider.key].trips,
+                "configured": bool(provider.api_key)
+            }
+        return {"hedge_enabled": self.hedge_enabled, "hedges": self.hedges, "providers": providers}
@@ -1,56 +1,113 @@
+import os
 import re
+import json
 import logging
+from functools import lru_cache
+from typing import List, Optional, Pattern, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Словарь синонимов для расширения запросов: {"термин": {"pattern": "регулярное выражение", "synonyms": [...]}}
+SYNONYMS_PATH = os.getenv(
+    "RAG_SYNONYMS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "synonyms.json")
+)
+# Сколько формулировок запроса искать (вместе с исходной); 1 - без расширения
+QUERY_VARIANTS = int(os.getenv("RAG_QUERY_VARIANTS", "4"))
+
+
+class SynonymExpander:
+    """
+    Синонимы терминов из файла данных. Все термины собраны в одно регулярное выражение
+    с именованными группами, поэтому запрос просматривается за один проход.
+    """
+    
+    def __init__(self, groups: List[Tuple[str, str, List[str]]]):
+        self.groups = groups
+        self.matcher: Optional[Pattern[str]] = None
+        if groups:
+            self.matcher = re.compile(
+                "|".join(f"(?P<g{index}>\\b(?:{pattern}))" for index, (_, pattern, _) in enumerate(groups)),
+                re.IGNORECASE
+            )
+    
+    @classmethod
+    def from_file(cls, path: str) -> "SynonymExpander":
+        """Загружает словарь; без файла расширение запросов отключается."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить словарь синонимов {path}: {e}")
+            return cls([])
+        groups = []
+        for term, entry in data.items():
+            # Без pattern термин ищется как начало слова
+            pattern = entry.get("pattern") or re.escape(term) + r"\w*"
+            groups.append((term, pattern, list(entry.get("synonyms", []))))
+        return cls(groups)
+    
+    def find(self, text: str) -> List[Tuple[int, int, List[str]]]:
+        """Найденные термины: (начало, конец, синонимы), по одному вхождению на термин."""
+        if self.matcher is None:
+            return []
+        found, seen = [], set()
+        for match in self.matcher.finditer(text):
+            group = match.lastgroup
+            if group in seen:
+                continue
+            seen.add(group)
+            found.append((match.start(), match.end(), self.groups[int(group[1:])][2]))
+        return found
+
+
+@lru_cache(maxsize=4)
+def get_synonym_expander(path: str = SYNONYMS_PATH) -> SynonymExpander:
+    return SynonymExpander.from_file(path)
+
+
 class QueryProcessor:
     """
     Класс для минимальной обработки поисковых запросов.
     """
     
+    def __init__(self, synonyms_path: str = SYNONYMS_PATH, max_variants: int = QUERY_VARIANTS):
+        self.expander = get_synonym_expander(synonyms_path)
+        self.max_variants = max(1, max_variants)
+    
     def clean_query(self, query_text: str) -> str:
         """
-        Улучшенная очистка и расширение запроса
+        Базовая очистка запроса (лишние пробелы)
         """
         if not query_text or not isinstance(query_text, str):
             return ""
+        return " ".join(query_text.strip().split())
+    
+    def expand_query(self, query_text: str, max_variants: Optional[int] = None) -> List[str]:
+        """
+        Формулировки запроса для поиска: очищенный запрос и варианты, в которых
+        найденный термин заменен синонимом ("температура" -> "нагрев").
+        Термины чередуются, чтобы варианты отличались разными словами.
+        Каждая формулировка кодируется отдельным вектором, а не склеивается в одну строку.
+        """
+        cleaned_query = self.clean_query(query_text)
+        if not cleaned_query:
+            return []
+        limit = max_variants or self.max_variants
+        variants = [cleaned_query]
+        terms = self.expander.find(cleaned_query)
+        depth = max((len(synonyms) for _, _, synonyms in terms), default=0)
+        for index in range(depth):
+            for start, end, synonyms in terms:
+                if len(variants) >= limit:
+                    break
+                if index < len(synonyms):
+                    variant = f"{cleaned_query[:start]}{synonyms[index]}{cleaned_query[end:]}"
+                    if variant not in variants:
+                        variants.append(variant)
         
-        # Базовая очистка
-        cleaned_query = " ".join(query_text.strip().split())
-        
-        # Добавляем синонимы и расширения для лучшего поиска
-        query_expansions = []
-        
-        # Расширяем запрос синонимами битумных терминов
-        expansions = {
-            "битум": ["битумный", "битумная", "асфальт"],
-            "гидроизоляция": ["гидроизоляционный", "водозащита", "влагозащита"],
-            "кровля": ["кровельный", "крыша", "покрытие"],
-            "температура": ["термический", "тепловой", "нагрев", "размягчения"],
-            "применение": ["использование", "область применения", "назначение"],
-            "характеристики": ["свойства", "параметры", "показатели", "спецификация"],
-            "отличие": ["разница", "различие", "сравнение", "отличается"],
-            "мастика": ["герметик", "состав", "материал"],
-            "гибкость": ["эластичность", "пластичность"],
-            "прочность": ["стойкость", "устойчивость"],
-        }
-        
-        # Ищем ключевые слова и добавляем синонимы
-        query_lower = cleaned_query.lower()
-        for key, synonyms in expansions.items():
-            if key in query_lower:
-                query_expansions.extend(synonyms)
-        
-        # Если найдены расширения, добавляем их к запросу
-        if query_expansions:
-            expanded_query = cleaned_query + " " + " ".join(query_expansions)
-        else:
-            expanded_query = cleaned_query
-            
         logger.info(f"Исходный запрос: '{query_text}'")
-        logger.info(f"Расширенный запрос: '{expanded_query}'")
-
-        return expanded_query
+        logger.info(f"Формулировки запроса: {variants}")
+        return variants
     
     def extract_product_names(self, query: str) -> list:
         """
@@ -1,14 +1,35 @@
+import os
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, FrozenSet, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.embeddings.unified_embedding_service import UnifiedEmbeddingService
+from src.services.embeddings.diversity import MMR_ENABLED, MMR_FETCH_FACTOR, DiversityReport, mmr_select
 from src.services.rag.query_processor import QueryProcessor
-from src.services.rag.llm_generator import LLMResponseGenerator
+from src.services.rag.multi_llm_generator import MultiLLMGenerator
+from src.services.rag.llm_client_pool import llm_client_pool
 from src.services.rag.product_metadata import get_product_metadata
+from src.services.rag.table_lookup import TableLookupService, TableLookupResult
+from src.services.rag.reranker import CrossEncoderReranker
+from src.services.rag.intent_router import IntentRouter, IntentDecision, PRODUCT
+from src.services.rag.answer_cache import semantic_answer_cache, result_chunk_keys
+from src.services.rag.single_flight import rag_single_flight, normalize_flight_query
+from src.services.rag.tracing import rag_tracer, Trace
+from src.services.rag.deadline import (
+    Deadline, DeadlineExceeded, RAG_LLM_MIN_BUDGET, deadline_stats, fallback_passages_answer
+)
+from src.services.rag.conversation import conversation_memory, merge_results, FollowUp, EXTEND_K, KEEP_CHUNKS
+from src.services.catalog_cache import product_catalog_cache
 
 logger = logging.getLogger(__name__)
 
+# Сколько дочерних фрагментов запрашивать на один итоговый раздел при двухуровневом индексе
+CHILD_FANOUT = 3
+# Совпадение фрагментов, достаточное для ответа из кеша, когда LLM не успевает
+FALLBACK_CACHE_OVERLAP = float(os.getenv("RAG_FALLBACK_CACHE_OVERLAP", "0.5"))
+
 class RagService:
     """
     Основной сервис для работы с RAG (Retrieval Augmented Generation).
@@ -27,8 +48,14 @@ class RagService:
         )
         # Обработка запросов
         self.query_processor = QueryProcessor()
-        # Генерация ответов от LLM
-        self.llm_generator = LLMResponseGenerator(api_key)
+        # Генерация ответов от LLM: провайдеры из RAG_LLM_PROVIDERS с дублированием медленных запросов
+        self.llm_generator = MultiLLMGenerator(api_key)
+        # Табличный индекс: упаковка и числовые характеристики
+        self.table_lookup = TableLookupService()
+        # Необязательное переранжирование кандидатов (RAG_RERANKER=1)
+        self.reranker = CrossEncoderReranker()
+        # Коммерческие вопросы и вопросы не по теме получают стандартный ответ без поиска
+        self.intent_router = IntentRouter(self.embedding_service)
         self._is_initialized = False
     
     async def initialize(self):
@@ -42,79 +69,427 @@ class RagService:
         try:
             # Инициализируем сервис эмбеддингов
             await self.embedding_service.initialize()
+            try:
+                await asyncio.to_thread(self.intent_router.prepare)
+            except Exception as e:
+                logger.error(f"Ошибка подготовки центроидов намерений: {e}")
+            # Модель реранкера загружается заранее, а не на первом вопросе
+            await self.reranker.load_model()
             self._is_initialized = True
             logger.info("RAG-сервис успешно инициализирован")
         except Exception as e:
             logger.error(f"Ошибка инициализации RAG-сервиса: {e}")
             raise
     
-    async def search_and_answer(self, query: str, top_k: int = 7, threshold: float = 0.3, generate_answer: bool = True) -> Dict[str, Any]:
+    async def search_and_answer(self, query: str, top_k: int = 7, threshold: float = 0.3, generate_answer: bool = True,
+                                session: Optional[AsyncSession] = None,
+                                deadline: Optional[Deadline] = None,
+                                user_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Поиск по запросу и генерация ответа.
+        deadline - бюджет времени вопроса (по умолчанию RAG_LATENCY_BUDGET с момента вызова).
+        user_id - для памяти диалога: уточняющий вопрос ("а для Т-90?") ищется вместе
+        с прошлым вопросом пользователя и получает сжатую историю, ответ запоминается.
+        Одинаковые запросы, пришедшие одновременно, выполняются один раз (RAG_SINGLE_FLIGHT):
+        остальные вызовы получают копию результата с флагом "coalesced".
+        """
+        deadline = deadline or Deadline()
+        follow_up = conversation_memory.follow_up(user_id, query) if generate_answer else None
+        if follow_up is not None or not rag_single_flight.enabled:
+            # Ответ на уточняющий вопрос зависит от истории пользователя - не объединяем
+            result = await self._search_and_answer(query, top_k, threshold, generate_answer, session, deadline, follow_up)
+        else:
+            key = (normalize_flight_query(query), top_k, threshold, generate_answer)
+            # Общая задача может пережить вызвавший ее обработчик, поэтому сессию БД открывает сама
+            result, shared = await rag_single_flight.run(
+                key, lambda: self._search_and_answer(query, top_k, threshold, generate_answer, None, deadline)
+            )
+            if shared:
+                logger.info(f"[RAG] Запрос '{query}' объединен с уже выполняющимся")
+                # Токены и стоимость учтены у выполнившего запрос вызова - копия записывается
+                # в bot_responses отдельным источником без затрат, как попадание в кеш
+                result = {
+                    key: value for key, value in result.items()
+                    if key not in ("llm_usage", "llm_provider", "llm_model", "llm_hedged")
+                }
+                result.update(query=query, coalesced=True, answer_source="coalesced",
+                              coalesced_source=result.get("answer_source"))
+        
+        source = result.get("coalesced_source") or result.get("answer_source")
+        if generate_answer and source in ("rag", "rag_followup", "answer_cache"):
+            conversation_memory.remember(
+                user_id, follow_up.retrieval_query if follow_up else query,
+                result.get("llm_answer", ""), result.get("search_results", [])
+            )
+        return result
+    
+    async def _search_and_answer(self, query: str, top_k: int, threshold: float, generate_answer: bool,
+                                 session: Optional[AsyncSession], deadline: Deadline,
+                                 follow_up: Optional[FollowUp] = None) -> Dict[str, Any]:
+        """
+        Поиск по запросу и генерация ответа с трассировкой этапов (rag_tracer)
+        и учетом итогов бюджета времени.
+        """
+        with rag_tracer.trace(query) as trace:
+            result = await self._run_pipeline(trace, deadline, query, top_k, threshold, generate_answer, session,
+                                              follow_up)
+            result["deadline"] = deadline.summary()
+            deadline_stats.add(deadline, result.get("answer_source"))
+            if deadline.exceeded_stages:
+                exceeded = ", ".join(f"{stage} - {deadline.stages[stage]}" for stage in deadline.exceeded_stages)
+                logger.warning(
+                    f"[RAG] Бюджет {deadline.budget:g} с превышен ({exceeded}), "
+                    f"ответ: {result.get('answer_source')}, израсходовано {deadline.elapsed():.2f} с"
+                )
+            else:
+                logger.info(f"[RAG] Бюджет {deadline.budget:g} с: уложились, остаток {deadline.remaining():.2f} с")
+            trace.attrs.update({
+                "answer_source": result.get("answer_source"),
+                "total_found": result.get("total_found", 0),
+                "llm_provider": result.get("llm_provider"),
+                "llm_model": result.get("llm_model"),
+                "deadline_exceeded": deadline.exceeded_stages,
+                "follow_up": follow_up is not None
+            })
+            return result
+    
+    async def _run_pipeline(self, trace: Trace, deadline: Deadline, query: str, top_k: int, threshold: float,
+                            generate_answer: bool, session: Optional[AsyncSession],
+                            follow_up: Optional[FollowUp] = None) -> Dict[str, Any]:
         """
-        Поиск по запросу и генерация ответа
+        Поиск по запросу и генерация ответа.
+        Вопросы про упаковку и числовые характеристики сначала ищутся в табличном индексе
+        (session - сессия БД; без нее открывается отдельная).
+        Время этапов (timings) собирается из интервалов трассы; каждый этап ограничен
+        остатком бюджета deadline, необязательные этапы оставляют время для LLM.
+        Уточняющий вопрос (follow_up) ищется по переписанному запросу: про тот же продукт -
+        небольшой дополнительный поиск к фрагментам прошлого ответа, про другой - полный поиск
+        с парой прошлых фрагментов для сравнения; кеш ответов для него не используется.
+        Намерение по правилам определяется до поиска, по центроидам - вектором этапа embed,
+        поэтому кодирование запроса учитывается только в embed.
         """
-        # Для подсчета времени генерации
-        start_time = asyncio.get_event_loop().time()
+        timings = trace.timings
+        # Запрос для поиска; LLM получает исходный вопрос вместе с историей
+        search_query = follow_up.retrieval_query if follow_up else query
         
         if not self._is_initialized:
-            await self.initialize()
+            with trace.span("initialize"):
+                await self.initialize()
         
         logger.info(f"[RAG] Обрабатываем запрос: '{query}'")
         
-        # Очищаем запрос
-        processed_query = self.query_processor.clean_query(query)
-        logger.info(f"[RAG] Обработанный запрос: '{processed_query}'")
+        # Правила намерений - до поиска; сравнение с центроидами - после этапа embed, по его вектору
+        with trace.span("intent", timing_key="intent") as span:
+            intent = self.intent_router.classify_fast(search_query)
+            span.set(intent=intent.intent if intent else None)
+        if generate_answer and intent is not None and intent.short_circuit:
+            return self._intent_result(query, intent, trace)
+        
+        # Табличный индекс: по названию продукта из вопроса
+        table_intent = self.table_lookup.detect_intent(search_query)
+        table_result = None
+        if table_intent:
+            try:
+                with trace.span("table_lookup", timing_key="table_lookup", intent=table_intent):
+                    table_result = await deadline.run(
+                        "table_lookup", self._lookup_tables(search_query, table_intent, session), reserve=RAG_LLM_MIN_BUDGET
+                    )
+            except DeadlineExceeded:
+                table_result = None
+            if generate_answer and self.table_lookup.can_answer_directly(search_query, table_result):
+                logger.info(f"[RAG] Ответ сформирован из табличного индекса ({len(table_result.matches)} строк)")
+                return {
+                    "query": query,
+                    "processed_query": query,
+                    "search_results": [],
+                    "total_found": 0,
+                    "table_rows": len(table_result.matches),
+                    "answer_source": "table_index",
+                    "llm_answer": table_result.direct_answer(),
+                    "timings": timings,
+                    "execution_time": trace.elapsed()
+                }
+        
+        # Очищаем запрос и получаем формулировки с синонимами (первая - сам очищенный запрос)
+        with trace.span("expand_query", timing_key="expand") as span:
+            query_variants = self.query_processor.expand_query(search_query) or [search_query]
+            processed_query = query_variants[0]
+            span.set(variants=len(query_variants))
+        logger.info(f"[RAG] Обработанный запрос: '{processed_query}', формулировок: {len(query_variants)}")
+        
+        # Векторы формулировок считаются одним батчем отдельно (для учета времени этапа);
+        # поиск берет их из LRU-кеша, кеш ответов - вектор очищенного запроса
+        # Векторы и поиск считаются в потоках и прерываются по бюджету; без них ответа нет
+        try:
+            with trace.span("embed", timing_key="embed", queries=len(query_variants)):
+                query_vectors = await deadline.run(
+                    "embed", asyncio.to_thread(self.embedding_service.embed_queries, query_variants)
+                )
+                query_vector = query_vectors[0]
+        except DeadlineExceeded:
+            return self._deadline_result(query, processed_query, intent.intent if intent else PRODUCT, trace)
+        
+        if intent is None:
+            with trace.span("intent_vector", timing_key="intent") as span:
+                intent = self.intent_router.classify(search_query, query_vector=query_vector)
+                span.set(intent=intent.intent)
+            if generate_answer and intent.short_circuit:
+                return self._intent_result(query, intent, trace)
         
         # Запускаем поиск по эмбеддингам
         logger.info(f"[RAG] Поиск документов (top_k={top_k}, threshold={threshold})")
-        # Используем новый API поиска
-        raw_results = await self.embedding_service.search_similar(
-            query=processed_query, 
-            result_limit=top_k, 
-            min_similarity_threshold=threshold
-        )
-        
-        logger.info(f"[RAG] Найдено {len(raw_results)} документов")
+        # С реранкером берем больше кандидатов, лучшие top_k отбирает CrossEncoder
+        rerank_k = self.reranker.candidate_count(top_k)
+        # Уточнение про тот же продукт: фрагменты прошлого ответа уже есть, дозапрашиваем немного новых
+        extend_only = follow_up is not None and follow_up.reuse_results
+        if extend_only:
+            rerank_k = min(rerank_k, EXTEND_K)
+        # MMR нужен запас кандидатов, чтобы заменить почти одинаковые фрагменты
+        pool_k = max(rerank_k, min(top_k, rerank_k) * MMR_FETCH_FACTOR) if MMR_ENABLED else rerank_k
+        # Мелкие дочерние фрагменты одного раздела часто находятся вместе:
+        # берем больше кандидатов и схлопываем их до нужного числа родительских разделов
+        candidate_k = pool_k * CHILD_FANOUT if self.embedding_service.parent_child else pool_k
+        try:
+            with trace.span("search", timing_key="search") as search_span:
+                with trace.span("vector_search", limit=candidate_k):
+                    raw_results = await deadline.run("search", self.embedding_service.search_similar(
+                        query=processed_query, 
+                        result_limit=candidate_k, 
+                        min_similarity_threshold=threshold,
+                        include_embeddings=MMR_ENABLED,
+                        query_variants=query_variants[1:]
+                    ))
+                with trace.span("expand_parents"):
+                    raw_results = self.embedding_service.expand_parents(raw_results, pool_k)
+                search_span.set(found=len(raw_results))
+        except DeadlineExceeded:
+            return self._deadline_result(query, processed_query, intent.intent, trace)
         
-        # Шаг 3: Обработка результатов поиска
+        # Шаг 3: Обработка результатов поиска (с MMR - без почти одинаковых фрагментов)
         logger.info(f"[RAG] Найдено {len(raw_results)} документов/чанков")
-        detailed_results = self._process_search_results(raw_results)
+        with trace.span("process_results", timing_key="mmr", mmr=MMR_ENABLED):
+            detailed_results, diversity = self._process_search_results(raw_results, limit=rerank_k)
+        
+        if follow_up is not None:
+            with trace.span("follow_up", reuse=follow_up.reuse_results) as span:
+                previous = follow_up.previous.search_results
+                if extend_only:
+                    # Новые фрагменты (про уточняемую сторону вопроса) первыми, остальное - из прошлого ответа
+                    detailed_results = merge_results(detailed_results, previous, max(top_k, len(detailed_results)))
+                else:
+                    # Другой продукт: полный поиск плюс лучшие фрагменты прошлого ответа для сравнения
+                    detailed_results = merge_results(
+                        detailed_results, previous[:KEEP_CHUNKS], len(detailed_results) + KEEP_CHUNKS
+                    )
+                reused = sum(1 for r in detailed_results if any(r is p for p in previous))
+                span.set(reused=reused, total=len(detailed_results))
+            logger.info(f"[RAG] Уточняющий вопрос: {reused} фрагментов из прошлого ответа, всего {len(detailed_results)}")
+        
+        if self.reranker.enabled:
+            try:
+                with trace.span("rerank", timing_key="rerank", candidates=len(detailed_results)):
+                    detailed_results = await deadline.run(
+                        "rerank", self.reranker.rerank(search_query, detailed_results, top_k), reserve=RAG_LLM_MIN_BUDGET
+                    )
+            except DeadlineExceeded:
+                # Без переранжирования - порядок векторного поиска
+                detailed_results = detailed_results[:top_k]
+        
+        with trace.span("context") as context_span:
+            # Вопрос без названия продукта - ищем строки таблиц найденных продуктов
+            if table_intent and (table_result is None or not table_result.matches) and detailed_results:
+                found_product_ids = list(dict.fromkeys(
+                    pid for r in detailed_results for pid in r.get("product_ids") or [r.get("product_id")] if pid
+                ))[:3]
+                try:
+                    with trace.span("table_lookup", timing_key="table_lookup", intent=table_intent):
+                        table_result = await deadline.run(
+                            "table_lookup", self._lookup_tables(search_query, table_intent, session, found_product_ids),
+                            reserve=RAG_LLM_MIN_BUDGET
+                        )
+                except DeadlineExceeded:
+                    table_result = None
+            
+            table_context = ""
+            if table_result and table_result.matches:
+                product_names = await product_catalog_cache.get_names({m.product_id for m in table_result.matches})
+                table_context = table_result.to_context(product_names)
+            context_span.set(chunks=len(detailed_results), table_rows=len(table_result.matches) if table_result else 0)
         
         result = {
             "query": query,
             "processed_query": processed_query,
             "search_results": detailed_results,
-            "total_found": len(detailed_results)
+            "total_found": len(detailed_results),
+            "table_rows": len(table_result.matches) if table_result else 0,
+            "intent": intent.intent,
+            "answer_source": "rag_followup" if follow_up else "rag",
+            "diversity": diversity.to_dict(),
+            "timings": timings
         }
-
-        #TODO: проверить
-        print(f"Полученный результат: {result}")
+        if follow_up is not None:
+            result["follow_up"] = {
+                "retrieval_query": follow_up.retrieval_query,
+                "mode": "extend" if follow_up.reuse_results else "new_product",
+                "history_turns": len(follow_up.history)
+            }
+        
+        # Семантический кеш: похожий вопрос с тем же набором фрагментов уже получал ответ
+        # (ответ на уточняющий вопрос зависит от истории - его не ищем и не сохраняем)
+        cache_keys = result_chunk_keys(detailed_results, table_context) if follow_up is None else frozenset()
+        if generate_answer and semantic_answer_cache.enabled and cache_keys:
+            with trace.span("answer_cache", timing_key="answer_cache") as span:
+                cached = semantic_answer_cache.lookup(query, query_vector, cache_keys)
+                span.set(hit=cached.entry is not None)
+            if cached.entry is not None:
+                result["llm_answer"] = cached.entry.answer
+                result["answer_source"] = "answer_cache"
+                result["answer_cache_entry"] = cached.entry.entry_id
+                result["answer_cache_hit"] = True
         
         # Генерация ответа, если был запрос
-        if generate_answer and detailed_results:
+        if generate_answer and (detailed_results or table_context) and "llm_answer" not in result:
             logger.info(f"[RAG] Генерация ответа с помощью LLM")
             try:
-                #? Что выдает за answer и за result?
-                answer = await self.llm_generator.generate_response(query, detailed_results)
-                result["llm_answer"] = answer
-                logger.info(f"[RAG] Ответ сгенерирован успешно")
-                print(result["llm_answer"])
+                with trace.span("llm", timing_key="llm") as span:
+                    # Остатка бюджета меньше RAG_LLM_MIN_BUDGET - LLM не вызываем
+                    answer = await deadline.run(
+                        "llm",
+                        self.llm_generator.generate_answer(
+                            query, detailed_results, table_context=table_context,
+                            history=follow_up.history_messages() if follow_up else None
+                        ),
+                        cap=None if deadline.remaining() >= RAG_LLM_MIN_BUDGET else 0.0
+                    )
+                    span.set(provider=answer.provider_key, hedged=answer.hedged,
+                             prompt_tokens=answer.prompt_tokens, completion_tokens=answer.completion_tokens)
+                if answer.provider is None:
+                    # Все провайдеры ответили ошибкой - вместо текста ошибки отдаем найденное
+                    logger.warning(f"[RAG] LLM не ответила: {answer.text}")
+                    self._fallback_answer(result, query, query_vector, cache_keys, detailed_results, table_context,
+                                         reason="llm_error")
+                    return self._finish(result, trace)
+                result["llm_answer"] = answer.text
+                result["llm_provider"] = answer.provider
+                result["llm_model"] = answer.model
+                result["llm_hedged"] = answer.hedged
+                result["llm_usage"] = {
+                    "prompt_tokens": answer.prompt_tokens,
+                    "completion_tokens": answer.completion_tokens,
+                    "cached_tokens": answer.cached_tokens
+                }
+                result["answer_cache_entry"] = semantic_answer_cache.store(
+                    query, query_vector, cache_keys,
+                    {pid for r in detailed_results for pid in r.get("product_ids") or [r.get("product_id")]}, answer.text,
+                    file_paths={r.get("file_path") for r in detailed_results}
+                )
+                logger.info(f"[RAG] Ответ сгенерирован успешно ({len(answer.text)} символов)")
+            except DeadlineExceeded as e:
+                logger.warning(f"[RAG] LLM не успела в бюджет ({e.outcome}), запасной ответ")
+                self._fallback_answer(result, query, query_vector, cache_keys, detailed_results, table_context,
+                                      reason="deadline")
             except Exception as e:
                 logger.error(f"Ошибка генерации ответа: {e}")
                 result["llm_answer"] = f"Ошибка при генерации ответа: {str(e)}"
         
-        # Добавляем время выполнения
-        end_time = asyncio.get_event_loop().time()
-        execution_time = end_time - start_time
+        return self._finish(result, trace)
+    
+    def _finish(self, result: Dict[str, Any], trace: Trace) -> Dict[str, Any]:
+        """Добавляет время выполнения"""
+        execution_time = trace.elapsed()
         result["execution_time"] = execution_time
         
-        logger.info(f"[RAG] Обработка завершена за {execution_time:.2f} секунд")
+        stages = ", ".join(f"{name} {seconds:.2f}" for name, seconds in trace.timings.items())
+        logger.info(f"[RAG] Обработка завершена за {execution_time:.2f} секунд ({stages})")
         
         return result
     
-    def _process_search_results(self, search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _intent_result(self, query: str, intent: IntentDecision, trace: Trace) -> Dict[str, Any]:
+        """Стандартный ответ для коммерческого вопроса или вопроса не по теме."""
+        logger.info(f"[RAG] Намерение '{intent.intent}' ({intent.source}, {intent.score:.3f}) - стандартный ответ")
+        return {
+            "query": query,
+            "processed_query": query,
+            "search_results": [],
+            "total_found": 0,
+            "table_rows": 0,
+            "intent": intent.intent,
+            "answer_source": f"intent:{intent.intent}",
+            "llm_answer": intent.answer,
+            "timings": trace.timings,
+            "execution_time": trace.elapsed()
+        }
+    
+    def _deadline_result(self, query: str, processed_query: str, intent: str, trace: Trace) -> Dict[str, Any]:
+        """Поиск не уложился в бюджет: нечего показать, кроме просьбы повторить."""
+        return self._finish({
+            "query": query,
+            "processed_query": processed_query,
+            "search_results": [],
+            "total_found": 0,
+            "table_rows": 0,
+            "intent": intent,
+            "answer_source": "deadline_empty",
+            "llm_answer": "Сейчас не успеваю найти ответ: база знаний отвечает слишком долго. "
+                          "Пожалуйста, повторите вопрос через минуту или воспользуйтесь каталогом продукции.",
+            "timings": trace.timings
+        }, trace)
+    
+    def _fallback_answer(self,
+                         result: Dict[str, Any],
+                         query: str,
+                         query_vector: List[float],
+                         cache_keys: FrozenSet[str],
+                         detailed_results: List[Dict[str, Any]],
+                         table_context: str,
+                         reason: str) -> None:
+        """
+        Ответ без LLM: кешированный ответ на очень похожий вопрос с частично совпадающими
+        фрагментами, иначе лучшие найденные фрагменты с названиями продуктов.
+        reason (deadline - не успела, llm_error - ошибка провайдеров) - префикс answer_source.
+        """
+        if semantic_answer_cache.enabled and cache_keys:
+            cached = semantic_answer_cache.lookup(query, query_vector, cache_keys, min_overlap=FALLBACK_CACHE_OVERLAP)
+            if cached.entry is not None:
+                result["llm_answer"] = cached.entry.answer
+                result["answer_source"] = f"{reason}_cache"
+                result["answer_cache_entry"] = cached.entry.entry_id
+                result["answer_cache_hit"] = True
+                return
+        result["llm_answer"] = fallback_passages_answer(detailed_results, table_context)
+        result["answer_source"] = f"{reason}_passages"
+    
+    async def _lookup_tables(self,
+                             query: str,
+                             intent: str,
+                             session: Optional[AsyncSession],
+                             product_ids: Optional[List[int]] = None) -> Optional[TableLookupResult]:
+        """Поиск в табличном индексе; ошибки БД не мешают обычному RAG."""
+        try:
+            if session is not None:
+                return await self.table_lookup.lookup(session, query, product_ids, intent)
+            from src.database.connection import AsyncSessionLocal
+            async with AsyncSessionLocal() as own_session:
+                return await self.table_lookup.lookup(own_session, query, product_ids, intent)
+        except Exception as e:
+            logger.error(f"[RAG] Ошибка поиска в табличном индексе: {e}")
+            return None
+    
+    def _process_search_results(self,
+                                search_results: List[Dict[str, Any]],
+                                limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], DiversityReport]:
         """
         Обрабатывает результаты поиска из нового объединенного сервиса.
+        При включенном MMR (RAG_MMR) сначала отбирает до limit результатов без
+        почти одинаковых фрагментов по уже посчитанным векторам.
         """
+        limit = limit or len(search_results)
+        if MMR_ENABLED:
+            search_results, diversity = mmr_select(search_results, limit)
+        else:
+            search_results = search_results[:limit]
+            diversity = DiversityReport(candidates=len(search_results), selected=len(search_results))
+        
         detailed_results = []
         
         for result in search_results:
@@ -124,24 +499,32 @@ class RagService:
                 text = result.get("text", "")
                 metadata = result.get("metadata", {})
                 
-                product_name = metadata.get("product_name", f"Продукт {product_id}")
+                # Название подставлено из кеша каталога в search_similar
+                product_name = result.get("product_name") or metadata.get("product_name") or f"Продукт {product_id}"
+                # Общий фрагмент (dedup) относится и к продуктам, сохраненным ссылками на него
+                shared_ids = result.get("shared_product_ids", [])
+                shared_names = result.get("shared_product_names", [])
                 
                 # Формируем результат
                 detailed_result = {
+                    "chunk_id": result.get("id"),
                     "product_id": product_id,
                     "product_name": product_name,
+                    "product_ids": [product_id] + shared_ids,
+                    "product_names": [product_name] + shared_names,
+                    "shared_product_ids": shared_ids,
                     "similarity": similarity,
                     "text": text,
                     "text_preview": text[:300] + "..." if len(text) > 300 else text,
                     "file_path": metadata.get("file_path"),
                     "is_chunk": result.get("is_chunk", False),
-                    "chunk_index": result.get("chunk_index")
+                    "chunk_index": result.get("chunk_index"),
+                    "parent_id": result.get("parent_id"),
+                    "matched_text": result.get("matched_text", []),
+                    "start_word": metadata.get("start_word"),
+                    "end_word": metadata.get("end_word")
                 }
                 
-                # Добавляем дополнительные метаданные
-                if "description" in metadata:
-                    detailed_result["description"] = metadata["description"]
-                
                 detailed_results.append(detailed_result)
                 
                 chunk_info = f" (чанк #{result.get('chunk_index', 0)})" if result.get("is_chunk") else ""
@@ -151,7 +534,7 @@ class RagService:
                 logger.error(f"Ошибка при обработке результата поиска: {e}")
                 continue
         
-        return detailed_results
+        return detailed_results, diversity
     
     async def get_statistics(self) -> Dict[str, Any]:
         """
@@ -165,6 +548,11 @@ class RagService:
         
         return {
             "embedding_service": embedding_stats,
+            "reranker": self.reranker.get_stats(),
+            "single_flight": rag_single_flight.get_stats(),
+            "llm_providers": self.llm_generator.get_stats(),
+            "llm_pool": llm_client_pool.get_stats(),
+            "deadline": deadline_stats.get_stats(),
             "rag_service_initialized": self._is_initialized
         }
     
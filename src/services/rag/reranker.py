@@ -0,0 +1,146 @@
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.services.embeddings.model_manager import model_manager
+
+logger = logging.getLogger(__name__)
+
+"""
+Переранжирование кандидатов поиска моделью CrossEncoder.
+Векторный поиск берет с запасом RAG_RERANK_CANDIDATES кандидатов, реранкер
+оценивает пары (запрос, фрагмент) и оставляет лучшие top_k для LLM.
+Оценки кешируются по (хеш запроса, хеш фрагмента): повторные и похожие
+вопросы не пересчитывают уже оцененные пары.
+"""
+
+RERANKER_ENABLED = os.getenv("RAG_RERANKER", "0") == "1"
+RERANKER_MODEL = os.getenv("RAG_RERANKER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "24"))
+RERANK_BATCH_SIZE = int(os.getenv("RAG_RERANK_BATCH_SIZE", "16"))
+RERANK_CACHE_SIZE = int(os.getenv("RAG_RERANK_CACHE_SIZE", "4096"))
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=8).digest()
+
+
+class CrossEncoderReranker:
+    """
+    Необязательный этап переранжирования на CPU.
+    Если модель не загрузилась, кандидаты возвращаются в исходном порядке.
+    """
+
+    def __init__(self,
+                 enabled: bool = RERANKER_ENABLED,
+                 model_name: str = RERANKER_MODEL,
+                 candidates: int = RERANK_CANDIDATES,
+                 batch_size: int = RERANK_BATCH_SIZE,
+                 cache_size: int = RERANK_CACHE_SIZE):
+        self.enabled = enabled
+        self.model_name = model_name
+        self.candidates = candidates
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[bytes, bytes], float]" = OrderedDict()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._model: Optional[Any] = None
+        # Одна загрузка модели на все одновременные вопросы
+        self._load_lock = asyncio.Lock()
+
+    def candidate_count(self, top_k: int) -> int:
+        """Сколько кандидатов брать из векторного поиска под итоговые top_k."""
+        return max(top_k, self.candidates) if self.enabled else top_k
+
+    def _get_model(self) -> Optional[Any]:
+        if self._model is None:
+            try:
+                self._model = model_manager.get_cross_encoder(self.model_name)
+            except Exception as e:
+                logger.error(f"Реранкер отключен, модель {self.model_name} не загружена: {e}")
+                self.enabled = False
+        return self._model
+
+    async def load_model(self) -> Optional[Any]:
+        """Загружает модель в отдельном потоке, не блокируя цикл событий (при старте или первом вопросе)."""
+        if self._model is None and self.enabled:
+            async with self._load_lock:
+                if self._model is None and self.enabled:
+                    await asyncio.to_thread(self._get_model)
+        return self._model
+
+    def _cache_get(self, key: Tuple[bytes, bytes]) -> Optional[float]:
+        score = self._cache.get(key)
+        if score is not None:
+            self._cache.move_to_end(key)
+        return score
+
+    def _cache_put(self, key: Tuple[bytes, bytes], score: float) -> None:
+        self._cache[key] = score
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _predict(self, model: Any, pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    async def rerank(self, query: str, results: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        """
+        Переупорядочивает результаты по оценке CrossEncoder и возвращает top_k лучших.
+        Оценка записывается в result["rerank_score"].
+        """
+        if not self.enabled or len(results) <= 1:
+            return results[:top_k]
+
+        model = await self.load_model()
+        if model is None:
+            return results[:top_k]
+
+        query_hash = _digest(query)
+        scores: List[Optional[float]] = []
+        missing: List[int] = []
+        for i, result in enumerate(results):
+            score = self._cache_get((query_hash, _digest(result.get("text", ""))))
+            scores.append(score)
+            if score is None:
+                missing.append(i)
+
+        self._cache_hits += len(results) - len(missing)
+        self._cache_misses += len(missing)
+
+        if missing:
+            pairs = [(query, results[i].get("text", "")) for i in missing]
+            try:
+                # Модель считает на CPU - не блокируем цикл событий бота
+                predicted = await asyncio.to_thread(self._predict, model, pairs)
+            except Exception as e:
+                logger.error(f"Ошибка реранкинга, используется порядок векторного поиска: {e}")
+                return results[:top_k]
+            for i, score in zip(missing, predicted):
+                scores[i] = score
+                self._cache_put((query_hash, _digest(results[i].get("text", ""))), score)
+
+        for result, score in zip(results, scores):
+            result["rerank_score"] = score
+
+        reranked = sorted(results, key=lambda r: r["rerank_score"], reverse=True)
+        logger.info(
+            f"[RAG] Реранкинг: {len(results)} кандидатов -> {min(top_k, len(results))}, "
+            f"из кеша {len(results) - len(missing)}"
+        )
+        return reranked[:top_k]
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self._cache_hits + self._cache_misses
+        return {
+            "enabled": self.enabled,
+            "model": self.model_name,
+            "candidates": self.candidates,
+            "cache_size": len(self._cache),
+            "cache_hit_rate": self._cache_hits / total if total else 0.0
+        }
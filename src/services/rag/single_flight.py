@@ -0,0 +1,101 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+"""
+Объединение одинаковых запросов, которые выполняются одновременно (single-flight).
+После рассылки о новом продукте десятки пользователей задают один и тот же вопрос
+за несколько секунд. Первый запрос запускает поиск и генерацию в отдельной задаче,
+остальные ждут ее результата вместо собственных вызовов эмбеддингов, ChromaDB и OpenAI.
+Отмена одного ожидающего не затрагивает остальных; задача отменяется,
+только когда ее результат больше никому не нужен.
+"""
+
+SINGLE_FLIGHT_ENABLED = os.getenv("RAG_SINGLE_FLIGHT", "1") == "1"
+
+
+def normalize_flight_query(query: str) -> str:
+    """Ключ объединения: регистр, пробелы и знаки препинания по краям не важны."""
+    return " ".join(query.lower().split()).strip(" ?!.,;:")
+
+
+@dataclass(eq=False)
+class _Flight:
+    task: "asyncio.Future[Any]"
+    waiters: int = 0
+
+
+class SingleFlight:
+    """
+    Реестр выполняющихся задач по ключу.
+    run() возвращает (результат, shared): shared=True, если вызов присоединился к чужой задаче.
+    """
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._stats = {
+            "calls": 0,
+            "leaders": 0,
+            "coalesced": 0,
+            "cancelled_waiters": 0,
+            "abandoned": 0,
+            "max_waiters": 0
+        }
+
+    def _finish(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Ошибку забирают ожидающие; если их не осталось, не даем asyncio ругаться в лог
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        if not self.enabled:
+            return await factory(), False
+
+        self._stats["calls"] += 1
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _task, key=key, flight=flight: self._finish(key, flight))
+            self._stats["leaders"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        flight.waiters += 1
+        self._stats["max_waiters"] = max(self._stats["max_waiters"], flight.waiters)
+
+        try:
+            # shield: отмена этого вызывающего не отменяет общую задачу
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if not flight.task.done():
+                self._stats["cancelled_waiters"] += 1
+                if flight.waiters == 1:
+                    # Последний ожидающий ушел - результат никому не нужен
+                    self._stats["abandoned"] += 1
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                    flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        calls = self._stats["calls"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "coalesce_rate": self._stats["coalesced"] / calls if calls else 0.0
+        }
+
+
+# Глобальный реестр запросов RAG
+rag_single_flight = SingleFlight()
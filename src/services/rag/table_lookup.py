@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.table_repositories import ProductTableRepository
+from src.services.catalog_cache import product_catalog_cache
+from src.services.rag.query_processor import QueryProcessor
+
+logger = logging.getLogger(__name__)
+
+"""
+Поиск по табличному индексу (product_tables / product_table_rows).
+Вопросы про упаковку/фасовку и числовые характеристики решаются выборкой
+нужных строк таблиц: строки либо подставляются в промпт в виде «столбец: значение»,
+либо (для простых вопросов про упаковку) сразу становятся ответом без LLM.
+"""
+
+PACKAGING_QUERY = re.compile(
+    r"тар[аыуе]\b|фасов|упаков|нетто|брутто|поддон|паллет|ведр|бочк|мешк|канистр|еврокуб|габарит",
+    re.IGNORECASE
+)
+# Основы названий показателей: по ним же отбираются строки таблиц характеристик
+SPEC_STEMS = (
+    "температур", "плотност", "вязкост", "пенетрац", "растяжимост", "гибкост", "размягчен",
+    "прочност", "адгези", "сцеплени", "водопоглощ", "водонепроницаем", "удлинени",
+    "массов", "сухого остатк", "толщин", "расход", "время высыхан", "теплостойк", "эластичност"
+)
+
+PACKAGING_COLUMNS = ("тара", "фасов", "упаков", "нетто", "брутто", "поддон", "габарит", "кол-во", "количество")
+NAME_COLUMNS = ("наимен", "марка", "продукт", "номенклатур", "артикул")
+
+
+def _normalize(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"[«»\"']", "", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _code_variants(code: str) -> List[str]:
+    """'Т-75' -> ['Т-75', 'Т75', 'Т 75'] для поиска в строках таблиц."""
+    compact = re.sub(r"[\s\-]", "", code)
+    spaced = re.sub(r"([^\d\s\-])[\s\-]?(\d)", r"\1 \2", code, count=1)
+    dashed = re.sub(r"([^\d\s\-])[\s\-]?(\d)", r"\1-\2", code, count=1)
+    variants = []
+    for variant in (code, compact, dashed, spaced):
+        if variant and variant not in variants:
+            variants.append(variant)
+    return variants
+
+
+def _term_pattern(terms: Sequence[str]) -> "re.Pattern":
+    """
+    Термины целиком: 'Т-75' не совпадает с 'Т-750' или 'МТ-75'
+    (в БД строки ищутся по подстроке).
+    """
+    return re.compile("|".join(rf"(?<!\w){re.escape(_normalize(term))}(?!\d)" for term in terms))
+
+
+@dataclass
+class TableMatch:
+    """Найденная строка таблицы вместе с заголовками."""
+    product_id: int
+    source_path: str
+    location: Optional[str]
+    columns: List[str]
+    cells: List[str]
+
+    def describe(self, intent: str, max_columns: int = 8) -> str:
+        """Строка в виде 'столбец: значение; ...' (только непустые ячейки)."""
+        pairs = []
+        wide = len(self.columns) > max_columns
+        for index, value in enumerate(self.cells):
+            if not value:
+                continue
+            column = self.columns[index] if index < len(self.columns) else f"Столбец {index + 1}"
+            lowered = column.lower()
+            if wide and intent == "packaging" and index > 0 \
+                    and not any(key in lowered for key in PACKAGING_COLUMNS + NAME_COLUMNS):
+                continue
+            pairs.append(f"{column}: {value}")
+        return "; ".join(pairs)
+
+
+@dataclass
+class TableLookupResult:
+    """Результат табличного поиска по вопросу."""
+    intent: str  # packaging | spec
+    product_terms: List[str] = field(default_factory=list)
+    matches: List[TableMatch] = field(default_factory=list)
+    matched_by_name: bool = False  # строки найдены по названию продукта из вопроса
+
+    def to_context(self, product_names: Optional[Dict[int, str]] = None) -> str:
+        """Компактный блок для промпта: строки, сгруппированные по таблицам."""
+        if not self.matches:
+            return ""
+        parts = []
+        current_key = None
+        for match in self.matches:
+            key = (match.source_path, match.location)
+            if key != current_key:
+                current_key = key
+                product_name = (product_names or {}).get(match.product_id, f"Продукт {match.product_id}")
+                source = os.path.basename(match.source_path)
+                location = f", {match.location}" if match.location else ""
+                parts.append(f"Таблица ({product_name}; {source}{location}):")
+            parts.append(f"- {match.describe(self.intent)}")
+        return "\n".join(parts)
+
+    def direct_answer(self) -> str:
+        """Ответ на вопрос про упаковку прямо из таблицы (без LLM)."""
+        title = ", ".join(self.product_terms)
+        lines = [f"Варианты упаковки {title}:"]
+        lines.extend(f"- {match.describe(self.intent)}" for match in self.matches)
+        return "\n".join(lines)
+
+
+class TableLookupService:
+    """
+    Отбор строк таблиц под вопрос пользователя.
+    """
+
+    def __init__(self,
+                 max_rows: int = int(os.getenv("TABLE_LOOKUP_MAX_ROWS", "20")),
+                 direct_answers: bool = os.getenv("TABLE_LOOKUP_DIRECT_ANSWERS", "1") == "1",
+                 direct_max_rows: int = 8,
+                 max_tables: int = int(os.getenv("TABLE_LOOKUP_MAX_TABLES", "200"))):
+        self.max_rows = max_rows
+        self.max_tables = max_tables
+        self.direct_answers = direct_answers
+        self.direct_max_rows = direct_max_rows
+        self.query_processor = QueryProcessor()
+        self._name_codes: Dict[str, set] = {}
+
+    @staticmethod
+    def detect_intent(query: str) -> Optional[str]:
+        """packaging - упаковка/тара/фасовка, spec - числовые характеристики, None - прочее."""
+        if PACKAGING_QUERY.search(query):
+            return "packaging"
+        lowered = _normalize(query)
+        if any(stem in lowered for stem in SPEC_STEMS):
+            return "spec"
+        return None
+
+    async def match_products(self, query: str) -> Dict[int, str]:
+        """
+        Продукты каталога, упомянутые в вопросе: по полному названию или по коду марки (Т-75, ЗВС-65...).
+        """
+        normalized_query = _normalize(query)
+        query_codes = {re.sub(r"[\s\-]", "", _normalize(code))
+                       for code in self.query_processor.extract_product_names(query)}
+        matched: Dict[int, str] = {}
+        for product_id, name in (await product_catalog_cache.get_all_names()).items():
+            normalized_name = _normalize(name)
+            if normalized_name and normalized_name in normalized_query:
+                matched[product_id] = name
+                continue
+            if query_codes & self._codes_of(name):
+                matched[product_id] = name
+        return matched
+
+    async def lookup(self,
+                     session: AsyncSession,
+                     query: str,
+                     product_ids: Optional[Sequence[int]] = None,
+                     intent: Optional[str] = None) -> Optional[TableLookupResult]:
+        """
+        Ищет строки таблиц под вопрос.
+
+        Args:
+            session: Сессия БД
+            query: Вопрос пользователя
+            product_ids: Продукты из векторного поиска (если в вопросе нет названия)
+            intent: Тип вопроса, если уже определен
+        """
+        intent = intent or self.detect_intent(query)
+        if not intent:
+            return None
+
+        repository = ProductTableRepository(session)
+        named_products = await self.match_products(query)
+        codes = self.query_processor.extract_product_names(query)
+        result = TableLookupResult(intent=intent, product_terms=codes or list(named_products.values()))
+
+        if intent == "packaging":
+            # Таблицы упаковки общие (прайс-листы), поэтому строки ищем по названию во всех таких таблицах;
+            # таблицы упаковки (по заголовкам) отбираются в БД, не больше max_tables
+            terms = [variant for code in codes for variant in _code_variants(code)]
+            terms.extend(name for name in named_products.values() if name not in terms)
+            tables, rows = [], []
+            if terms:
+                tables = await repository.get_tables(column_keys=PACKAGING_COLUMNS, limit=self.max_tables)
+                # С запасом: часть строк по подстроке отсеется проверкой границ ('Т-750' для 'Т-75')
+                pattern = _term_pattern(terms)
+                rows = [row for row in await repository.find_rows([table.id for table in tables], terms,
+                                                                  2 * (self.max_rows + 1))
+                        if pattern.search(_normalize(row.row_text))][:self.max_rows + 1]
+            result.matched_by_name = bool(rows)
+
+            if not rows:
+                # Таблица упаковки из документа самого продукта - строки могут не содержать названия
+                own_products = set(named_products) or set(product_ids or [])
+                if own_products:
+                    own_tables = await repository.get_tables(list(own_products), column_keys=PACKAGING_COLUMNS,
+                                                             limit=self.max_tables)
+                    rows = await repository.find_rows([table.id for table in own_tables], None, self.max_rows + 1)
+                    tables = tables + own_tables
+        else:
+            target_products = list(named_products) or list(product_ids or [])
+            if not target_products:
+                return result
+            lowered = _normalize(query)
+            stems = [stem for stem in SPEC_STEMS if stem in lowered]
+            tables = await repository.get_tables(target_products)
+            rows = await repository.find_rows([table.id for table in tables], stems, self.max_rows + 1)
+
+        tables_by_id = {table.id: table for table in tables}
+        for row in rows[:self.max_rows]:
+            table = tables_by_id.get(row.table_id)
+            if table is None:
+                continue
+            result.matches.append(TableMatch(
+                product_id=table.product_id,
+                source_path=table.source_path,
+                location=table.location,
+                columns=json.loads(table.columns_json),
+                cells=json.loads(row.cells_json)
+            ))
+
+        logger.info(f"[TableLookup] Вопрос '{query}': тип {intent}, найдено строк {len(result.matches)}")
+        return result
+
+    def can_answer_directly(self, query: str, result: Optional[TableLookupResult]) -> bool:
+        """
+        Прямой ответ только на короткий вопрос про упаковку одного продукта,
+        когда строки найдены по его названию и их немного.
+        """
+        return (
+            self.direct_answers
+            and result is not None
+            and result.intent == "packaging"
+            and result.matched_by_name
+            and len(result.product_terms) == 1
+            and 0 < len(result.matches) <= self.direct_max_rows
+            and len(query) <= 80
+            and not any(stem in _normalize(query) for stem in SPEC_STEMS)
+        )
+
+    def _codes_of(self, name: str) -> set:
+        """Коды марок в названии продукта (кешируются - каталог меняется редко)."""
+        if name not in self._name_codes:
+            self._name_codes[name] = {re.sub(r"[\s\-]", "", _normalize(code))
+                                      for code in self.query_processor.extract_product_names(name)}
+        return self._name_codes[name]
+
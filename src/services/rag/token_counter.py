@@ -0,0 +1,45 @@
+import re
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+"""
+Подсчет токенов промпта локально, без обращения к API.
+Используется tiktoken (кодировка модели OpenAI), если он установлен;
+иначе - приближенная оценка по числу слов и знаков.
+"""
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=4)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.info("tiktoken не установлен, токены считаются приближенно")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """
+    Число токенов текста для модели.
+    Приближение без tiktoken: русские слова в BPE-словарях OpenAI в среднем
+    занимают 2-3 токена, знаки препинания - по одному.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    tokens = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        tokens += 1 if len(piece) <= 3 else (len(piece) + 3) // 4
+    return tokens
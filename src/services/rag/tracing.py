@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+"""
+Трассировка RAG-запросов: вложенные интервалы (span) для этапов конвейера -
+очистка запроса, эмбеддинг, векторный поиск, обработка результатов, сборка контекста, вызов LLM.
+Трасса всегда собирает время этапов (из нее берутся timings результата), а на диск
+попадает только доля запросов RAG_TRACE_SAMPLE: фоновая задача дописывает трассы
+в JSONL-файл RAG_TRACE_PATH, не задерживая ответ пользователю.
+Текущая трасса и интервал хранятся в contextvars, поэтому вложенный код
+(например, MultiLLMGenerator) добавляет свои интервалы через current_span().
+"""
+
+TRACE_ENABLED = os.getenv("RAG_TRACE", "1") == "1"
+TRACE_SAMPLE = float(os.getenv("RAG_TRACE_SAMPLE", "1.0"))
+TRACE_PATH = os.getenv("RAG_TRACE_PATH", "./logs/rag_traces.jsonl")
+# При превышении размера файл переименовывается в <path>.1 (предыдущий удаляется)
+TRACE_MAX_BYTES = int(os.getenv("RAG_TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+# Сколько трасс может ждать записи; лишние отбрасываются
+TRACE_QUEUE_SIZE = int(os.getenv("RAG_TRACE_QUEUE_SIZE", "1000"))
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("rag_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("rag_span", default=None)
+
+
+@dataclass(eq=False)
+class Span:
+    """Интервал одного этапа; parent_id - интервал, внутри которого он начат."""
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    depth: int
+    start: float
+    duration: Optional[float] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self, trace_start: float) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "name": self.name,
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "depth": self.depth,
+            "offset": round(self.start - trace_start, 4),
+            "duration": round(self.duration, 4) if self.duration is not None else None
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class Trace:
+    """
+    Трасса одного запроса. span() - контекстный менеджер интервала;
+    с timing_key время интервала добавляется в timings под этим ключом.
+    """
+
+    def __init__(self, query: str, sampled: bool):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.query = query
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Span] = []
+        self.timings: Dict[str, float] = {}
+        self.attrs: Dict[str, Any] = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @contextmanager
+    def span(self, name: str, timing_key: Optional[str] = None, **attrs: Any) -> Iterator[Span]:
+        parent = _current_span.get()
+        # Интервал из чужой трассы не считается родителем
+        if parent is not None and parent not in self.spans:
+            parent = None
+        span = Span(
+            name=name,
+            span_id=len(self.spans) + 1,
+            parent_id=parent.span_id if parent else None,
+            depth=parent.depth + 1 if parent else 0,
+            start=time.perf_counter(),
+            attrs=dict(attrs)
+        )
+        self.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            _current_span.reset(token)
+            if timing_key:
+                self.timings[timing_key] = self.timings.get(timing_key, 0.0) + span.duration
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "ts": round(self.started_at, 3),
+            "query": self.query[:200],
+            "duration": round(self.duration if self.duration is not None else self.elapsed(), 4),
+            "attrs": self.attrs,
+            "spans": [span.to_dict(self.start) for span in self.spans]
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def current_span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """Интервал в текущей трассе; вне трассы ничего не делает."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attrs) as span:
+        yield span
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RagTracer:
+    """
+    Создает трассы и пишет выбранные (sample) в JSONL в фоновой задаче.
+    Запись в файл выполняется в пуле потоков пачками из очереди.
+    """
+
+    def __init__(self,
+                 path: str = TRACE_PATH,
+                 sample_rate: float = TRACE_SAMPLE,
+                 enabled: bool = TRACE_ENABLED,
+                 max_bytes: int = TRACE_MAX_BYTES,
+                 queue_size: int = TRACE_QUEUE_SIZE):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self._queue: Optional["asyncio.Queue[Dict[str, Any]]"] = None
+        self._writer: Optional["asyncio.Task[None]"] = None
+        self._stats = {"traces": 0, "sampled": 0, "written": 0, "dropped": 0, "write_errors": 0}
+
+    @contextmanager
+    def trace(self, query: str) -> Iterator[Trace]:
+        """Трасса запроса; по выходе выбранная трасса ставится в очередь на запись."""
+        sampled = self.enabled and random.random() < self.sample_rate
+        trace = Trace(query, sampled)
+        self._stats["traces"] += 1
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            trace.duration = trace.elapsed()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            if sampled:
+                self._submit(trace.to_dict())
+
+    def _submit(self, record: Dict[str, Any]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._stats["dropped"] += 1
+            return
+        if self._queue is None or self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._writer = loop.create_task(self._write_loop(self._queue))
+        try:
+            self._queue.put_nowait(record)
+            self._stats["sampled"] += 1
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+
+    async def _write_loop(self, queue: "asyncio.Queue[Dict[str, Any]]") -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < 100:
+                batch.append(queue.get_nowait())
+            try:
+                await loop.run_in_executor(None, self._write_batch, batch)
+                self._stats["written"] += len(batch)
+            except Exception as e:
+                self._stats["write_errors"] += 1
+                logger.error(f"[TRACE] Ошибка записи трасс в {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in batch:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    async def flush(self) -> None:
+        """Дожидается записи всех трасс из очереди."""
+        if self._queue is not None and self._writer is not None and not self._writer.done():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Дописывает очередь и останавливает фоновую задачу (при остановке бота)."""
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+
+    def _read_last(self, limit: int) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        # Хвост файла: трассы обычно меньше 4 КБ, берем с запасом
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - limit * 8192))
+            lines = f.read().splitlines()
+        if size > limit * 8192:
+            lines = lines[1:]
+        traces = []
+        for line in lines[-limit:]:
+            try:
+                traces.append(json.loads(line))
+            except ValueError:
+                continue
+        return traces
+
+    async def get_stage_stats(self, last_n: int = 200) -> Dict[str, Any]:
+        """
+        p50/p95 по каждому этапу за последние last_n записанных трасс.
+        Этапы - пути интервалов ("search/vector_search"), в порядке первого появления.
+        """
+        await self.flush()
+        traces = await asyncio.get_running_loop().run_in_executor(None, self._read_last, last_n)
+        durations: Dict[str, List[float]] = {}
+        totals: List[float] = []
+        sources: Dict[str, int] = {}
+        for record in traces:
+            totals.append(record.get("duration") or 0.0)
+            source = (record.get("attrs") or {}).get("answer_source") or "?"
+            sources[source] = sources.get(source, 0) + 1
+            names: Dict[int, str] = {}
+            for span in record.get("spans", []):
+                path = span["name"] if span.get("parent") is None else f"{names.get(span['parent'], '?')}/{span['name']}"
+                names[span["id"]] = path
+                if span.get("duration") is not None:
+                    durations.setdefault(path, []).append(span["duration"])
+
+        stages = {
+            path: {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "max": max(values)
+            }
+            for path, values in durations.items()
+        }
+        return {
+            "traces": len(traces),
+            "total": {"p50": percentile(totals, 0.5), "p95": percentile(totals, 0.95)} if totals else None,
+            "answer_sources": sources,
+            "stages": stages,
+            "path": self.path,
+            "sample_rate": self.sample_rate if self.enabled else 0.0,
+            **self._stats
+        }
+
+
+# Глобальный трассировщик RAG-запросов
+rag_tracer = RagTracer()
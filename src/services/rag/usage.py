@@ -0,0 +1,110 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+"""
+Учет токенов, стоимости и времени этапов для ответа RAG.
+RagService кладет в результат токены ответа LLM и время этапов, из них собираются
+значения для колонок bot_responses (FeedbackService.log_bot_response(metrics=...)).
+"""
+
+# Цены в долларах за 1 млн токенов: (вход, вход из кеша провайдера, выход).
+# Переопределение: RAG_LLM_PRICES='{"gpt-4o-mini": [0.15, 0.075, 0.6]}'
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "deepseek-chat": (0.27, 0.07, 1.10),
+}
+try:
+    MODEL_PRICES.update({
+        model: tuple(float(price) for price in prices)
+        for model, prices in json.loads(os.getenv("RAG_LLM_PRICES", "{}")).items()
+    })
+except (ValueError, TypeError) as e:
+    logger.error(f"Некорректное значение RAG_LLM_PRICES: {e}")
+
+# Этапы, которые сохраняются в bot_responses (time_<этап>), и ключи timings RagService в каждом из них.
+# intent - правила и сравнение с центроидами по готовому вектору; кодирование запроса - только в embed
+STAGES: Dict[str, Tuple[str, ...]] = {
+    "expand": ("intent", "expand"),
+    "embed": ("embed",),
+    "retrieve": ("table_lookup", "search", "mmr"),
+    "rerank": ("rerank",),
+    "generate": ("answer_cache", "llm"),
+}
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Optional[float]:
+    """Стоимость запроса в долларах; None - цена модели неизвестна."""
+    prices = MODEL_PRICES.get(model or "")
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1_000_000
+
+
+def stage_timings(timings: Dict[str, float]) -> Dict[str, float]:
+    """Сводит подробные timings RagService к этапам STAGES; этапы без замеров пропускаются."""
+    stages = {}
+    for stage, keys in STAGES.items():
+        measured = [timings[key] for key in keys if key in timings]
+        if measured:
+            stages[stage] = sum(measured)
+    return stages
+
+
+@dataclass
+class ResponseMetrics:
+    """Метрики одного ответа для сохранения в bot_responses."""
+    answer_source: Optional[str] = None
+    llm_provider: Optional[str] = None
+    llm_model: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost_usd: Optional[float] = None
+    stages: Dict[str, float] = field(default_factory=dict)
+
+    @classmethod
+    def from_result(cls, result: Dict[str, Any]) -> "ResponseMetrics":
+        usage = result.get("llm_usage") or {}
+        model = result.get("llm_model")
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        cached_tokens = int(usage.get("cached_tokens") or 0)
+        return cls(
+            answer_source=result.get("answer_source"),
+            llm_provider=result.get("llm_provider"),
+            llm_model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            # Ответ без вызова LLM (кеш, таблицы, стандартный ответ) ничего не стоит
+            cost_usd=estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens) if model else 0.0,
+            stages=stage_timings(result.get("timings") or {})
+        )
+
+    def to_columns(self) -> Dict[str, Any]:
+        columns: Dict[str, Any] = {
+            "answer_source": self.answer_source,
+            "llm_provider": self.llm_provider,
+            "llm_model": self.llm_model,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost_usd": round(self.cost_usd, 6) if self.cost_usd is not None else None,
+        }
+        for stage in STAGES:
+            seconds = self.stages.get(stage)
+            columns[f"time_{stage}"] = round(seconds, 3) if seconds is not None else None
+        return columns